@@ -0,0 +1,244 @@
+"""
+MilkShow — Agendador de tarefas
+Agendas declarativas (diária, semanal, mensal) com último disparo persistido,
+recuperação de execuções perdidas (reinício às 6h01 não pula o relatório),
+espalhamento de fazendas numa janela e métricas por tarefa.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger("milkshow_bot")
+
+
+# ─── AGENDAS ──────────────────────────────────────────────────────────────────
+class Agenda:
+    """Momento recorrente: diário (hora/minuto), semanal (+ dia da semana,
+    0=segunda) ou mensal (+ dia do mês)."""
+
+    def __init__(self, tipo: str, hora: int, minuto: int = 0,
+                 dia_semana: Optional[int] = None, dia_mes: Optional[int] = None):
+        if tipo not in ("diaria", "semanal", "mensal"):
+            raise ValueError(f"tipo de agenda inválido: {tipo}")
+        self.tipo       = tipo
+        self.hora       = hora
+        self.minuto     = minuto
+        self.dia_semana = dia_semana
+        self.dia_mes    = dia_mes
+
+    def __repr__(self) -> str:
+        extra = {"semanal": f" dia_semana={self.dia_semana}",
+                 "mensal":  f" dia_mes={self.dia_mes}"}.get(self.tipo, "")
+        return f"<Agenda {self.tipo} {self.hora:02d}:{self.minuto:02d}{extra}>"
+
+    def _casa(self, d: datetime.date) -> bool:
+        if self.tipo == "semanal":
+            return d.weekday() == self.dia_semana
+        if self.tipo == "mensal":
+            return d.day == self.dia_mes
+        return True
+
+    def ultima(self, ate: datetime.datetime) -> datetime.datetime:
+        """Disparo previsto mais recente ≤ `ate`."""
+        d = ate.date()
+        for _ in range(62):
+            momento = datetime.datetime.combine(d, datetime.time(self.hora, self.minuto))
+            if momento <= ate and self._casa(d):
+                return momento
+            d -= datetime.timedelta(days=1)
+        raise ValueError(f"{self!r} sem disparo nos últimos 62 dias")
+
+    def proxima(self, apos: datetime.datetime) -> datetime.datetime:
+        """Próximo disparo previsto > `apos`."""
+        d = apos.date()
+        for _ in range(62):
+            momento = datetime.datetime.combine(d, datetime.time(self.hora, self.minuto))
+            if momento > apos and self._casa(d):
+                return momento
+            d += datetime.timedelta(days=1)
+        raise ValueError(f"{self!r} sem disparo nos próximos 62 dias")
+
+
+def diaria(hora: int, minuto: int = 0) -> Agenda:
+    return Agenda("diaria", hora, minuto)
+
+
+def semanal(dia_semana: int, hora: int, minuto: int = 0) -> Agenda:
+    return Agenda("semanal", hora, minuto, dia_semana=dia_semana)
+
+
+def mensal(dia_mes: int, hora: int, minuto: int = 0) -> Agenda:
+    return Agenda("mensal", hora, minuto, dia_mes=dia_mes)
+
+
+def atraso_espalhado(chave: str, janela_s: float) -> float:
+    """Atraso determinístico em [0, janela_s) para `chave` — espalha as fazendas
+    pela janela sempre na mesma posição (carga plana, horário previsível)."""
+    if janela_s <= 0:
+        return 0.0
+    h = int(hashlib.sha1(chave.encode()).hexdigest()[:8], 16)
+    return (h / 0x100000000) * janela_s
+
+
+# ─── TAREFAS ──────────────────────────────────────────────────────────────────
+class Tarefa:
+    """Tarefa agendada. `fn(previsto)` é uma corrotina que recebe o datetime do
+    disparo previsto (não o horário real — importa na recuperação).
+    `recuperar_h`: até quantas horas depois do previsto um disparo perdido
+    ainda é executado."""
+
+    def __init__(self, nome: str, agenda: Agenda,
+                 fn: Callable[[datetime.datetime], Awaitable[None]],
+                 recuperar_h: float = 6.0):
+        self.nome        = nome
+        self.agenda      = agenda
+        self.fn          = fn
+        self.recuperar_h = recuperar_h
+
+
+class Agendador:
+    """Executa tarefas nos horários das agendas.
+    `carregar_estado()` → {nome: {"ultimo_disparo": iso, ...}} e
+    `salvar_estado(nome, dict)` persistem o último disparo de cada tarefa."""
+
+    def __init__(self, tarefas: list,
+                 carregar_estado: Optional[Callable[[], Dict[str, dict]]] = None,
+                 salvar_estado: Optional[Callable[[str, dict], None]] = None,
+                 relogio: Callable[[], datetime.datetime] = datetime.datetime.now,
+                 espera_max_s: float = 900.0):
+        self.tarefas       = {t.nome: t for t in tarefas}
+        self._carregar     = carregar_estado
+        self._salvar       = salvar_estado
+        self._agora        = relogio
+        self._espera_max_s = espera_max_s
+        self._estado: Dict[str, dict] = {}
+        self._metricas: Dict[str, dict] = {
+            t.nome: {"execucoes": 0, "falhas": 0, "recuperadas": 0, "puladas": 0,
+                     "duracao_total_s": 0.0, "ultima_duracao_s": None,
+                     "ultimo_atraso_s": None, "ultimo_erro": None}
+            for t in tarefas
+        }
+        self._carregado = False
+
+    # ── estado persistido ─────────────────────────────────────
+    def _carregar_estado(self) -> bool:
+        """Carrega o último disparo de cada tarefa. Falha fica sem carregar (e
+        sem disparo) até a próxima volta: estado vazio faria todo job ainda na
+        janela de recuperação rodar de novo."""
+        if self._carregado:
+            return True
+        if self._carregar:
+            try:
+                self._estado = dict(self._carregar() or {})
+            except Exception as e:
+                log.warning(f"[agendador] falha ao carregar estado: {e}")
+                return False
+        self._carregado = True
+        return True
+
+    def _ultimo_disparo(self, nome: str) -> Optional[datetime.datetime]:
+        raw = (self._estado.get(nome) or {}).get("ultimo_disparo")
+        try:
+            return datetime.datetime.fromisoformat(raw) if raw else None
+        except ValueError:
+            return None
+
+    def _registrar(self, nome: str, previsto: datetime.datetime, dur: float, erro: str = ""):
+        est = {
+            "ultimo_disparo":  previsto.isoformat(),
+            "executado_em":    self._agora().isoformat(timespec="seconds"),
+            "duracao_s":       round(dur, 2),
+            "ok":              not erro,
+            "erro":            erro[:300],
+        }
+        self._estado[nome] = est
+        if self._salvar:
+            try:
+                self._salvar(nome, est)
+            except Exception as e:
+                log.warning(f"[agendador] falha ao salvar estado de {nome}: {e}")
+
+    # ── execução ──────────────────────────────────────────────
+    def pendentes(self) -> list:
+        """[(tarefa, previsto)] com disparo devido e ainda não executado."""
+        if not self._carregar_estado():
+            return []
+        agora = self._agora()
+        devidas = []
+        for t in self.tarefas.values():
+            previsto = t.agenda.ultima(agora)
+            ultimo   = self._ultimo_disparo(t.nome)
+            if ultimo is not None and ultimo >= previsto:
+                continue
+            if agora - previsto > datetime.timedelta(hours=t.recuperar_h):
+                # Perdido há tempo demais — marca como visto sem executar
+                self._metricas[t.nome]["puladas"] += 1
+                log.warning(f"[agendador] {t.nome}: disparo de {previsto} perdido "
+                            f"(fora da janela de {t.recuperar_h}h)")
+                self._registrar(t.nome, previsto, 0.0, erro="pulado: fora da janela")
+                continue
+            devidas.append((t, previsto))
+        return devidas
+
+    async def executar(self, tarefa: Tarefa, previsto: datetime.datetime):
+        m = self._metricas[tarefa.nome]
+        atraso = (self._agora() - previsto).total_seconds()
+        if atraso > 120:
+            m["recuperadas"] += 1
+            log.info(f"[agendador] {tarefa.nome}: recuperando disparo de {previsto} "
+                     f"({atraso/60:.0f} min de atraso)")
+        t0, erro = time.monotonic(), ""
+        try:
+            await tarefa.fn(previsto)
+        except Exception as e:
+            erro = f"{type(e).__name__}: {e}"
+            m["falhas"] += 1
+            log.error(f"[agendador] {tarefa.nome} falhou: {erro}")
+        dur = time.monotonic() - t0
+        m["execucoes"]        += 1
+        m["duracao_total_s"]  += dur
+        m["ultima_duracao_s"]  = round(dur, 2)
+        m["ultimo_atraso_s"]   = round(atraso, 1)
+        m["ultimo_erro"]       = erro or None
+        # Falha também conta como disparo feito: evita repetir em loop um job
+        # quebrado; o erro fica registrado no estado e nas métricas.
+        self._registrar(tarefa.nome, previsto, dur, erro)
+
+    def segundos_ate_proximo(self) -> float:
+        agora = self._agora()
+        prox  = min(t.agenda.proxima(agora) for t in self.tarefas.values())
+        espera_max = self._espera_max_s if self._carregado else 60.0   # estado não carregou: tenta logo
+        return max(1.0, min((prox - agora).total_seconds(), espera_max))
+
+    async def rodar(self):
+        """Loop principal. Acorda no próximo disparo (ou a cada espera_max_s,
+        para tolerar ajuste de relógio) e executa o que estiver devido."""
+        while True:
+            try:
+                for tarefa, previsto in self.pendentes():
+                    await self.executar(tarefa, previsto)
+                await asyncio.sleep(self.segundos_ate_proximo())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"[agendador] erro no loop: {e}")
+                await asyncio.sleep(60)
+
+    def metricas(self) -> dict:
+        agora = self._agora()
+        out = {}
+        for nome, m in self._metricas.items():
+            n = m["execucoes"] or 1
+            t = self.tarefas[nome]
+            out[nome] = {
+                **{k: v for k, v in m.items() if k != "duracao_total_s"},
+                "duracao_media_s": round(m["duracao_total_s"] / n, 2),
+                "agenda":          repr(t.agenda),
+                "ultimo_disparo":  (self._estado.get(nome) or {}).get("ultimo_disparo"),
+                "proximo_disparo": t.agenda.proxima(agora).isoformat(),
+            }
+        return out
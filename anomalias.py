@@ -0,0 +1,212 @@
+"""
+MilkShow — Detector incremental de anomalias de produção
+Cada animal (e o rebanho, chave REBANHO) mantém médias móveis exponenciais
+(EWMA) de média e variância: do total diário, de cada registro de ordenha e do
+número de ordenhas por dia. Cada escrita de produção atualiza o estado em O(1)
+e já marca:
+
+  outlier      registro muito fora do típico do animal (provável digitação)
+  queda        dia completo (ou fechado pela chegada do dia seguinte) muito
+               abaixo da média do animal/rebanho
+  sem_ordenha  lactante sem produção há DIAS_SEM_ORDENHA dias — avaliado na
+               leitura a partir da última ordenha guardada, sem consultar a base
+
+O agendador lê os alertas atuais em vez de varrer a produção. Correção,
+exclusão ou ordenha atrasada (a da tarde lançada depois da manhã seguinte) num
+dia já incorporado às médias marca o detector para remontagem (replay do
+histórico) na próxima leitura.
+"""
+
+import datetime
+import math
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+ALFA             = float(os.environ.get("ANOMALIA_ALFA", "0.25"))      # ~1 semana de memória
+Z_QUEDA          = float(os.environ.get("ANOMALIA_Z_QUEDA", "3.0"))
+Z_OUTLIER        = float(os.environ.get("ANOMALIA_Z_OUTLIER", "4.0"))
+QUEDA_MIN        = float(os.environ.get("ANOMALIA_QUEDA_MIN", "0.30"))  # e no mínimo 30% abaixo
+MIN_DIAS         = int(os.environ.get("ANOMALIA_MIN_DIAS", "5"))        # aquecimento antes de marcar
+DIAS_SEM_ORDENHA = 3
+JANELA_DIAS      = int(os.environ.get("ANOMALIA_JANELA_DIAS", "30"))    # histórico do replay
+REBANHO          = "*"
+_TTL_S           = int(os.environ.get("ANOMALIA_TTL_S", "21600"))
+
+
+class _Ewma:
+    __slots__ = ("media", "var", "n")
+
+    def __init__(self):
+        self.media, self.var, self.n = 0.0, 0.0, 0
+
+    def atualizar(self, x: float):
+        if self.n == 0:
+            self.media = x
+        else:
+            d = x - self.media
+            self.media += ALFA * d
+            self.var = (1 - ALFA) * (self.var + ALFA * d * d)
+        self.n += 1
+
+    def desvio(self) -> float:
+        # piso: séries muito regulares não marcam variações de poucos litros
+        return max(math.sqrt(self.var), 0.15 * abs(self.media), 0.5)
+
+
+class _Serie:
+    """Estado de um animal (ou do rebanho): dia aberto e médias dos dias fechados."""
+    __slots__ = ("dia", "total", "registros", "diario", "registro", "turnos", "ultima")
+
+    def __init__(self):
+        self.dia, self.total, self.registros = "", 0.0, 0
+        self.diario, self.registro, self.turnos = _Ewma(), _Ewma(), _Ewma()
+        self.ultima = ""
+
+
+class Detector:
+    """Estado de anomalias de uma fazenda."""
+
+    def __init__(self, producao: list = ()):
+        self._lock   = threading.Lock()
+        self._series = {}
+        self._flags  = {}      # (nome, tipo) → flag
+        self.sujo    = False
+        for p in sorted(producao, key=lambda p: str(p.get("data", ""))[:10]):
+            try:
+                self.registrar(p.get("nome_animal") or "Rebanho", p.get("data"), float(p.get("leite") or 0))
+            except (TypeError, ValueError):
+                pass
+
+    # ── escrita ──────────────────────────────
+    def registrar(self, nome: str, data, litros: float) -> list:
+        """Aplica um registro (litros negativos = remoção/correção) ao animal e ao
+        rebanho. Retorna as flags novas geradas por ele."""
+        dia = str(data or "")[:10]
+        if not nome or not dia:
+            return []
+        with self._lock:
+            novas = []
+            for chave in (nome, REBANHO):
+                novas += self._aplicar(chave, dia, litros, outlier=chave != REBANHO)
+            return novas
+
+    def _aplicar(self, chave: str, dia: str, litros: float, outlier: bool) -> list:
+        s = self._series.setdefault(chave, _Serie())
+        if dia < s.dia:
+            # dia já incorporado às médias: o total fechado estava incompleto ou
+            # errado — replay na próxima leitura; até lá a queda daquele dia sai
+            if litros:
+                self.sujo = True
+                atual = self._flags.get((chave, "queda"))
+                if atual and atual["data"] == dia:
+                    del self._flags[(chave, "queda")]
+            if litros > 0:
+                s.ultima = max(s.ultima, dia)
+            return []
+        novas = []
+        if dia > s.dia:
+            if s.dia:
+                novas += self._fechar(chave, s)
+            s.dia, s.total, s.registros = dia, 0.0, 0
+        s.total = max(s.total + litros, 0.0)
+        s.registros = max(s.registros + (1 if litros > 0 else -1 if litros < 0 else 0), 0)
+        if litros > 0:
+            s.ultima = max(s.ultima, dia)
+            if outlier:
+                r = s.registro
+                if r.n >= MIN_DIAS and abs(litros - r.media) / r.desvio() > Z_OUTLIER:
+                    novas += self._marcar(chave, "outlier", dia, litros, r.media)
+                else:
+                    r.atualizar(litros)
+        # dia completo (ordenhas típicas já lançadas) → avalia a queda na hora
+        if s.registros >= max(1, round(s.turnos.media)) and s.turnos.n:
+            novas += self._avaliar(chave, s)
+        return novas
+
+    def _fechar(self, chave: str, s: _Serie) -> list:
+        novas = self._avaliar(chave, s)
+        s.diario.atualizar(s.total)
+        s.turnos.atualizar(s.registros)
+        return novas
+
+    def _avaliar(self, chave: str, s: _Serie) -> list:
+        d = s.diario
+        if d.n < MIN_DIAS:
+            return []
+        caiu = (s.total < d.media * (1 - QUEDA_MIN)
+                and (d.media - s.total) / d.desvio() > Z_QUEDA)
+        atual = self._flags.get((chave, "queda"))
+        if caiu:
+            if atual and atual["data"] == s.dia:
+                atual["valor"] = round(s.total, 1)
+                return []
+            return self._marcar(chave, "queda", s.dia, s.total, d.media)
+        if atual and atual["data"] == s.dia:
+            del self._flags[(chave, "queda")]      # ordenhas que faltavam chegaram
+        return []
+
+    def _marcar(self, chave: str, tipo: str, dia: str, valor: float, esperado: float) -> list:
+        flag = {"nome": "Rebanho" if chave == REBANHO else chave, "tipo": tipo, "data": dia,
+                "valor": round(valor, 1), "esperado": round(esperado, 1)}
+        self._flags[(chave, tipo)] = flag
+        return [flag]
+
+    # ── leitura ──────────────────────────────
+    def alertas(self, hoje: datetime.date, lactantes: list = ()) -> list:
+        """Flags de ontem/hoje mais as lactantes sem ordenha há DIAS_SEM_ORDENHA
+        dias (na ordem recebida)."""
+        desde  = (hoje - datetime.timedelta(days=1)).isoformat()
+        limite = (hoje - datetime.timedelta(days=DIAS_SEM_ORDENHA)).isoformat()
+        with self._lock:
+            saida = sorted((dict(f) for f in self._flags.values() if f["data"] >= desde),
+                           key=lambda f: (f["data"], f["nome"]))
+            for nome in lactantes:
+                s = self._series.get(nome)
+                if not s or s.ultima < limite:
+                    saida.append({"nome": nome, "tipo": "sem_ordenha",
+                                  "data": s.ultima if s else None, "valor": 0.0, "esperado": None})
+        return saida
+
+    def medias(self, nomes: list) -> dict:
+        """{nome: média diária (EWMA)} dos animais com pelo menos 3 dias fechados."""
+        with self._lock:
+            return {n: self._series[n].diario.media for n in nomes
+                    if n in self._series and self._series[n].diario.n >= 3}
+
+
+# ─── CACHE POR FAZENDA ────────────────────────────────────────────────────────
+_CACHE: dict = {}    # fazenda_id → (versão do chamador, expira, Detector)
+_LOCK = threading.Lock()
+_M = {"montagens": 0, "reusos": 0}
+
+
+def detector(fazenda_id: str, carregar: Callable[[], list], versao=None) -> Detector:
+    """Detector da fazenda. `carregar()` devolve a produção dos últimos
+    JANELA_DIAS dias para o replay, chamado só na montagem: versão nova
+    (escritas de fora do processo), cache expirado ou detector marcado sujo."""
+    agora = time.monotonic()
+    with _LOCK:
+        e = _CACHE.get(fazenda_id)
+    if e and e[0] == versao and e[1] > agora and not e[2].sujo:
+        _M["reusos"] += 1
+        return e[2]
+    det = Detector(carregar())
+    _M["montagens"] += 1
+    with _LOCK:
+        _CACHE[fazenda_id] = (versao, agora + _TTL_S, det)
+    return det
+
+
+def existente(fazenda_id: str) -> Optional[Detector]:
+    """Detector já montado (ou None) — para atualizar no lugar sem forçar leitura."""
+    with _LOCK:
+        e = _CACHE.get(fazenda_id)
+    return e[2] if e else None
+
+
+def metricas() -> dict:
+    with _LOCK:
+        return {**_M, "fazendas": len(_CACHE),
+                "flags": sum(len(e[2]._flags) for e in _CACHE.values())}
@@ -0,0 +1,154 @@
+"""
+MilkShow — Cache em disco
+Armazena blobs (PDFs, textos extraídos de mídia) em arquivos nomeados pelo
+hash da chave, com limite de tamanho total (despejo LRU pelo mtime, que é
+renovado a cada leitura) e TTL opcional. O diretório pode ser compartilhado
+entre processos (bot e scripts de lote): arquivo gravado por outro processo
+é adotado no índice na primeira leitura.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+log = logging.getLogger("milkshow_bot")
+
+DIR_PADRAO = os.environ.get(
+    "MILKSHOW_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+)
+
+
+class CacheDisco:
+    """Cache LRU de bytes em disco, seguro para várias threads."""
+
+    def __init__(self, nome: str, max_bytes: int, ttl_s: Optional[float] = None,
+                 diretorio: Optional[str] = None):
+        self.nome      = nome
+        self.max_bytes = max_bytes
+        self.ttl_s     = ttl_s
+        self.dir       = os.path.join(diretorio or DIR_PADRAO, nome)
+        self._lock     = threading.Lock()
+        self._idx: "OrderedDict[str, tuple]" = OrderedDict()   # arquivo → (bytes, mtime)
+        self._total    = 0
+        self._m = {"hits": 0, "misses": 0, "gravacoes": 0, "despejos": 0, "expirados": 0}
+        self._carregado = False
+
+    # ── índice ─────────────────────────────────────────────────
+    def _carregar(self):
+        if self._carregado:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        itens = []
+        for nome_arq in os.listdir(self.dir):
+            if nome_arq.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dir, nome_arq))
+                itens.append((st.st_mtime, nome_arq, st.st_size))
+            except OSError:
+                pass
+        for mtime, nome_arq, tam in sorted(itens):
+            self._idx[nome_arq] = (tam, mtime)
+            self._total += tam
+        self._carregado = True
+
+    @staticmethod
+    def _arquivo(chave: str) -> str:
+        return hashlib.sha256(chave.encode()).hexdigest()
+
+    def _adotar(self, arq: str) -> Optional[tuple]:
+        """Arquivo gravado por outro processo depois que o índice foi montado."""
+        try:
+            st = os.stat(os.path.join(self.dir, arq))
+        except OSError:
+            return None
+        self._idx[arq] = (st.st_size, st.st_mtime)
+        self._total += st.st_size
+        return self._idx[arq]
+
+    def _remover(self, arq: str):
+        tam, _ = self._idx.pop(arq, (0, 0))
+        self._total -= tam
+        try:
+            os.remove(os.path.join(self.dir, arq))
+        except OSError:
+            pass
+
+    def _despejar(self):
+        while self._total > self.max_bytes and self._idx:
+            arq = next(iter(self._idx))
+            self._remover(arq)
+            self._m["despejos"] += 1
+
+    # ── API ────────────────────────────────────────────────────
+    def caminho(self, chave: str) -> Optional[str]:
+        """Caminho do arquivo em cache (renova a posição LRU) ou None."""
+        with self._lock:
+            self._carregar()
+            arq = self._arquivo(chave)
+            ent = self._idx.get(arq) or self._adotar(arq)
+            if ent is None:
+                self._m["misses"] += 1
+                return None
+            if self.ttl_s is not None and time.time() - ent[1] > self.ttl_s:
+                self._remover(arq)
+                self._m["expirados"] += 1
+                self._m["misses"] += 1
+                return None
+            self._idx.move_to_end(arq)
+            self._m["hits"] += 1
+            path = os.path.join(self.dir, arq)
+            if self.ttl_s is None:
+                # Sem TTL o mtime marca o último uso (ordem LRU sobrevive a restart)
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+            return path
+
+    def obter(self, chave: str) -> Optional[bytes]:
+        path = self.caminho(chave)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._remover(self._arquivo(chave))
+            return None
+
+    def gravar(self, chave: str, conteudo: bytes) -> str:
+        """Grava atomicamente (tmp + rename) e devolve o caminho."""
+        with self._lock:
+            self._carregar()
+            arq  = self._arquivo(chave)
+            path = os.path.join(self.dir, arq)
+            fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(conteudo)
+            os.replace(tmp, path)
+            if arq in self._idx:
+                self._total -= self._idx.pop(arq)[0]
+            self._idx[arq] = (len(conteudo), time.time())
+            self._total += len(conteudo)
+            self._m["gravacoes"] += 1
+            self._despejar()
+            return path
+
+    def remover(self, chave: str):
+        with self._lock:
+            self._carregar()
+            self._remover(self._arquivo(chave))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            n = self._m["hits"] + self._m["misses"]
+            return {**self._m, "itens": len(self._idx), "bytes": self._total,
+                    "max_bytes": self.max_bytes,
+                    "taxa_acerto": round(self._m["hits"] / n, 3) if n else None}
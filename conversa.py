@@ -0,0 +1,532 @@
+"""
+MilkShow — Estado da conversa do bot (conversas_bot)
+Compactação do histórico: cada agente recebe até 8 turnos e o documento do
+Firestore cresce a cada COLETANDO/CONFIRMANDO. Turnos antigos viram um resumo
+estruturado dos campos já preenchidos, cada turno tem teto de bytes e extrações
+grandes (tabela lida por Vision, lista de itens) ficam num anexo em disco — no
+histórico só vai a referência.
+Confirmação local: em CONFIRMANDO, "sim", "não" ou a correção de um campo
+("o valor é 300", "são 25 litros") são resolvidos aqui, sem provedor de IA.
+Coleta por esquema: cada tipo tem seus campos obrigatórios; a resposta curta
+ao campo pendente (número, valor, data, turno, animal) é lida localmente e só
+o que não dá para ler segue para o agente.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Callable, Optional, Tuple
+
+from cache_disco import CacheDisco
+
+log = logging.getLogger("milkshow_bot")
+
+CACHE_ANEXOS = CacheDisco(
+    "anexos",
+    max_bytes=int(os.environ.get("CONV_ANEXOS_MB", "20")) * 1024 * 1024,
+    ttl_s=float(os.environ.get("CONV_ANEXOS_TTL_H", "24")) * 3600,
+)
+
+HIST_TURNOS      = int(os.environ.get("CONV_HIST_TURNOS", "4"))         # turnos mantidos na íntegra
+TURNO_MAX_BYTES  = int(os.environ.get("CONV_TURNO_MAX_BYTES", "1500"))
+_MARCA_RESUMO    = "[resumo das mensagens anteriores]"
+
+_M = {"compactacoes": 0, "turnos_resumidos": 0, "anexos": 0, "bytes_antes": 0, "bytes_depois": 0}
+_M_LOCK = threading.Lock()
+
+
+# ─── ANEXOS ───────────────────────────────────────────────────────────────────
+def guardar_anexo(conteudo: str) -> str:
+    """Grava o conteúdo completo no cache de anexos; devolve a referência."""
+    bruto = conteudo.encode()
+    ref = hashlib.sha256(bruto).hexdigest()[:16]
+    try:
+        CACHE_ANEXOS.gravar(ref, bruto)
+    except OSError as e:
+        log.warning(f"[conversa] falha ao gravar anexo: {e}")
+    with _M_LOCK:
+        _M["anexos"] += 1
+    return ref
+
+
+def anexo(ref: Optional[str]) -> Optional[str]:
+    if not ref:
+        return None
+    bruto = CACHE_ANEXOS.obter(ref)
+    return bruto.decode() if bruto is not None else None
+
+
+def itens_do_turno(turno: dict) -> Optional[list]:
+    """Itens de um turno do assistente — inline ou do anexo, se compactado."""
+    if turno.get("itens"):
+        return turno["itens"]
+    bruto = anexo(turno.get("itens_ref"))
+    if bruto:
+        try:
+            return json.loads(bruto)
+        except ValueError:
+            return None
+    return None
+
+
+# ─── COMPACTAÇÃO ──────────────────────────────────────────────────────────────
+def _tam(turno: dict) -> int:
+    return len((turno.get("content") or "").encode())
+
+
+def _cortar(texto: str, max_bytes: int) -> str:
+    """Prefixo de até max_bytes sem quebrar caractere UTF-8 no meio."""
+    return texto.encode()[:max_bytes].decode(errors="ignore")
+
+
+def limitar_turno(turno: dict, max_bytes: int = TURNO_MAX_BYTES) -> dict:
+    """Turno com no máximo `max_bytes`. Itens do assistente e textos longos
+    (extração de imagem/áudio) vão para anexo; fica a referência."""
+    conteudo = turno.get("content") or ""
+    if turno.get("role") == "assistant" and '"itens"' in conteudo:
+        try:
+            parsed = json.loads(conteudo)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict) and isinstance(parsed.get("itens"), list) and parsed["itens"]:
+            itens = parsed.pop("itens")
+            parsed["itens_ref"] = guardar_anexo(json.dumps(itens, ensure_ascii=False))
+            parsed["n_itens"] = len(itens)
+            conteudo = json.dumps(parsed, ensure_ascii=False)
+    if len(conteudo.encode()) > max_bytes:
+        ref = guardar_anexo(conteudo)
+        rodape = f"\n[… anexo {ref}: {len(conteudo.encode())} bytes, já processado]"
+        conteudo = _cortar(conteudo, max(0, max_bytes - len(rodape.encode()))) + rodape
+    if conteudo == turno.get("content"):
+        return turno
+    return {**turno, "content": conteudo}
+
+
+def _resumo(tipo: Optional[str], dados: Optional[dict]) -> list:
+    """Par user/assistant com os campos já preenchidos — substitui turnos antigos
+    mantendo a alternância de papéis que os provedores esperam."""
+    slots = {k: v for k, v in (dados or {}).items()
+             if k != "itens" and v not in (None, "", [], {})}
+    return [
+        {"role": "user", "content": _MARCA_RESUMO},
+        {"role": "assistant", "content": json.dumps(
+            {"resumo": True, "tipo": tipo, "dados": slots}, ensure_ascii=False)},
+    ]
+
+
+def compactar_historico(hist: list, tipo: Optional[str] = None, dados: Optional[dict] = None,
+                        manter: int = HIST_TURNOS, max_bytes: int = TURNO_MAX_BYTES) -> list:
+    """Histórico pronto para gravar: últimos `manter` turnos (começando num turno
+    do usuário) precedidos do resumo dos campos preenchidos, cada um com teto de bytes."""
+    antes = sum(_tam(t) for t in hist)
+    recentes, resumidos = hist, 0
+    if len(hist) > manter + 2:
+        corte = len(hist) - manter
+        while corte < len(hist) and hist[corte].get("role") != "user":
+            corte += 1
+        antigos, recentes = hist[:corte], hist[corte:]
+        resumidos = len(antigos) - (2 if antigos and antigos[0].get("content") == _MARCA_RESUMO else 0)
+        recentes = _resumo(tipo, dados) + recentes
+    novo = [limitar_turno(t, max_bytes) for t in recentes]
+    depois = sum(_tam(t) for t in novo)
+    if resumidos or depois != antes:
+        with _M_LOCK:
+            _M["compactacoes"]     += 1
+            _M["turnos_resumidos"] += resumidos
+            _M["bytes_antes"]      += antes
+            _M["bytes_depois"]     += depois
+    return novo
+
+
+# ─── PARSERS DE VALOR ─────────────────────────────────────────────────────────
+def parse_float(v) -> float:
+    """Converte valor monetário em float de forma robusta.
+    Aceita: 300, "300", "R$300", "300,50", "R$ 1.200,00", "trezentos" (passa 0).
+    """
+    if v is None:
+        return 0.0
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = re.sub(r'[^\d.,]', '', str(v))   # remove tudo exceto dígitos, vírgula, ponto
+    if not s:
+        return 0.0
+    # "1.200,50" → "1200.50"  |  "300,50" → "300.50"  |  "300.50" → "300.50"
+    if ',' in s and '.' in s:
+        s = s.replace('.', '').replace(',', '.')
+    elif ',' in s:
+        s = s.replace(',', '.')
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+
+def _sem_acento(s: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+
+
+_RE_NUMERO = re.compile(r'\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:[.,]\d+)?')
+_TURNOS    = {"manha": 1, "tarde": 2, "noite": 3}
+_NOME_TURNO = {1: "Manhã", 2: "Tarde", 3: "Noite"}
+
+
+def ler_numero(txt: str) -> Optional[float]:
+    """Primeiro número do texto ("25", "1.200,50", "R$ 300") ou None."""
+    m = _RE_NUMERO.search(txt or "")
+    return parse_float(m.group(0)) if m else None
+
+
+def ler_turno(txt: str) -> Optional[int]:
+    palavras = re.findall(r'[a-z]+', _sem_acento((txt or "").lower()))
+    achados = {_TURNOS[p] for p in palavras if p in _TURNOS}
+    return achados.pop() if len(achados) == 1 else None
+
+
+def ler_data(txt: str, hoje: Optional[datetime.date] = None) -> Optional[str]:
+    """hoje / ontem / anteontem / dd/mm[/aa[aa]] / aaaa-mm-dd → 'YYYY-MM-DD'."""
+    hoje = hoje or datetime.date.today()
+    t = _sem_acento((txt or "").lower())
+    for palavra, dias in (("anteontem", 2), ("ontem", 1), ("hoje", 0)):
+        if re.search(rf'\b{palavra}\b', t):
+            return (hoje - datetime.timedelta(days=dias)).isoformat()
+    try:
+        m = re.search(r'\b(\d{4})-(\d{2})-(\d{2})\b', t)
+        if m:
+            return datetime.date(int(m[1]), int(m[2]), int(m[3])).isoformat()
+        m = re.search(r'\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b', t)
+        if m:
+            ano = int(m[3]) if m[3] else hoje.year
+            ano = ano + 2000 if ano < 100 else ano
+            return datetime.date(ano, int(m[2]), int(m[1])).isoformat()
+    except ValueError:
+        return None
+    return None
+
+
+# ─── CONFIRMAÇÃO LOCAL ────────────────────────────────────────────────────────
+_PALAVRAS_SIM = {
+    "sim", "s", "ok", "okay", "pode", "salvar", "salva", "confirma", "confirmar",
+    "confirmo", "confirmado", "isso", "mesmo", "correto", "certo", "certinho", "exato",
+    "bora", "beleza", "blz", "claro", "yes",
+}
+# só confirmam junto de uma palavra de _PALAVRAS_SIM: "tá certo", "pode mandar",
+# "tudo certo" — "manda" ou "tudo" sozinhos não são confirmação
+_PALAVRAS_SIM_APOIO = {"ta", "esta", "tudo", "manda", "mandar"}
+_PALAVRAS_NAO = {
+    "nao", "n", "cancela", "cancelar", "cancelado", "esquece", "deixa", "pra", "la",
+    "quero", "nem", "no",
+}
+
+# palavra → (tipo do campo, chave em dados); "moeda" vai para valor/custo conforme o tipo
+_CAMPOS = {
+    "litros": "litros", "litro": "litros", "leite": "litros",
+    "valor": "moeda", "preco": "moeda", "custo": "moeda", "total": "moeda",
+    "quantidade": "qtd", "qtd": "qtd",
+    "turno": "turno", "data": "data", "dia": "data",
+    "animal": "animal", "vaca": "animal",
+    "nome": "nome", "produto": "produto", "fornecedor": "fornecedor",
+    "laticinio": "laticinio", "unidade": "unidade", "descricao": "descricao",
+}
+_CHAVE_POR_TIPO = {
+    ("GASTO_SANITARIO", "moeda"):    "custo",
+    ("REPRODUCAO", "moeda"):         "custo",
+    ("NOVO_ANIMAL", "animal"):       "nome",
+    ("COMPRA_ANIMAL", "animal"):     "nome",
+    ("CORRIGIR_PRODUCAO", "litros"): "litros_correto",
+}
+_NUMERICOS = {"litros", "litros_correto", "qtd", "valor", "custo"}
+
+_RE_EDITAR = re.compile(
+    r'^(?:(?:muda|mudar|altera|alterar|corrige|corrigir|troca|trocar|coloca|colocar)\s+)?'
+    r'(?:(?:o|a)\s+)?(?P<campo>[a-z]+)\s*[:=]?\s*'
+    r'(?:(?:para|pra|por|e|eh|foi|sao)\s+)*(?P<valor>\S.*?)[\s.!]*$'
+)
+_RE_LITROS = re.compile(r'^(?:(?:sao|foram|foi|e|eh)\s+)?(?P<num>\d+(?:[.,]\d+)?)\s*(?:litros?|l)$')
+_RE_MOEDA  = re.compile(r'^(?:(?:sao|foram|foi|e|eh)\s+)?(?:r\$\s*(?P<a>[\d.,]+)|(?P<b>[\d.,]+)\s*reais)$')
+
+
+def chave_campo(tipo: Optional[str], campo: str) -> str:
+    return _CHAVE_POR_TIPO.get((tipo, campo), "valor" if campo == "moeda" else campo)
+
+
+def converter_valor(chave: str, bruto: str, hoje: Optional[datetime.date] = None):
+    """Valor do campo a partir do texto do usuário, ou None se não der para ler."""
+    if chave in _NUMERICOS:
+        v = ler_numero(bruto)
+        return v if v and v > 0 else None
+    if chave == "turno":
+        return ler_turno(bruto)
+    if chave == "data":
+        return ler_data(bruto, hoje)
+    bruto = bruto.strip(" .,!\"'")
+    return bruto or None
+
+
+def _editar(texto: str, tipo: Optional[str], hoje: Optional[datetime.date]) -> Optional[dict]:
+    """{chave: valor} para "o valor é 300" / "muda o turno pra tarde" / "são 25 litros"."""
+    base = _sem_acento(texto.lower()).strip()
+    # acentos removidos preservam o comprimento → fatia do original mantém a grafia
+    original = texto.strip() if len(base) == len(texto.strip()) else base
+    m = re.match(r'^(?:(?:sim|nao|ok)\b[\s,.!-]*)', base)
+    ini = m.end() if m else 0
+    resto, resto_orig = base[ini:], original[ini:]
+    m = _RE_LITROS.match(resto)
+    if m:
+        chave = chave_campo(tipo, "litros")
+        v = converter_valor(chave, m["num"])
+        return {chave: v} if v is not None else None
+    m = _RE_MOEDA.match(resto)
+    if m:
+        chave = chave_campo(tipo, "moeda")
+        v = converter_valor(chave, m["a"] or m["b"])
+        return {chave: v} if v is not None else None
+    m = _RE_EDITAR.match(resto)
+    if not m or m["campo"] not in _CAMPOS:
+        return None
+    chave = chave_campo(tipo, _CAMPOS[m["campo"]])
+    if chave not in _NUMERICOS and chave not in ("turno", "data"):
+        # texto livre só com ligação explícita ("o animal é X", "fornecedor: Y")
+        # e curto — "a vaca tá mancando" não é correção de campo
+        ligacao = re.search(r'\b(?:para|pra|por|e|eh)\b|[:=]', resto[:m.start("valor")])
+        if not ligacao or len(m["valor"].split()) > 4:
+            return None
+    v = converter_valor(chave, resto_orig[m.start("valor"):m.end("valor")], hoje)
+    return {chave: v} if v is not None else None
+
+
+def resolver_confirmacao(texto: str, tipo: Optional[str] = None,
+                         hoje: Optional[datetime.date] = None) -> Tuple[Optional[str], Optional[dict]]:
+    """Resposta do usuário em CONFIRMANDO → ("confirmar"|"cancelar"|"editar", campos)
+    ou (None, None) quando não dá para decidir localmente (segue para a IA)."""
+    campos = _editar(texto or "", tipo, hoje)
+    if campos:
+        return "editar", campos
+    palavras = set(re.findall(r'[a-z]+', _sem_acento((texto or "").lower())))
+    if not palavras:
+        return None, None
+    eh_nao = palavras & {"nao", "n", "cancela", "cancelar", "esquece", "no"}
+    if eh_nao and palavras <= _PALAVRAS_NAO:
+        return "cancelar", None
+    if not eh_nao and palavras & _PALAVRAS_SIM and palavras <= _PALAVRAS_SIM | _PALAVRAS_SIM_APOIO:
+        return "confirmar", None
+    return None, None
+
+
+# ─── COLETA POR ESQUEMA ───────────────────────────────────────────────────────
+# tipo → campos obrigatórios, na ordem em que são perguntados: (chave, leitor).
+# "texto" não tem leitor local — a resposta a esse campo vai para o agente.
+ESQUEMA_SLOTS = {
+    "PRODUCAO_LEITE":    [("litros", "numero"), ("turno", "turno")],
+    "VENDA_LEITE":       [("valor", "moeda"), ("litros", "numero")],
+    "GASTO_GERAL":       [("descricao", "texto"), ("valor", "moeda")],
+    "COMPRA_PRODUTO":    [("produto", "texto"), ("qtd", "numero"), ("valor", "moeda")],
+    "GASTO_SANITARIO":   [("produto", "texto")],
+    "VENDA_ANIMAL":      [("animal", "animal"), ("valor", "moeda")],
+    "COMPRA_ANIMAL":     [("nome", "texto"), ("valor", "moeda")],
+    "NOVO_ANIMAL":       [("nome", "texto")],
+    "REPRODUCAO":        [("animal", "animal"), ("evento", "texto")],
+    "CORRIGIR_PRODUCAO": [("animal", "animal"), ("data", "data"), ("litros_correto", "numero")],
+}
+
+_PERGUNTAS = {
+    "litros":         "Quantos *litros*?",
+    "litros_correto": "Quantos *litros* é o valor correto?",
+    "turno":          "Qual *turno*? (manhã, tarde ou noite)",
+    "valor":          "Qual o *valor* (R$)?",
+    "qtd":            "Qual a *quantidade*?",
+    "data":           "Qual a *data*? (ex.: hoje, ontem, 05/03)",
+    "animal":         "Qual *animal*?",
+    "descricao":      "Qual foi o gasto? (descrição)",
+    "produto":        "Qual *produto*?",
+    "nome":           "Qual o *nome* do animal?",
+    "evento":         "Qual evento? (inseminação, prenhez confirmada, parto, secagem…)",
+}
+_PERGUNTAS_TIPO = {("VENDA_LEITE", "litros"): "Quantos *litros* foram vendidos?"}
+_MAX_PALAVRAS = 5   # resposta a um campo é curta; frase longa vai para o agente
+
+
+def _vazio(v) -> bool:
+    return v in (None, "", [], {}) or (isinstance(v, (int, float)) and v <= 0)
+
+
+def proximo_slot(tipo: Optional[str], dados: dict) -> Optional[Tuple[str, str]]:
+    """Primeiro campo obrigatório ainda vazio — (chave, leitor) — ou None."""
+    for chave, leitor in ESQUEMA_SLOTS.get(tipo or "", []):
+        if chave == "valor" and not _vazio(dados.get("custo")):
+            continue
+        if _vazio(dados.get(chave)):
+            return chave, leitor
+    return None
+
+
+# palavras que identificam na última pergunta qual campo foi pedido
+_PISTAS = {
+    "litros": r"litro", "litros_correto": r"litro", "turno": r"turno|manha|tarde|noite",
+    "valor": r"valor|r\$|preco|reais|recebeu|pagou|custou", "qtd": r"quantidade|quant[oa]s",
+    "data": r"data|quando|que dia", "animal": r"animal|vaca|qual delas|qual dela",
+}
+
+
+def slot_perguntado(tipo: Optional[str], dados: dict, pergunta: str) -> Optional[Tuple[str, str]]:
+    """Campo vazio a que a última pergunta se refere; None se nenhum ou mais de um."""
+    p = _sem_acento((pergunta or "").lower())
+    vazios = [(c, l) for c, l in ESQUEMA_SLOTS.get(tipo or "", [])
+              if _vazio(dados.get(c)) and not (c == "valor" and not _vazio(dados.get("custo")))]
+    citados = [(c, l) for c, l in vazios if c in _PISTAS and re.search(_PISTAS[c], p)]
+    if len(citados) > 1 and citados[0][0] == "qtd":
+        citados = citados[1:]          # "quantos litros?" cita qtd e litros
+    return citados[0] if len(citados) == 1 else None
+
+
+def pergunta_slot(tipo: Optional[str], chave: str) -> str:
+    return _PERGUNTAS_TIPO.get((tipo, chave)) or _PERGUNTAS.get(chave, f"Qual {chave}?")
+
+
+_MAX_NGRAMA   = 3     # palavras por trecho consultado no índice
+_MIN_TRECHO   = 4     # letras: "sua" não vira "Lua" por erro de digitação
+
+
+def ler_animal(txt: str, nomes, resolver: Optional[Callable[[str], Optional[str]]] = None) -> Optional[str]:
+    """Nome cadastrado citado na resposta (sem acento/caixa) — None se nenhum ou
+    ambíguo. Com `resolver` (índice: apelido, diminutivo, brinco, erro de
+    digitação) a frase também é consultada trecho a trecho; dois animais
+    diferentes entre os dois modos também é ambíguo."""
+    alvo = f" {' '.join(re.findall(r'[a-z0-9]+', _sem_acento((txt or '').lower())))} "
+    achados = {}
+    for nome in nomes:
+        n = " ".join(re.findall(r'[a-z0-9]+', _sem_acento((nome or "").lower())))
+        if n and f" {n} " in alvo:
+            achados[n] = nome
+    escolhido = None
+    if achados:
+        # "Mimosa Branca" também contém "Mimosa": vale o nome mais longo que cobre os outros
+        maior = max(achados, key=len)
+        if not all(f" {n} " in f" {maior} " for n in achados):
+            return None
+        escolhido = achados[maior]
+    citados = ({escolhido} if escolhido else set()) | (_animais_por_trechos(txt, resolver) if resolver else set())
+    return citados.pop() if len(citados) == 1 else None
+
+
+def _animais_por_trechos(txt: str, resolver) -> set:
+    """Trechos de até _MAX_NGRAMA palavras, do mais longo ao mais curto; palavra
+    já coberta por um trecho reconhecido não conta de novo."""
+    palavras = re.findall(r'[a-z0-9#]+', _sem_acento((txt or "").lower()))
+    coberto = [False] * len(palavras)
+    achados = set()
+    for n in range(min(_MAX_NGRAMA, len(palavras)), 0, -1):
+        for i in range(len(palavras) - n + 1):
+            trecho = " ".join(palavras[i:i + n])
+            if any(coberto[i:i + n]) or len(trecho.replace(" ", "")) < _MIN_TRECHO:
+                continue
+            nome = resolver(trecho)
+            if nome:
+                achados.add(nome)
+                coberto[i:i + n] = [True] * n
+    return achados
+
+
+def ler_slot(leitor: str, txt: str, nomes=(), hoje: Optional[datetime.date] = None,
+             resolver: Optional[Callable[[str], Optional[str]]] = None):
+    """Valor do campo lido da resposta curta, ou None (não deu para ler com segurança)."""
+    base = _sem_acento((txt or "").lower()).strip()
+    if not base or len(base.split()) > _MAX_PALAVRAS or "?" in base:
+        return None
+    if leitor in ("numero", "moeda"):
+        numeros = _RE_NUMERO.findall(base)
+        if len(numeros) != 1:
+            return None
+        v = parse_float(numeros[0])
+        return v if v > 0 else None
+    if leitor == "turno":
+        return ler_turno(base)
+    if leitor == "data":
+        return ler_data(base, hoje)
+    if leitor == "animal":
+        return ler_animal(txt, nomes, resolver)
+    return None
+
+
+def preencher_slots(tipo: Optional[str], dados: dict, texto: str, nomes=(),
+                    hoje: Optional[datetime.date] = None,
+                    pergunta: Optional[str] = None,
+                    resolver: Optional[Callable[[str], Optional[str]]] = None) -> Optional[dict]:
+    """Campos preenchidos pela resposta ao campo pendente — o citado na última
+    `pergunta`, ou o primeiro vazio do esquema. O pendente tem de ser lido; turno
+    e data ainda vazios aproveitam a mesma frase ("25 litros de tarde").
+    `nomes`: animais que podem ser citados; `resolver`: índice para o que não
+    aparece escrito igual ao cadastro.
+    None quando o pendente não é lido localmente — a mensagem segue para o agente."""
+    pendente = (slot_perguntado(tipo, dados, pergunta) if pergunta is not None
+                else proximo_slot(tipo, dados))
+    if not pendente:
+        return None
+    chave, leitor = pendente
+    v = ler_slot(leitor, texto, nomes, hoje, resolver)
+    if v is None:
+        return None
+    novos = {chave: v}
+    for outra, leitor_o in ESQUEMA_SLOTS.get(tipo, []):
+        if outra != chave and leitor_o in ("turno", "data") and _vazio(dados.get(outra)):
+            v2 = ler_slot(leitor_o, texto, nomes, hoje)
+            if v2 is not None:
+                novos[outra] = v2
+    return novos
+
+
+_ROTULOS = {
+    "litros": "Litros", "litros_correto": "Litros (correto)", "valor": "Valor",
+    "custo": "Custo", "qtd": "Quantidade", "unidade": "Unidade", "turno": "Turno",
+    "data": "Data", "animal": "Animal", "nome": "Nome", "produto": "Produto",
+    "fornecedor": "Fornecedor", "laticinio": "Laticínio", "descricao": "Descrição",
+    "categoria": "Categoria", "evento": "Evento", "sexo": "Sexo",
+    "status_animal": "Status", "tipo_sanitario": "Tipo", "obs": "Obs",
+}
+_NOME_TIPO = {
+    "PRODUCAO_LEITE": "Produção de leite", "PRODUCAO_MULTIPLA": "Produção (vários registros)",
+    "CORRIGIR_PRODUCAO": "Correção de produção", "VENDA_LEITE": "Venda de leite",
+    "COMPRA_PRODUTO": "Compra de produto", "GASTO_SANITARIO": "Sanitário",
+    "GASTO_GERAL": "Despesa", "VENDA_ANIMAL": "Venda de animal",
+    "COMPRA_ANIMAL": "Compra de animal", "NOVO_ANIMAL": "Novo animal",
+    "REPRODUCAO": "Reprodução",
+}
+
+
+def _fmt(chave: str, v) -> str:
+    if chave in ("valor", "custo"):
+        return f"R$ {parse_float(v):.2f}"
+    if chave == "turno":
+        try:
+            return _NOME_TURNO.get(int(v), str(v))
+        except (TypeError, ValueError):
+            return str(v)
+    if chave == "data" and isinstance(v, str) and re.match(r'^\d{4}-\d{2}-\d{2}$', v):
+        a, m, d = v.split("-")
+        return f"{d}/{m}/{a}"
+    if isinstance(v, float):
+        return f"{v:g}"
+    return str(v)
+
+
+def resumo_confirmacao(tipo: Optional[str], dados: dict) -> str:
+    """Texto de confirmação montado localmente a partir dos campos preenchidos."""
+    linhas = [f"*{_NOME_TIPO.get(tipo or '', tipo or 'Registro')}*"]
+    for chave, rotulo in _ROTULOS.items():
+        v = (dados or {}).get(chave)
+        if v not in (None, "", [], {}):
+            linhas.append(f"• {rotulo}: {_fmt(chave, v)}")
+    linhas.append('\nConfirma? Responda *sim*, *não* ou corrija um campo (ex.: "o valor é 300").')
+    return "\n".join(linhas)
+
+
+def metricas() -> dict:
+    with _M_LOCK:
+        m = dict(_M)
+    m["bytes_economizados"] = m.pop("bytes_antes") - m.pop("bytes_depois")
+    m["cache_anexos"] = CACHE_ANEXOS.metricas()
+    return m
@@ -0,0 +1,464 @@
+"""
+MilkShow — Índices em memória por fazenda
+Montados a partir das listas já em cache (animais, estoque) e guardados junto
+delas — toda busca por nome vira consulta em dicionário, sem Firestore nem IA.
+
+Animais: nome sem acento/caixa/artigo, apelidos (campo `apelidos` do animal,
+lista ou texto separado por vírgula), raiz do nome ("mimosinha" → "Mimosa"),
+brinco/`id` e, por fim, candidatos por trigramas confirmados por Levenshtein.
+
+Estoque: nome normalizado (nutricao._normalizar), sinônimos da tabela INSUMOS
+("silagem de milho" acha "Milho, silagem") e, por último, trecho do nome.
+Atualizado no lugar a cada escrita do bot — a coleção não é relida. Cada baixa
+atualiza no próprio item a taxa de consumo (soma com decaimento exponencial),
+de onde sai a previsão de dias até acabar sem reler o histórico.
+
+Produção: registros por (data, animal, turno) para checar duplicata e um
+buffer circular com o total diário dos últimos 14 dias (média do rebanho para
+valores fora da curva) — aquecidos com uma leitura e atualizados a cada escrita.
+
+Ids de animais: registro de prefixos (base → último sufixo emitido) que o
+alocador transacional guarda num documento por fazenda.
+"""
+
+import datetime
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from nutricao import INSUMOS, _normalizar
+
+_ARTIGOS  = {"a", "o", "as", "os", "da", "do", "vaca", "novilha", "bezerra", "bezerro", "touro"}
+_SUFIXOS  = ("zinha", "zinho", "inha", "inho", "ona", "ao", "a", "o")
+
+
+def normalizar(s: str) -> str:
+    """Minúsculas, sem acento, só letras/dígitos separados por um espaço."""
+    s = ''.join(c for c in unicodedata.normalize('NFD', str(s or "").lower())
+                if unicodedata.category(c) != 'Mn')
+    return " ".join(re.findall(r'[a-z0-9]+', s))
+
+
+def _sem_artigo(chave: str) -> str:
+    partes = chave.split()
+    while len(partes) > 1 and partes[0] in _ARTIGOS:
+        partes = partes[1:]
+    return " ".join(partes)
+
+
+def raiz(chave: str) -> str:
+    """Raiz da última palavra sem diminutivo/aumentativo: mimosinha, mimosona → mimos."""
+    partes = chave.split()
+    if not partes:
+        return chave
+    ult = partes[-1]
+    for suf in _SUFIXOS:
+        if ult.endswith(suf) and len(ult) - len(suf) >= 3:
+            ult = ult[:-len(suf)]
+            break
+    return " ".join(partes[:-1] + [ult])
+
+
+def _trigramas(chave: str) -> set:
+    p = f"  {chave} "
+    return {p[i:i + 3] for i in range(len(p) - 2)}
+
+
+def levenshtein(a: str, b: str, limite: int) -> int:
+    """Distância de edição; para cedo (devolve limite + 1) ao passar do limite."""
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    ant = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        atual = [i]
+        for j, cb in enumerate(b, 1):
+            atual.append(min(ant[j] + 1, atual[j - 1] + 1, ant[j - 1] + (ca != cb)))
+        if min(atual) > limite:
+            return limite + 1
+        ant = atual
+    return ant[-1]
+
+
+def apelidos(animal: dict) -> list:
+    bruto = animal.get("apelidos") or []
+    if isinstance(bruto, str):
+        bruto = bruto.split(",")
+    return [a for a in bruto if str(a).strip()]
+
+
+class IndiceAnimais:
+    """Resolução local de nome/apelido/brinco → animal cadastrado."""
+
+    def __init__(self, animais: list):
+        self.animais = [a for a in animais if a.get("nome")]
+        self._exato: dict = defaultdict(list)   # nome/apelido normalizado → [animal]
+        self._raiz:  dict = defaultdict(list)
+        self._id:    dict = {}
+        self._tri:   dict = defaultdict(set)    # trigrama → chaves
+        for a in self.animais:
+            for termo in [a["nome"]] + apelidos(a):
+                chave = _sem_artigo(normalizar(termo))
+                if not chave:
+                    continue
+                if a not in self._exato[chave]:
+                    self._exato[chave].append(a)
+                if a not in self._raiz[raiz(chave)]:
+                    self._raiz[raiz(chave)].append(a)
+                for t in _trigramas(chave):
+                    self._tri[t].add(chave)
+            if a.get("id"):
+                self._id[normalizar(a["id"]).replace(" ", "")] = a
+
+    @staticmethod
+    def _unico(lista: list) -> Optional[dict]:
+        if len(lista) == 1:
+            return lista[0]
+        ativos = [a for a in lista if a.get("status") not in ("Vendido", "Morto")]
+        return ativos[0] if len(ativos) == 1 else None
+
+    def por_id(self, texto: str) -> Optional[dict]:
+        return self._id.get(normalizar(texto).replace(" ", ""))
+
+    def candidatos(self, texto: str, n: int = 5) -> list:
+        """Nomes cadastrados mais próximos: [(nome, distância)], menor primeiro."""
+        chave = _sem_artigo(normalizar(texto))
+        if not chave:
+            return []
+        votos: dict = defaultdict(int)
+        for t in _trigramas(chave):
+            for c in self._tri.get(t, ()):
+                votos[c] += 1
+        limite = max(1, len(chave) // 4)
+        achados = {}
+        for c in sorted(votos, key=votos.get, reverse=True)[:20]:
+            d = levenshtein(chave, c, limite)
+            if d <= limite:
+                for a in self._exato[c]:
+                    achados[a["nome"]] = min(d, achados.get(a["nome"], d))
+        return sorted(achados.items(), key=lambda x: x[1])[:n]
+
+    def resolver(self, texto: str) -> Optional[dict]:
+        """Animal citado, ou None se não houver correspondência única."""
+        if not texto:
+            return None
+        achado = self.por_id(texto.lstrip("#"))
+        if achado:
+            return achado
+        chave = _sem_artigo(normalizar(texto))
+        if not chave:
+            return None
+        for mapa, termo in ((self._exato, chave), (self._raiz, raiz(chave))):
+            if termo in mapa:
+                return self._unico(mapa[termo])
+        cands = self.candidatos(texto, 2)
+        if cands and (len(cands) == 1 or cands[0][1] < cands[1][1]):
+            return self._unico(self._exato[_sem_artigo(normalizar(cands[0][0]))])
+        return None
+
+    def resolver_nome(self, texto: str, so_ativos: bool = False) -> Optional[str]:
+        """Nome do animal citado; `so_ativos` descarta vendido/morto."""
+        a = self.resolver(texto)
+        if a and so_ativos and a.get("status") in ("Vendido", "Morto"):
+            return None
+        return a["nome"] if a else None
+
+    def nomes_ativos(self) -> list:
+        return [a["nome"] for a in self.animais if a.get("status") not in ("Vendido", "Morto")]
+
+
+# ─── ESTOQUE ──────────────────────────────────────────────────────────────────
+def _mapa_sinonimos() -> dict:
+    """Nome/sinônimo normalizado → nome do insumo na tabela nutricional."""
+    mapa = {}
+    for nome, dados in INSUMOS.items():
+        for termo in [nome] + list(dados.get("sinonimos", [])):
+            mapa.setdefault(_normalizar(termo), nome)
+    return mapa
+
+
+_SINONIMOS = _mapa_sinonimos()
+
+
+class IndiceEstoque:
+    """Itens do estoque por nome normalizado e por insumo canônico.
+    Cada item é o dict do documento com `doc_id`."""
+
+    def __init__(self, itens: list):
+        self._lock  = threading.Lock()
+        self._itens: dict = {}                 # doc_id → item
+        self._nome:  dict = {}                 # nome normalizado → doc_id
+        self._canon: dict = defaultdict(list)  # insumo canônico → [doc_id]
+        for it in itens:
+            self._incluir(it["doc_id"], it)
+
+    def _incluir(self, doc_id: str, item: dict):
+        item = {**item, "doc_id": doc_id}
+        self._itens[doc_id] = item
+        n = _normalizar(item.get("item") or "")
+        if n:
+            self._nome.setdefault(n, doc_id)
+            c = _SINONIMOS.get(n)
+            if c and doc_id not in self._canon[c]:
+                self._canon[c].append(doc_id)
+
+    def _excluir(self, doc_id: str):
+        item = self._itens.pop(doc_id, None)
+        if not item:
+            return
+        n = _normalizar(item.get("item") or "")
+        if self._nome.get(n) == doc_id:
+            del self._nome[n]
+            outro = next((d for d, it in self._itens.items()
+                          if _normalizar(it.get("item") or "") == n), None)
+            if outro:
+                self._nome[n] = outro
+        for lst in self._canon.values():
+            if doc_id in lst:
+                lst.remove(doc_id)
+
+    def buscar(self, nome: str) -> Optional[dict]:
+        """Item do estoque para o nome citado: exato, sinônimo ou trecho do nome."""
+        n = _normalizar(nome or "")
+        if not n:
+            return None
+        with self._lock:
+            did = self._nome.get(n)
+            if did is None and _SINONIMOS.get(n) in self._canon:
+                did = next(iter(self._canon[_SINONIMOS[n]]), None)
+            if did is None:
+                did = next((d for nome_i, d in self._nome.items()
+                            if n in nome_i or nome_i in n), None)
+            return dict(self._itens[did]) if did is not None else None
+
+    def gravar(self, doc_id: str, campos: dict):
+        """Reflete no índice um add/update feito no Firestore."""
+        with self._lock:
+            atual = self._itens.get(doc_id, {})
+            self._excluir(doc_id)
+            self._incluir(doc_id, {**atual, **campos})
+
+    def remover(self, doc_id: str):
+        with self._lock:
+            self._excluir(doc_id)
+
+    def itens(self) -> list:
+        with self._lock:
+            return [dict(it) for it in self._itens.values()]
+
+    def esgotando(self, hoje: datetime.date, dias: int) -> list:
+        """Itens com estoque previsto para acabar em até `dias` dias (com a
+        previsão em `previsao`), do mais urgente ao menos."""
+        with self._lock:
+            itens = [dict(it) for it in self._itens.values()]
+        saida = []
+        for it in itens:
+            prev = previsao_consumo(it, hoje)
+            if prev["dias_restantes"] is not None and prev["dias_restantes"] <= dias:
+                saida.append({**it, "previsao": prev})
+        return sorted(saida, key=lambda it: it["previsao"]["dias_restantes"])
+
+
+# ─── CONSUMO DO ESTOQUE ───────────────────────────────────────────────────────
+# Estado no documento do item: consumo_soma (baixas com peso e^(−idade/τ), na
+# data da última), consumo_ini/consumo_ult (primeira e última baixa) e
+# consumo_n. Taxa = soma decaída até hoje ÷ soma dos pesos de baixas unitárias
+# espaçadas do intervalo médio desde a primeira — exata para uso regular, e
+# cai sozinha quando as baixas param.
+CONSUMO_TAU_D      = float(os.environ.get("ESTOQUE_CONSUMO_TAU_D", "30"))
+ESTOQUE_AVISO_DIAS = int(os.environ.get("ESTOQUE_AVISO_DIAS", "7"))   # alerta antecipado
+
+
+def _dia(s) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(str(s)[:10]) if s else None
+    except ValueError:
+        return None
+
+
+def registrar_consumo(item: dict, qtd: float, dia: datetime.date) -> dict:
+    """Campos a gravar no item junto com a nova quantidade após uma baixa de
+    `qtd` em `dia` — O(1), sem consultar baixas anteriores."""
+    qtd = float(qtd or 0)
+    ult = _dia(item.get("consumo_ult"))
+    ini = _dia(item.get("consumo_ini")) or dia
+    soma = float(item.get("consumo_soma") or 0)
+    if ult and dia < ult:
+        soma += qtd * math.exp(-(ult - dia).days / CONSUMO_TAU_D)     # baixa retroativa
+    else:
+        if ult:
+            soma *= math.exp(-(dia - ult).days / CONSUMO_TAU_D)
+        soma += qtd
+        ult = dia
+    return {"consumo_soma": round(soma, 6), "consumo_ini": min(ini, dia).isoformat(),
+            "consumo_ult": ult.isoformat(), "consumo_n": int(item.get("consumo_n") or 0) + 1}
+
+
+def consumo_diario(item: dict, hoje: datetime.date) -> Optional[float]:
+    """Consumo médio por dia (unidade do item) ou None com menos de 2 baixas."""
+    n = int(item.get("consumo_n") or 0)
+    ini, ult = _dia(item.get("consumo_ini")), _dia(item.get("consumo_ult"))
+    if n < 2 or not ini or not ult:
+        return None
+    tau = CONSUMO_TAU_D
+    soma = float(item.get("consumo_soma") or 0) * math.exp(-max((hoje - ult).days, 0) / tau)
+    passo = max((ult - ini).days / (n - 1), 1.0)            # intervalo médio entre baixas
+    efetivo = max((hoje - ini).days, 0) + passo
+    # janela equivalente das baixas espaçadas de `passo` com o mesmo decaimento
+    janela = passo * (1 - math.exp(-efetivo / tau)) / (1 - math.exp(-passo / tau))
+    return soma / janela
+
+
+def previsao_consumo(item: dict, hoje: datetime.date) -> dict:
+    """{consumo_dia, dias_restantes, acaba_em} do item (None sem taxa)."""
+    taxa = consumo_diario(item, hoje)
+    if not taxa or taxa <= 0:
+        return {"consumo_dia": None, "dias_restantes": None, "acaba_em": None}
+    dias = int(max(float(item.get("qtd") or 0), 0.0) / taxa + 1e-6)
+    return {"consumo_dia": round(taxa, 3), "dias_restantes": dias,
+            "acaba_em": (hoje + datetime.timedelta(days=dias)).isoformat()}
+
+
+# ─── IDS DE ANIMAIS ───────────────────────────────────────────────────────────
+def base_id(nome: str) -> str:
+    """Prefixo do id derivado do nome: 4 primeiras letras em maiúsculas."""
+    return (nome or "").strip()[:4].upper() or "ANIM"
+
+
+def registro_ids(ids) -> dict:
+    """Registro de prefixos a partir dos ids existentes: cada id conta como base
+    emitida e "MIMO3" avança o sufixo de "MIMO" até 3."""
+    prefixos: dict = {}
+    for i in ids:
+        i = str(i or "").strip()
+        if not i:
+            continue
+        prefixos[i] = max(prefixos.get(i, 0), 1)
+        m = re.match(r'^(.*\D)(\d+)$', i)
+        if m and int(m[2]) >= 2:
+            prefixos[m[1]] = max(prefixos.get(m[1], 0), int(m[2]))
+    return prefixos
+
+
+def reservar_id(prefixos: dict, base: str) -> str:
+    """Próximo id livre para `base` (BASE, BASE2, BASE3…); atualiza `prefixos`."""
+    k = prefixos.get(base, 0) + 1
+    while True:
+        cand = base if k == 1 else f"{base}{k}"
+        if k == 1 or not prefixos.get(cand):
+            break
+        k += 1
+    prefixos[base] = k
+    prefixos[cand] = max(prefixos.get(cand, 0), 1)
+    return cand
+
+
+# ─── PRODUÇÃO ─────────────────────────────────────────────────────────────────
+def _turno_int(t) -> int:
+    try:
+        return int(t)
+    except (TypeError, ValueError):
+        return {"manha": 1, "tarde": 2, "noite": 3}.get(normalizar(t), 1)
+
+
+class IndiceProducao:
+    """Janela móvel de `DIAS` dias da produção de uma fazenda."""
+
+    DIAS = 14
+
+    def __init__(self, docs: list, hoje: datetime.date):
+        self._lock  = threading.Lock()
+        self._n     = self.DIAS + 1
+        self._dias  = [None] * self._n          # buffer circular: data de cada posição
+        self._total = [0.0] * self._n
+        self._qtd   = [0] * self._n
+        self._regs: dict = {}                    # doc_id → (data, id_animal, turno, leite)
+        self._chave: dict = {}                   # (data, id_animal, turno) → doc_id
+        self.hoje = hoje
+        for d in docs:
+            self._incluir(d["doc_id"], d)
+
+    @property
+    def inicio(self) -> str:
+        return (self.hoje - datetime.timedelta(days=self.DIAS)).isoformat()
+
+    def _posicao(self, data: str) -> Optional[int]:
+        try:
+            dia = datetime.date.fromisoformat(str(data)[:10])
+        except ValueError:
+            return None
+        i = dia.toordinal() % self._n
+        if self._dias[i] != dia:                 # posição de um dia que saiu da janela
+            self._dias[i], self._total[i], self._qtd[i] = dia, 0.0, 0
+        return i
+
+    def _incluir(self, doc_id: str, doc: dict):
+        data = str(doc.get("data") or "")[:10]
+        if not self.cobre(data):
+            return
+        reg = (data, doc.get("id_animal") or "geral", _turno_int(doc.get("turno")),
+               float(doc.get("leite") or 0))
+        self._regs[doc_id] = reg
+        self._chave[reg[:3]] = doc_id
+        i = self._posicao(data)
+        if i is not None:
+            self._total[i] += reg[3]
+            self._qtd[i]   += 1
+
+    def _excluir(self, doc_id: str) -> Optional[dict]:
+        reg = self._regs.pop(doc_id, None)
+        if not reg:
+            return None
+        if self._chave.get(reg[:3]) == doc_id:
+            del self._chave[reg[:3]]
+        i = self._posicao(reg[0])
+        if i is not None and self._qtd[i]:
+            self._total[i] -= reg[3]
+            self._qtd[i]   -= 1
+        return {"data": reg[0], "id_animal": reg[1], "turno": reg[2], "leite": reg[3]}
+
+    def rolar(self, hoje: datetime.date):
+        """Avança a janela; registros anteriores ao novo início são descartados."""
+        with self._lock:
+            if hoje <= self.hoje:
+                return
+            self.hoje = hoje
+            for doc_id in [k for k, r in self._regs.items() if r[0] < self.inicio]:
+                self._excluir(doc_id)
+
+    def cobre(self, data: str) -> bool:
+        """Data dentro da janela (datas futuras ficam de fora: ocupariam a
+        posição do buffer de um dia ainda válido)."""
+        return self.inicio <= str(data)[:10] <= self.hoje.isoformat()
+
+    def duplicata(self, data: str, id_animal: str, turno) -> Optional[dict]:
+        """Registro já existente do animal no dia/turno: {"doc_id", "leite"} ou None."""
+        with self._lock:
+            doc_id = self._chave.get((str(data)[:10], id_animal, _turno_int(turno)))
+            return {"doc_id": doc_id, "leite": self._regs[doc_id][3]} if doc_id else None
+
+    def media_diaria(self) -> float:
+        """Média do total diário nos dias da janela que têm registro."""
+        with self._lock:
+            ini = datetime.date.fromisoformat(self.inicio)
+            tot = [self._total[i] for i in range(self._n)
+                   if self._dias[i] and self._dias[i] >= ini and self._qtd[i]]
+        return sum(tot) / len(tot) if tot else 0.0
+
+    def registrar(self, doc_id: str, doc: dict):
+        with self._lock:
+            self._excluir(doc_id)
+            self._incluir(doc_id, doc)
+
+    def atualizar(self, doc_id: str, campos: dict):
+        with self._lock:
+            atual = self._excluir(doc_id)
+            if atual is not None:
+                self._incluir(doc_id, {**atual, **campos})
+
+    def remover(self, doc_id: str):
+        with self._lock:
+            self._excluir(doc_id)
@@ -0,0 +1,300 @@
+"""
+MilkShow — Curva de lactação por vaca (modelo de Wood)
+y(t) = a · t^b · e^(−c·t), t = DIM (dias desde o parto), ajustada por vaca
+com mínimos quadrados no log: ln y = ln a + b·ln t − c·t, regressão linear
+em [1, ln t, t] sobre o total diário da lactação atual.
+
+Cada vaca guarda só as somas das equações normais (XᵀX e Xᵀy — 9 números)
+e os totais por dia. Registro novo, correção ou exclusão troca a contribuição
+daquele dia e o reajuste é um sistema 3×3 (mais a forma do rebanho, uma soma
+vetorizada das mesmas somas); a montagem inicial resolve o rebanho inteiro de
+uma vez (np.bincount das somas + np.linalg.solve em lote).
+
+Vaca com poucos dias ou ajuste fora do formato de lactação (b ≤ 0 ou c ≤ 0)
+usa a forma da curva do rebanho (regressão dentro de cada vaca) no nível de
+produção dela; sem rebanho ajustável, a curva padrão. A forma própria só vale
+inteira quando os dias cobrem `MIN_EXTENSAO` dias de DIM ou passam pelo pico
+do rebanho; entre metade e o total dessa extensão (b, c) é puxado para a forma
+do rebanho, abaixo disso fica a forma do rebanho — 10 dias seguidos no fim da
+lactação não dizem nada sobre o pico.
+"""
+
+import datetime
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+PADRAO        = (20.0, 0.12, 0.0035)   # zebuínos/cruzados brasileiros
+DIAS_LACTACAO = 305
+MIN_DIAS      = int(os.environ.get("LACTACAO_MIN_DIAS", "10"))
+MIN_EXTENSAO  = int(os.environ.get("LACTACAO_MIN_EXTENSAO", "60"))   # dias de DIM para a forma própria
+_TTL_S        = int(os.environ.get("LACTACAO_TTL_S", "21600"))   # escritas do bot já atualizam no lugar
+
+
+def _data(s) -> Optional[datetime.date]:
+    try:
+        return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
+    except (ValueError, TypeError):
+        return None
+
+
+def wood(dim, a: float = PADRAO[0], b: float = PADRAO[1], c: float = PADRAO[2]):
+    """Produção esperada (L/dia) no DIM; aceita escalares ou arrays (0 onde DIM ≤ 0)."""
+    t = np.asarray(dim, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = np.where(t > 0, a * np.power(np.maximum(t, 1e-9), b) * np.exp(-c * t), 0.0)
+    return float(y) if y.ndim == 0 else y
+
+
+def _termos(t, y) -> np.ndarray:
+    """Contribuição de (t, y) às somas [n, L, T, LL, LT, TT, Y, LY, TY] com
+    L = ln t, Y = ln y. Dias sem produção (y ≤ 0) ou fora da lactação não contam."""
+    t = np.atleast_1d(np.asarray(t, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    ok = (t >= 1) & (t <= DIAS_LACTACAO) & (y > 0)
+    L = np.log(np.where(ok, t, 1.0))
+    Y = np.log(np.where(ok, y, 1.0))
+    m = ok.astype(float)
+    return np.stack([m, L * m, t * m, L * L * m, L * t * m, t * t * m,
+                     Y * m, L * Y * m, t * Y * m], axis=1)
+
+
+def _forma_rebanho(S: np.ndarray):
+    """(ln a médio, b, c) do rebanho: regressão dentro de cada vaca (intercepto
+    próprio por vaca, forma comum), para níveis diferentes não distorcerem a
+    forma. None se não houver dados suficientes ou formato de lactação."""
+    S = S[S[:, 0] > 0]
+    if S[:, 0].sum() < MIN_DIAS:
+        return None
+    n, L, T, Y = S[:, 0], S[:, 1], S[:, 2], S[:, 6]
+    LL = (S[:, 3] - L * L / n).sum()
+    LT = (S[:, 4] - L * T / n).sum()
+    TT = (S[:, 5] - T * T / n).sum()
+    LY = (S[:, 7] - L * Y / n).sum()
+    TY = (S[:, 8] - T * Y / n).sum()
+    det = LL * TT - LT * LT
+    if abs(det) < 1e-9:
+        return None
+    b = (LY * TT - LT * TY) / det
+    c = -(LL * TY - LT * LY) / det
+    if b <= 0 or c <= 0:
+        return None
+    return float(((Y - b * L + c * T) / n).mean()), float(b), float(c)
+
+
+def _resolver(S: np.ndarray):
+    """Somas (n, 9) → (ln a, b, c) de cada linha e máscara dos ajustes válidos."""
+    n = len(S)
+    A = np.empty((n, 3, 3))
+    A[:, 0, 0] = S[:, 0]
+    A[:, 0, 1] = A[:, 1, 0] = S[:, 1]
+    A[:, 0, 2] = A[:, 2, 0] = S[:, 2]
+    A[:, 1, 1] = S[:, 3]
+    A[:, 1, 2] = A[:, 2, 1] = S[:, 4]
+    A[:, 2, 2] = S[:, 5]
+    B = S[:, 6:9].copy()
+    ok = S[:, 0] >= MIN_DIAS
+    ok &= np.abs(np.linalg.det(np.where(ok[:, None, None], A, np.eye(3)))) > 1e-9
+    A[~ok] = np.eye(3)
+    B[~ok] = 0.0
+    x = np.linalg.solve(A, B[..., None])[..., 0]
+    ln_a, b, c = x[:, 0], x[:, 1], -x[:, 2]
+    ok &= (b > 0) & (c > 0)
+    return ln_a, b, c, ok
+
+
+def _peso(tmin, tmax, pico: float) -> np.ndarray:
+    """Peso da forma própria (0–1) pela faixa de DIM coberta [tmin, tmax]:
+    1 com `MIN_EXTENSAO` dias ou passando pelo pico do rebanho (com pelo menos
+    metade), linear entre metade e o total, 0 abaixo da metade."""
+    tmin = np.asarray(tmin, dtype=float)
+    tmax = np.asarray(tmax, dtype=float)
+    ext, meio = tmax - tmin, MIN_EXTENSAO / 2
+    w = np.clip((ext - meio) / max(MIN_EXTENSAO - meio, 1e-9), 0.0, 1.0)
+    return np.where((tmin <= pico) & (tmax >= pico) & (ext >= meio), 1.0, w)
+
+
+class CurvasLactacao:
+    """Parâmetros de Wood de cada vaca de uma fazenda, reajustados por escrita."""
+
+    def __init__(self, producao: list, animais: list):
+        self._lock  = threading.Lock()
+        self._parto = {}            # nome → data do último parto
+        self._dias  = {}            # nome → {data_iso: litros do dia}
+        self._pos   = {}            # nome → linha em _S/_par
+        for a in animais:
+            d = _data(a.get("dt_parto") or a.get("parto"))
+            if d and a.get("nome"):
+                self._parto[a["nome"]] = d
+                self._pos[a["nome"]] = len(self._pos)
+                self._dias[a["nome"]] = {}
+        n = len(self._pos)
+        self._S   = np.zeros((n, 9))
+        self._par = np.tile(np.array(PADRAO), (max(n, 0), 1))
+        self._fonte = np.array(["padrao"] * n, dtype=object)
+        self._rebanho = PADRAO
+
+        # totais diários por vaca da lactação atual
+        for p in producao:
+            nome = p.get("nome_animal")
+            if nome in self._parto:
+                dia = str(p.get("data", ""))[:10]
+                tot = self._dias[nome]
+                try:
+                    tot[dia] = tot.get(dia, 0.0) + float(p.get("leite") or 0)
+                except (TypeError, ValueError):
+                    pass
+        k, t, y = [], [], []
+        for nome, tot in self._dias.items():
+            parto = self._parto[nome]
+            for dia, litros in tot.items():
+                d = _data(dia)
+                if d:
+                    k.append(self._pos[nome])
+                    t.append((d - parto).days)
+                    y.append(litros)
+        if k:
+            T = _termos(t, y)
+            k = np.array(k)
+            self._S = np.stack([np.bincount(k, weights=T[:, j], minlength=n) for j in range(9)], axis=1)
+        self._reajustar(np.arange(n))
+
+    def __len__(self):
+        return len(self._pos)
+
+    # ── ajuste ───────────────────────────────
+    def _faixa(self, linhas: np.ndarray):
+        """(DIM mínimo, DIM máximo) com produção de cada linha — chamar com o lock."""
+        nomes = {k: n for n, k in self._pos.items()}
+        tmin, tmax = np.zeros(len(linhas)), np.zeros(len(linhas))
+        for i, k in enumerate(linhas):
+            nome = nomes[int(k)]
+            dims = [(_data(dia) - self._parto[nome]).days
+                    for dia, litros in self._dias[nome].items() if litros > 0 and _data(dia)]
+            dims = [t for t in dims if 1 <= t <= DIAS_LACTACAO]
+            if dims:
+                tmin[i], tmax[i] = min(dims), max(dims)
+        return tmin, tmax
+
+    def _reajustar(self, linhas: np.ndarray):
+        """Reajusta as linhas indicadas (e a forma do rebanho) — chamar com o lock."""
+        if not len(self._S):
+            return
+        forma = _forma_rebanho(self._S)
+        self._rebanho = (float(np.exp(forma[0])), forma[1], forma[2]) if forma else PADRAO
+        if not len(linhas):
+            return
+        S = self._S[linhas]
+        _, b, c, ok = _resolver(S)
+        # forma própria pesada pela faixa de DIM, puxada para a do rebanho;
+        # nível da vaca = média dos resíduos no log com a forma final
+        _, bh, ch = self._rebanho
+        w = np.where(ok, _peso(*self._faixa(linhas), bh / ch), 0.0)
+        b = np.where(w > 0, w * b + (1 - w) * bh, bh)
+        c = np.where(w > 0, w * c + (1 - w) * ch, ch)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            nivel = np.where(S[:, 0] > 0, (S[:, 6] - b * S[:, 1] + c * S[:, 2]) / S[:, 0],
+                             np.log(self._rebanho[0]))
+        self._par[linhas, 0] = np.exp(nivel)
+        self._par[linhas, 1] = b
+        self._par[linhas, 2] = c
+        self._fonte[linhas] = np.where(w >= 1, "vaca", np.where(w > 0, "parcial",
+                                                                "rebanho" if forma else "padrao"))
+
+    def sincronizar(self, animais: list):
+        """Aplica partos novos/alterados: a vaca começa uma lactação sem histórico."""
+        with self._lock:
+            mudou = []
+            for a in animais:
+                nome, d = a.get("nome"), _data(a.get("dt_parto") or a.get("parto"))
+                if not nome or not d or self._parto.get(nome) == d:
+                    continue
+                if nome not in self._pos:
+                    self._pos[nome] = len(self._pos)
+                    self._S   = np.vstack([self._S, np.zeros((1, 9))])
+                    self._par = np.vstack([self._par, np.array(PADRAO)])
+                    self._fonte = np.append(self._fonte, "padrao")
+                self._parto[nome] = d
+                self._dias[nome] = {}
+                self._S[self._pos[nome]] = 0.0
+                mudou.append(self._pos[nome])
+            if mudou:
+                self._reajustar(np.array(mudou))
+
+    def registrar(self, nome: str, data, litros: float):
+        """Soma `litros` (negativo para correção/exclusão) ao dia e reajusta a vaca."""
+        with self._lock:
+            parto = self._parto.get(nome)
+            d = _data(data)
+            if not parto or not d:
+                return
+            dia = d.isoformat()
+            tot = self._dias[nome]
+            antes = tot.get(dia, 0.0)
+            depois = max(antes + float(litros or 0), 0.0)
+            tot[dia] = depois
+            t = (d - parto).days
+            k = self._pos[nome]
+            self._S[k] += _termos(t, depois)[0] - _termos(t, antes)[0]
+            self._reajustar(np.array([k]))
+
+    # ── consultas ────────────────────────────
+    def parametros(self, nome: str) -> dict:
+        """{a, b, c, fonte ("vaca" | "parcial" | "rebanho" | "padrao"), dias, dim_pico}."""
+        with self._lock:
+            k = self._pos.get(nome)
+            if k is None:
+                a, b, c = self._rebanho
+                fonte, dias = "rebanho" if self._rebanho != PADRAO else "padrao", 0
+            else:
+                a, b, c = (float(v) for v in self._par[k])
+                fonte, dias = str(self._fonte[k]), int(self._S[k, 0])
+        return {"a": round(a, 4), "b": round(b, 5), "c": round(c, 6), "fonte": fonte,
+                "dias": dias, "dim_pico": int(b / c) if c > 0 else None}
+
+    def esperado(self, nomes, dims) -> np.ndarray:
+        """Produção esperada (L/dia) de cada vaca no DIM dado — uma operação
+        vetorizada para o rebanho. Vaca sem curva usa a do rebanho."""
+        with self._lock:
+            idx = np.array([self._pos.get(n, -1) for n in nomes], dtype=int)
+            par = np.vstack([self._par, np.array(self._rebanho)])[idx]
+        return wood(np.asarray(dims, dtype=float), par[:, 0], par[:, 1], par[:, 2])
+
+
+# ─── CACHE POR FAZENDA ────────────────────────────────────────────────────────
+_CACHE: dict = {}    # fazenda_id → (versão do chamador, expira, CurvasLactacao)
+_LOCK = threading.Lock()
+_M = {"montagens": 0, "reusos": 0}
+
+
+def curvas(fazenda_id: str, carregar: Callable[[], tuple], versao=None) -> CurvasLactacao:
+    """Curvas da fazenda. `carregar()` devolve (producao da lactação, animais) e
+    só é chamado na primeira vez, quando `versao` (escritas de fora do processo)
+    muda ou quando o cache expira; as escritas do bot usam `registrar`."""
+    agora = time.monotonic()
+    with _LOCK:
+        e = _CACHE.get(fazenda_id)
+    if e and e[0] == versao and e[1] > agora:
+        _M["reusos"] += 1
+        return e[2]
+    producao, animais = carregar()
+    cur = CurvasLactacao(producao, animais)
+    _M["montagens"] += 1
+    with _LOCK:
+        _CACHE[fazenda_id] = (versao, agora + _TTL_S, cur)
+    return cur
+
+
+def existente(fazenda_id: str) -> Optional[CurvasLactacao]:
+    """Curvas já montadas (ou None) — para atualizar no lugar sem forçar leitura."""
+    with _LOCK:
+        e = _CACHE.get(fazenda_id)
+    return e[2] if e else None
+
+
+def metricas() -> dict:
+    with _LOCK:
+        return {**_M, "fazendas": len(_CACHE)}
@@ -16,6 +16,8 @@ from utils import (
     exportar_excel, exportar_pdf_simples, sidebar_mini_resumo,
     requer_autenticacao,
 )
+import previsao
+import rentabilidade
 
 st.set_page_config(page_title="MilkShow | BI", layout="wide", page_icon="📊")
 apply_theme()
@@ -486,70 +488,33 @@ with tab_rankings:
         if df_r.empty:
             st.warning("Sem registros neste período.")
         else:
-            custo_kg_r  = get_custo_racao()
-            preco_ref_r = float(get_config('preco_leite', PRECO_PADRAO_LEITE))
-
-            # Preço real das vendas no período (se houver)
-            if not df_fin.empty:
-                vendas_r = df_fin[(df_fin['cat'] == 'Venda de Leite') &
-                                  (df_fin['data'] >= dt_ini_r) &
-                                  (df_fin['data'] <= dt_fim_r)]
-                total_l_r = float(df_r['leite'].sum())
-                if total_l_r > 0 and vendas_r['valor'].sum() > 0:
-                    preco_ref_r = float(vendas_r['valor'].sum()) / total_l_r
-
-            resumo_r = df_r.groupby(['id_animal', 'nome_animal']).agg(
-                Leite_Total  = ('leite', 'sum'),
-                Racao_Total  = ('racao', 'sum'),
-                Dias         = ('data',  'nunique'),
-            ).reset_index()
-            resumo_r['Receita']     = resumo_r['Leite_Total'] * preco_ref_r
-            resumo_r['Custo_Racao'] = resumo_r['Racao_Total'] * custo_kg_r
+            # Motor único de rentabilidade (mesmo modelo de custo da API/bot)
+            def _na_janela(docs):
+                return [d for d in docs
+                        if str(dt_ini_r) <= str(d.get('data', ''))[:10] <= str(dt_fim_r)]
+
+            rent_r = rentabilidade.calcular(
+                df_r.assign(nome_animal=df_r['nome_animal'].fillna('Rebanho')).to_dict('records'),
+                _na_janela(st.session_state.db.get('sanitario', [])),
+                _na_janela(st.session_state.db.get('financeiro', [])),
+                {'preco_leite': get_config('preco_leite', PRECO_PADRAO_LEITE)},
+                st.session_state.db.get('estoque', []),
+                (dt_fim_r - dt_ini_r).days + 1,
+            )
+            preco_ref_r = rent_r['preco_leite']
+            resumo_r = pd.DataFrame(rent_r['linhas'], columns=rentabilidade.COLUNAS).rename(columns={
+                'nome': 'nome_animal', 'litros': 'Leite_Total', 'racao_kg': 'Racao_Total',
+                'dias': 'Dias', 'receita': 'Receita', 'custo_racao': 'Custo_Racao',
+                'custo_vet': 'Custo_Vet', 'custo_rateio': 'Custo_Fixo_Rat',
+                'custo_total': 'Custo_Total', 'margem': 'Margem',
+                'custo_litro': 'Custo_L', 'lucro_litro': 'Lucro_L',
+            })
             resumo_r['Eficiencia']  = resumo_r.apply(
                 lambda row: row['Leite_Total'] / row['Racao_Total']
                 if row['Racao_Total'] > 0 else 0.0, axis=1
             )
             resumo_r['Media_Dia'] = resumo_r['Leite_Total'] / resumo_r['Dias']
 
-            # ── Custos diretos de veterinário/sanidade por animal ──
-            resumo_r['Custo_Vet'] = 0.0
-            if not df_fin.empty and 'animal' in df_fin.columns:
-                nome_map = resumo_r.set_index('id_animal')['nome_animal'].to_dict()
-                for vid, vnome in nome_map.items():
-                    mask_vet = (
-                        (df_fin['animal'].fillna('').str.lower() == vnome.lower()) &
-                        (df_fin['data'] >= dt_ini_r) & (df_fin['data'] <= dt_fim_r) &
-                        (df_fin['cat'].isin(CATEGORIAS_DESPESA))
-                    )
-                    resumo_r.loc[resumo_r['id_animal'] == vid, 'Custo_Vet'] = (
-                        float(df_fin[mask_vet]['valor'].sum())
-                    )
-
-            # ── Rateio proporcional dos custos fixos (sem animal específico) ──
-            custos_fixos_r = 0.0
-            if not df_fin.empty:
-                mask_fix = (
-                    df_fin['cat'].isin(CATEGORIAS_DESPESA) &
-                    (df_fin['data'] >= dt_ini_r) & (df_fin['data'] <= dt_fim_r) &
-                    (df_fin['animal'].isna() | (df_fin['animal'].fillna('') == ''))
-                )
-                custos_fixos_r = float(df_fin[mask_fix]['valor'].sum())
-
-            total_prod_r = resumo_r['Leite_Total'].sum()
-            resumo_r['Custo_Fixo_Rat'] = resumo_r['Leite_Total'].apply(
-                lambda l: (l / total_prod_r * custos_fixos_r) if total_prod_r > 0 else 0.0
-            )
-
-            resumo_r['Custo_Total']  = (resumo_r['Custo_Racao'] +
-                                        resumo_r['Custo_Vet'] +
-                                        resumo_r['Custo_Fixo_Rat'])
-            resumo_r['Margem']       = resumo_r['Receita'] - resumo_r['Custo_Total']
-            resumo_r['Custo_L']      = resumo_r.apply(
-                lambda row: row['Custo_Total'] / row['Leite_Total']
-                if row['Leite_Total'] > 0 else 0.0, axis=1
-            )
-            resumo_r['Lucro_L']      = preco_ref_r - resumo_r['Custo_L']
-
             # Enriquecer com idade do animal
             hoje_r = datetime.date.today()
             def _calc_idade(id_animal):
@@ -838,37 +803,28 @@ with tab_lactacao:
 # ══════════════════════════════════════════════
 with tab_forecast:
     st.markdown("#### Previsão de Produção — Próximos 7 Dias")
-    st.caption("Regressão polinomial sobre os últimos 30 dias de produção diária.")
+    st.caption("Soma das curvas de lactação de cada vaca (com secagens e partos previstos), "
+               "ajustada pelo dia da semana e pela sazonalidade do ano anterior.")
 
     if df_prod.empty:
         st.info("Sem dados de produção para gerar previsão.")
     else:
-        df_fc = df_prod.copy()
-        df_fc['data'] = pd.to_datetime(df_fc['data'], errors='coerce').dt.date
         hoje_dt = datetime.date.today()
-        ini_fc  = hoje_dt - timedelta(days=30)
-        diario  = (df_fc[df_fc['data'] >= ini_fc]
-                   .groupby('data')['leite'].sum()
-                   .reset_index()
-                   .sort_values('data'))
-
-        if len(diario) < 5:
-            st.warning("Mínimo de 5 dias de dados necessário para previsão.")
-        else:
-            # Regressão polinomial grau 2
-            x = np.arange(len(diario))
-            y = diario['leite'].values
-            coef = np.polyfit(x, y, deg=2)
-            poly = np.poly1d(coef)
+        prev = previsao.prever(st.session_state.db["producao"], st.session_state.db["animais"],
+                               hoje_dt + timedelta(days=1), dias=7)
 
-            # Projetar 7 dias futuros
-            dias_futuros = 7
-            x_fut = np.arange(len(x), len(x) + dias_futuros)
-            datas_fut = [hoje_dt + timedelta(days=i+1) for i in range(dias_futuros)]
-            y_fut = np.maximum(poly(x_fut), 0)  # não deixa negativo
-
-            # Linha de tendência sobre histórico
-            y_trend = poly(x)
+        if not prev["dias"]:
+            st.warning(f"Mínimo de {previsao.MIN_DIAS} dias de dados nas últimas 4 semanas "
+                       "necessário para previsão.")
+        else:
+            df_fc = df_prod.copy()
+            df_fc['data'] = pd.to_datetime(df_fc['data'], errors='coerce').dt.date
+            diario = (df_fc[df_fc['data'] >= hoje_dt - timedelta(days=30)]
+                      .groupby('data')['leite'].sum()
+                      .reset_index()
+                      .sort_values('data'))
+            datas_fut = [datetime.date.fromisoformat(d['data']) for d in prev['dias']]
+            y_fut = [d['litros'] for d in prev['dias']]
 
             fig = go.Figure()
             fig.add_trace(go.Bar(
@@ -876,9 +832,10 @@ with tab_forecast:
                 name='Real', marker_color='#1d4ed8', opacity=0.7,
             ))
             fig.add_trace(go.Scatter(
-                x=diario['data'], y=y_trend,
-                name='Tendência', mode='lines',
-                line=dict(color='#60a5fa', width=2, dash='dot'),
+                x=datas_fut + datas_fut[::-1],
+                y=[d['max'] for d in prev['dias']] + [d['min'] for d in prev['dias']][::-1],
+                name='Faixa', fill='toself', mode='none',
+                fillcolor='rgba(245,158,11,0.15)',
             ))
             fig.add_trace(go.Scatter(
                 x=datas_fut, y=y_fut,
@@ -899,12 +856,18 @@ with tab_forecast:
             # Tabela de previsão
             df_prev = pd.DataFrame({
                 'Data':          [d.strftime('%d/%m/%Y') for d in datas_fut],
-                'Previsão (L)':  [round(float(v), 1) for v in y_fut],
+                'Previsão (L)':  y_fut,
+                'Mín (L)':       [d['min'] for d in prev['dias']],
+                'Máx (L)':       [d['max'] for d in prev['dias']],
             })
             st.dataframe(df_prev, hide_index=True, use_container_width=True)
+            m = prev['modelo']
             st.caption(
-                "Modelo: regressão polinomial grau 2 (numpy.polyfit). "
-                "Previsões são estimativas baseadas na tendência recente — não substituem o julgamento do gestor."
+                f"Modelo: {m['vacas']} vacas em lactação pela curva de Wood"
+                + (f", {m['secagens']} secagem(ns)" if m['secagens'] else "")
+                + (f", {m['partos']} parto(s)" if m['partos'] else "")
+                + (", sazonalidade do ano anterior" if m['sazonal'] else "")
+                + ". Previsões são estimativas — não substituem o julgamento do gestor."
             )
 
 # ══════════════════════════════════════════════
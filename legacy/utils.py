@@ -12,6 +12,7 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import io
 import json
+import sys
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import timedelta
@@ -22,14 +23,22 @@ try:
 except ImportError:
     pass
 
+# Módulos compartilhados com a API/bot (motor de relatórios) ficam na raiz do repo
+_RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _RAIZ_REPO not in sys.path:
+    sys.path.append(_RAIZ_REPO)
+
 # ─────────────────────────────────────────────
 # CONSTANTS
 # ─────────────────────────────────────────────
-DIAS_PVE        = 45
-DIAS_DIAGNOSTICO = 30
-DIAS_SECAGEM    = 60
-GESTACAO        = 283
-DIAS_DESMAME    = 90
+import reproducao   # regras reprodutivas compartilhadas com a API/bot
+import rentabilidade  # modelo de custo por animal compartilhado com a API/bot
+
+DIAS_PVE        = reproducao.DIAS_PVE
+DIAS_DIAGNOSTICO = reproducao.DIAS_DIAGN
+DIAS_SECAGEM    = reproducao.DIAS_SECAR
+GESTACAO        = reproducao.GESTACAO
+DIAS_DESMAME    = reproducao.DIAS_DESMAME
 PRECO_PADRAO_LEITE = 2.50
 DENSIDADE_LEITE = 1.032
 BASE_PASTO_LITROS = 4.0
@@ -407,14 +416,8 @@ def registrar_compra_animal(
 
 
 def get_custo_racao():
-    """Returns the weighted-average cost of 'ração' from stock. Falls back to R$ 2.00."""
-    for item in st.session_state.db.get('estoque', []):
-        nome = item.get('item', '').lower()
-        if any(k in nome for k in ['ração', 'racao', 'concentrado', 'silagem']):
-            c = item.get('custo_medio', 0)
-            if c and c > 0:
-                return float(c)
-    return 2.00
+    """Cost/kg of 'ração' from stock (same rule as the API/bot). Falls back to R$ 1.20."""
+    return rentabilidade.custo_racao_kg(st.session_state.db.get('estoque', []))
 
 
 def calcular_saldo():
@@ -428,64 +431,25 @@ def calcular_saldo():
 
 def processar_alertas():
     hoje = datetime.date.today()
+    animais = st.session_state.db.get("animais", [])
+    cal = reproducao.calendario(f"legacy:{_fazenda_id()}", lambda: animais)
+    _ALERTA = {
+        "diagnostico": ("critico", "CONFIRMAR PRENHEZ", "diagnostico",
+                        lambda d: f"Inseminada há {DIAS_DIAGNOSTICO + d} dias"),
+        "inseminar":   ("critico", "INSEMINAR", "inseminar",
+                        lambda d: f"Vazia há {DIAS_PVE + 1 + d} dias"),
+        "secar":       ("critico", "SECAR VACA", "secar", lambda d: "Risco para o bezerro!"),
+        "colostro":    ("critico", "DAR COLOSTRO", "colostro", lambda d: "Recém-nascido!"),
+        "desmame":     ("atencao", "DESMAME", "desmamar",
+                        lambda d: f"Idade: {DIAS_DESMAME + d} dias"),
+    }
     alertas = []
-    for animal in st.session_state.db.get("animais", []):
-        doc_id = animal.get('doc_id')
-        nome   = animal.get('nome') or f"Animal {doc_id or '?'}"
-
-        if animal.get('status') in ['Lactação', 'Seca']:
-            dt_insem_str = animal.get('dt_insem')
-            dt_parto_str = animal.get('dt_parto')
-
-            try:
-                d_insem = (datetime.datetime.strptime(dt_insem_str, "%Y-%m-%d").date()
-                           if dt_insem_str else None)
-            except (ValueError, TypeError):
-                d_insem = None
-
-            try:
-                d_parto = (datetime.datetime.strptime(dt_parto_str, "%Y-%m-%d").date()
-                           if dt_parto_str else None)
-            except (ValueError, TypeError):
-                d_parto = None
-
-            if d_insem and not animal.get('prenhez'):
-                dias = (hoje - d_insem).days
-                if dias >= DIAS_DIAGNOSTICO:
-                    alertas.append({"nivel": "critico", "msg": f"CONFIRMAR PRENHEZ: {nome}",
-                                    "detalhe": f"Inseminada há {dias} dias", "acao": "diagnostico",
-                                    "doc_id": doc_id, "animal": nome})
-
-            if not animal.get('prenhez') and not d_insem and d_parto and animal.get('status') == 'Lactação':
-                dias = (hoje - d_parto).days
-                if dias > DIAS_PVE:
-                    alertas.append({"nivel": "critico", "msg": f"INSEMINAR: {nome}",
-                                    "detalhe": f"Vazia há {dias} dias", "acao": "inseminar",
-                                    "doc_id": doc_id, "animal": nome})
-
-            if animal.get('prenhez') and d_insem and animal.get('status') == 'Lactação':
-                prev_parto = d_insem + timedelta(days=GESTACAO)
-                dias_secar = (prev_parto - timedelta(days=DIAS_SECAGEM) - hoje).days
-                if dias_secar <= 0:
-                    alertas.append({"nivel": "critico", "msg": f"SECAR VACA: {nome}",
-                                    "detalhe": "Risco para o bezerro!", "acao": "secar",
-                                    "doc_id": doc_id, "animal": nome})
-
-        if animal.get('status') == 'Bezerro':
-            d_nasc_str = animal.get('nasc') or str(hoje)
-            try:
-                d_nasc = datetime.datetime.strptime(d_nasc_str, "%Y-%m-%d").date()
-            except (ValueError, TypeError):
-                continue
-            idade = (hoje - d_nasc).days
-            if idade <= 2 and not animal.get('colostro'):
-                alertas.append({"nivel": "critico", "msg": f"DAR COLOSTRO: {nome}",
-                                "detalhe": "Recém-nascido!", "acao": "colostro",
-                                "doc_id": doc_id, "animal": nome})
-            if idade >= DIAS_DESMAME:
-                alertas.append({"nivel": "atencao", "msg": f"DESMAME: {nome}",
-                                "detalhe": f"Idade: {idade} dias", "acao": "desmamar",
-                                "doc_id": doc_id, "animal": nome})
+    for ev in cal.pendentes(hoje, tipos=_ALERTA):
+        nivel, msg, acao, detalhe = _ALERTA[ev["tipo"]]
+        nome = ev["nome"] if ev["nome"] != "?" else f"Animal {ev['doc_id'] or '?'}"
+        alertas.append({"nivel": nivel, "msg": f"{msg}: {nome}",
+                        "detalhe": detalhe((hoje - ev["data"]).days), "acao": acao,
+                        "doc_id": ev["doc_id"], "animal": nome})
     return alertas
 
 
@@ -1050,29 +1014,15 @@ def auto_refresh_contador():
 # ─────────────────────────────────────────────
 # RELATÓRIO PDF COMPLETO
 # ─────────────────────────────────────────────
-def _pdf_txt(text: str) -> str:
-    """Sanitize text for fpdf2 Helvetica (Latin-1): replace common Unicode chars."""
-    return (str(text)
-            .replace('\u2014', ' - ')   # em dash
-            .replace('\u2013', '-')      # en dash
-            .replace('\u2022', '*')      # bullet
-            .replace('\u2019', "'")      # right single quote
-            .replace('\u201c', '"')      # left double quote
-            .replace('\u201d', '"')      # right double quote
-            .replace('\u00b7', '.')      # middle dot
-            .encode('latin-1', errors='replace').decode('latin-1'))
-
-
 def gerar_relatorio_pdf_completo() -> bytes:
-    """Generates a full farm management report as PDF."""
+    """Generates a full farm management report as PDF (shared report engine)."""
     try:
-        from fpdf import FPDF
+        import relatorios
     except ImportError:
         st.warning('Instale fpdf2: pip install fpdf2')
         return b''
 
     hoje = datetime.date.today()
-    nome_fazenda = get_config('nome_fazenda', 'Fazenda')
     animais      = st.session_state.db.get('animais', [])
     alertas      = processar_alertas()
     score        = calcular_score_rebanho()
@@ -1087,84 +1037,29 @@ def gerar_relatorio_pdf_completo() -> bytes:
         prod_30d = float(df_prod[df_prod['data'] >= ini_30]['leite'].sum())
         prod_hoje_val = float(df_prod[df_prod['data'] == str(hoje)]['leite'].sum())
 
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-
-    # Header
-    pdf.set_fill_color(18, 40, 22)
-    pdf.rect(0, 0, 210, 35, 'F')
-    pdf.set_font('Helvetica', 'B', 18)
-    pdf.set_text_color(165, 214, 167)
-    pdf.set_xy(10, 8)
-    pdf.cell(0, 10, _pdf_txt(f'MilkShow - {nome_fazenda}'), ln=True)
-    pdf.set_font('Helvetica', '', 10)
-    pdf.set_text_color(100, 180, 100)
-    pdf.set_x(10)
-    pdf.cell(0, 8, _pdf_txt(f'Relatorio Gerencial  -  {hoje.strftime("%d/%m/%Y")}'), ln=True)
-
-    pdf.set_text_color(30, 30, 30)
-    pdf.ln(8)
-
-    def section(titulo):
-        pdf.set_fill_color(230, 245, 230)
-        pdf.set_font('Helvetica', 'B', 11)
-        pdf.cell(0, 8, _pdf_txt(titulo), ln=True, fill=True)
-        pdf.ln(2)
-
-    def row(label, valor, destaque=False):
-        pdf.set_font('Helvetica', 'B' if destaque else '', 9)
-        pdf.cell(80, 6, _pdf_txt(label), border='B')
-        pdf.cell(0, 6, _pdf_txt(str(valor)), border='B', ln=True)
-
-    # Score
-    section('Score de Saúde do Rebanho')
-    row('Score Geral', f"{score['score']} / 100 - {score['label']}", destaque=True)
-    row('Alertas Críticos', score['detalhes']['alertas_criticos']['valor'])
-    row('Alertas de Atenção', score['detalhes']['alertas_atencao']['valor'])
-    pdf.ln(4)
-
-    # Rebanho
-    section('Rebanho')
     from collections import Counter
-    status_count = Counter(a.get('status', '?') for a in animais)
-    row('Total de Animais', len(animais))
-    for status, qtd in status_count.most_common():
-        row(f'  • {status}', qtd)
-    pdf.ln(4)
-
-    # Produção
-    section('Produção')
-    row('Produção Hoje', f'{prod_hoje_val:.1f} L')
-    row('Produção Últimos 30 dias', f'{prod_30d:.1f} L')
-    row('Média Diária (30d)', f'{prod_30d/30:.1f} L/dia')
-    pdf.ln(4)
-
-    # Financeiro
-    section('Financeiro')
-    row('Receitas Totais',  f'R$ {rec:,.2f}')
-    row('Despesas Totais',  f'R$ {desp:,.2f}')
-    row('Saldo em Caixa',   f'R$ {saldo:,.2f}', destaque=True)
-    pdf.ln(4)
-
-    # Alertas
-    if alertas:
-        section(f'Alertas Pendentes ({len(alertas)})')
-        for a in alertas[:15]:
-            icone = '!! ' if a['nivel'] == 'critico' else ' > '
-            pdf.set_font('Helvetica', '', 8)
-            pdf.cell(0, 5, _pdf_txt(f"{icone}{a['msg']} - {a.get('detalhe','')}"), ln=True)
-        if len(alertas) > 15:
-            pdf.set_font('Helvetica', 'I', 8)
-            pdf.cell(0, 5, f'... e mais {len(alertas)-15} alertas.', ln=True)
-
-    # Footer
-    pdf.set_y(-18)
-    pdf.set_font('Helvetica', 'I', 7)
-    pdf.set_text_color(130, 130, 130)
-    pdf.cell(0, 6, _pdf_txt(f'Gerado por MilkShow em {hoje.strftime("%d/%m/%Y")} - gestaodeleite.app'), align='C')
-
-    return bytes(pdf.output())
+    dados = {
+        'nome_fazenda':     get_config('nome_fazenda', 'Fazenda'),
+        'gerado_em':        hoje.strftime('%d/%m/%Y'),
+        'score':            score['score'],
+        'score_label':      score['label'],
+        'alertas_criticos': score['detalhes']['alertas_criticos']['valor'],
+        'alertas_atencao':  score['detalhes']['alertas_atencao']['valor'],
+        'total_animais':    len(animais),
+        'status_count':     Counter(a.get('status', '?') for a in animais).most_common(),
+        'prod_hoje':        prod_hoje_val,
+        'prod_30d':         prod_30d,
+        'rec':              float(rec),
+        'desp':             float(desp),
+        'saldo':            float(saldo),
+        'alertas':          [{'nivel': a['nivel'], 'msg': a['msg'], 'detalhe': a.get('detalhe', '')}
+                             for a in alertas],
+    }
+    try:
+        return relatorios.renderizar('gerencial', dados, em_processo=False)
+    except ImportError:
+        st.warning('Instale fpdf2: pip install fpdf2')
+        return b''
 
 
 # ─────────────────────────────────────────────
@@ -1256,37 +1151,19 @@ def exportar_excel(dfs: dict) -> bytes:
 
 
 def exportar_pdf_simples(titulo: str, df: pd.DataFrame) -> bytes:
-    """Generates a simple PDF table from a DataFrame using fpdf2."""
+    """Generates a simple PDF table from a DataFrame (shared report engine)."""
     try:
-        from fpdf import FPDF
+        import relatorios
+        return relatorios.renderizar('tabela', {
+            'titulo':    titulo,
+            'gerado_em': datetime.date.today().strftime('%d/%m/%Y'),
+            'colunas':   [str(c) for c in df.columns],
+            'linhas':    [[str(v) for v in row] for row in df.itertuples(index=False)],
+        }, em_processo=False)
     except ImportError:
         st.warning("Exportação PDF indisponível. Instale a dependência: `pip install fpdf2`")
         return b""
 
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Helvetica", "B", 14)
-    pdf.cell(0, 10, _pdf_txt(titulo), ln=True)
-    pdf.set_font("Helvetica", "", 8)
-    pdf.ln(4)
-
-    col_w = min(190 // max(len(df.columns), 1), 40)
-    # Header
-    pdf.set_fill_color(30, 100, 40)
-    pdf.set_text_color(255, 255, 255)
-    for col in df.columns:
-        pdf.cell(col_w, 7, _pdf_txt(str(col))[:18], border=1, fill=True)
-    pdf.ln()
-    # Rows
-    pdf.set_text_color(0, 0, 0)
-    for _, row in df.iterrows():
-        for val in row:
-            pdf.cell(col_w, 6, _pdf_txt(str(val))[:18], border=1)
-        pdf.ln()
-
-    return bytes(pdf.output())
-
 # ─────────────────────────────────────────────
 # DATE HELPER
 # ─────────────────────────────────────────────
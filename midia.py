@@ -0,0 +1,244 @@
+"""
+MilkShow — Mídia recebida (áudio, imagem)
+Cache por impressão digital: SHA-256 dos bytes da mídia → texto extraído
+(transcrição, leitura por Vision). Áudio encaminhado ou foto reenviada resolve
+na hora, sem chamar Whisper/Gemini/Claude de novo.
+Pré-processamento de imagem antes do Vision: orientação EXIF, redução do lado
+maior e recompressão JPEG (tons de cinza opcional) — upload menor em link rural
+e resposta mais rápida do provedor.
+Download em streaming com limite por tipo: mídia grande demais é recusada
+antes (tamanho declarado) ou no meio do download, sem estourar a memória.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from cache_disco import CacheDisco
+
+log = logging.getLogger("milkshow_bot")
+
+CACHE_MIDIA = CacheDisco(
+    "midia",
+    max_bytes=int(os.environ.get("MIDIA_CACHE_MB", "50")) * 1024 * 1024,
+    ttl_s=float(os.environ.get("MIDIA_CACHE_TTL_H", "72")) * 3600,
+)
+
+
+def impressao(conteudo: bytes) -> str:
+    """SHA-256 (hex) dos bytes da mídia."""
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def impressao_whatsapp(msg_midia: dict) -> Optional[str]:
+    """SHA-256 que o próprio WhatsApp manda na mensagem (fileSha256, base64) —
+    é o hash do arquivo decifrado, o mesmo de `impressao`. Permite achar a mídia
+    no cache antes de baixá-la."""
+    raw = (msg_midia or {}).get("fileSha256")
+    if not raw or not isinstance(raw, str):
+        return None
+    try:
+        h = base64.b64decode(raw).hex()
+    except (binascii.Error, ValueError):
+        return None
+    return h if len(h) == 64 else None
+
+
+def _chave(tipo: str, h: str) -> str:
+    return f"{tipo}:{h}"
+
+
+def texto_por_impressao(tipo: str, h: Optional[str]) -> Optional[str]:
+    if not h:
+        return None
+    bruto = CACHE_MIDIA.obter(_chave(tipo, h))
+    return bruto.decode() if bruto is not None else None
+
+
+def guardar_texto(tipo: str, h: str, texto: str):
+    try:
+        CACHE_MIDIA.gravar(_chave(tipo, h), texto.encode())
+    except OSError as e:
+        log.warning(f"[midia] falha ao gravar cache: {e}")
+
+
+async def extrair_com_cache(tipo: str, conteudo: bytes,
+                            extrair: Callable[[bytes], Awaitable[str]]) -> str:
+    """Texto da mídia: do cache se os mesmos bytes já foram processados, senão
+    `extrair(conteudo)` (guardado só se não vier vazio — falha não fica em cache)."""
+    h = impressao(conteudo)
+    txt = texto_por_impressao(tipo, h)
+    if txt is not None:
+        log.info(f"[midia] {tipo} repetido ({h[:12]}) — resultado do cache")
+        return txt
+    txt = await extrair(conteudo)
+    if txt:
+        guardar_texto(tipo, h, txt)
+    return txt
+
+
+# ─── PRÉ-PROCESSAMENTO DE IMAGEM ──────────────────────────────────────────────
+# Foto de celular (12 MP, 3-5 MB) → ~1600 px no lado maior, JPEG q80:
+# tabela manuscrita e nota fiscal continuam legíveis com 5-10x menos bytes.
+# Cinza só com VISION_CINZA=1 — caneta colorida e carimbo ajudam na leitura.
+VISION_LADO_MAX  = int(os.environ.get("VISION_LADO_MAX", "1600"))
+VISION_QUALIDADE = int(os.environ.get("VISION_QUALIDADE", "80"))
+VISION_CINZA     = os.environ.get("VISION_CINZA", "0") == "1"
+VISION_MARGEM    = 0.10    # reprocessada até 10% maior ainda vale (sai sem EXIF, já girada)
+
+_M_IMG = {"imagens": 0, "falhas": 0, "bytes_entrada": 0, "bytes_saida": 0, "ms_total": 0.0}
+_M_IMG_LOCK = threading.Lock()
+
+
+def preparar_imagem(conteudo: bytes, mime: str = "image/jpeg",
+                    lado_max: int = VISION_LADO_MAX, cinza: bool = VISION_CINZA,
+                    qualidade: int = VISION_QUALIDADE) -> Tuple[bytes, str]:
+    """(bytes, mime) prontos para o Vision. Mime que não é image/* (PDF do
+    Twilio), sem Pillow ou com imagem ilegível devolve o original; também
+    quando o resultado fica mais que VISION_MARGEM maior — salvo se a foto
+    tinha orientação EXIF: aí o original chegaria deitado ao Vision."""
+    if not (mime or "").startswith("image/"):
+        return conteudo, mime
+    t0 = time.perf_counter()
+    try:
+        from PIL import Image, ImageOps
+        with Image.open(io.BytesIO(conteudo)) as img:
+            girada = img.getexif().get(0x0112, 1) not in (0, 1)    # tag Orientation
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > lado_max:
+                img.thumbnail((lado_max, lado_max), Image.LANCZOS)
+            img = img.convert("L" if cinza else "RGB")
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=qualidade, optimize=True)
+        saida, falhou = conteudo, False
+        if girada or buf.tell() <= len(conteudo) * (1 + VISION_MARGEM):
+            saida, mime = buf.getvalue(), "image/jpeg"
+    except Exception as e:
+        log.warning(f"[midia] pré-processamento de imagem falhou, enviando original: {e}")
+        saida, falhou = conteudo, True
+    ms = (time.perf_counter() - t0) * 1000
+    with _M_IMG_LOCK:
+        _M_IMG["imagens"]       += 1
+        _M_IMG["falhas"]        += falhou
+        _M_IMG["bytes_entrada"] += len(conteudo)
+        _M_IMG["bytes_saida"]   += len(saida)
+        _M_IMG["ms_total"]      += ms
+    log.info(f"[midia] imagem {len(conteudo)//1024} KB → {len(saida)//1024} KB em {ms:.0f} ms")
+    return saida, mime
+
+
+# ─── DOWNLOAD EM STREAMING ────────────────────────────────────────────────────
+LIMITES_MB = {
+    "audio":  float(os.environ.get("MIDIA_MAX_AUDIO_MB", "16")),    # ~15 min de voz em opus
+    "imagem": float(os.environ.get("MIDIA_MAX_IMAGEM_MB", "10")),
+}
+_BLOCO = 64 * 1024
+_M_DOWN = {"downloads": 0, "recusados": 0, "bytes": 0}
+
+
+class MidiaGrande(Exception):
+    """Mídia acima do limite do tipo — download abortado."""
+
+    def __init__(self, tipo: str, tamanho: int, limite: int):
+        super().__init__(f"{tipo} com {tamanho // 1024} KB excede o limite de {limite // 1024} KB")
+        self.tipo, self.tamanho, self.limite = tipo, tamanho, limite
+
+
+def limite_bytes(tipo: str) -> int:
+    return int(LIMITES_MB.get(tipo, 10) * 1024 * 1024)
+
+
+def _recusar(tipo: str, tamanho: int, limite: int):
+    with _M_IMG_LOCK:
+        _M_DOWN["recusados"] += 1
+    raise MidiaGrande(tipo, tamanho, limite)
+
+
+def checar_tamanho_declarado(tipo: str, msg_midia: dict):
+    """Recusa pelo fileLength da mensagem do WhatsApp, antes de baixar qualquer
+    byte. fileLength vem como int, str ou Long do Baileys ({"low", "high"})."""
+    raw = (msg_midia or {}).get("fileLength")
+    if isinstance(raw, dict):
+        raw = (raw.get("high") or 0) * 2**32 + (raw.get("low") or 0)
+    try:
+        tamanho = int(raw or 0)
+    except (TypeError, ValueError):
+        return
+    if tamanho > limite_bytes(tipo):
+        _recusar(tipo, tamanho, limite_bytes(tipo))
+
+
+async def baixar(url: str, tipo: str, metodo: str = "GET",
+                 limite: Optional[int] = None, timeout: float = 30, **kwargs) -> bytes:
+    """Baixa em blocos com teto de `limite` bytes (padrão: limite do tipo).
+    Aborta pelo Content-Length ou assim que o corpo passa do teto."""
+    import httpx
+    limite = limite or limite_bytes(tipo)
+    partes, total = [], 0
+    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as c:
+        async with c.stream(metodo, url, **kwargs) as r:
+            r.raise_for_status()
+            declarado = int(r.headers.get("content-length") or 0)
+            if declarado > limite:
+                _recusar(tipo, declarado, limite)
+            async for parte in r.aiter_bytes(_BLOCO):
+                total += len(parte)
+                if total > limite:
+                    _recusar(tipo, total, limite)
+                partes.append(parte)
+    with _M_IMG_LOCK:
+        _M_DOWN["downloads"] += 1
+        _M_DOWN["bytes"]     += total
+    return b"".join(partes)
+
+
+def _pular_espacos(bruto: bytes, i: int) -> int:
+    while bruto[i:i + 1] in (b" ", b"\t", b"\r", b"\n"):
+        i += 1
+    return i
+
+
+def decodificar_base64_json(bruto: bytes, campo: str = "base64") -> bytes:
+    """Decodifica `campo` de uma resposta JSON direto dos bytes, sem montar o
+    dict nem a string intermediária (o base64 é ~4/3 do arquivo). Valor que não
+    é string (null, número) ou com escapes vai pelo json.loads."""
+    marca = f'"{campo}"'.encode()
+    i = bruto.find(marca)
+    if i >= 0:
+        j = _pular_espacos(bruto, i + len(marca))
+        k = _pular_espacos(bruto, j + 1) if bruto[j:j + 1] == b":" else -1
+        if k >= 0 and bruto[k:k + 1] == b'"':
+            try:
+                ini = k + 1
+                fim = bruto.index(b'"', ini)
+                if bruto.find(b"\\", ini, fim) < 0:
+                    return base64.b64decode(memoryview(bruto)[ini:fim])
+            except (ValueError, binascii.Error):
+                pass
+    import json
+    valor = json.loads(bruto).get(campo) or ""
+    return base64.b64decode(valor) if valor else b""
+
+
+async def baixar_evolution(url: str, tipo: str, headers: dict, corpo: dict) -> bytes:
+    """getBase64FromMediaMessage da Evolution, com o limite do tipo aplicado ao
+    tamanho codificado."""
+    bruto = await baixar(url, tipo, metodo="POST", headers=headers, json=corpo,
+                         limite=limite_bytes(tipo) * 4 // 3 + 4096, timeout=20)
+    return decodificar_base64_json(bruto)
+
+
+def metricas() -> dict:
+    with _M_IMG_LOCK:
+        down = dict(_M_DOWN)
+        img = dict(_M_IMG)
+    n = img["imagens"] or 1
+    img["bytes_economizados"] = img["bytes_entrada"] - img["bytes_saida"]
+    img["ms_medio"] = round(img.pop("ms_total") / n, 1)
+    return {"cache": CACHE_MIDIA.metricas(), "imagens": img, "downloads": down}
@@ -31,6 +31,12 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 
+import indices
+import lactacao
+import previsao
+import rentabilidade
+import reproducao
+
 # Inicializa Firebase Admin uma única vez no carregamento do módulo
 if not firebase_admin._apps:
     _fb_key = os.path.join(os.path.dirname(__file__), "firebase_key.json")
@@ -88,11 +94,30 @@ def _rate_gc():
 # Dicionário: fazenda_id → {"colecao": str, "ts": float}
 # Atualizado pelo bot após cada escrita — clientes SSE detectam a mudança
 _UPDATE_TS: dict = {}
+_VERSAO_FAZENDA: dict = {}   # fazenda_id → contador de escritas (invalida caches derivados)
+_VERSAO_COLECAO: dict = {}   # (fazenda_id, colecao) → contador de escritas feitas fora do bot
 
 
-def notify_update(fazenda_id: str, colecao: str = "all"):
-    """Chamado pelo bot após salvar dados — acorda clientes SSE daquela fazenda."""
+def notify_update(fazenda_id: str, colecao: str = "all", origem: str = "app"):
+    """Chamado após salvar dados — acorda clientes SSE daquela fazenda.
+    Escritas do bot (origem="bot") já atualizam os índices dele no lugar e não
+    contam em versao_colecao."""
     _UPDATE_TS[fazenda_id] = {"colecao": colecao, "ts": time.time()}
+    _VERSAO_FAZENDA[fazenda_id] = _VERSAO_FAZENDA.get(fazenda_id, 0) + 1
+    if origem != "bot":
+        _VERSAO_COLECAO[(fazenda_id, colecao)] = _VERSAO_COLECAO.get((fazenda_id, colecao), 0) + 1
+
+
+def versao_fazenda(fazenda_id: str) -> int:
+    """Contador de escritas da fazenda neste processo (muda a cada notify_update)."""
+    return _VERSAO_FAZENDA.get(fazenda_id, 0)
+
+
+def versao_colecao(fazenda_id: str, colecao: str) -> int:
+    """Contador de escritas de uma coleção da fazenda feitas fora do bot
+    (notify_update "all" conta para todas)."""
+    return (_VERSAO_COLECAO.get((fazenda_id, colecao), 0)
+            + _VERSAO_COLECAO.get((fazenda_id, "all"), 0))
 
 # ─────────────────────────────────────────────
 # JWT simples (sem dependência extra)
@@ -145,24 +170,61 @@ def _coll(fazenda_id: str, nome: str):
     return db.collection("fazendas").document(fazenda_id).collection(nome)
 
 
+def alocar_id_animal(fazenda_id: str, base: str) -> str:
+    """Reserva o próximo id livre para `base` (MIMO, MIMO2, …) numa transação sobre
+    contadores/ids_animais: sem varrer `animais`, sem colisão entre cadastros
+    simultâneos. Na primeira vez o registro é montado a partir dos ids existentes.
+    Ids gravados por fora do registro (id explícito no cadastro, app legado) são
+    conferidos na mesma transação — campo `id` ou doc_id — e o sufixo avança."""
+    ref = _coll(fazenda_id, "contadores").document("ids_animais")
+    animais = _coll(fazenda_id, "animais")
+
+    def _em_uso(cand, tx):
+        if "/" not in cand and animais.document(cand).get(transaction=tx).exists:
+            return True
+        return bool(animais.where(filter=FieldFilter("id", "==", cand)).limit(1).get(transaction=tx))
+
+    @firestore.transactional
+    def _reservar(tx):
+        snap = ref.get(transaction=tx)
+        if snap.exists:
+            prefixos = dict((snap.to_dict() or {}).get("prefixos") or {})
+        else:
+            prefixos = indices.registro_ids(
+                d.to_dict().get("id") for d in animais.stream(transaction=tx))
+        novo = indices.reservar_id(prefixos, base)
+        while _em_uso(novo, tx):               # reservar_id já marcou `novo`: o próximo avança
+            novo = indices.reservar_id(prefixos, base)
+        tx.set(ref, {"prefixos": prefixos, "ts": datetime.datetime.now().isoformat()})
+        return novo
+
+    return _reservar(_db().transaction())
+
+
 def _custo_racao_kg_real(fazenda_id: str) -> float:
     """Retorna o custo real da ração/kg baseado no estoque. Fallback: 1.20."""
     try:
-        for e in _coll(fazenda_id, "estoque").stream():
-            ed = e.to_dict()
-            item = (ed.get("item") or "").lower()
-            if any(k in item for k in ("ração", "racao", "concentrado", "milho")):
-                qtd = float(ed.get("qtd") or 0)
-                val = float(ed.get("custo_unit") or 0)
-                if val > 0:
-                    return round(val, 4)
-                # Calcula por valor_total / qtd se disponível
-                val_tot = float(ed.get("valor_total") or 0)
-                if qtd > 0 and val_tot > 0:
-                    return round(val_tot / qtd, 4)
+        return rentabilidade.custo_racao_kg([e.to_dict() for e in _coll(fazenda_id, "estoque").stream()])
     except Exception:
-        pass
-    return 1.20
+        return rentabilidade.CUSTO_RACAO_PADRAO
+
+
+def _rentabilidade(fazenda_id: str, dias: int) -> dict:
+    """Rentabilidade por animal dos últimos `dias` dias (motor único em
+    rentabilidade.py), em cache até a próxima escrita na fazenda."""
+    def carregar(ini: str, fim: str) -> dict:
+        def janela(colecao):
+            docs = _coll(fazenda_id, colecao).where(filter=FieldFilter("data", ">=", ini)).stream()
+            return [d for d in (x.to_dict() for x in docs) if str(d.get("data", ""))[:10] <= fim]
+        config = {}
+        for d in _coll(fazenda_id, "config").stream():
+            c = d.to_dict()
+            config[c.get("chave", d.id)] = c.get("valor")
+        return {"producao": janela("producao"), "sanitario": janela("sanitario"),
+                "financeiro": janela("financeiro"), "config": config,
+                "estoque": [e.to_dict() for e in _coll(fazenda_id, "estoque").stream()]}
+    ini, fim = rentabilidade.janela(dias)
+    return rentabilidade.ranking(fazenda_id, ini, fim, dias, carregar, versao_fazenda(fazenda_id))
 
 def _normalizar_tel(raw: str) -> str:
     digits = re.sub(r'\D', '', raw.strip())
@@ -661,12 +723,16 @@ def atualizar_financeiro(fid_doc: str, body: FinanceiroInput, user=Depends(_get_
 # ─────────────────────────────────────────────
 @mobile_router.get("/estoque")
 def listar_estoque(user=Depends(_get_user)):
+    """Itens do estoque com consumo_dia, dias_restantes e acaba_em, calculados
+    da taxa de consumo guardada no item a cada baixa (indices.registrar_consumo)."""
     fid = user["fazenda_id"]
+    hoje = datetime.date.today()
     docs = _coll(fid, "estoque").stream()
     result = []
     for d in docs:
         row = d.to_dict()
         row["id"] = d.id
+        row.update(indices.previsao_consumo(row, hoje))
         result.append(row)
     return result
 
@@ -780,7 +846,8 @@ def atualizar_estoque(item_id: str, body: EstoqueInput, user=Depends(_get_user))
     fid = user["fazenda_id"]
     doc = body.model_dump()
     doc["atualizado_em"] = datetime.datetime.now().isoformat()
-    _coll(fid, "estoque").document(item_id).set(doc)
+    # merge: preserva a taxa de consumo (consumo_*) gravada pelas baixas do bot
+    _coll(fid, "estoque").document(item_id).set(doc, merge=True)
     notify_update(fid, "estoque")
     return {"id": item_id, **doc}
 
@@ -818,6 +885,7 @@ def adicionar_animal(body: AnimalInput, user=Depends(_get_user)):
         _coll(fid, "animais").document(aid).set(doc, merge=True)
         doc_id = aid
     else:
+        doc["id"] = alocar_id_animal(fid, indices.base_id(doc["nome"]))
         _, ref = _coll(fid, "animais").add(doc)
         doc_id = ref.id
     notify_update(fid, "animais")
@@ -933,63 +1001,15 @@ def salvar_config(body: dict, user=Depends(_get_user)):
 # ─────────────────────────────────────────────
 @mobile_router.get("/ranking")
 def ranking_rentabilidade(dias: int = 30, user=Depends(_get_user)):
-    """Ranking de rentabilidade por animal: litros vs custo ração + veterinário."""
-    fid = user["fazenda_id"]
-    ini = (datetime.date.today() - datetime.timedelta(days=dias)).isoformat()
-
-    config = {}
-    for d in _coll(fid, "config").stream():
-        c = d.to_dict()
-        config[c.get("chave", d.id)] = c.get("valor")
-    preco_leite    = float(config.get("preco_leite", 2.50))
-    custo_racao_kg = _custo_racao_kg_real(fid)
-
-    prod_docs = [d.to_dict() for d in
-                 _coll(fid, "producao")
-                 .where(filter=FieldFilter("data", ">=", ini)).stream()]
-
-    san_docs = [d.to_dict() for d in
-                _coll(fid, "sanitario")
-                .where(filter=FieldFilter("data", ">=", ini)).stream()]
-
-    ranking: dict = {}
-    for p in prod_docs:
-        nome = p.get("nome_animal") or "Rebanho"
-        if nome not in ranking:
-            ranking[nome] = {"nome": nome, "litros": 0.0, "racao_kg": 0.0, "custo_vet": 0.0}
-        ranking[nome]["litros"]   += float(p.get("leite")  or 0)
-        ranking[nome]["racao_kg"] += float(p.get("racao")  or 0)
-
-    for s in san_docs:
-        nome = s.get("nome_animal") or s.get("animal") or "Rebanho"
-        val  = float(s.get("valor") or 0)
-        if nome in ranking:
-            ranking[nome]["custo_vet"] += val
-
-    result = []
-    for r in ranking.values():
-        receita     = r["litros"] * preco_leite
-        custo_racao = r["racao_kg"] * custo_racao_kg
-        custo_total = custo_racao + r["custo_vet"]
-        margem      = receita - custo_total
-        custo_litro = custo_total / r["litros"] if r["litros"] > 0 else 0
-        result.append({
-            "nome":        r["nome"],
-            "litros":      round(r["litros"], 1),
-            "racao_kg":    round(r["racao_kg"], 1),
-            "receita":     round(receita, 2),
-            "custo_racao": round(custo_racao, 2),
-            "custo_vet":   round(r["custo_vet"], 2),
-            "custo_total": round(custo_total, 2),
-            "margem":      round(margem, 2),
-            "custo_litro": round(custo_litro, 4),
-        })
-
+    """Ranking de rentabilidade por animal: litros vs custo ração + veterinário + rateio."""
+    r = _rentabilidade(user["fazenda_id"], dias)
+    campos = ("nome", "litros", "racao_kg", "receita", "custo_racao", "custo_vet",
+              "custo_rateio", "custo_total", "margem", "custo_litro")
     return {
         "dias":           dias,
-        "preco_leite":    preco_leite,
-        "custo_racao_kg": round(custo_racao_kg, 2),
-        "ranking":        sorted(result, key=lambda x: x["margem"], reverse=True),
+        "preco_leite":    round(r["preco_leite"], 2),
+        "custo_racao_kg": round(r["custo_racao_kg"], 2),
+        "ranking":        [{k: l[k] for k in campos} for l in r["margem"]],
     }
 
 
@@ -1063,32 +1083,34 @@ def listar_lotes_racao(user=Depends(_get_user)):
 # ─────────────────────────────────────────────
 # CURVA DE LACTAÇÃO POR ANIMAL
 # ─────────────────────────────────────────────
-import math as _math
-
-def _wood(dim: int, a=20.0, b=0.12, c=0.0035) -> float:
-    if dim <= 0: return 0.0
-    return a * (dim ** b) * _math.exp(-c * dim)
+def curvas_lactacao(fazenda_id: str) -> lactacao.CurvasLactacao:
+    """Curvas de Wood por vaca da fazenda (lactacao.py). Remontadas quando o
+    app grava produção (versao_colecao); as escritas do bot atualizam no lugar."""
+    def carregar():
+        ini = (datetime.date.today() - datetime.timedelta(days=lactacao.DIAS_LACTACAO)).isoformat()
+        prod = [d.to_dict() for d in
+                _coll(fazenda_id, "producao").where(filter=FieldFilter("data", ">=", ini)).stream()]
+        return prod, [d.to_dict() for d in _coll(fazenda_id, "animais").stream()]
+    return lactacao.curvas(fazenda_id, carregar, versao_colecao(fazenda_id, "producao"))
 
 
 @mobile_router.get("/lactacao/{nome}")
 def curva_lactacao(nome: str, dias: int = 120, user=Depends(_get_user)):
-    """Retorna produção real + curva de Wood padrão para um animal.
+    """Retorna produção real + curva de Wood ajustada ao histórico do animal.
     Permite plotar curva esperada vs real no frontend."""
     fid  = user["fazenda_id"]
     hoje = datetime.date.today()
     ini  = (hoje - datetime.timedelta(days=dias)).isoformat()
 
     # Busca animal para obter dt_parto
-    animais = [d.to_dict() for d in _coll(fid, "animais").stream()
-               if d.to_dict().get("nome") == nome]
+    todos   = [d.to_dict() for d in _coll(fid, "animais").stream()]
+    animais = [a for a in todos if a.get("nome") == nome]
     animal  = animais[0] if animais else {}
-    dt_parto_raw = animal.get("dt_parto") or animal.get("parto")
-    dt_parto = None
-    if dt_parto_raw:
-        try:
-            dt_parto = datetime.datetime.strptime(str(dt_parto_raw)[:10], "%Y-%m-%d").date()
-        except Exception:
-            pass
+    dt_parto = reproducao.data(animal.get("dt_parto") or animal.get("parto"))
+
+    cur = curvas_lactacao(fid)
+    cur.sincronizar(todos)
+    curva = cur.parametros(nome)
 
     # Produção real por dia
     docs = [d.to_dict() for d in
@@ -1101,27 +1123,16 @@ def curva_lactacao(nome: str, dias: int = 120, user=Depends(_get_user)):
         por_dia[d_] = por_dia.get(d_, 0) + float(p.get("leite") or 0)
     real_sorted = sorted(por_dia.items())
 
-    # Fator de escala: ajusta curva ao pico real
-    fator = 1.0
-    if real_sorted:
-        pico_real = max(v for _, v in real_sorted)
-        pico_wood = _wood(_math.floor(0.12 / 0.0035))  # ~34
-        if pico_wood > 0 and pico_real > 0:
-            fator = pico_real / pico_wood
-
     # Constrói série com curva e real
     series = []
     for data_str, litros_real in real_sorted:
         dim = None
         esperado = None
-        if dt_parto:
-            try:
-                d_obj = datetime.datetime.strptime(data_str, "%Y-%m-%d").date()
-                dim   = (d_obj - dt_parto).days
-                if dim > 0:
-                    esperado = round(_wood(dim) * fator, 1)
-            except Exception:
-                pass
+        d_obj = reproducao.data(data_str)
+        if dt_parto and d_obj:
+            dim = (d_obj - dt_parto).days
+            if dim > 0:
+                esperado = round(lactacao.wood(dim, curva["a"], curva["b"], curva["c"]), 1)
         series.append({
             "data":    data_str,
             "dia":     data_str[5:],
@@ -1138,7 +1149,7 @@ def curva_lactacao(nome: str, dias: int = 120, user=Depends(_get_user)):
 
     queda_pct = None
     if dim_atual and media_7d and dim_atual > 60:
-        esperado_atual = _wood(dim_atual) * fator
+        esperado_atual = lactacao.wood(dim_atual, curva["a"], curva["b"], curva["c"])
         if esperado_atual > 0:
             queda_pct = round((1 - media_7d / esperado_atual) * 100, 1)
 
@@ -1148,11 +1159,38 @@ def curva_lactacao(nome: str, dias: int = 120, user=Depends(_get_user)):
         "dim_atual":  dim_atual,
         "media_7d":   media_7d,
         "queda_pct":  queda_pct,
-        "fator_escala": round(fator, 3),
+        # nível da vaca relativo à curva padrão (compatível com o antigo fator de escala)
+        "fator_escala": round(curva["a"] / lactacao.PADRAO[0], 3),
+        "curva":      curva,
         "serie":      series,
     }
 
 
+def previsao_fazenda(fazenda_id: str, recalcular: bool = False) -> dict:
+    """Previsão de produção do dia (previsao.py): lida do cache gravado pela tarefa
+    das 5h do agendador; sem ela, calcula com o histórico e as curvas de lactação e grava."""
+    def carregar():
+        ini = (datetime.date.today() - datetime.timedelta(days=previsao.HISTORICO)).isoformat()
+        prod = [d.to_dict() for d in
+                _coll(fazenda_id, "producao").where(filter=FieldFilter("data", ">=", ini)).stream()]
+        return prod, [d.to_dict() for d in _coll(fazenda_id, "animais").stream()]
+    return previsao.previsao(fazenda_id, carregar, recalcular=recalcular)
+
+
+@mobile_router.get("/previsao")
+def previsao_producao(dias: int = Query(7, ge=1, le=previsao.HORIZONTE), user=Depends(_get_user)):
+    """Previsão diária da produção do rebanho (litros, faixa mín–máx) para os
+    próximos `dias` dias, com o resumo do período e o modelo usado."""
+    prev = previsao_fazenda(user["fazenda_id"])
+    return {
+        "gerado_em":     prev["gerado_em"],
+        "media_recente": prev["media_recente"],
+        "resumo":        previsao.resumo(prev, dias),
+        "dias":          prev["dias"][:dias],
+        "modelo":        prev["modelo"],
+    }
+
+
 # ─────────────────────────────────────────────
 # AGENDA DOS PRÓXIMOS DIAS
 # ─────────────────────────────────────────────
@@ -1162,46 +1200,23 @@ def agenda_semana(dias: int = 7, user=Depends(_get_user)):
     fid  = user["fazenda_id"]
     hoje = datetime.date.today()
 
-    GESTACAO   = 283
-    DIAS_SECAR = 60
-    DIAS_DIAGN = 30
-    DIAS_PVE   = 45
     DIAS_PT    = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+    _TEXTO     = {"diagnostico": ("diagnostico", "Diagnóstico prenhez: {nome}"),
+                  "inseminar":   ("inseminacao", "Inseminar (atrasada): {nome}"),
+                  "secar":       ("secar",       "Secar hoje: {nome}"),
+                  "parto":       ("parto",       "Parto em {faltam}d: {nome}")}
 
     agenda: dict = {str(hoje + datetime.timedelta(days=i)): [] for i in range(dias)}
 
-    def _pd(s):
-        try:
-            return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
-        except Exception:
-            return None
-
     try:
-        animais = [d.to_dict() for d in _coll(fid, "animais").stream()]
-        for a in animais:
-            nome    = a.get("nome", "?")
-            status  = a.get("status", "")
-            d_insem = _pd(a.get("dt_insem"))
-            d_parto = _pd(a.get("dt_parto"))
-            if status != "Lactação":
-                continue
-            if d_insem and not a.get("prenhez"):
-                data_d = d_insem + datetime.timedelta(days=DIAS_DIAGN)
-                if str(data_d) in agenda:
-                    agenda[str(data_d)].append({"tipo": "diagnostico", "animal": nome, "texto": f"Diagnóstico prenhez: {nome}"})
-            if not d_insem and d_parto:
-                data_p = d_parto + datetime.timedelta(days=DIAS_PVE + 1)
-                if str(data_p) in agenda:
-                    agenda[str(data_p)].append({"tipo": "inseminacao", "animal": nome, "texto": f"Inseminar (atrasada): {nome}"})
-            if a.get("prenhez") and d_insem:
-                prev  = d_insem + datetime.timedelta(days=GESTACAO)
-                d_sec = prev - datetime.timedelta(days=DIAS_SECAR)
-                if str(d_sec) in agenda:
-                    agenda[str(d_sec)].append({"tipo": "secar", "animal": nome, "texto": f"Secar hoje: {nome}"})
-                for dd in range(1, 8):
-                    data_a = prev - datetime.timedelta(days=dd)
-                    if str(data_a) in agenda:
-                        agenda[str(data_a)].append({"tipo": "parto", "animal": nome, "texto": f"Parto em {dd}d: {nome}"})
+        cal = reproducao.calendario(
+            fid, lambda: [d.to_dict() for d in _coll(fid, "animais").stream()],
+            versao=versao_fazenda(fid))
+        for dia, evs in reproducao.agenda(cal, hoje, dias).items():
+            for e in evs:
+                tipo, texto = _TEXTO[e["tipo"]]
+                agenda[dia].append({"tipo": tipo, "animal": e["nome"],
+                                    "texto": texto.format(**e)})
     except Exception:
         logger.warning("Erro ao calcular agenda de animais para fazenda %s", fid, exc_info=True)
 
@@ -1209,7 +1224,7 @@ def agenda_semana(dias: int = 7, user=Depends(_get_user)):
         protos = [d.to_dict() for d in _coll(fid, "protocolos_sanitarios").stream()
                   if d.to_dict().get("ativo", True)]
         for p in protos:
-            prox = _pd(p.get("proxima_data"))
+            prox = reproducao.data(p.get("proxima_data"))
             if prox and str(prox) in agenda:
                 agenda[str(prox)].append({"tipo": "sanitario", "animal": p.get("animal",""), "texto": f"Protocolo: {p.get('nome','')}"})
     except Exception:
@@ -1319,11 +1334,12 @@ def custo_por_litro(user=Depends(_get_user)):
 # RELATÓRIO MENSAL EM PDF — design profissional
 # ─────────────────────────────────────────────
 @mobile_router.get("/relatorio_mensal")
-def relatorio_mensal(user=Depends(_get_user), mes: str = Query(default="")):
-    """Gera PDF com relatorio mensal premium: KPI cards, barras visuais, design profissional."""
-    from fpdf import FPDF
-    from fpdf.enums import XPos, YPos, Align
+def relatorio_mensal(user=Depends(_get_user), mes: str = Query(default=""),
+                     if_none_match: str = Header(default="")):
+    """Gera PDF com relatorio mensal premium: KPI cards, barras visuais, design profissional.
+    Layout e cache no motor de relatórios (relatorios.py) — responde 304 se o ETag bater."""
     from fastapi.responses import Response as _Resp
+    import relatorios
 
     fid  = user["fazenda_id"]
     hoje = datetime.date.today()
@@ -1338,331 +1354,22 @@ def relatorio_mensal(user=Depends(_get_user), mes: str = Query(default="")):
     else:
         ano, m = hoje.year, hoje.month
 
-    ini_mes = f"{ano:04d}-{m:02d}-01"
-    fim_mes = f"{ano+1:04d}-01-01" if m == 12 else f"{ano:04d}-{m+1:02d}-01"
+    mes_chave = f"{ano:04d}-{m:02d}"
+    hdrs = {"Cache-Control": ("private, max-age=86400" if relatorios.mes_fechado(mes_chave)
+                              else "private, max-age=0, must-revalidate")}
 
-    import calendar
-    meses_pt = ["","Janeiro","Fevereiro","Marco","Abril","Maio","Junho",
-                 "Julho","Agosto","Setembro","Outubro","Novembro","Dezembro"]
-    mes_label = f"{meses_pt[m]} / {ano}"
+    # Atalho: nada foi escrito na fazenda desde o último PDF e o cliente já o tem
+    marca = versao_fazenda(fid)
+    memo  = relatorios.memorizado(relatorios.NS_MENSAL, fid, mes_chave, marca)
+    if memo and if_none_match == relatorios.etag(memo["versao"]):
+        return _Resp(status_code=304, headers={**hdrs, "ETag": if_none_match})
 
-    # ── Dados ──────────────────────────────────────────────────
-    db = _db()
-    # Nome da fazenda: config > fazendas doc > fid
-    nome_fazenda = fid
-    cfg_doc = _coll(fid, "config").document("principal").get()
-    if cfg_doc.exists:
-        nome_fazenda = cfg_doc.to_dict().get("nome_fazenda") or fid
-    else:
-        faz_doc = db.collection("fazendas").document(fid).get()
-        if faz_doc.exists:
-            nome_fazenda = faz_doc.to_dict().get("nome") or fid
-
-    fin_docs  = [d.to_dict() for d in _coll(fid,"financeiro")
-                 .where(filter=FieldFilter("data",">=",ini_mes))
-                 .where(filter=FieldFilter("data","<",fim_mes)).stream()]
-    prod_docs = [d.to_dict() for d in _coll(fid,"producao")
-                 .where(filter=FieldFilter("data",">=",ini_mes))
-                 .where(filter=FieldFilter("data","<",fim_mes)).stream()]
-    animais   = [d.to_dict() for d in _coll(fid,"animais").stream()]
-
-    total_prod   = sum(p.get("leite",0) for p in prod_docs)
-    dias_no_mes  = calendar.monthrange(ano, m)[1]
-    media_dia    = round(total_prod / dias_no_mes, 1) if dias_no_mes else 0
-    vacas_lact   = len([a for a in animais if a.get("status","") in ("Lactacao","Lactação")])
-    total_rec    = sum(f.get("valor",0) for f in fin_docs if "Venda" in (f.get("cat") or f.get("categoria","")))
-    total_desp   = sum(f.get("valor",0) for f in fin_docs if "Venda" not in (f.get("cat") or f.get("categoria","")))
-    saldo        = total_rec - total_desp
-    custo_litro  = round(total_desp / total_prod, 2) if total_prod > 0 else 0.0
-    preco_litro  = round(total_rec  / total_prod, 2) if total_prod > 0 else 0.0
-    margem_litro = round(preco_litro - custo_litro, 2)
-
-    por_animal: dict = {}
-    for p in prod_docs:
-        n = p.get("nome_animal") or p.get("id_animal") or "?"
-        por_animal[n] = por_animal.get(n, 0) + p.get("leite", 0)
-    top_animais = sorted(por_animal.items(), key=lambda x: -x[1])[:8]
-
-    por_cat: dict = {}
-    for f in fin_docs:
-        if "Venda" in (f.get("cat") or f.get("categoria","")): continue
-        cat = f.get("cat") or f.get("categoria") or "Outros"
-        por_cat[cat] = por_cat.get(cat, 0) + f.get("valor", 0)
-    desp_cats = sorted(por_cat.items(), key=lambda x: -x[1])[:8]
-
-    # ── Design tokens ──────────────────────────────────────────
-    C_GREEN_DARK  = (22,  101, 52)
-    C_GREEN_MED   = (34,  139, 70)
-    C_GREEN_LIGHT = (220, 242, 228)
-    C_GREEN_PALE  = (240, 253, 244)
-    C_BLUE        = (37,  99,  235)
-    C_BLUE_LIGHT  = (219, 234, 254)
-    C_RED         = (185, 28,  28)
-    C_RED_LIGHT   = (254, 226, 226)
-    C_AMBER       = (180, 83,  9)
-    C_AMBER_LIGHT = (254, 243, 199)
-    C_GRAY_900    = (17,  24,  39)
-    C_GRAY_600    = (75,  85,  99)
-    C_GRAY_400    = (156, 163, 175)
-    C_GRAY_100    = (243, 244, 246)
-    C_WHITE       = (255, 255, 255)
-    C_BORDER      = (209, 213, 219)
-
-    # margens e largura útil
-    ML = 12   # margin left
-    MR = 12   # margin right
-    W  = 210 - ML - MR   # 186mm útil
-
-    def _s(t: str) -> str:
-        return (str(t)
-                .replace("\u2014","-").replace("\u2013","-")
-                .replace("\u2019","'").replace("\u2018","'")
-                .replace("\u201c",'"').replace("\u201d",'"')
-                .encode("latin-1", errors="replace").decode("latin-1"))
-
-    def brl(v: float, sign=False) -> str:
-        s = f"{abs(v):,.2f}".replace(",","X").replace(".",",").replace("X",".")
-        prefix = "R$ " if not sign else ("+ R$ " if v >= 0 else "- R$ ")
-        return _s(prefix + s)
-
-    # ── Classe PDF ─────────────────────────────────────────────
-    class PDF(FPDF):
-        def header(self):
-            # Fundo escuro header
-            self.set_fill_color(*C_GREEN_DARK)
-            self.rect(0, 0, 210, 32, style="F")
-            # Faixa accent
-            self.set_fill_color(*C_GREEN_MED)
-            self.rect(0, 32, 210, 2, style="F")
-            # Logo / produto
-            self.set_xy(ML, 6)
-            self.set_font("Helvetica", "B", 18)
-            self.set_text_color(*C_WHITE)
-            self.cell(90, 9, "MilkShow", new_x=XPos.RIGHT, new_y=YPos.TOP)
-            # Mes/ano alinhado à direita
-            self.set_font("Helvetica", "B", 11)
-            self.set_text_color(180, 230, 190)
-            self.set_xy(ML + 90, 7)
-            self.cell(W - 90, 8, _s(mes_label), align="R",
-                      new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            # Nome da fazenda
-            self.set_xy(ML, 17)
-            self.set_font("Helvetica", "", 9)
-            self.set_text_color(180, 220, 190)
-            self.cell(W/2, 6, _s(nome_fazenda),
-                      new_x=XPos.RIGHT, new_y=YPos.TOP)
-            # Gerado em - direita
-            self.set_font("Helvetica", "", 8)
-            self.set_text_color(150, 200, 160)
-            self.set_xy(ML + W/2, 18)
-            self.cell(W/2, 5, f"Gerado em {hoje.strftime('%d/%m/%Y')}", align="R",
-                      new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            self.set_text_color(*C_GRAY_900)
-            self.set_y(38)
-
-        def footer(self):
-            self.set_y(-13)
-            self.set_fill_color(*C_GRAY_100)
-            self.rect(0, self.get_y(), 210, 13, style="F")
-            self.set_font("Helvetica", "", 8)
-            self.set_text_color(*C_GRAY_400)
-            self.cell(0, 13,
-                      _s(f"MilkShow  |  {nome_fazenda}  |  {mes_label}  |  Pag. {self.page_no()}"),
-                      align="C")
-
-    pdf = PDF()
-    pdf.set_margins(ML, 10, MR)
-    pdf.set_auto_page_break(auto=True, margin=18)
-    pdf.add_page()
-
-    # ── helpers de layout ──────────────────────────────────────
-    def section_title(title: str, icon: str = ""):
-        pdf.ln(4)
-        y = pdf.get_y()
-        pdf.set_fill_color(*C_GREEN_LIGHT)
-        pdf.rect(ML, y, W, 8, style="F")
-        # linha esquerda accent
-        pdf.set_fill_color(*C_GREEN_MED)
-        pdf.rect(ML, y, 3, 8, style="F")
-        pdf.set_xy(ML + 5, y)
-        pdf.set_font("Helvetica", "B", 9)
-        pdf.set_text_color(*C_GREEN_DARK)
-        txt = _s(f"{icon}  {title}" if icon else title)
-        pdf.cell(W - 5, 8, txt, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.ln(2)
-
-    def kpi_card(x, y, w, h, label, value, unit="", bg=C_WHITE, val_color=None):
-        """Desenha um card KPI com borda."""
-        pdf.set_fill_color(*bg)
-        pdf.set_draw_color(*C_BORDER)
-        pdf.rect(x, y, w, h, style="FD")
-        # label topo
-        pdf.set_xy(x + 2, y + 2)
-        pdf.set_font("Helvetica", "", 7)
-        pdf.set_text_color(*C_GRAY_400)
-        pdf.cell(w - 4, 4, _s(label.upper()), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        # valor grande
-        pdf.set_xy(x + 2, y + 7)
-        pdf.set_font("Helvetica", "B", 14)
-        pdf.set_text_color(*(val_color or C_GRAY_900))
-        pdf.cell(w - 4, 8, _s(str(value)), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        # unidade
-        if unit:
-            pdf.set_xy(x + 2, y + h - 5)
-            pdf.set_font("Helvetica", "", 7)
-            pdf.set_text_color(*C_GRAY_400)
-            pdf.cell(w - 4, 4, _s(unit))
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.set_draw_color(0, 0, 0)
-
-    def bar_row(label, value, max_val, suffix="", color=C_GREEN_MED, show_val=""):
-        """Linha com barra horizontal proporcional."""
-        y = pdf.get_y()
-        if y > 265:
-            pdf.add_page()
-            y = pdf.get_y()
-        BAR_X   = ML + 38
-        BAR_W   = 95
-        bar_pct = min(value / max_val, 1.0) if max_val > 0 else 0
-        # Label
-        pdf.set_xy(ML, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.set_text_color(*C_GRAY_600)
-        pdf.cell(36, 6, _s(label[:18]), new_x=XPos.RIGHT, new_y=YPos.TOP)
-        # Track (fundo cinza)
-        pdf.set_fill_color(*C_GRAY_100)
-        pdf.rect(BAR_X, y + 1.5, BAR_W, 3.5, style="F")
-        # Bar preenchida
-        if bar_pct > 0:
-            pdf.set_fill_color(*color)
-            pdf.rect(BAR_X, y + 1.5, BAR_W * bar_pct, 3.5, style="F")
-        # Percentual
-        pdf.set_xy(BAR_X + BAR_W + 2, y)
-        pdf.set_font("Helvetica", "B", 8)
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.cell(18, 6, _s(suffix), new_x=XPos.RIGHT, new_y=YPos.TOP)
-        # Valor
-        pdf.set_xy(BAR_X + BAR_W + 22, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.set_text_color(*C_GRAY_600)
-        pdf.cell(W - BAR_W - 60, 6, _s(show_val), align="R",
-                 new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.set_text_color(*C_GRAY_900)
-
-    # ══ 1. KPI CARDS — Produção ═══════════════════════════════
-    section_title("PRODUCAO DE LEITE", "")
-    y0  = pdf.get_y()
-    gap = 3
-    cw  = (W - gap * 3) / 4
-
-    kpi_card(ML,              y0, cw, 22, "Total do Mes",
-             f"{total_prod:,.0f}".replace(",","."), "litros",
-             bg=C_GREEN_PALE, val_color=C_GREEN_DARK)
-    kpi_card(ML + cw + gap,   y0, cw, 22, "Media Diaria",
-             f"{media_dia:.1f}", "L / dia",
-             bg=C_BLUE_LIGHT, val_color=C_BLUE)
-    kpi_card(ML + (cw+gap)*2, y0, cw, 22, "Vacas em Lactacao",
-             str(vacas_lact), "animais",
-             bg=C_GREEN_PALE, val_color=C_GREEN_MED)
-    kpi_card(ML + (cw+gap)*3, y0, cw, 22, "Registros",
-             str(len(prod_docs)), "lancamentos",
-             bg=C_GRAY_100, val_color=C_GRAY_600)
-    pdf.set_y(y0 + 26)
-
-    # ══ 2. BARRAS — Top Animais ════════════════════════════════
-    if top_animais:
-        section_title("TOP ANIMAIS - PRODUCAO DO MES", "")
-        max_anim = top_animais[0][1] if top_animais else 1
-        for nome_a, litros in top_animais:
-            pct = litros / total_prod * 100 if total_prod > 0 else 0
-            bar_row(nome_a, litros, max_anim,
-                    suffix=f"{pct:.1f}%",
-                    show_val=f"{litros:,.0f} L".replace(",","."),
-                    color=C_GREEN_MED)
-
-    # ══ 3. KPI CARDS — Financeiro ══════════════════════════════
-    section_title("RESUMO FINANCEIRO", "")
-    y1  = pdf.get_y()
-    fw  = (W - gap * 2) / 3
-    bg_saldo  = C_GREEN_PALE  if saldo >= 0 else C_RED_LIGHT
-    cor_saldo = C_GREEN_DARK  if saldo >= 0 else C_RED
-
-    kpi_card(ML,           y1, fw, 22, "Receitas (Venda de Leite)",
-             brl(total_rec), "", bg=C_GREEN_PALE, val_color=C_GREEN_DARK)
-    kpi_card(ML + fw+gap,  y1, fw, 22, "Despesas Totais",
-             brl(total_desp), "", bg=C_RED_LIGHT, val_color=C_RED)
-    kpi_card(ML + (fw+gap)*2, y1, fw, 22, "Saldo do Mes",
-             brl(saldo), "", bg=bg_saldo, val_color=cor_saldo)
-    pdf.set_y(y1 + 26)
-
-    # ══ 4. BARRAS — Despesas por Categoria ════════════════════
-    if desp_cats:
-        section_title("DESPESAS POR CATEGORIA", "")
-        max_cat = desp_cats[0][1] if desp_cats else 1
-        for cat, val in desp_cats:
-            pct = val / total_desp * 100 if total_desp > 0 else 0
-            bar_row(cat, val, max_cat,
-                    suffix=f"{pct:.1f}%",
-                    show_val=brl(val),
-                    color=C_RED)
-
-    # ══ 5. KPI CARDS — Custo por Litro ════════════════════════
-    section_title("CUSTO POR LITRO - KPI MENSAL", "")
-    y2   = pdf.get_y()
-    tw   = (W - gap * 2) / 3
-    bg_m = C_GREEN_PALE if margem_litro >= 0 else C_AMBER_LIGHT
-    cm   = C_GREEN_DARK  if margem_litro >= 0 else C_AMBER
-
-    kpi_card(ML,           y2, tw, 22, "Custo / Litro",
-             f"R$ {custo_litro:.2f}", "despesas / producao",
-             bg=C_RED_LIGHT, val_color=C_RED)
-    kpi_card(ML + tw+gap,  y2, tw, 22, "Preco Recebido / Litro",
-             f"R$ {preco_litro:.2f}", "receita / producao",
-             bg=C_BLUE_LIGHT, val_color=C_BLUE)
-    kpi_card(ML + (tw+gap)*2, y2, tw, 22, "Margem / Litro",
-             f"R$ {margem_litro:+.2f}", "preco - custo",
-             bg=bg_m, val_color=cm)
-    pdf.set_y(y2 + 26)
-
-    # ══ 6. ANALISE TEXTUAL ════════════════════════════════════
-    pdf.ln(4)
-    bg_box   = C_GREEN_PALE if margem_litro >= 0 else C_AMBER_LIGHT
-    cor_box  = C_GREEN_DARK  if margem_litro >= 0 else C_AMBER
-    icon_txt = "Resultado positivo:" if margem_litro >= 0 else "Atencao:"
-    if margem_litro >= 0:
-        analise = (f"Margem de R$ {margem_litro:.2f}/L. "
-                   f"A cada 1.000 litros, a fazenda gerou R$ {margem_litro*1000:.2f} de lucro.")
-    else:
-        analise = (f"Margem negativa de R$ {margem_litro:.2f}/L. "
-                   f"As despesas superaram as receitas em R$ {abs(saldo):.2f} no mes. "
-                   f"Revise as categorias de maior impacto.")
-
-    ya = pdf.get_y()
-    pdf.set_fill_color(*bg_box)
-    pdf.set_draw_color(*cor_box)
-    pdf.rect(ML, ya, W, 14, style="FD")
-    pdf.set_fill_color(*cor_box)
-    pdf.rect(ML, ya, 3, 14, style="F")
-    pdf.set_xy(ML + 6, ya + 2)
-    pdf.set_font("Helvetica", "B", 8)
-    pdf.set_text_color(*cor_box)
-    pdf.cell(30, 5, _s(icon_txt), new_x=XPos.RIGHT, new_y=YPos.TOP)
-    pdf.set_font("Helvetica", "", 8)
-    pdf.set_text_color(*C_GRAY_600)
-    pdf.set_xy(ML + 6 + 31, ya + 2)
-    pdf.multi_cell(W - 40, 5, _s(analise))
-    pdf.set_draw_color(0, 0, 0)
-    pdf.set_text_color(*C_GRAY_900)
-
-    # Gera bytes
-    pdf_bytes = pdf.output()
-    filename  = _s(f"MilkShow_{nome_fazenda.replace(' ','_')}_{ano}{m:02d}.pdf")
-    return _Resp(
-        content=bytes(pdf_bytes),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
+    pdf_bytes, versao, filename = relatorios.pdf_mensal(_coll, _db(), fid, mes_chave, marca)
+    hdrs["ETag"] = relatorios.etag(versao)
+    if if_none_match == hdrs["ETag"]:
+        return _Resp(status_code=304, headers=hdrs)
+    hdrs["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return _Resp(content=pdf_bytes, media_type="application/pdf", headers=hdrs)
 
 
 # ─────────────────────────────────────────────
@@ -1740,72 +1447,19 @@ def deletar_racao(racao_id: str, user=Depends(_get_user)):
 @mobile_router.get("/rankings")
 def rankings_avancados(dias: int = 30, user=Depends(_get_user)):
     """Retorna 3 rankings: produção, rentabilidade e alerta de descarte."""
-    fid = user["fazenda_id"]
-    ini = (datetime.date.today() - datetime.timedelta(days=dias)).isoformat()
+    r = _rentabilidade(user["fazenda_id"], dias)
+    campos = ("nome", "litros", "media_dia", "racao_kg", "receita", "custo_racao", "custo_vet",
+              "custo_rateio", "custo_total", "lucro", "custo_litro", "margem_pct")
 
-    config = {}
-    for d in _coll(fid, "config").stream():
-        c = d.to_dict()
-        config[c.get("chave", d.id)] = c.get("valor")
-
-    preco_leite    = float(config.get("preco_leite", 2.50))
-    custo_racao_kg = _custo_racao_kg_real(fid)
-
-    # Coleta produção e sanitário
-    prod_docs = [d.to_dict() for d in
-                 _coll(fid, "producao")
-                 .where(filter=FieldFilter("data", ">=", ini)).stream()]
-    san_docs  = [d.to_dict() for d in
-                 _coll(fid, "sanitario")
-                 .where(filter=FieldFilter("data", ">=", ini)).stream()]
-
-    # Agrega por animal
-    por_animal: dict = {}
-    for p in prod_docs:
-        nome = p.get("nome_animal") or "Rebanho"
-        if nome not in por_animal:
-            por_animal[nome] = {"litros": 0.0, "racao_kg": 0.0, "custo_vet": 0.0, "registros": 0}
-        por_animal[nome]["litros"]    += float(p.get("leite", 0) or 0)
-        por_animal[nome]["racao_kg"]  += float(p.get("racao", 0) or 0)
-        por_animal[nome]["registros"] += 1
-    for s in san_docs:
-        nome = s.get("nome_animal") or s.get("animal") or "Rebanho"
-        if nome in por_animal:
-            por_animal[nome]["custo_vet"] += float(s.get("valor", 0) or 0)
-
-    lista = []
-    for nome, d in por_animal.items():
-        litros = d["litros"]
-        if litros <= 0:
-            continue
-        receita     = litros * preco_leite
-        custo_racao = d["racao_kg"] * custo_racao_kg
-        custo_total = custo_racao + d["custo_vet"]
-        lucro       = receita - custo_total
-        custo_litro = custo_total / litros if litros > 0 else 0
-        margem_pct  = (lucro / receita * 100) if receita > 0 else 0
-        media_dia   = litros / dias
-
-        lista.append({
-            "nome":        nome,
-            "litros":      round(litros, 1),
-            "media_dia":   round(media_dia, 1),
-            "racao_kg":    round(d["racao_kg"], 1),
-            "receita":     round(receita, 2),
-            "custo_racao": round(custo_racao, 2),
-            "custo_vet":   round(d["custo_vet"], 2),
-            "custo_total": round(custo_total, 2),
-            "lucro":       round(lucro, 2),
-            "custo_litro": round(custo_litro, 3),
-            "margem_pct":  round(margem_pct, 1),
-        })
+    def _lista(chave):
+        return [{k: l[k] for k in campos} for l in r[chave]]
 
     return {
         "dias":             dias,
-        "preco_leite":      preco_leite,
-        "custo_racao_kg":   round(custo_racao_kg, 2),
-        "total_animais":    len(lista),
-        "producao":         sorted(lista, key=lambda x: x["litros"], reverse=True),
-        "rentabilidade":    sorted(lista, key=lambda x: x["custo_litro"]),
-        "alerta_descarte":  sorted(lista, key=lambda x: x["margem_pct"]),
+        "preco_leite":      round(r["preco_leite"], 2),
+        "custo_racao_kg":   round(r["custo_racao_kg"], 2),
+        "total_animais":    len(r["linhas"]),
+        "producao":         _lista("producao"),
+        "rentabilidade":    _lista("rentabilidade"),
+        "alerta_descarte":  _lista("alerta_descarte"),
     }
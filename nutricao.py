@@ -235,78 +235,42 @@ def calcular_ranking(animais: list, producao: list, preco_leite: float,
 
     Retorna dict com tres listas ordenadas.
     """
-    from collections import defaultdict
     from datetime import datetime, timedelta
+    import rentabilidade
 
     # Filtra últimos 30 dias
     hoje   = datetime.now().date()
     inicio = hoje - timedelta(days=30)
     prod_recente = [
-        p for p in producao
+        {**p, "nome_animal": p.get("nome_animal") or p.get("id_animal", "?")}
+        for p in producao
         if p.get("data", "") >= str(inicio)
     ]
 
-    # Agrega por animal
-    por_animal = defaultdict(lambda: {"litros": 0, "racao_kg": 0, "registros": 0})
-    for reg in prod_recente:
-        chave = reg.get("nome_animal") or reg.get("id_animal", "?")
-        por_animal[chave]["litros"]    += float(reg.get("leite", 0) or 0)
-        por_animal[chave]["racao_kg"]  += float(reg.get("racao", 0) or 0)
-        por_animal[chave]["registros"] += 1
-
-    CUSTO_RACAO_KG = 1.20  # R$/kg padrão; idealmente viria da config
-
-    lista = []
-    for nome, dados in por_animal.items():
-        litros   = dados["litros"]
-        racao_kg = dados["racao_kg"]
-        if litros <= 0:
-            continue
-
-        receita         = litros * preco_leite
-        custo_racao     = racao_kg * CUSTO_RACAO_KG
-        custo_op        = litros * custo_por_litro
-        custo_total     = custo_racao + custo_op
-        lucro           = receita - custo_total
-        custo_por_litro_animal = custo_total / litros if litros > 0 else 0
-        margem_pct      = ((receita - custo_total) / receita * 100) if receita > 0 else 0
-        media_dia       = litros / 30
-
-        lista.append({
-            "nome":           nome,
-            "litros":         round(litros, 1),
-            "media_dia":      round(media_dia, 1),
-            "racao_kg":       round(racao_kg, 1),
-            "receita":        round(receita, 2),
-            "custo_total":    round(custo_total, 2),
-            "lucro":          round(lucro, 2),
-            "custo_por_litro": round(custo_por_litro_animal, 2),
-            "margem_pct":     round(margem_pct, 1),
-        })
+    # Motor único de rentabilidade; ração no custo padrão (sem estoque) e o
+    # custo operacional da fazenda somado por litro
+    r = rentabilidade.calcular(prod_recente, [], [], {"preco_leite": preco_leite}, [], 30,
+                               custo_litro_op=custo_por_litro)
 
-    if not lista:
+    def _linha(l):
         return {
-            "producao":      [],
-            "rentabilidade": [],
-            "alerta_descarte": [],
-            "periodo_dias":  30,
+            "nome":            l["nome"],
+            "litros":          l["litros"],
+            "media_dia":       l["media_dia"],
+            "racao_kg":        l["racao_kg"],
+            "receita":         l["receita"],
+            "custo_total":     l["custo_total"],
+            "lucro":           l["lucro"],
+            "custo_por_litro": round(l["custo_litro"], 2),
+            "margem_pct":      l["margem_pct"],
         }
 
-    # Ranking 1: Produção (maior litros)
-    ranking_producao = sorted(lista, key=lambda x: x["litros"], reverse=True)
-
-    # Ranking 2: Rentabilidade (menor custo por litro)
-    ranking_rent = sorted(lista, key=lambda x: x["custo_por_litro"])
-
-    # Ranking 3: Alerta de Descarte (menor margem % ou lucro negativo)
-    ranking_descarte = sorted(lista, key=lambda x: x["margem_pct"])
-
     return {
-        "producao":        ranking_producao,
-        "rentabilidade":   ranking_rent,
-        "alerta_descarte": ranking_descarte,
+        "producao":        [_linha(l) for l in r["producao"]],
+        "rentabilidade":   [_linha(l) for l in r["rentabilidade"]],
+        "alerta_descarte": [_linha(l) for l in r["alerta_descarte"]],
         "periodo_dias":    30,
-        "total_animais":   len(lista),
+        "total_animais":   len(r["linhas"]),
     }
 
 
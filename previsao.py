@@ -0,0 +1,314 @@
+"""
+MilkShow — Previsão de produção do rebanho
+A previsão diária é a soma das projeções de cada vaca pela curva de lactação
+dela (lactacao.py). Fazenda que lança por vaca: só as vacas com registros
+recentes, cada uma no seu nível, mais a produção de animais sem cadastro.
+Fazenda que lança o total do rebanho: todas as lactantes pela curva, em escala
+ajustada para bater com os totais das últimas semanas (os totais já contêm as
+vacas — não são somados). Sobre isso:
+
+  secagem/parto  vaca prenhe para de contar na secagem prevista e volta, com a
+                 curva do rebanho, no parto previsto (novilhas prenhes também)
+  semana         fator multiplicativo por dia da semana (razão entre o total do
+                 dia e a média móvel centrada de 7 dias, encolhido para 1)
+  sazonal        com um ano de histórico, a variação do mesmo período do ano
+                 anterior em relação às últimas semanas, atenuada pela metade
+
+A faixa (mín–máx) vem da dispersão dos resíduos diários e abre com o horizonte.
+
+A tarefa "previsao" do agendador do bot (5h, antes do disparo das 6h) — ou
+scripts/gerar_relatorios.py, rodado à mão — calcula a previsão de todas as
+fazendas e grava em memória e no cache em disco; app, PDF e WhatsApp leem de
+lá. Sem previsão do dia, `previsao()` calcula e grava na hora.
+"""
+
+import datetime
+import json
+import os
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+import lactacao
+import reproducao
+from cache_disco import CacheDisco
+
+HORIZONTE  = int(os.environ.get("PREVISAO_HORIZONTE", "30"))
+HISTORICO  = int(os.environ.get("PREVISAO_HISTORICO_DIAS", "400"))   # cobre o sazonal
+CALIBRACAO = 14            # dias que definem o nível atual de cada vaca
+MIN_DIAS   = 5             # dias com produção nas últimas 4 semanas
+_SEMANAS   = 8             # janela do efeito dia da semana
+_Z         = 1.645         # faixa de 90%
+
+_LACTACAO = ("Lactação", "Lactacao")
+
+CACHE = CacheDisco(
+    "previsoes",
+    max_bytes=20 * 1024 * 1024,
+    ttl_s=float(os.environ.get("PREVISAO_TTL_H", "30")) * 3600,
+)
+
+
+def _serie(producao: list, ini: datetime.date, n: int):
+    """Totais diários do rebanho (NaN = dia sem registro) e registros de cada
+    animal na janela de calibração: (y, {nome: {índice do dia: litros}})."""
+    y = np.zeros(n)
+    tem = np.zeros(n, dtype=bool)
+    por_vaca: dict = {}
+    cal = n - CALIBRACAO
+    for p in producao:
+        d = reproducao.data(p.get("data"))
+        if not d:
+            continue
+        i = (d - ini).days
+        if not 0 <= i < n:
+            continue
+        try:
+            litros = float(p.get("leite") or 0)
+        except (TypeError, ValueError):
+            continue
+        y[i] += litros
+        tem[i] = True
+        if i >= cal:
+            dias = por_vaca.setdefault(p.get("nome_animal") or "Rebanho", {})
+            dias[i] = dias.get(i, 0.0) + litros
+    return np.where(tem, y, np.nan), por_vaca
+
+
+def _efeito_semana(y: np.ndarray, ini: datetime.date):
+    """(fator por dia da semana [seg..dom], desvio dos resíduos no log)."""
+    n = len(y)
+    ok = ~np.isnan(y)
+    v = np.where(ok, y, 0.0)
+    k = np.ones(7)
+    soma = np.convolve(v, k, "same")
+    cont = np.convolve(ok.astype(float), k, "same")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        razao = v / (soma / cont)
+    usar = ok & (cont >= 5) & (v > 0) & (np.arange(n) >= n - 7 * _SEMANAS)
+    dia_sem = (ini.weekday() + np.arange(n)) % 7
+    c = np.bincount(dia_sem[usar], minlength=7).astype(float)
+    s = np.bincount(dia_sem[usar], weights=razao[usar], minlength=7)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ef = np.where(c >= 3, 1 + (s / c - 1) * c / (c + 2), 1.0)
+    ef /= ef.mean()
+    res = np.log(razao[usar]) - np.log(ef[dia_sem[usar]])
+    desvio = float(res.std()) if len(res) >= 14 else 0.10
+    return ef, max(desvio, 0.03)
+
+
+def _efeito_sazonal(y: np.ndarray, dias: int) -> Optional[np.ndarray]:
+    """Razão, no ano anterior (364 dias: mesmo dia da semana), entre a média
+    de 7 dias em torno de cada dia previsto e a da janela de calibração."""
+    n = len(y)
+    ref = n - 364
+    if ref - CALIBRACAO < 0 or ref + dias + 3 > n:
+        return None
+    base = y[ref - CALIBRACAO:ref]
+    if np.isnan(base).sum() > CALIBRACAO // 2:
+        return None
+    base = np.nanmean(base)
+    if not base > 0:
+        return None
+    v = np.where(np.isnan(y), 0.0, y)
+    cont = np.convolve((~np.isnan(y)).astype(float), np.ones(7), "same")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        media = np.convolve(v, np.ones(7), "same") / cont
+    f = media[ref:ref + dias] / base
+    f = np.where(np.isfinite(f) & (cont[ref:ref + dias] >= 4), 1 + 0.5 * (f - 1), 1.0)
+    return np.clip(f, 0.8, 1.25)
+
+
+def _projecao_vacas(animais: list, cur: lactacao.CurvasLactacao, por_vaca: dict,
+                    hoje: datetime.date, dias: int, n: int, rebanho: bool):
+    """Matriz (vacas × dias) projetada, nomes cobertos, secagens/partos no
+    horizonte e a soma das curvas nos dias da janela de calibração.
+
+    Com `rebanho` (a fazenda lança totais do rebanho) projeta todas as
+    lactantes com parto pela curva, sem nível próprio — a calibração é feita
+    depois contra os totais. Sem ele, só as vacas com registros próprios na
+    janela, cada uma no seu nível (real ÷ curva nos mesmos dias)."""
+    datas = np.array([hoje + datetime.timedelta(days=k) for k in range(dias)])
+    passado = np.array([hoje - datetime.timedelta(days=CALIBRACAO - i) for i in range(CALIBRACAO)])
+    reb = cur.parametros("")
+    linhas, cobertos = [], set()
+    secagens = partos = 0
+    nomes, dims_cal, y_cal, idx_cal = [], [], [], []
+    esperado_cal = np.zeros(CALIBRACAO)
+
+    for a in animais:
+        nome = a.get("nome")
+        if not nome:
+            continue
+        status = a.get("status", "")
+        d_parto = reproducao.data(a.get("dt_parto") or a.get("parto"))
+        d_insem = reproducao.data(a.get("dt_insem") or a.get("ins") or a.get("inseminacao"))
+        prev = d_insem + datetime.timedelta(days=reproducao.GESTACAO) if a.get("prenhez") and d_insem else None
+        reg = por_vaca.get(nome, {})
+        projetar = status in _LACTACAO and (d_parto is not None if rebanho else bool(reg))
+        linha = np.zeros(dias)
+        if projetar:
+            cobertos.add(nome)
+            fim = prev - datetime.timedelta(days=reproducao.DIAS_SECAR) if prev else None
+            ativa = np.array([fim is None or d < fim for d in datas])
+            secagens += bool(fim and hoje <= fim < datas[-1])
+            if d_parto:
+                dim = np.array([(d - d_parto).days for d in datas])
+                linha = np.where(ativa, cur.esperado([nome] * dias, dim), 0.0)
+                if rebanho:
+                    esperado_cal += cur.esperado([nome] * CALIBRACAO,
+                                                 [(d - d_parto).days for d in passado])
+                else:
+                    for i, litros in reg.items():
+                        idx_cal.append(len(linhas))
+                        nomes.append(nome)
+                        dims_cal.append((hoje - datetime.timedelta(days=n - i) - d_parto).days)
+                        y_cal.append(litros)
+            else:
+                linha = np.where(ativa, sum(reg.values()) / len(reg), 0.0)
+        pare = bool(prev and hoje <= prev <= datas[-1])
+        if pare:
+            partos += 1
+            t = np.array([(d - prev).days for d in datas])
+            linha = linha + lactacao.wood(t, reb["a"], reb["b"], reb["c"])
+        if projetar or pare:
+            linhas.append(linha)
+
+    M = np.array(linhas) if linhas else np.zeros((0, dias))
+    if idx_cal:
+        idx = np.array(idx_cal)
+        esp = cur.esperado(nomes, dims_cal)
+        real = np.bincount(idx, weights=y_cal, minlength=len(M))
+        curva = np.bincount(idx, weights=esp, minlength=len(M))
+        com_curva = np.zeros(len(M), dtype=bool)
+        com_curva[idx] = True
+        with np.errstate(divide="ignore", invalid="ignore"):
+            nivel = np.where(com_curva & (curva > 0), np.clip(real / curva, 0.5, 2.0), 1.0)
+        M = M * nivel[:, None]
+    return M, cobertos, secagens, partos, esperado_cal
+
+
+def prever(producao: list, animais: list, hoje: datetime.date, dias: int = HORIZONTE,
+           curvas: Optional[lactacao.CurvasLactacao] = None) -> dict:
+    """Previsão diária do rebanho de `hoje` a hoje + dias − 1. `producao` é o
+    histórico (até HISTORICO dias; dias ≥ hoje são ignorados)."""
+    n = HISTORICO
+    ini = hoje - datetime.timedelta(days=n)
+    y, por_vaca = _serie(producao, ini, n)
+    recentes = y[-28:]
+    saida = {"gerado_em": hoje.isoformat(), "dias": [], "total": 0.0, "media_dia": 0.0,
+             "media_recente": round(float(np.nanmean(y[-7:])), 1) if (~np.isnan(y[-7:])).any() else 0.0,
+             "modelo": {"base": "sem_dados"}}
+    if (~np.isnan(recentes)).sum() < MIN_DIAS:
+        return saida
+
+    cur = curvas or lactacao.CurvasLactacao(producao, animais)
+    rebanho = "Rebanho" in por_vaca          # lançamentos do total, sem animal
+    M, cobertos, secagens, partos, esperado_cal = _projecao_vacas(
+        animais, cur, por_vaca, hoje, dias, n, rebanho)
+
+    cal = y[-CALIBRACAO:]
+    ok = ~np.isnan(cal)
+    dias_cal = max(int(ok.sum()), 1)
+    fator, resto = 1.0, 0.0
+    if rebanho and esperado_cal[ok].sum() > 0:
+        # totais do rebanho já contêm as vacas: as curvas dão a forma, os totais o nível
+        fator = float(np.clip(cal[ok].sum() / esperado_cal[ok].sum(), 0.3, 3.0))
+        base = "rebanho"
+    else:
+        # produção sem vaca projetada (totais sem curva, vacas sem cadastro)
+        resto = sum(v for nome, reg in por_vaca.items() if nome not in cobertos
+                    for v in reg.values()) / dias_cal
+        base = "curvas" if cobertos else "media"
+
+    semana, desvio = _efeito_semana(y, ini)
+    sazonal = _efeito_sazonal(y, dias)
+    dia_sem = (hoje.weekday() + np.arange(dias)) % 7
+    litros = (M.sum(axis=0) * fator + resto) * semana[dia_sem]
+    if sazonal is not None:
+        litros = litros * sazonal
+    litros = np.maximum(litros, 0.0)
+    faixa = np.exp(_Z * desvio * np.sqrt(1 + np.arange(dias) / 7))
+
+    saida["dias"] = [{"data": (hoje + datetime.timedelta(days=k)).isoformat(),
+                      "litros": round(float(litros[k]), 1),
+                      "min": round(float(litros[k] / faixa[k]), 1),
+                      "max": round(float(litros[k] * faixa[k]), 1)} for k in range(dias)]
+    saida["total"] = round(float(litros.sum()), 1)
+    saida["media_dia"] = round(float(litros.mean()), 1)
+    saida["modelo"] = {
+        "base":     base,
+        "vacas":    len(cobertos),
+        "secagens": secagens,
+        "partos":   partos,
+        "fator":    round(fator, 3),
+        "resto":    round(resto, 1),
+        "semana":   [round(float(f), 3) for f in semana],
+        "sazonal":  sazonal is not None,
+        "desvio":   round(desvio, 3),
+    }
+    return saida
+
+
+def resumo(prev: Optional[dict], dias: int = 7) -> Optional[dict]:
+    """Total, média e faixa dos primeiros `dias` dias (None sem previsão)."""
+    if not prev or not prev.get("dias"):
+        return None
+    d = prev["dias"][:dias]
+    return {"dias": len(d), "total": round(sum(x["litros"] for x in d), 1),
+            "media_dia": round(sum(x["litros"] for x in d) / len(d), 1),
+            "min": round(sum(x["min"] for x in d), 1), "max": round(sum(x["max"] for x in d), 1)}
+
+
+# ─── CACHE POR FAZENDA ────────────────────────────────────────────────────────
+_MEMO: dict = {}    # fazenda_id → (dia, previsão)
+_LOCK = threading.Lock()
+_M = {"calculadas": 0, "memoria": 0, "disco": 0}
+
+
+def guardar(fazenda_id: str, dia: str, prev: dict) -> dict:
+    with _LOCK:
+        _MEMO[fazenda_id] = (dia, prev)
+    CACHE.gravar(f"prev:{fazenda_id}:{dia}", json.dumps(prev).encode())
+    return prev
+
+
+def em_cache(fazenda_id: str, dia: str) -> Optional[dict]:
+    """Previsão do dia já calculada (memória → disco), sem consultar a base."""
+    with _LOCK:
+        e = _MEMO.get(fazenda_id)
+    if e and e[0] == dia:
+        _M["memoria"] += 1
+        return e[1]
+    bruto = CACHE.obter(f"prev:{fazenda_id}:{dia}")
+    if bruto is None:
+        return None
+    try:
+        prev = json.loads(bruto)
+    except ValueError:
+        return None
+    _M["disco"] += 1
+    with _LOCK:
+        _MEMO[fazenda_id] = (dia, prev)
+    return prev
+
+
+def previsao(fazenda_id: str, carregar: Callable[[], tuple],
+             hoje: Optional[datetime.date] = None, recalcular: bool = False) -> dict:
+    """Previsão do dia da fazenda: do cache ou calculada agora. `carregar()`
+    devolve (produção dos últimos HISTORICO dias, animais)."""
+    hoje = hoje or datetime.date.today()
+    dia = hoje.isoformat()
+    if not recalcular:
+        prev = em_cache(fazenda_id, dia)
+        if prev is not None:
+            return prev
+    producao, animais = carregar()
+    _M["calculadas"] += 1
+    return guardar(fazenda_id, dia, prever(producao, animais, hoje))
+
+
+def metricas() -> dict:
+    with _LOCK:
+        return {**_M, "fazendas": len(_MEMO), "arquivos": CACHE.metricas()}
@@ -0,0 +1,111 @@
+"""
+MilkShow — Retrato colunar do rebanho
+A lista de animais vira colunas NumPy uma vez por versão dos dados: datas
+(inseminação, parto, nascimento) em datetime64[D] com NaT para vazio/inválido,
+status como categoria (código int8) e prenhez/colostro como booleanos.
+Consultas de alerta, agenda e contexto ("lactantes com DIM > 60 sem
+inseminação") viram máscaras vetorizadas — nenhum strptime por animal a cada
+pedido.
+"""
+
+import re
+from typing import Optional
+
+import numpy as np
+
+# Categorias conhecidas primeiro (códigos estáveis); status novos entram no fim
+STATUS = ("Lactação", "Seca", "Novilha", "Bezerro", "Touro", "Vendido", "Morto")
+REPRODUTIVOS = ("Lactação", "Seca")
+
+_RE_DATA = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_NAT = np.datetime64("NaT", "D")
+
+
+def _datas(valores: list) -> np.ndarray:
+    """'YYYY-MM-DD...' → datetime64[D]; vazio ou inválido vira NaT."""
+    txt = [str(v)[:10] if v else "" for v in valores]
+    try:
+        return np.array([t if _RE_DATA.match(t) else "NaT" for t in txt], dtype="datetime64[D]")
+    except ValueError:                   # formato certo, data impossível (2026-02-30)
+        saida = np.full(len(txt), _NAT)
+        for i, t in enumerate(txt):
+            try:
+                saida[i] = np.datetime64(t, "D") if _RE_DATA.match(t) else _NAT
+            except ValueError:
+                pass
+        return saida
+
+
+class Rebanho:
+    """Colunas do rebanho de uma fazenda (um elemento por animal)."""
+
+    def __init__(self, animais: list):
+        self.nome = np.array([a.get("nome") or "?" for a in animais], dtype=object)
+        self.id   = np.array([a.get("id") or a.get("nome") or "" for a in animais], dtype=object)
+        status    = [a.get("status") or "" for a in animais]
+        self.categorias = STATUS + tuple(sorted(set(status) - set(STATUS)))
+        codigo = {s: i for i, s in enumerate(self.categorias)}
+        self.status   = np.array([codigo[s] for s in status], dtype=np.int8)
+        self.prenhez  = np.array([bool(a.get("prenhez")) for a in animais], dtype=bool)
+        self.colostro = np.array([bool(a.get("colostro")) for a in animais], dtype=bool)
+        self.dt_insem = _datas([a.get("dt_insem") or a.get("ins") or a.get("inseminacao")
+                                for a in animais])
+        self.dt_parto = _datas([a.get("dt_parto") or a.get("parto") for a in animais])
+        self.nasc     = _datas([a.get("nasc") for a in animais])
+
+    def __len__(self):
+        return len(self.nome)
+
+    # ── colunas derivadas ────────────────────
+    def com_status(self, *status: str) -> np.ndarray:
+        codigos = [self.categorias.index(s) for s in status if s in self.categorias]
+        return np.isin(self.status, codigos)
+
+    @staticmethod
+    def dias_desde(coluna: np.ndarray, hoje) -> np.ndarray:
+        """Dias de `coluna` até `hoje` (float; NaN onde a data é NaT)."""
+        dias = (np.datetime64(hoje, "D") - coluna).astype("timedelta64[D]").astype(np.int64)
+        return np.where(np.isnat(coluna), np.nan, dias.astype(float))
+
+    def dim(self, hoje) -> np.ndarray:
+        """DIM — dias em lactação, desde o último parto."""
+        return self.dias_desde(self.dt_parto, hoje)
+
+    # ── consultas ────────────────────────────
+    def filtrar(self, hoje=None, status=None, prenhe: Optional[bool] = None,
+                inseminada: Optional[bool] = None, dim_min: float = None,
+                dim_max: float = None) -> np.ndarray:
+        """Máscara booleana com todos os critérios informados (E lógico).
+        Limites de DIM são inclusivos; animal sem parto não passa em filtro de DIM."""
+        m = np.ones(len(self), dtype=bool)
+        if status:
+            m &= self.com_status(*((status,) if isinstance(status, str) else status))
+        if prenhe is not None:
+            m &= self.prenhez == prenhe
+        if inseminada is not None:
+            m &= ~np.isnat(self.dt_insem) == inseminada
+        if dim_min is not None or dim_max is not None:
+            d = self.dim(hoje)
+            with np.errstate(invalid="ignore"):
+                if dim_min is not None:
+                    m &= d >= dim_min
+                if dim_max is not None:
+                    m &= d <= dim_max
+        return m
+
+    def vazias(self, hoje, dim_min: float, dim_max: float = None,
+               status=REPRODUTIVOS) -> np.ndarray:
+        """Não prenhes e sem inseminação com DIM no intervalo."""
+        return self.filtrar(hoje, status=status, prenhe=False, inseminada=False,
+                            dim_min=dim_min, dim_max=dim_max)
+
+    def nomes(self, mascara: np.ndarray) -> list:
+        return self.nome[mascara].tolist()
+
+    def linhas(self, mascara: np.ndarray, hoje=None) -> list:
+        """[{nome, id, dim}] dos animais da máscara (dim só com `hoje`)."""
+        idx = np.flatnonzero(mascara)
+        dias = self.dim(hoje)[idx] if hoje is not None else None
+        return [{"nome": self.nome[i], "id": self.id[i],
+                 "dim": (None if dias is None or np.isnan(dias[k]) else int(dias[k]))}
+                for k, i in enumerate(idx)]
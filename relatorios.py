@@ -0,0 +1,751 @@
+"""
+MilkShow — Relatórios
+Motor único de relatórios em PDF, usado pela API, pelo bot e pelo app legado:
+coleta (Firestore → dict simples) separada do layout (dict → PDF), página
+padrão MilkShow montada uma vez por processo e renderização num pool de
+processos — o lote mensal renderiza várias fazendas em paralelo.
+
+Cache de artefatos endereçado por conteúdo: a chave é (fazenda_id, mês,
+versão dos dados), onde a versão é o SHA-256 dos dados usados no relatório.
+Mesmo dado → mesmo PDF, sem renderizar de novo; meses fechados praticamente
+nunca mudam e ficam no disco até o despejo LRU.
+"""
+
+import calendar
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cache_disco import CacheDisco
+
+log = logging.getLogger("milkshow_bot")
+
+CACHE_PDF = CacheDisco(
+    "relatorios",
+    max_bytes=int(os.environ.get("CACHE_RELATORIOS_MB", "200")) * 1024 * 1024,
+)
+
+# Namespace do relatório mensal no cache — o mesmo PDF serve API e WhatsApp
+NS_MENSAL = "mensal"
+
+# Textos pré-gerados pelo lote (scripts/gerar_relatorios.py): semanal, ranking.
+# Chaveados pela data de envio: o lote pode rodar na véspera (até 24h antes do
+# disparo das 6h) e o disparo pode ser recuperado até 6h depois.
+CACHE_TEXTO = CacheDisco(
+    "textos",
+    max_bytes=20 * 1024 * 1024,
+    ttl_s=float(os.environ.get("CACHE_TEXTOS_TTL_H", "30")) * 3600,
+)
+
+# Atalho sem consultar o Firestore: (ns, fazenda, mês) → versão já calculada,
+# válida enquanto o contador de escritas da fazenda (mobile_api.versao_fazenda)
+# não mudar. O TTL cobre escritas que não passam pelo notify_update (app legado).
+_MEMO: dict = {}    # (ns, fid, mes) → {"marca": int, "versao": str, "filename": str, "ts": float}
+_MEMO_LOCK = threading.Lock()
+_MEMO_TTL_MES_ATUAL = 600       # 10 min
+_MEMO_TTL_MES_FECHADO = 86400   # 24 h
+
+
+def versao_dados(*partes) -> str:
+    """Hash estável (SHA-256) dos dados que alimentam um relatório."""
+    bruto = json.dumps(partes, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+def etag(versao: str) -> str:
+    return f'"{versao[:32]}"'
+
+
+def mes_fechado(mes: str, hoje: Optional[datetime.date] = None) -> bool:
+    """True se 'YYYY-MM' é anterior ao mês corrente."""
+    hoje = hoje or datetime.date.today()
+    return mes < f"{hoje.year:04d}-{hoje.month:02d}"
+
+
+def _chave(ns: str, fazenda_id: str, mes: str, versao: str) -> str:
+    return f"pdf:{ns}:{fazenda_id}:{mes}:{versao}"
+
+
+def memorizar(ns: str, fazenda_id: str, mes: str, marca: int, versao: str, filename: str = ""):
+    with _MEMO_LOCK:
+        _MEMO[(ns, fazenda_id, mes)] = {"marca": marca, "versao": versao,
+                                        "filename": filename, "ts": time.time()}
+
+
+def memorizado(ns: str, fazenda_id: str, mes: str, marca: int) -> Optional[dict]:
+    """Versão conhecida do relatório se nada foi escrito na fazenda desde então."""
+    with _MEMO_LOCK:
+        ent = _MEMO.get((ns, fazenda_id, mes))
+    if not ent or ent["marca"] != marca:
+        return None
+    ttl = _MEMO_TTL_MES_FECHADO if mes_fechado(mes) else _MEMO_TTL_MES_ATUAL
+    if time.time() - ent["ts"] > ttl:
+        return None
+    return ent
+
+
+def pdf_em_cache(ns: str, fazenda_id: str, mes: str, versao: str) -> Optional[bytes]:
+    return CACHE_PDF.obter(_chave(ns, fazenda_id, mes, versao))
+
+
+def caminho_pdf(ns: str, fazenda_id: str, mes: str, versao: str) -> Optional[str]:
+    return CACHE_PDF.caminho(_chave(ns, fazenda_id, mes, versao))
+
+
+def guardar_pdf(ns: str, fazenda_id: str, mes: str, versao: str, pdf: bytes) -> str:
+    return CACHE_PDF.gravar(_chave(ns, fazenda_id, mes, versao), bytes(pdf))
+
+
+def guardar_texto(tipo: str, fazenda_id: str, dia: str, texto: str) -> str:
+    """Grava o texto do envio de `dia` (data do disparo, não da geração)."""
+    return CACHE_TEXTO.gravar(f"txt:{tipo}:{fazenda_id}:{dia}", texto.encode())
+
+
+def texto_em_cache(tipo: str, fazenda_id: str, dia: str) -> Optional[str]:
+    bruto = CACHE_TEXTO.obter(f"txt:{tipo}:{fazenda_id}:{dia}")
+    return bruto.decode() if bruto is not None else None
+
+
+def obter_pdf(ns: str, fazenda_id: str, mes: str, versao: str,
+              renderizar: Callable[[], bytes]) -> Tuple[bytes, bool]:
+    """(pdf, veio_do_cache). Renderiza e grava só se a versão ainda não existe."""
+    pdf = pdf_em_cache(ns, fazenda_id, mes, versao)
+    if pdf is not None:
+        return pdf, True
+    pdf = bytes(renderizar())
+    guardar_pdf(ns, fazenda_id, mes, versao, pdf)
+    return pdf, False
+
+
+# ─── COLETA ───────────────────────────────────────────────────────────────────
+# Tudo o que o layout precisa, como dict simples (vai por pickle ao processo
+# que renderiza). Nenhuma chamada ao Firestore acontece durante o layout.
+
+MESES_PT = ["", "Janeiro", "Fevereiro", "Marco", "Abril", "Maio", "Junho",
+            "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+
+
+def _eh_receita(f: dict) -> bool:
+    return "Venda" in (f.get("cat") or f.get("categoria", ""))
+
+
+def kpis_mensal(ano: int, m: int, fin_docs: list, prod_docs: list, animais: list) -> dict:
+    """Indicadores do relatório mensal a partir dos documentos do mês."""
+    total_prod   = sum(p.get("leite", 0) for p in prod_docs)
+    dias_no_mes  = calendar.monthrange(ano, m)[1]
+    total_rec    = sum(f.get("valor", 0) for f in fin_docs if _eh_receita(f))
+    total_desp   = sum(f.get("valor", 0) for f in fin_docs if not _eh_receita(f))
+    custo_litro  = round(total_desp / total_prod, 2) if total_prod > 0 else 0.0
+    preco_litro  = round(total_rec  / total_prod, 2) if total_prod > 0 else 0.0
+
+    por_animal: dict = {}
+    for p in prod_docs:
+        n = p.get("nome_animal") or p.get("id_animal") or "?"
+        por_animal[n] = por_animal.get(n, 0) + p.get("leite", 0)
+
+    por_cat: dict = {}
+    for f in fin_docs:
+        if _eh_receita(f):
+            continue
+        cat = f.get("cat") or f.get("categoria") or "Outros"
+        por_cat[cat] = por_cat.get(cat, 0) + f.get("valor", 0)
+
+    return {
+        "total_prod":   total_prod,
+        "media_dia":    round(total_prod / dias_no_mes, 1) if dias_no_mes else 0,
+        "vacas_lact":   len([a for a in animais if a.get("status", "") in ("Lactacao", "Lactação")]),
+        "n_registros":  len(prod_docs),
+        "total_rec":    total_rec,
+        "total_desp":   total_desp,
+        "saldo":        total_rec - total_desp,
+        "custo_litro":  custo_litro,
+        "preco_litro":  preco_litro,
+        "margem_litro": round(preco_litro - custo_litro, 2),
+        "top_animais":  sorted(por_animal.items(), key=lambda x: -x[1])[:8],
+        "desp_cats":    sorted(por_cat.items(), key=lambda x: -x[1])[:8],
+    }
+
+
+def nome_arquivo_mensal(nome_fazenda: str, mes: str) -> str:
+    return (f"MilkShow_{nome_fazenda.replace(' ', '_')}_{mes.replace('-', '')}.pdf"
+            .encode("latin-1", errors="replace").decode("latin-1"))
+
+
+def coletar_mensal(coll: Callable, db, fazenda_id: str, mes: str,
+                   hoje: Optional[datetime.date] = None) -> dict:
+    """Dados do relatório mensal ('YYYY-MM'). `coll(fid, nome)` resolve a coleção
+    da fazenda (o _coll da API/bot)."""
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    hoje   = hoje or datetime.date.today()
+    ano, m = int(mes[:4]), int(mes[5:7])
+    ini_mes = f"{ano:04d}-{m:02d}-01"
+    fim_mes = f"{ano+1:04d}-01-01" if m == 12 else f"{ano:04d}-{m+1:02d}-01"
+
+    # Nome da fazenda: config > fazendas doc > fid
+    nome_fazenda = fazenda_id
+    cfg_doc = coll(fazenda_id, "config").document("principal").get()
+    if cfg_doc.exists:
+        nome_fazenda = cfg_doc.to_dict().get("nome_fazenda") or fazenda_id
+    else:
+        faz_doc = db.collection("fazendas").document(fazenda_id).get()
+        if faz_doc.exists:
+            nome_fazenda = faz_doc.to_dict().get("nome") or fazenda_id
+
+    def _do_mes(nome: str) -> list:
+        return [d.to_dict() for d in coll(fazenda_id, nome)
+                .where(filter=FieldFilter("data", ">=", ini_mes))
+                .where(filter=FieldFilter("data", "<", fim_mes)).stream()]
+
+    fin_docs  = _do_mes("financeiro")
+    prod_docs = _do_mes("producao")
+    animais   = [d.to_dict() for d in coll(fazenda_id, "animais").stream()]
+
+    dados = {
+        "fazenda_id":   fazenda_id,
+        "mes":          mes,
+        "mes_label":    f"{MESES_PT[m]} / {ano}",
+        "nome_fazenda": nome_fazenda,
+        "gerado_em":    hoje.strftime("%d/%m/%Y"),
+        "filename":     nome_arquivo_mensal(nome_fazenda, mes),
+        **kpis_mensal(ano, m, fin_docs, prod_docs, animais),
+    }
+    dados["previsao"] = _previsao_do_mes(fazenda_id, mes, hoje)
+    extra = [dados["previsao"]] if dados["previsao"] else []
+    dados["versao"] = versao_dados(nome_fazenda, mes, fin_docs, prod_docs, dados["vacas_lact"], *extra)
+    return dados
+
+
+def _previsao_do_mes(fazenda_id: str, mes: str, hoje: datetime.date) -> Optional[dict]:
+    """Resumo da previsão dos próximos 30 dias, se o mês do relatório acabou de
+    fechar (envio do dia 1). Lida do cache: a tarefa "previsao" do agendador
+    (5h) grava a de hoje e o job mensal calcula a que faltar antes do lote."""
+    ant = hoje.replace(day=1) - datetime.timedelta(days=1)
+    if mes != ant.strftime("%Y-%m"):
+        return None
+    try:
+        import previsao
+        return previsao.resumo(previsao.em_cache(fazenda_id, hoje.isoformat()), 30)
+    except Exception as e:
+        log.warning(f"previsão no relatório mensal {fazenda_id}: {e}")
+        return None
+
+
+# ─── LAYOUT ───────────────────────────────────────────────────────────────────
+# Design tokens
+C_GREEN_DARK  = (22,  101, 52)
+C_GREEN_MED   = (34,  139, 70)
+C_GREEN_LIGHT = (220, 242, 228)
+C_GREEN_PALE  = (240, 253, 244)
+C_BLUE        = (37,  99,  235)
+C_BLUE_LIGHT  = (219, 234, 254)
+C_RED         = (185, 28,  28)
+C_RED_LIGHT   = (254, 226, 226)
+C_AMBER       = (180, 83,  9)
+C_AMBER_LIGHT = (254, 243, 199)
+C_GRAY_900    = (17,  24,  39)
+C_GRAY_600    = (75,  85,  99)
+C_GRAY_400    = (156, 163, 175)
+C_GRAY_100    = (243, 244, 246)
+C_WHITE       = (255, 255, 255)
+C_BORDER      = (209, 213, 219)
+
+# margens e largura útil
+ML = 12   # margin left
+MR = 12   # margin right
+W  = 210 - ML - MR   # 186mm útil
+GAP = 3
+
+
+def _s(t) -> str:
+    """Texto seguro para Helvetica (Latin-1)."""
+    return (str(t)
+            .replace("\u2014", "-").replace("\u2013", "-")
+            .replace("\u2019", "'").replace("\u2018", "'")
+            .replace("\u201c", '"').replace("\u201d", '"')
+            .replace("\u2022", "*").replace("\u00b7", ".")
+            .encode("latin-1", errors="replace").decode("latin-1"))
+
+
+def brl(v: float, sign=False) -> str:
+    s = f"{abs(v):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    prefix = "R$ " if not sign else ("+ R$ " if v >= 0 else "- R$ ")
+    return _s(prefix + s)
+
+
+@functools.lru_cache(maxsize=None)
+def _modelo_pagina():
+    """Classe da página padrão MilkShow (cabeçalho, rodapé e blocos de layout).
+    Montada uma vez por processo: o import do fpdf e a criação da classe saem
+    do caminho de cada relatório."""
+    from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
+
+    class PaginaMilkShow(FPDF):
+        titulo    = ""    # à direita no cabeçalho (mês, nome do relatório)
+        subtitulo = ""    # abaixo do logo (nome da fazenda)
+        gerado_em = ""
+        rodape    = ""
+
+        def header(self):
+            # Fundo escuro header + faixa accent
+            self.set_fill_color(*C_GREEN_DARK)
+            self.rect(0, 0, 210, 32, style="F")
+            self.set_fill_color(*C_GREEN_MED)
+            self.rect(0, 32, 210, 2, style="F")
+            self.set_xy(ML, 6)
+            self.set_font("Helvetica", "B", 18)
+            self.set_text_color(*C_WHITE)
+            self.cell(90, 9, "MilkShow", new_x=XPos.RIGHT, new_y=YPos.TOP)
+            self.set_font("Helvetica", "B", 11)
+            self.set_text_color(180, 230, 190)
+            self.set_xy(ML + 90, 7)
+            self.cell(W - 90, 8, _s(self.titulo), align="R",
+                      new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_xy(ML, 17)
+            self.set_font("Helvetica", "", 9)
+            self.set_text_color(180, 220, 190)
+            self.cell(W/2, 6, _s(self.subtitulo), new_x=XPos.RIGHT, new_y=YPos.TOP)
+            if self.gerado_em:
+                self.set_font("Helvetica", "", 8)
+                self.set_text_color(150, 200, 160)
+                self.set_xy(ML + W/2, 18)
+                self.cell(W/2, 5, f"Gerado em {self.gerado_em}", align="R",
+                          new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_text_color(*C_GRAY_900)
+            self.set_y(38)
+
+        def footer(self):
+            self.set_y(-13)
+            self.set_fill_color(*C_GRAY_100)
+            self.rect(0, self.get_y(), 210, 13, style="F")
+            self.set_font("Helvetica", "", 8)
+            self.set_text_color(*C_GRAY_400)
+            self.cell(0, 13, _s(f"{self.rodape}  |  Pag. {self.page_no()}"), align="C")
+
+        # ── blocos de layout ───────────────────────────────────
+        def secao(self, titulo: str):
+            self.ln(4)
+            y = self.get_y()
+            self.set_fill_color(*C_GREEN_LIGHT)
+            self.rect(ML, y, W, 8, style="F")
+            self.set_fill_color(*C_GREEN_MED)
+            self.rect(ML, y, 3, 8, style="F")
+            self.set_xy(ML + 5, y)
+            self.set_font("Helvetica", "B", 9)
+            self.set_text_color(*C_GREEN_DARK)
+            self.cell(W - 5, 8, _s(titulo), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_text_color(*C_GRAY_900)
+            self.ln(2)
+
+        def kpi_card(self, x, y, w, h, label, value, unit="", bg=C_WHITE, val_color=None):
+            """Card KPI com borda."""
+            self.set_fill_color(*bg)
+            self.set_draw_color(*C_BORDER)
+            self.rect(x, y, w, h, style="FD")
+            self.set_xy(x + 2, y + 2)
+            self.set_font("Helvetica", "", 7)
+            self.set_text_color(*C_GRAY_400)
+            self.cell(w - 4, 4, _s(label.upper()), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_xy(x + 2, y + 7)
+            self.set_font("Helvetica", "B", 14)
+            self.set_text_color(*(val_color or C_GRAY_900))
+            self.cell(w - 4, 8, _s(str(value)), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            if unit:
+                self.set_xy(x + 2, y + h - 5)
+                self.set_font("Helvetica", "", 7)
+                self.set_text_color(*C_GRAY_400)
+                self.cell(w - 4, 4, _s(unit))
+            self.set_text_color(*C_GRAY_900)
+            self.set_draw_color(0, 0, 0)
+
+        def linha_cards(self, cards: list, h: float = 22):
+            """Fileira de cards [(label, valor, unidade, bg, cor)] na largura útil."""
+            y0 = self.get_y()
+            cw = (W - GAP * (len(cards) - 1)) / len(cards)
+            for i, (label, valor, unidade, bg, cor) in enumerate(cards):
+                self.kpi_card(ML + (cw + GAP) * i, y0, cw, h, label, valor, unidade, bg, cor)
+            self.set_y(y0 + h + 4)
+
+        def barra(self, label, value, max_val, suffix="", color=C_GREEN_MED, show_val=""):
+            """Linha com barra horizontal proporcional."""
+            y = self.get_y()
+            if y > 265:
+                self.add_page()
+                y = self.get_y()
+            BAR_X   = ML + 38
+            BAR_W   = 95
+            bar_pct = min(value / max_val, 1.0) if max_val > 0 else 0
+            self.set_xy(ML, y)
+            self.set_font("Helvetica", "", 8)
+            self.set_text_color(*C_GRAY_600)
+            self.cell(36, 6, _s(label[:18]), new_x=XPos.RIGHT, new_y=YPos.TOP)
+            self.set_fill_color(*C_GRAY_100)
+            self.rect(BAR_X, y + 1.5, BAR_W, 3.5, style="F")
+            if bar_pct > 0:
+                self.set_fill_color(*color)
+                self.rect(BAR_X, y + 1.5, BAR_W * bar_pct, 3.5, style="F")
+            self.set_xy(BAR_X + BAR_W + 2, y)
+            self.set_font("Helvetica", "B", 8)
+            self.set_text_color(*C_GRAY_900)
+            self.cell(18, 6, _s(suffix), new_x=XPos.RIGHT, new_y=YPos.TOP)
+            self.set_xy(BAR_X + BAR_W + 22, y)
+            self.set_font("Helvetica", "", 8)
+            self.set_text_color(*C_GRAY_600)
+            self.cell(W - BAR_W - 60, 6, _s(show_val), align="R",
+                      new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_text_color(*C_GRAY_900)
+
+        def caixa(self, rotulo: str, texto: str, bg, cor):
+            """Caixa de destaque com faixa lateral (análise, avisos)."""
+            ya = self.get_y()
+            self.set_fill_color(*bg)
+            self.set_draw_color(*cor)
+            self.rect(ML, ya, W, 14, style="FD")
+            self.set_fill_color(*cor)
+            self.rect(ML, ya, 3, 14, style="F")
+            self.set_xy(ML + 6, ya + 2)
+            self.set_font("Helvetica", "B", 8)
+            self.set_text_color(*cor)
+            self.cell(30, 5, _s(rotulo), new_x=XPos.RIGHT, new_y=YPos.TOP)
+            self.set_font("Helvetica", "", 8)
+            self.set_text_color(*C_GRAY_600)
+            self.set_xy(ML + 6 + 31, ya + 2)
+            self.multi_cell(W - 40, 5, _s(texto))
+            self.set_draw_color(0, 0, 0)
+            self.set_text_color(*C_GRAY_900)
+
+        def linha_kv(self, label, valor, destaque=False):
+            self.set_font("Helvetica", "B" if destaque else "", 9)
+            self.set_text_color(*(C_GRAY_900 if destaque else C_GRAY_600))
+            self.cell(80, 6, _s(label), border="B")
+            self.cell(W - 80, 6, _s(valor), border="B", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_text_color(*C_GRAY_900)
+
+        def tabela(self, colunas: list, linhas: list):
+            col_w = min(W // max(len(colunas), 1), 40)
+            self.set_font("Helvetica", "B", 8)
+            self.set_fill_color(*C_GREEN_DARK)
+            self.set_text_color(*C_WHITE)
+            for col in colunas:
+                self.cell(col_w, 7, _s(col)[:18], border=1, fill=True)
+            self.ln()
+            self.set_font("Helvetica", "", 8)
+            self.set_text_color(*C_GRAY_900)
+            for linha in linhas:
+                for val in linha:
+                    self.cell(col_w, 6, _s(val)[:18], border=1)
+                self.ln()
+
+    return PaginaMilkShow
+
+
+def _nova_pagina(titulo: str, subtitulo: str, rodape: str, gerado_em: str = ""):
+    pdf = _modelo_pagina()()
+    pdf.titulo, pdf.subtitulo, pdf.rodape, pdf.gerado_em = titulo, subtitulo, rodape, gerado_em
+    pdf.set_margins(ML, 10, MR)
+    pdf.set_auto_page_break(auto=True, margin=18)
+    pdf.add_page()
+    return pdf
+
+
+def renderizar_mensal(d: dict) -> bytes:
+    """Relatório mensal: KPI cards, barras e análise de margem."""
+    pdf = _nova_pagina(d["mes_label"], d["nome_fazenda"],
+                       f"MilkShow  |  {d['nome_fazenda']}  |  {d['mes_label']}", d["gerado_em"])
+    total_prod, total_desp = d["total_prod"], d["total_desp"]
+    saldo, margem = d["saldo"], d["margem_litro"]
+
+    pdf.secao("PRODUCAO DE LEITE")
+    pdf.linha_cards([
+        ("Total do Mes",      f"{total_prod:,.0f}".replace(",", "."), "litros",
+         C_GREEN_PALE, C_GREEN_DARK),
+        ("Media Diaria",      f"{d['media_dia']:.1f}", "L / dia", C_BLUE_LIGHT, C_BLUE),
+        ("Vacas em Lactacao", str(d["vacas_lact"]), "animais", C_GREEN_PALE, C_GREEN_MED),
+        ("Registros",         str(d["n_registros"]), "lancamentos", C_GRAY_100, C_GRAY_600),
+    ])
+
+    if d["top_animais"]:
+        pdf.secao("TOP ANIMAIS - PRODUCAO DO MES")
+        max_anim = d["top_animais"][0][1]
+        for nome_a, litros in d["top_animais"]:
+            pct = litros / total_prod * 100 if total_prod > 0 else 0
+            pdf.barra(nome_a, litros, max_anim, f"{pct:.1f}%", C_GREEN_MED,
+                      f"{litros:,.0f} L".replace(",", "."))
+
+    prev = d.get("previsao")
+    if prev:
+        pdf.secao(f"PREVISAO - PROXIMOS {prev['dias']} DIAS")
+        pdf.linha_cards([
+            ("Producao Prevista", f"{prev['total']:,.0f}".replace(",", "."), "litros",
+             C_BLUE_LIGHT, C_BLUE),
+            ("Media Diaria", f"{prev['media_dia']:.1f}", "L / dia", C_BLUE_LIGHT, C_BLUE),
+            ("Faixa", f"{prev['min']:,.0f} - {prev['max']:,.0f}".replace(",", "."), "litros",
+             C_GRAY_100, C_GRAY_600),
+        ])
+
+    pdf.secao("RESUMO FINANCEIRO")
+    pdf.linha_cards([
+        ("Receitas (Venda de Leite)", brl(d["total_rec"]), "", C_GREEN_PALE, C_GREEN_DARK),
+        ("Despesas Totais",           brl(total_desp),     "", C_RED_LIGHT,  C_RED),
+        ("Saldo do Mes",              brl(saldo),          "",
+         C_GREEN_PALE if saldo >= 0 else C_RED_LIGHT, C_GREEN_DARK if saldo >= 0 else C_RED),
+    ])
+
+    if d["desp_cats"]:
+        pdf.secao("DESPESAS POR CATEGORIA")
+        max_cat = d["desp_cats"][0][1]
+        for cat, val in d["desp_cats"]:
+            pct = val / total_desp * 100 if total_desp > 0 else 0
+            pdf.barra(cat, val, max_cat, f"{pct:.1f}%", C_RED, brl(val))
+
+    pdf.secao("CUSTO POR LITRO - KPI MENSAL")
+    pdf.linha_cards([
+        ("Custo / Litro",          f"R$ {d['custo_litro']:.2f}", "despesas / producao",
+         C_RED_LIGHT, C_RED),
+        ("Preco Recebido / Litro", f"R$ {d['preco_litro']:.2f}", "receita / producao",
+         C_BLUE_LIGHT, C_BLUE),
+        ("Margem / Litro",         f"R$ {margem:+.2f}", "preco - custo",
+         C_GREEN_PALE if margem >= 0 else C_AMBER_LIGHT, C_GREEN_DARK if margem >= 0 else C_AMBER),
+    ])
+
+    pdf.ln(4)
+    if margem >= 0:
+        pdf.caixa("Resultado positivo:",
+                  f"Margem de R$ {margem:.2f}/L. "
+                  f"A cada 1.000 litros, a fazenda gerou R$ {margem*1000:.2f} de lucro.",
+                  C_GREEN_PALE, C_GREEN_DARK)
+    else:
+        pdf.caixa("Atencao:",
+                  f"Margem negativa de R$ {margem:.2f}/L. "
+                  f"As despesas superaram as receitas em R$ {abs(saldo):.2f} no mes. "
+                  f"Revise as categorias de maior impacto.",
+                  C_AMBER_LIGHT, C_AMBER)
+    return bytes(pdf.output())
+
+
+def renderizar_gerencial(d: dict) -> bytes:
+    """Relatório gerencial do app legado: score, rebanho, produção, caixa e alertas."""
+    pdf = _nova_pagina("Relatorio Gerencial", d["nome_fazenda"],
+                       f"MilkShow  |  {d['nome_fazenda']}  |  gestaodeleite.app", d["gerado_em"])
+
+    pdf.secao("SCORE DE SAUDE DO REBANHO")
+    pdf.linha_kv("Score Geral", f"{d['score']} / 100 - {d['score_label']}", destaque=True)
+    pdf.linha_kv("Alertas Criticos", d["alertas_criticos"])
+    pdf.linha_kv("Alertas de Atencao", d["alertas_atencao"])
+
+    pdf.secao("REBANHO")
+    pdf.linha_kv("Total de Animais", d["total_animais"])
+    for status, qtd in d["status_count"]:
+        pdf.linha_kv(f"  * {status}", qtd)
+
+    pdf.secao("PRODUCAO")
+    pdf.linha_kv("Producao Hoje", f"{d['prod_hoje']:.1f} L")
+    pdf.linha_kv("Producao Ultimos 30 dias", f"{d['prod_30d']:.1f} L")
+    pdf.linha_kv("Media Diaria (30d)", f"{d['prod_30d']/30:.1f} L/dia")
+
+    pdf.secao("FINANCEIRO")
+    pdf.linha_kv("Receitas Totais", brl(d["rec"]))
+    pdf.linha_kv("Despesas Totais", brl(d["desp"]))
+    pdf.linha_kv("Saldo em Caixa",  brl(d["saldo"]), destaque=True)
+
+    alertas = d["alertas"]
+    if alertas:
+        pdf.secao(f"ALERTAS PENDENTES ({len(alertas)})")
+        pdf.set_font("Helvetica", "", 8)
+        for a in alertas[:15]:
+            icone = "!! " if a["nivel"] == "critico" else " > "
+            pdf.multi_cell(W, 5, _s(f"{icone}{a['msg']} - {a.get('detalhe', '')}"))
+        if len(alertas) > 15:
+            pdf.set_font("Helvetica", "I", 8)
+            pdf.cell(W, 5, f"... e mais {len(alertas)-15} alertas.")
+    return bytes(pdf.output())
+
+
+def renderizar_tabela(d: dict) -> bytes:
+    """Tabela simples: {"titulo", "colunas": [...], "linhas": [[...], ...]}."""
+    pdf = _nova_pagina(d["titulo"], d.get("subtitulo", ""),
+                       f"MilkShow  |  {d['titulo']}", d.get("gerado_em", ""))
+    pdf.tabela(d["colunas"], d["linhas"])
+    return bytes(pdf.output())
+
+
+_RENDERIZADORES: Dict[str, Callable[[dict], bytes]] = {
+    "mensal":     renderizar_mensal,
+    "gerencial":  renderizar_gerencial,
+    "tabela":     renderizar_tabela,
+}
+
+
+# ─── RENDERIZAÇÃO EM PROCESSOS ────────────────────────────────────────────────
+# O fpdf é Python puro e segura o GIL: renderizar em processos separados não
+# trava o event loop e deixa o lote mensal usar todos os núcleos.
+# RELATORIOS_PROCESSOS=0 renderiza no próprio processo.
+_PROCESSOS = int(os.environ.get("RELATORIOS_PROCESSOS", str(min(4, os.cpu_count() or 1))))
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_M_RENDER = {"processo": 0, "local": 0, "falhas_pool": 0, "segundos": 0.0}
+
+
+def _renderizar_medido(tipo: str, dados: dict) -> Tuple[bytes, float]:
+    t0 = time.perf_counter()
+    pdf = _RENDERIZADORES[tipo](dados)
+    return pdf, time.perf_counter() - t0
+
+
+def _pool() -> Optional[ProcessPoolExecutor]:
+    global _POOL
+    if _PROCESSOS <= 0:
+        return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: o processo do servidor tem threads (gRPC do Firestore) — fork não é seguro
+            _POOL = ProcessPoolExecutor(max_workers=_PROCESSOS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def _descartar_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def _contar(onde: str, segundos: float):
+    with _POOL_LOCK:
+        _M_RENDER[onde] += 1
+        _M_RENDER["segundos"] += segundos
+
+
+def _local(tipo: str, dados: dict) -> Tuple[bytes, float]:
+    pdf, dur = _renderizar_medido(tipo, dados)
+    _contar("local", dur)
+    return pdf, dur
+
+
+def renderizar_lote(itens: List[Tuple[str, dict]]) -> list:
+    """Renderiza [(tipo, dados)] em paralelo. Devolve, na mesma ordem,
+    (pdf, segundos) ou a exceção do item que falhou."""
+    pool = _pool() if len(itens) else None
+    if pool is None:
+        out = []
+        for tipo, dados in itens:
+            try:
+                out.append(_local(tipo, dados))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    futs = [pool.submit(_renderizar_medido, tipo, dados) for tipo, dados in itens]
+    out = []
+    for (tipo, dados), fut in zip(itens, futs):
+        try:
+            pdf, dur = fut.result()
+            _contar("processo", dur)
+            out.append((pdf, dur))
+            continue
+        except BrokenProcessPool as e:
+            log.warning(f"[relatorios] pool de processos quebrado, renderizando local: {e}")
+            _descartar_pool()
+            _contar("falhas_pool", 0.0)
+        except Exception as e:
+            log.warning(f"[relatorios] falha ao renderizar {tipo} no pool: {e}")
+            _contar("falhas_pool", 0.0)
+        try:
+            out.append(_local(tipo, dados))
+        except Exception as e:
+            out.append(e)
+    return out
+
+
+def renderizar(tipo: str, dados: dict, em_processo: bool = True) -> bytes:
+    """PDF de um relatório. `em_processo=False` força renderizar aqui mesmo
+    (app legado, scripts)."""
+    if not em_processo:
+        return _local(tipo, dados)[0]
+    res = renderizar_lote([(tipo, dados)])[0]
+    if isinstance(res, Exception):
+        raise res
+    return res[0]
+
+
+# ─── RELATÓRIO MENSAL ─────────────────────────────────────────────────────────
+def pdf_mensal(coll: Callable, db, fazenda_id: str, mes: str,
+               marca: Optional[int] = None) -> Tuple[bytes, str, str]:
+    """(pdf, versao, filename) do relatório mensal: memo → cache em disco →
+    coleta + renderização. `marca` é o contador de escritas da fazenda."""
+    if marca is not None:
+        memo = memorizado(NS_MENSAL, fazenda_id, mes, marca)
+        if memo:
+            pdf = pdf_em_cache(NS_MENSAL, fazenda_id, mes, memo["versao"])
+            if pdf is not None:
+                return pdf, memo["versao"], memo["filename"]
+
+    dados = coletar_mensal(coll, db, fazenda_id, mes)
+    if marca is not None:
+        memorizar(NS_MENSAL, fazenda_id, mes, marca, dados["versao"], dados["filename"])
+    pdf, _ = obter_pdf(NS_MENSAL, fazenda_id, mes, dados["versao"],
+                       lambda: renderizar("mensal", dados))
+    return pdf, dados["versao"], dados["filename"]
+
+
+def pdfs_mensais_lote(coll: Callable, db, fazendas: list, mes: str,
+                      marcas: Optional[Dict[str, int]] = None,
+                      coleta_workers: int = 8) -> Dict[str, dict]:
+    """Relatório mensal de várias fazendas de uma vez: coleta em threads (I/O
+    do Firestore) e renderiza só as versões ausentes do cache, em paralelo nos
+    processos. Os PDFs ficam no cache; devolve {fid: resumo com tempos}."""
+    marcas = marcas or {}
+    res: Dict[str, dict] = {}
+    coletados: List[dict] = []
+
+    def _coletar(fid: str):
+        t0 = time.perf_counter()
+        return coletar_mensal(coll, db, fid, mes), time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=max(1, coleta_workers)) as ex:
+        futs = {ex.submit(_coletar, fid): fid for fid in fazendas}
+        for fut in as_completed(futs):
+            fid = futs[fut]
+            try:
+                dados, dur = fut.result()
+            except Exception as e:
+                res[fid] = {"erro": f"coleta: {e}"}
+                continue
+            res[fid] = {"versao": dados["versao"], "filename": dados["filename"],
+                        "coleta_s": round(dur, 3), "render_s": 0.0, "cache": True}
+            if fid in marcas:
+                memorizar(NS_MENSAL, fid, mes, marcas[fid], dados["versao"], dados["filename"])
+            if caminho_pdf(NS_MENSAL, fid, mes, dados["versao"]) is None:
+                coletados.append(dados)
+
+    for dados, r in zip(coletados, renderizar_lote([("mensal", d) for d in coletados])):
+        fid = dados["fazenda_id"]
+        if isinstance(r, Exception):
+            res[fid] = {**res[fid], "erro": f"render: {r}"}
+            continue
+        pdf, dur = r
+        guardar_pdf(NS_MENSAL, fid, mes, dados["versao"], pdf)
+        res[fid].update(cache=False, render_s=round(dur, 3), bytes=len(pdf))
+    return res
+
+
+def metricas() -> dict:
+    with _POOL_LOCK:
+        render = dict(_M_RENDER)
+    n = render["processo"] + render["local"]
+    render["media_s"] = round(render.pop("segundos") / n, 3) if n else None
+    render["processos"] = _PROCESSOS
+    return {"pdf": CACHE_PDF.metricas(), "textos": CACHE_TEXTO.metricas(),
+            "memo": len(_MEMO), "render": render}
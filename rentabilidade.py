@@ -0,0 +1,205 @@
+"""
+MilkShow — Rentabilidade por animal
+Motor único dos rankings: /ranking e /rankings do app, ranking do WhatsApp,
+seção RENTABILIDADE do contexto da IA, aba de rankings do app legado e
+nutricao.calcular_ranking. Agregação por animal com NumPy (np.unique +
+np.bincount) e um só modelo de custo da fazenda:
+
+  preço do leite  vendas de leite da janela ÷ litros da janela; sem vendas,
+                  config preco_leite; sem config, R$ 2,50
+  ração           kg registrados na ordenha × custo/kg do estoque (custo_medio,
+                  custo_unit ou valor_total/qtd do item de ração; padrão R$ 1,20)
+  veterinário     custo dos registros sanitários do animal na janela
+  rateio          despesas da janela sem animal — fora ração (já contada no
+                  consumo) e compra de animais (capital) — pela parcela de litros
+
+Resultado em cache por (fazenda, janela, versão dos dados).
+"""
+
+import datetime
+import threading
+import time
+import unicodedata
+from typing import Callable
+
+import numpy as np
+
+PRECO_PADRAO       = 2.50
+CUSTO_RACAO_PADRAO = 1.20
+_CHAVES_RACAO      = ("racao", "concentrado", "milho", "silagem")
+_FORA_RATEIO       = ("venda", "receita", "servico", "racao", "nutricao", "compra de anima")
+_TTL_S             = 300
+COLUNAS = ("nome", "id_animal", "litros", "media_dia", "registros", "dias", "racao_kg",
+           "receita", "custo_racao", "custo_vet", "custo_rateio", "custo_total", "margem",
+           "lucro", "custo_litro", "lucro_litro", "margem_pct")
+
+
+def _norm(s) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', str(s or "").lower())
+                   if unicodedata.category(c) != 'Mn')
+
+
+def _cat(f: dict) -> str:
+    return f.get("categoria") or f.get("cat") or ""
+
+
+def _num(v) -> float:
+    try:
+        f = float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return f if f == f else 0.0          # NaN (células vazias do pandas) vira 0
+
+
+# ─── MODELO DE CUSTO ──────────────────────────────────────────────────────────
+def custo_racao_kg(estoque: list) -> float:
+    """Custo/kg da ração pelo primeiro item de ração do estoque com custo."""
+    for e in estoque:
+        if not any(k in _norm(e.get("item")) for k in _CHAVES_RACAO):
+            continue
+        for campo in ("custo_medio", "custo_unit"):
+            if _num(e.get(campo)) > 0:
+                return round(_num(e.get(campo)), 4)
+        if _num(e.get("qtd")) > 0 and _num(e.get("valor_total")) > 0:
+            return round(_num(e.get("valor_total")) / _num(e.get("qtd")), 4)
+    return CUSTO_RACAO_PADRAO
+
+
+def preco_leite(config: dict, financeiro: list, litros: float) -> float:
+    vendas = sum(_num(f.get("valor")) for f in financeiro if _cat(f) == "Venda de Leite")
+    if vendas > 0 and litros > 0:
+        return vendas / litros
+    return _num(config.get("preco_leite")) or PRECO_PADRAO
+
+
+def custos_fixos(financeiro: list) -> float:
+    """Despesas sem animal que entram no rateio por litro."""
+    total = 0.0
+    for f in financeiro:
+        if f.get("animal") or f.get("tipo") == "receita":
+            continue
+        if any(k in _norm(_cat(f)) for k in _FORA_RATEIO):
+            continue
+        total += _num(f.get("valor"))
+    return total
+
+
+# ─── CÁLCULO ──────────────────────────────────────────────────────────────────
+def calcular(producao: list, sanitario: list, financeiro: list, config: dict,
+             estoque: list, dias: int, custo_litro_op: float = 0.0) -> dict:
+    """Rentabilidade por animal já filtrada na janela. `custo_litro_op` soma um
+    custo operacional fixo por litro (usado por nutricao.calcular_ranking).
+    Retorna {"linhas", "producao", "rentabilidade", "alerta_descarte",
+    "margem", "preco_leite", "custo_racao_kg", "custos_fixos"}."""
+    dias = max(int(dias), 1)
+    nomes_p = np.array([p.get("nome_animal") or "Rebanho" for p in producao], dtype=object)
+    leite   = np.array([_num(p.get("leite")) for p in producao], dtype=float)
+    racao   = np.array([_num(p.get("racao")) for p in producao], dtype=float)
+
+    preco = preco_leite(config, financeiro, float(leite.sum()))
+    c_kg  = custo_racao_kg(estoque)
+    fixos = custos_fixos(financeiro)
+    vazio = {"linhas": [], "producao": [], "rentabilidade": [], "alerta_descarte": [],
+             "margem": [], "preco_leite": round(preco, 4), "custo_racao_kg": c_kg,
+             "custos_fixos": round(fixos, 2)}
+    if not len(nomes_p):
+        return vazio
+
+    nomes, inv = np.unique(nomes_p, return_inverse=True)
+    n = len(nomes)
+    litros    = np.bincount(inv, weights=leite, minlength=n)
+    racao_kg  = np.bincount(inv, weights=racao, minlength=n)
+    registros = np.bincount(inv, minlength=n)
+    # dias distintos com registro: pares (animal, data) únicos
+    _, d_inv  = np.unique(np.array([str(p.get("data", ""))[:10] for p in producao], dtype=object),
+                          return_inverse=True)
+    nd        = int(d_inv.max()) + 1
+    dias_dist = np.bincount(np.unique(inv * nd + d_inv) // nd, minlength=n)
+    primeiro_id = {}
+    for i, p in zip(inv, producao):
+        primeiro_id.setdefault(int(i), p.get("id_animal") or "")
+
+    posicao = {nome: k for k, nome in enumerate(nomes)}
+    vet = np.zeros(n)
+    for s in sanitario:
+        k = posicao.get(s.get("nome_animal") or s.get("animal"))
+        if k is not None:
+            vet[k] += _num(s.get("valor") or s.get("custo"))
+
+    total_l     = litros.sum()
+    receita     = litros * preco
+    custo_racao = racao_kg * c_kg
+    rateio      = litros / total_l * fixos if total_l > 0 else np.zeros(n)
+    custo_total = custo_racao + vet + rateio + litros * custo_litro_op
+    margem      = receita - custo_total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        custo_litro = np.where(litros > 0, custo_total / litros, 0.0)
+        margem_pct  = np.where(receita > 0, margem / receita * 100, 0.0)
+
+    linhas = [{
+        "nome":         str(nomes[k]),
+        "id_animal":    primeiro_id.get(k, ""),
+        "litros":       round(float(litros[k]), 1),
+        "media_dia":    round(float(litros[k]) / dias, 1),
+        "registros":    int(registros[k]),
+        "dias":         int(dias_dist[k]),
+        "racao_kg":     round(float(racao_kg[k]), 1),
+        "receita":      round(float(receita[k]), 2),
+        "custo_racao":  round(float(custo_racao[k]), 2),
+        "custo_vet":    round(float(vet[k]), 2),
+        "custo_rateio": round(float(rateio[k]), 2),
+        "custo_total":  round(float(custo_total[k]), 2),
+        "margem":       round(float(margem[k]), 2),
+        "lucro":        round(float(margem[k]), 2),
+        "custo_litro":  round(float(custo_litro[k]), 4),
+        "lucro_litro":  round(preco - float(custo_litro[k]), 4),
+        "margem_pct":   round(float(margem_pct[k]), 1),
+    } for k in np.flatnonzero(litros > 0)]
+
+    return {**vazio, "linhas": linhas,
+            "producao":        sorted(linhas, key=lambda x: x["litros"], reverse=True),
+            "rentabilidade":   sorted(linhas, key=lambda x: x["custo_litro"]),
+            "alerta_descarte": sorted(linhas, key=lambda x: x["margem_pct"]),
+            "margem":          sorted(linhas, key=lambda x: x["margem"], reverse=True)}
+
+
+# ─── CACHE POR FAZENDA ────────────────────────────────────────────────────────
+_CACHE: dict = {}    # (fazenda_id, ini, fim, dias) → (versão do chamador, expira, resultado)
+_LOCK = threading.Lock()
+_M = {"calculos": 0, "reusos": 0}
+
+
+def janela(dias: int, hoje: datetime.date = None) -> tuple:
+    """(ini, fim) ISO dos últimos `dias` dias até hoje."""
+    hoje = hoje or datetime.date.today()
+    return (hoje - datetime.timedelta(days=dias)).isoformat(), hoje.isoformat()
+
+
+def ranking(fazenda_id: str, ini: str, fim: str, dias: int,
+            carregar: Callable[[str, str], dict], versao=None) -> dict:
+    """Rentabilidade da fazenda na janela [ini, fim]. `carregar(ini, fim)` devolve
+    {"producao", "sanitario", "financeiro", "config", "estoque"}; só é chamado
+    quando a versão dos dados (contador de escritas do chamador) muda ou o cache
+    expira."""
+    chave = (fazenda_id, ini, fim, dias)
+    agora = time.monotonic()
+    with _LOCK:
+        e = _CACHE.get(chave)
+    if e and versao is not None and e[0] == versao and e[1] > agora:
+        _M["reusos"] += 1
+        return e[2]
+    d = carregar(ini, fim)
+    res = calcular(d.get("producao") or [], d.get("sanitario") or [], d.get("financeiro") or [],
+                   d.get("config") or {}, d.get("estoque") or [], dias)
+    _M["calculos"] += 1
+    with _LOCK:
+        # janelas antigas da fazenda (dia anterior) saem junto
+        for k in [k for k in _CACHE if k[0] == fazenda_id and k[2] != fim]:
+            del _CACHE[k]
+        _CACHE[chave] = (versao, agora + _TTL_S, res)
+    return res
+
+
+def metricas() -> dict:
+    with _LOCK:
+        return {**_M, "janelas": len(_CACHE)}
@@ -0,0 +1,167 @@
+"""
+MilkShow — Calendário reprodutivo
+Regras únicas (gestação, secagem, diagnóstico, período voluntário de espera,
+colostro, desmame) usadas pela agenda do app, pela agenda e lembretes do bot,
+pelos alertas, pelo relatório da manhã, pelo contexto da IA e pelo app legado.
+
+A linha do tempo de eventos da fazenda é derivada uma vez a partir da lista de
+animais e fica em cache até os animais mudarem (assinatura dos campos usados
+ou contador de escritas do chamador). Cada evento tem a data em que vence e o
+intervalo em que fica pendente; "eventos entre D1 e D2" é respondido por um
+índice de intervalos (início ordenado + maior duração), sem varrer o rebanho.
+"""
+
+import bisect
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+GESTACAO      = 283
+DIAS_SECAR    = 60
+DIAS_DIAGN    = 30
+DIAS_PVE      = 45
+DIAS_DESMAME  = 90
+DIAS_COLOSTRO = 2
+DIAS_PRE_PARTO = 7          # parto entra na agenda uma semana antes
+
+_LACTACAO = ("Lactação", "Lactacao")
+_CAMPOS   = ("doc_id", "nome", "status", "dt_insem", "ins", "inseminacao",
+             "prenhez", "dt_parto", "nasc", "colostro")
+_TTL_S    = 600
+
+
+def data(s) -> Optional[datetime.date]:
+    """'YYYY-MM-DD...' → date (None se vazio ou inválido)."""
+    try:
+        return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _dias(n: int) -> datetime.timedelta:
+    return datetime.timedelta(days=n)
+
+
+def _evento(tipo: str, a: dict, vence: datetime.date, ini: datetime.date = None,
+            fim: datetime.date = None, parto: datetime.date = None) -> dict:
+    return {"tipo": tipo, "data": vence, "ini": ini or vence, "fim": fim,
+            "nome": a.get("nome") or "?", "doc_id": a.get("doc_id"), "parto": parto}
+
+
+def eventos_do_animal(a: dict) -> list:
+    """Eventos de um animal. `fim` None = pendente até o cadastro mudar
+    (prenhez confirmada, inseminação, secagem, parto registrado, desmame)."""
+    status  = a.get("status", "")
+    d_insem = data(a.get("dt_insem") or a.get("ins") or a.get("inseminacao"))
+    d_parto = data(a.get("dt_parto"))
+    evs = []
+    if d_insem and not a.get("prenhez") and status in _LACTACAO + ("Seca",):
+        evs.append(_evento("diagnostico", a, d_insem + _dias(DIAS_DIAGN)))
+    if status in _LACTACAO:
+        if not d_insem and not a.get("prenhez") and d_parto:
+            # vence no primeiro dia após o PVE — a partir daí está atrasada
+            evs.append(_evento("inseminar", a, d_parto + _dias(DIAS_PVE + 1)))
+        if a.get("prenhez") and d_insem:
+            prev = d_insem + _dias(GESTACAO)
+            evs.append(_evento("secar", a, prev - _dias(DIAS_SECAR), parto=prev))
+            evs.append(_evento("parto", a, prev, ini=prev - _dias(DIAS_PRE_PARTO), parto=prev))
+    if status == "Bezerro":
+        d_nasc = data(a.get("nasc"))
+        if d_nasc:
+            if not a.get("colostro"):
+                evs.append(_evento("colostro", a, d_nasc, fim=d_nasc + _dias(DIAS_COLOSTRO)))
+            evs.append(_evento("desmame", a, d_nasc + _dias(DIAS_DESMAME)))
+    return evs
+
+
+class Calendario:
+    """Linha do tempo reprodutiva de uma fazenda."""
+
+    def __init__(self, animais: list):
+        evs = [e for a in animais for e in eventos_do_animal(a)]
+        self._por_data = sorted(evs, key=lambda e: e["data"])
+        self._datas    = [e["data"] for e in self._por_data]
+        fechados       = sorted((e for e in evs if e["fim"]), key=lambda e: e["ini"])
+        self._fechados = fechados
+        self._ini_f    = [e["ini"] for e in fechados]
+        self._dur_max  = max(((e["fim"] - e["ini"]).days for e in fechados), default=0)
+        self._abertos  = sorted((e for e in evs if not e["fim"]), key=lambda e: e["ini"])
+        self._ini_a    = [e["ini"] for e in self._abertos]
+
+    def __len__(self):
+        return len(self._por_data)
+
+    def vencendo(self, d1: datetime.date, d2: datetime.date = None, tipos=None) -> list:
+        """Eventos cuja data de vencimento está em [d1, d2] (d2 padrão = d1)."""
+        d2 = d2 or d1
+        evs = self._por_data[bisect.bisect_left(self._datas, d1):bisect.bisect_right(self._datas, d2)]
+        return [e for e in evs if not tipos or e["tipo"] in tipos]
+
+    def pendentes(self, d1: datetime.date, d2: datetime.date = None, tipos=None) -> list:
+        """Eventos cujo intervalo [ini, fim] cruza [d1, d2], em ordem de vencimento."""
+        d2 = d2 or d1
+        # fechado que começa antes de d1 - maior duração já terminou antes de d1
+        i = bisect.bisect_left(self._ini_f, d1 - _dias(self._dur_max))
+        j = bisect.bisect_right(self._ini_f, d2)
+        evs = [e for e in self._fechados[i:j] if e["fim"] >= d1]
+        evs += self._abertos[:bisect.bisect_right(self._ini_a, d2)]
+        evs.sort(key=lambda e: e["data"])
+        return [e for e in evs if not tipos or e["tipo"] in tipos]
+
+
+def agenda(cal: Calendario, ini: datetime.date, dias: int) -> dict:
+    """{data_iso: [eventos]} de `dias` dias a partir de `ini`: diagnóstico,
+    inseminação atrasada e secagem no dia em que vencem; o parto em cada um dos
+    dias da semana anterior, com "faltam" (dias até o parto)."""
+    fim = ini + _dias(dias - 1)
+    ag: dict = {str(ini + _dias(i)): [] for i in range(dias)}
+    for e in cal.vencendo(ini, fim, ("diagnostico", "inseminar", "secar")):
+        ag[str(e["data"])].append(e)
+    for e in cal.pendentes(ini, fim, ("parto",)):
+        for dd in range(DIAS_PRE_PARTO, 0, -1):
+            dia = str(e["data"] - _dias(dd))
+            if dia in ag:
+                ag[dia].append({**e, "faltam": dd})
+    return ag
+
+
+# ─── CACHE POR FAZENDA ────────────────────────────────────────────────────────
+_CACHE: dict = {}    # fazenda_id → (versão do chamador, assinatura, expira, Calendario)
+_LOCK = threading.Lock()
+_M = {"montagens": 0, "reusos": 0}
+
+
+def _assinatura(animais: list) -> str:
+    campos = sorted(json.dumps([a.get(c) for c in _CAMPOS], default=str) for a in animais)
+    return hashlib.sha256("\n".join(campos).encode()).hexdigest()
+
+
+def calendario(fazenda_id: str, carregar: Callable[[], list], versao=None) -> Calendario:
+    """Calendário da fazenda. Com `versao` (contador de escritas do chamador) a
+    lista de animais nem é relida enquanto ela não muda; sem, `carregar()` é
+    chamado e o calendário só é remontado se a assinatura dos animais mudou."""
+    agora = time.monotonic()
+    with _LOCK:
+        e = _CACHE.get(fazenda_id)
+    if e and versao is not None and e[0] == versao and e[2] > agora:
+        _M["reusos"] += 1
+        return e[3]
+    animais = carregar()
+    sig = _assinatura(animais)
+    if e and e[1] == sig:
+        cal = e[3]
+        _M["reusos"] += 1
+    else:
+        cal = Calendario(animais)
+        _M["montagens"] += 1
+    with _LOCK:
+        _CACHE[fazenda_id] = (versao, sig, agora + _TTL_S, cal)
+    return cal
+
+
+def metricas() -> dict:
+    with _LOCK:
+        return {**_M, "fazendas": len(_CACHE)}
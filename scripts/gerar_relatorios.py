@@ -0,0 +1,112 @@
+"""
+Geração em lote dos relatórios de todas as fazendas.
+Pré-gera o PDF mensal, o relatório semanal, o ranking de rentabilidade e a
+previsão de produção antes da janela das 6h (ou de novo, depois de uma correção
+de dados) e grava tudo no cache — o bot e o app só leem do cache na hora de usar.
+
+Os textos (semanal, ranking) ficam chaveados pela data do envio (--dia): por
+padrão o próximo disparo — hoje antes das 6h, amanhã depois.
+
+Uso: python3 /opt/milkshow/scripts/gerar_relatorios.py [--mes 2026-03] [--workers 8]
+         [--tipos previsao,pdf,semanal,ranking] [--fazendas fid1,fid2] [--dia 2026-03-02]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import relatorios
+from mobile_api import previsao_fazenda
+from whatsapp_bot import (
+    _db, _todos_telefones, _gerar_pdf_relatorio,
+    _gerar_relatorio_semanal, _gerar_ranking_rentabilidade,
+)
+
+TIPOS = ("previsao", "pdf", "semanal", "ranking")   # previsão antes: o PDF a lê do cache
+HORA_ENVIO = int(os.environ.get("RELATORIOS_HORA_ENVIO", "6"))   # disparo matinal do bot
+
+
+def proximo_envio(agora: datetime.datetime) -> datetime.date:
+    """Data do próximo disparo matinal: hoje antes de HORA_ENVIO, senão amanhã."""
+    return agora.date() + datetime.timedelta(days=0 if agora.hour < HORA_ENVIO else 1)
+
+
+def listar_fazendas() -> list:
+    """Fazendas com número ativo (registros_tel) + todas as de `fazendas`."""
+    fids = {reg["fazenda_id"] for reg in _todos_telefones()}
+    fids |= {d.id for d in _db().collection("fazendas").stream()}
+    return sorted(fids)
+
+
+def gerar_fazenda(fid: str, mes: str, tipos: list, dia: str) -> dict:
+    """Gera os relatórios de uma fazenda; devolve segundos por tipo (ou erro)."""
+    tempos = {}
+    for tipo in tipos:
+        t0 = time.perf_counter()
+        try:
+            if tipo == "previsao":
+                previsao_fazenda(fid, recalcular=True)
+            elif tipo == "pdf":
+                _gerar_pdf_relatorio(fid, mes)
+            elif tipo == "semanal":
+                relatorios.guardar_texto("semanal", fid, dia, _gerar_relatorio_semanal(fid))
+            elif tipo == "ranking":
+                relatorios.guardar_texto("ranking", fid, dia, _gerar_ranking_rentabilidade(fid, 30))
+            tempos[tipo] = round(time.perf_counter() - t0, 2)
+        except Exception as e:
+            tempos[tipo] = f"ERRO: {e}"
+    return tempos
+
+
+def main():
+    hoje = datetime.date.today()
+    mes_ant = (hoje.replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+
+    ap = argparse.ArgumentParser(description="Gera relatórios de todas as fazendas no cache.")
+    ap.add_argument("--mes", default=mes_ant, help="mês do PDF (YYYY-MM); padrão: mês anterior")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("RELATORIOS_WORKERS", "8")),
+                    help="fazendas processadas em paralelo")
+    ap.add_argument("--tipos", default=",".join(TIPOS), help="previsao,pdf,semanal,ranking")
+    ap.add_argument("--fazendas", default="", help="lista de fazenda_id (padrão: todas)")
+    ap.add_argument("--dia", default=proximo_envio(datetime.datetime.now()).isoformat(),
+                    type=lambda s: datetime.date.fromisoformat(s).isoformat(),
+                    help="data do envio dos textos (YYYY-MM-DD); padrão: próximo disparo")
+    args = ap.parse_args()
+
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip() in TIPOS]
+    fazendas = [f.strip() for f in args.fazendas.split(",") if f.strip()] or listar_fazendas()
+    print(f"{len(fazendas)} fazendas | tipos: {', '.join(tipos)} | mês PDF: {args.mes} | "
+          f"envio: {args.dia} | workers: {args.workers}")
+
+    t0 = time.perf_counter()
+    resultados, erros = {}, 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futs = {ex.submit(gerar_fazenda, fid, args.mes, tipos, args.dia): fid
+                for fid in fazendas}
+        for fut in as_completed(futs):
+            fid = futs[fut]
+            tempos = resultados[fid] = fut.result()
+            falhou = any(isinstance(v, str) for v in tempos.values())
+            erros += falhou
+            print(f"  {'✗' if falhou else '✓'} {fid:<30} "
+                  + "  ".join(f"{k}={v}{'' if isinstance(v, str) else 's'}"
+                              for k, v in tempos.items()))
+
+    total = time.perf_counter() - t0
+    n = len(fazendas)
+    print(f"\n{n} fazendas em {total:.1f}s — {n / total if total else 0:.2f} fazendas/s, "
+          f"{n * len(tipos) / total if total else 0:.2f} relatórios/s, {erros} com erro")
+    for tipo in tipos:
+        ok = [r[tipo] for r in resultados.values() if not isinstance(r.get(tipo), str)]
+        if ok:
+            print(f"  {tipo:<8} média {sum(ok)/len(ok):.2f}s  máx {max(ok):.2f}s")
+    print(f"Cache: {relatorios.metricas()}")
+    sys.exit(1 if erros else 0)
+
+
+if __name__ == "__main__":
+    main()
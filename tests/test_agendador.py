@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+test_agendador.py — Testes unitarios do agendador de tarefas (agendador.py)
+Agendas, recuperacao de disparos perdidos e estado persistido.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import asyncio
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from agendador import Agendador, Tarefa, diaria, semanal, mensal, atraso_espalhado
+
+DT = datetime.datetime
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Agendas
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_diaria_ultima_e_proxima():
+    ag = diaria(6)
+    assert ag.ultima(DT(2026, 3, 10, 6, 1))  == DT(2026, 3, 10, 6, 0)
+    assert ag.ultima(DT(2026, 3, 10, 5, 59)) == DT(2026, 3, 9, 6, 0)
+    assert ag.proxima(DT(2026, 3, 10, 6, 0)) == DT(2026, 3, 11, 6, 0)
+
+def test_semanal_domingo():
+    ag = semanal(6, 2)                      # domingo 2h
+    assert ag.proxima(DT(2026, 3, 10, 12)) == DT(2026, 3, 15, 2, 0)
+    assert ag.ultima(DT(2026, 3, 10, 12))  == DT(2026, 3, 8, 2, 0)
+
+def test_mensal_dia_1():
+    ag = mensal(1, 6, 5)
+    assert ag.proxima(DT(2026, 12, 15)) == DT(2027, 1, 1, 6, 5)
+    assert ag.ultima(DT(2026, 3, 1, 6, 4)) == DT(2026, 2, 1, 6, 5)
+
+def test_atraso_espalhado_estavel_e_na_janela():
+    a = atraso_espalhado("matinal:fazA", 600)
+    assert a == atraso_espalhado("matinal:fazA", 600)
+    assert 0 <= a < 600
+    assert atraso_espalhado("x", 0) == 0.0
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Recuperacao e estado
+# ═══════════════════════════════════════════════════════════════════════
+
+def _agendador(agora, estado=None, recuperar_h=6):
+    execucoes, salvos = [], {}
+
+    async def _job(previsto):
+        execucoes.append(previsto)
+
+    ag = Agendador(
+        [Tarefa("matinal", diaria(6), _job, recuperar_h=recuperar_h)],
+        carregar_estado=lambda: dict(estado or {}),
+        salvar_estado=lambda nome, est: salvos.__setitem__(nome, est),
+        relogio=lambda: agora,
+    )
+    return ag, execucoes, salvos
+
+def _rodar_pendentes(ag):
+    async def _go():
+        for tarefa, previsto in ag.pendentes():
+            await ag.executar(tarefa, previsto)
+    asyncio.run(_go())
+
+def test_restart_as_6h01_recupera_disparo():
+    ag, execs, salvos = _agendador(DT(2026, 3, 10, 6, 1))
+    _rodar_pendentes(ag)
+    assert execs == [DT(2026, 3, 10, 6, 0)]
+    assert salvos["matinal"]["ultimo_disparo"] == "2026-03-10T06:00:00"
+
+def test_disparo_ja_feito_nao_repete():
+    estado = {"matinal": {"ultimo_disparo": "2026-03-10T06:00:00"}}
+    ag, execs, _ = _agendador(DT(2026, 3, 10, 9, 0), estado)
+    _rodar_pendentes(ag)
+    assert execs == []
+
+def test_disparo_fora_da_janela_e_pulado():
+    ag, execs, salvos = _agendador(DT(2026, 3, 10, 15, 0), recuperar_h=6)
+    _rodar_pendentes(ag)
+    assert execs == []
+    assert salvos["matinal"]["erro"].startswith("pulado")
+
+def test_falha_ao_carregar_estado_nao_redispara():
+    estado = {"matinal": {"ultimo_disparo": "2026-03-10T06:00:00"}}
+    falhas = [RuntimeError("firestore indisponivel")]
+    execs = []
+
+    async def _job(previsto):
+        execs.append(previsto)
+
+    def _carregar():
+        if falhas:
+            raise falhas.pop()
+        return estado
+
+    ag = Agendador([Tarefa("matinal", diaria(6), _job)], carregar_estado=_carregar,
+                   relogio=lambda: DT(2026, 3, 10, 8, 0))
+    assert ag.pendentes() == []                   # sem estado, nada roda
+    assert ag.segundos_ate_proximo() <= 60        # tenta de novo logo
+    _rodar_pendentes(ag)                          # estado carregou: disparo já feito
+    assert execs == []
+
+def test_falha_no_job_registra_erro_sem_repetir():
+    async def _quebra(previsto):
+        raise RuntimeError("boom")
+    ag = Agendador([Tarefa("t", diaria(6), _quebra)], relogio=lambda: DT(2026, 3, 10, 6, 0))
+    _rodar_pendentes(ag)
+    assert ag.metricas()["t"]["falhas"] == 1
+    assert ag.pendentes() == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+test_anomalias.py — Testes unitarios do detector incremental de anomalias (anomalias.py)
+EWMA por animal e do rebanho atualizada a cada escrita: registro fora do
+padrao, queda no dia completo (e recuperacao), lactante sem ordenha e
+remontagem quando um dia ja incorporado e corrigido.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import anomalias
+from anomalias import Detector
+
+_D0 = datetime.date(2026, 3, 1)
+_HOJE = datetime.date(2026, 3, 11)
+
+
+def _dia(i):
+    return (_D0 + datetime.timedelta(days=i)).isoformat()
+
+
+def _historico(dias=10):
+    """Mimosa ~21 L/dia e Estrela 16 L/dia, duas ordenhas por dia."""
+    prod = []
+    for i in range(dias):
+        for _ in (1, 2):
+            prod.append({"nome_animal": "Mimosa", "data": _dia(i), "leite": 10 + (i % 3) * 0.5})
+            prod.append({"nome_animal": "Estrela", "data": _dia(i), "leite": 8})
+    return prod
+
+
+def _tipos(flags):
+    return sorted((f["nome"], f["tipo"]) for f in flags)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Flags na escrita
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_registro_fora_do_padrao():
+    det = Detector(_historico())
+    flags = det.registrar("Mimosa", _dia(10), 95)            # 9,5 L digitado como 95
+    assert _tipos(flags) == [("Mimosa", "outlier")]
+    assert flags[0]["esperado"] == 10.4
+    assert det.registrar("Estrela", _dia(10), 8) == []
+
+def test_queda_no_dia_completo_e_recuperacao():
+    det = Detector(_historico())
+    assert det.registrar("Mimosa", _dia(10), 5.5) == []      # 1ª ordenha: dia incompleto
+    flags = det.registrar("Mimosa", _dia(10), 5.0)
+    assert ("Mimosa", "queda") in _tipos(flags)
+    assert [f for f in det.alertas(_HOJE) if f["tipo"] == "queda"][0]["valor"] == 10.5
+    det.registrar("Mimosa", _dia(10), 10.0)                  # ordenha que faltava
+    assert not [f for f in det.alertas(_HOJE) if f["tipo"] == "queda"]
+
+def test_queda_marcada_ao_fechar_o_dia():
+    det = Detector(_historico())
+    det.registrar("Estrela", _dia(10), 2.0)                  # só uma ordenha lançada
+    flags = det.registrar("Estrela", _dia(11), 8.0)          # dia seguinte fecha o anterior
+    assert ("Estrela", "queda") in _tipos(flags)
+    assert set(det.medias(["Estrela", "Nova"])) == {"Estrela"}
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Leitura pelo agendador
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_sem_ordenha_sem_consultar_producao():
+    det = Detector(_historico(7))                            # última ordenha em 03-07
+    faltas = [f for f in det.alertas(_HOJE, ["Mimosa", "Jurema"]) if f["tipo"] == "sem_ordenha"]
+    assert [(f["nome"], f["data"]) for f in faltas] == [("Mimosa", "2026-03-07"), ("Jurema", None)]
+    det.registrar("Mimosa", _dia(10), 10)
+    assert [f["nome"] for f in det.alertas(_HOJE, ["Mimosa"])] == []
+
+def test_ordenha_atrasada_depois_do_dia_seguinte():
+    leituras = []
+
+    def carregar():
+        leituras.append(1)
+        return _historico() + [{"nome_animal": "Mimosa", "data": _dia(d), "leite": 10}
+                               for d in (10, 11, 10)]
+
+    det = anomalias.detector("faz-atraso", carregar, versao=1)
+    det.registrar("Mimosa", _dia(10), 10)                    # manhã de ontem
+    det.registrar("Mimosa", _dia(11), 10)                    # manhã de hoje fecha ontem pela metade
+    det.registrar("Mimosa", _dia(10), 10)                    # tarde de ontem, lançada depois
+    assert det.sujo
+    assert not [f for f in det.alertas(_HOJE) if f["tipo"] == "queda" and f["nome"] == "Mimosa"]
+    novo = anomalias.detector("faz-atraso", carregar, versao=1)
+    assert novo is not det and len(leituras) == 2
+    assert not [f for f in novo.alertas(_HOJE) if f["tipo"] == "queda" and f["nome"] == "Mimosa"]
+
+def test_correcao_em_dia_fechado_pede_remontagem():
+    leituras = []
+
+    def carregar():
+        leituras.append(1)
+        return _historico()
+
+    det = anomalias.detector("faz-anom", carregar, versao=1)
+    assert anomalias.detector("faz-anom", carregar, versao=1) is det
+    det.registrar("Mimosa", _dia(10), 10)
+    det.registrar("Mimosa", _dia(3), -10)                    # dia já nas médias
+    assert det.sujo
+    assert anomalias.detector("faz-anom", carregar, versao=1) is not det
+    assert len(leituras) == 2 and anomalias.existente("faz-anom") is not det
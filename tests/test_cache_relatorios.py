@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+test_cache_relatorios.py — Testes unitarios do cache em disco (cache_disco.py)
+e do cache de PDFs enderecado por conteudo (relatorios.py).
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import relatorios
+from cache_disco import CacheDisco
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — CacheDisco
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_grava_e_le(tmp_path):
+    c = CacheDisco("t", max_bytes=1000, diretorio=str(tmp_path))
+    c.gravar("a", b"123")
+    assert c.obter("a") == b"123"
+    assert c.obter("b") is None
+    assert c.metricas()["hits"] == 1
+
+def test_despejo_lru(tmp_path):
+    c = CacheDisco("t", max_bytes=10, diretorio=str(tmp_path))
+    c.gravar("a", b"xxxx")
+    c.gravar("b", b"yyyy")
+    c.obter("a")                 # "a" vira o mais recente
+    c.gravar("c", b"zzzz")       # estoura 10 bytes → despeja "b"
+    assert c.obter("b") is None
+    assert c.obter("a") == b"xxxx"
+    assert c.metricas()["despejos"] == 1
+
+def test_ttl_expira(tmp_path):
+    c = CacheDisco("t", max_bytes=1000, ttl_s=0.01, diretorio=str(tmp_path))
+    c.gravar("a", b"1")
+    time.sleep(0.05)
+    assert c.obter("a") is None
+
+def test_indice_sobrevive_restart(tmp_path):
+    CacheDisco("t", max_bytes=1000, diretorio=str(tmp_path)).gravar("a", b"abc")
+    c2 = CacheDisco("t", max_bytes=1000, diretorio=str(tmp_path))
+    assert c2.obter("a") == b"abc"
+    assert c2.metricas()["bytes"] == 3
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cache de PDF por versao dos dados
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_versao_estavel_e_sensivel_aos_dados():
+    v1 = relatorios.versao_dados("Faz", [{"leite": 10, "data": "2026-01-02"}])
+    v2 = relatorios.versao_dados("Faz", [{"data": "2026-01-02", "leite": 10}])
+    v3 = relatorios.versao_dados("Faz", [{"data": "2026-01-02", "leite": 11}])
+    assert v1 == v2
+    assert v1 != v3
+
+def test_pdf_renderizado_uma_vez(tmp_path, monkeypatch):
+    monkeypatch.setattr(relatorios, "CACHE_PDF", CacheDisco("r", 10**6, diretorio=str(tmp_path)))
+    chamadas = []
+    def _render():
+        chamadas.append(1)
+        return b"%PDF-fake"
+    pdf1, hit1 = relatorios.obter_pdf("api", "fazA", "2026-01", "v1", _render)
+    pdf2, hit2 = relatorios.obter_pdf("api", "fazA", "2026-01", "v1", _render)
+    assert pdf1 == pdf2 == b"%PDF-fake"
+    assert (hit1, hit2) == (False, True)
+    assert len(chamadas) == 1
+
+def test_memo_invalida_com_nova_escrita():
+    relatorios.memorizar("api", "fazM", "2020-01", 3, "abc")
+    assert relatorios.memorizado("api", "fazM", "2020-01", 3)["versao"] == "abc"
+    assert relatorios.memorizado("api", "fazM", "2020-01", 4) is None
+
+def test_mes_fechado():
+    import datetime
+    hoje = datetime.date(2026, 3, 15)
+    assert relatorios.mes_fechado("2026-02", hoje)
+    assert not relatorios.mes_fechado("2026-03", hoje)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Motor de relatorios (coleta / KPIs)
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_kpis_mensal():
+    fin = [{"cat": "Venda de Leite", "valor": 3000},
+           {"cat": "Ração / Nutrição", "valor": 1200},
+           {"categoria": "Medicamento / Sanitário", "valor": 300}]
+    prod = [{"nome_animal": "Mimosa", "leite": 600},
+            {"nome_animal": "Estrela", "leite": 400},
+            {"nome_animal": "Mimosa", "leite": 500}]
+    animais = [{"status": "Lactação"}, {"status": "Seca"}]
+    k = relatorios.kpis_mensal(2026, 2, fin, prod, animais)
+    assert k["total_prod"] == 1500
+    assert k["media_dia"] == round(1500 / 28, 1)
+    assert k["vacas_lact"] == 1
+    assert k["saldo"] == 1500
+    assert k["custo_litro"] == 1.0 and k["preco_litro"] == 2.0
+    assert k["top_animais"][0] == ("Mimosa", 1100)
+    assert k["desp_cats"][0] == ("Ração / Nutrição", 1200)
+
+def test_nome_arquivo_mensal():
+    assert relatorios.nome_arquivo_mensal("Sitio Boa Vista", "2026-03") == \
+        "MilkShow_Sitio_Boa_Vista_202603.pdf"
+
+def test_arquivo_de_outro_processo_e_adotado(tmp_path):
+    escritor = CacheDisco("t", max_bytes=1000, diretorio=str(tmp_path))
+    leitor   = CacheDisco("t", max_bytes=1000, diretorio=str(tmp_path))
+    assert leitor.obter("x") is None          # índice do leitor montado vazio
+    escritor.gravar("x", b"lote")
+    assert leitor.obter("x") == b"lote"
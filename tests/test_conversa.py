@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+test_conversa.py — Testes unitarios do estado da conversa do bot (conversa.py)
+Compactacao do historico: resumo dos turnos antigos, teto por turno, anexos.
+Confirmacao local em CONFIRMANDO: sim / nao / correcao de um campo.
+Coleta por esquema: resposta curta ao campo pendente lida sem IA.
+Nao requer servidor, Firebase nem chaves de API.
+"""
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import conversa
+from cache_disco import CacheDisco
+
+
+def _isolar(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversa, "CACHE_ANEXOS",
+                        CacheDisco("anexos", max_bytes=100_000, diretorio=str(tmp_path)))
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Compactacao do historico
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_turnos_antigos_viram_resumo():
+    hist = []
+    for i in range(5):
+        hist += [{"role": "user", "content": f"msg {i}"},
+                 {"role": "assistant", "content": json.dumps({"estado": "COLETANDO"})}]
+    dados = {"litros": 30, "turno": None, "animal": "Mimosa"}
+    novo = conversa.compactar_historico(hist, "PRODUCAO_LEITE", dados, manter=4)
+    assert len(novo) == 6
+    assert novo[0]["role"] == "user" and novo[2]["content"] == "msg 3"
+    resumo = json.loads(novo[1]["content"])
+    assert resumo["tipo"] == "PRODUCAO_LEITE"
+    assert resumo["dados"] == {"litros": 30, "animal": "Mimosa"}
+    # compactar de novo não acumula resumos
+    novo2 = conversa.compactar_historico(novo + hist[-2:], "PRODUCAO_LEITE", dados, manter=4)
+    assert sum(1 for t in novo2 if t["content"] == novo[0]["content"]) == 1
+
+def test_historico_curto_nao_muda():
+    hist = [{"role": "user", "content": "vendi leite"}]
+    assert conversa.compactar_historico(hist, manter=4) == hist
+
+def test_extracao_grande_vira_anexo(tmp_path, monkeypatch):
+    _isolar(tmp_path, monkeypatch)
+    tabela = "\n".join(f"Mimosa {d}/03 {20 + d % 5} litros ção" for d in range(1, 200))
+    turno = conversa.limitar_turno({"role": "user", "content": tabela}, max_bytes=500)
+    assert len(turno["content"].encode()) <= 500
+    ref = turno["content"].rsplit("anexo ", 1)[1].split(":")[0]
+    assert conversa.anexo(ref) == tabela
+
+def test_itens_do_assistente_recuperados_do_anexo(tmp_path, monkeypatch):
+    _isolar(tmp_path, monkeypatch)
+    itens = [{"animal": "Mimosa", "litros": 20}, {"animal": "Estrela", "litros": 18}]
+    turno = {"role": "assistant",
+             "content": json.dumps({"estado": "CONFIRMANDO", "itens": itens})}
+    compacto = json.loads(conversa.limitar_turno(turno)["content"])
+    assert "itens" not in compacto and compacto["n_itens"] == 2
+    assert conversa.itens_do_turno(compacto) == itens
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Confirmacao local (CONFIRMANDO sem IA)
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_confirma_e_cancela():
+    for t in ("sim", "Sim!", "ok, pode salvar", "✅ Confirmar", "isso mesmo",
+              "tá certo", "pode mandar", "tudo certo"):
+        assert conversa.resolver_confirmacao(t) == ("confirmar", None), t
+    # sozinhas não confirmam ("ver" = deixa eu ver); "salva" não cancela
+    for t in ("ver", "tudo", "esta", "ta", "manda", "não salva"):
+        assert conversa.resolver_confirmacao(t) == (None, None), t
+    for t in ("não", "nao, cancela", "❌ Cancelar", "esquece"):
+        assert conversa.resolver_confirmacao(t) == ("cancelar", None), t
+
+def test_corrige_um_campo():
+    import datetime
+    hoje = datetime.date(2026, 3, 10)
+    r = conversa.resolver_confirmacao
+    assert r("não, o valor é R$ 1.200,50", "VENDA_LEITE") == ("editar", {"valor": 1200.5})
+    assert r("são 25 litros", "PRODUCAO_LEITE") == ("editar", {"litros": 25.0})
+    assert r("muda o turno pra tarde", "PRODUCAO_LEITE") == ("editar", {"turno": 2})
+    assert r("a data é ontem", "GASTO_GERAL", hoje) == ("editar", {"data": "2026-03-09"})
+    assert r("300 reais", "GASTO_SANITARIO") == ("editar", {"custo": 300.0})
+    assert r("o animal é Estrela", "VENDA_ANIMAL") == ("editar", {"animal": "Estrela"})
+
+def test_resposta_ambigua_vai_para_ia():
+    for t in ("não é isso", "sim, mas falta o animal", "a vaca tá mancando", "quanto tenho de ração?"):
+        assert conversa.resolver_confirmacao(t, "GASTO_SANITARIO") == (None, None), t
+
+def test_resumo_confirmacao():
+    txt = conversa.resumo_confirmacao("PRODUCAO_LEITE",
+                                      {"litros": 25.0, "turno": 2, "data": "2026-03-09"})
+    assert "Produção de leite" in txt
+    assert "Litros: 25" in txt and "Turno: Tarde" in txt and "09/03/2026" in txt
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Coleta por esquema (campo pendente lido localmente)
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_preenche_campo_pendente():
+    assert conversa.proximo_slot("VENDA_LEITE", {"litros": 1200}) == ("valor", "moeda")
+    assert conversa.preencher_slots("VENDA_LEITE", {"litros": 1200}, "R$ 1.800,00") == {"valor": 1800.0}
+    assert conversa.preencher_slots("PRODUCAO_LEITE", {"litros": 30}, "de tarde") == {"turno": 2}
+    # turno aproveitado da mesma frase do campo pendente
+    assert conversa.preencher_slots("PRODUCAO_LEITE", {}, "25 litros de noite") == \
+        {"litros": 25.0, "turno": 3}
+    assert conversa.proximo_slot("PRODUCAO_LEITE", {"litros": 25.0, "turno": 3}) is None
+
+def test_animal_pelo_nome_cadastrado():
+    nomes = ["Mimosa", "Estrela", "Mimosa Branca"]
+    assert conversa.preencher_slots("VENDA_ANIMAL", {}, "a mimosa", nomes) == {"animal": "Mimosa"}
+    assert conversa.preencher_slots("VENDA_ANIMAL", {}, "Mimosa branca", nomes) == \
+        {"animal": "Mimosa Branca"}
+    assert conversa.preencher_slots("VENDA_ANIMAL", {}, "Mimosa e Estrela", nomes) is None
+
+def test_animal_na_frase_com_indice():
+    import indices
+    idx = indices.IndiceAnimais([
+        {"nome": "Mimosa", "status": "Lactação", "apelidos": "Mimi"},
+        {"nome": "Estrela", "status": "Seca"},
+        {"nome": "Boneca", "status": "Vendido"},
+    ])
+    nomes = idx.nomes_ativos()
+
+    def ler(txt):
+        return conversa.preencher_slots("CORRIGIR_PRODUCAO", {}, txt, nomes,
+                                        resolver=lambda t: idx.resolver_nome(t, so_ativos=True))
+
+    assert ler("foi a mimosa") == {"animal": "Mimosa"}
+    assert ler("a mimosa de manha") == {"animal": "Mimosa"}
+    assert ler("foi a mimosinha") == {"animal": "Mimosa"}     # só pelo índice
+    assert ler("foi a estrla") == {"animal": "Estrela"}       # erro de digitação
+    assert ler("boneca") is None                              # vendida não recebe produção
+    assert ler("mimosinha e estrela") is None
+
+def test_sem_leitura_segura_vai_para_agente():
+    assert conversa.preencher_slots("GASTO_GERAL", {}, "conta de luz") is None       # campo texto
+    assert conversa.preencher_slots("VENDA_LEITE", {"litros": 1200},
+                                    "não sei ainda, te falo amanhã cedo") is None
+    assert conversa.preencher_slots("VENDA_LEITE", {"litros": 1200}, "quanto foi o mês passado?") is None
+
+def test_campo_pela_ultima_pergunta():
+    dados = {"laticinio": "Piracanjuba"}
+    # o agente pediu litros antes do valor: "1200" vai para litros
+    assert conversa.preencher_slots("VENDA_LEITE", dados, "1200",
+                                    pergunta="Quantos litros foram vendidos?") == {"litros": 1200.0}
+    assert conversa.preencher_slots("VENDA_LEITE", dados, "1800",
+                                    pergunta="E qual o valor recebido?") == {"valor": 1800.0}
+    assert conversa.preencher_slots("VENDA_LEITE", dados, "Agro Sul",
+                                    pergunta="Qual o laticínio?") is None
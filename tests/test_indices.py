@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+test_indices.py — Testes unitarios dos indices em memoria por fazenda (indices.py)
+Resolucao local de nome, apelido, diminutivo, brinco e erro de digitacao;
+busca no estoque por nome normalizado, sinonimo de insumo e trecho do nome;
+taxa de consumo incremental por item e dias ate acabar;
+registro de prefixos do alocador de ids de animais;
+janela de 14 dias da producao (duplicata e media diaria do rebanho).
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from indices import (IndiceAnimais, IndiceEstoque, IndiceProducao, levenshtein,
+                     base_id, registro_ids, reservar_id, registrar_consumo,
+                     consumo_diario, previsao_consumo)
+
+
+_REBANHO = [
+    {"nome": "Mimosa", "id": "MIMO", "status": "Lactação"},
+    {"nome": "Mimosa Branca", "id": "MIMO2", "status": "Seca"},
+    {"nome": "Estrela", "id": "EST1", "apelidos": "Teté, Estrelinha"},
+    {"nome": "Jurema", "id": "123"},
+    {"nome": "Boneca", "id": "BONE", "status": "Vendido"},
+    {"nome": "Boneca", "id": "BONE2", "status": "Lactação"},
+]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Indice de animais
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_nome_sem_acento_artigo_e_diminutivo():
+    idx = IndiceAnimais(_REBANHO)
+    assert idx.resolver_nome("a Mimosa") == "Mimosa"
+    assert idx.resolver_nome("mimosinha") == "Mimosa"
+    assert idx.resolver_nome("MIMOSONA") == "Mimosa"
+    assert idx.resolver_nome("mimosa branca") == "Mimosa Branca"
+
+def test_apelido_e_brinco():
+    idx = IndiceAnimais(_REBANHO)
+    assert idx.resolver_nome("teté") == "Estrela"
+    assert idx.resolver_nome("#123") == "Jurema"
+    assert idx.resolver("mimo2")["id"] == "MIMO2"
+
+def test_erro_de_digitacao_e_homonimo_vendido():
+    idx = IndiceAnimais(_REBANHO)
+    assert idx.resolver_nome("Jurena") == "Jurema"
+    assert idx.resolver_nome("estrla") == "Estrela"
+    assert idx.resolver("boneca")["id"] == "BONE2"          # a ativa
+    assert idx.resolver("xuxa") is None
+
+def test_rebanho_grande_sem_truncar():
+    idx = IndiceAnimais([{"nome": f"Vaca {i:03d}", "id": f"V{i}"} for i in range(400)])
+    assert idx.resolver_nome("vaca 399") == "Vaca 399"
+
+def test_levenshtein_com_limite():
+    assert levenshtein("jurema", "jurena", 2) == 1
+    assert levenshtein("mimosa", "estrela", 2) == 3
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Indice de estoque
+# ═══════════════════════════════════════════════════════════════════════
+
+def _estoque():
+    return IndiceEstoque([
+        {"doc_id": "a", "item": "Milho, silagem", "qtd": 100, "un": "kg"},
+        {"doc_id": "b", "item": "Ivermectina", "qtd": 2, "un": "fr"},
+        {"doc_id": "c", "item": "Sal mineral", "qtd": 5, "un": "sc"},
+    ])
+
+def test_estoque_nome_sinonimo_e_trecho():
+    idx = _estoque()
+    assert idx.buscar("IVERMECTINA")["doc_id"] == "b"
+    assert idx.buscar("silagem de milho")["doc_id"] == "a"     # sinônimo da tabela INSUMOS
+    assert idx.buscar("sal")["doc_id"] == "c"
+    assert idx.buscar("cimento") is None
+
+def test_estoque_atualizado_no_lugar():
+    idx = _estoque()
+    idx.gravar("b", {"qtd": 1})
+    assert idx.buscar("ivermectina")["qtd"] == 1
+    idx.gravar("d", {"item": "Cimento", "qtd": 3})
+    assert idx.buscar("cimento")["doc_id"] == "d"
+    idx.remover("a")
+    assert idx.buscar("silagem de milho") is None
+    assert len(idx.itens()) == 3
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Consumo do estoque
+# ═══════════════════════════════════════════════════════════════════════
+
+_D0 = datetime.date(2026, 3, 1)
+
+def _baixas(item, qtd, dias, passo=1):
+    for k in range(0, dias, passo):
+        item.update(registrar_consumo(item, qtd, _D0 + datetime.timedelta(days=k)))
+    return item
+
+def test_taxa_de_consumo_incremental():
+    sal = _baixas({"item": "Sal mineral", "qtd": 40}, 6, 60, passo=3)   # 2 sc/dia
+    assert sal["consumo_n"] == 20 and sal["consumo_ult"] == "2026-04-27"
+    assert consumo_diario(sal, datetime.date(2026, 4, 27)) == pytest.approx(2.0, rel=0.05)
+    assert consumo_diario({"item": "Novo", "consumo_n": 1}, _D0) is None
+    # parou de usar: a taxa cai com o tempo
+    assert consumo_diario(sal, datetime.date(2026, 6, 1)) < 1.0
+
+def test_baixa_retroativa_nao_move_a_ultima():
+    it = _baixas({"item": "Ivermectina", "qtd": 10}, 1, 10)
+    antes = it["consumo_soma"]
+    it.update(registrar_consumo(it, 1, _D0))
+    assert it["consumo_ult"] == "2026-03-10" and antes < it["consumo_soma"] < antes + 1
+
+def test_dias_ate_acabar_e_esgotando():
+    hoje = datetime.date(2026, 3, 20)
+    racao = _baixas({"doc_id": "a", "item": "Ração", "qtd": 50}, 10, 20)  # 10 kg/dia
+    prev = previsao_consumo(racao, hoje)
+    assert prev["dias_restantes"] == 5 and prev["acaba_em"] == "2026-03-25"
+    assert previsao_consumo({"item": "Cimento", "qtd": 3}, hoje)["dias_restantes"] is None
+    idx = IndiceEstoque([racao, {**racao, "doc_id": "b", "item": "Sal", "qtd": 500},
+                         {"doc_id": "c", "item": "Cimento", "qtd": 3}])
+    assert [e["doc_id"] for e in idx.esgotando(hoje, 7)] == ["a"]
+    idx.gravar("a", {"qtd": 200})
+    assert idx.esgotando(hoje, 7) == []
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Registro de ids de animais
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_ids_sem_colisao():
+    prefixos = registro_ids(["RAIN", "RAIN2", "AL", "AL2", "123"])
+    assert base_id("Raimunda") == "RAIM"
+    assert reservar_id(prefixos, "RAIN") == "RAIN3"
+    assert reservar_id(prefixos, "RAIM") == "RAIM"
+    assert reservar_id(prefixos, "RAIM") == "RAIM2"
+    assert reservar_id(prefixos, "AL") == "AL3"
+    # base igual a um id já emitido como sufixo de outra
+    assert reservar_id(prefixos, "AL2") == "AL22"
+    emitidos = ["RAIN3", "RAIM", "RAIM2", "AL3", "AL22"]
+    assert len(set(emitidos)) == len(emitidos)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Janela de producao
+# ═══════════════════════════════════════════════════════════════════════
+
+_HOJE = datetime.date(2026, 3, 15)
+
+def _producao():
+    return IndiceProducao([
+        {"doc_id": "a", "data": "2026-03-13", "id_animal": "geral", "turno": 1, "leite": 300},
+        {"doc_id": "b", "data": "2026-03-14", "id_animal": "geral", "turno": 1, "leite": 400},
+        {"doc_id": "c", "data": "2026-03-15", "id_animal": "MIMO", "turno": "tarde", "leite": 20},
+        {"doc_id": "velho", "data": "2026-02-01", "id_animal": "geral", "turno": 1, "leite": 999},
+    ], _HOJE)
+
+def test_producao_duplicata_e_media():
+    idx = _producao()
+    assert idx.duplicata("2026-03-15", "MIMO", 2) == {"doc_id": "c", "leite": 20.0}
+    assert idx.duplicata("2026-03-15", "MIMO", 1) is None
+    assert idx.media_diaria() == 240.0                       # (300 + 400 + 20) / 3 dias
+    assert not idx.cobre("2026-02-01") and not idx.cobre("2026-03-16")
+
+def test_producao_atualizada_no_lugar():
+    idx = _producao()
+    idx.registrar("d", {"data": "2026-03-15", "id_animal": "geral", "turno": 1, "leite": 380})
+    assert idx.duplicata("2026-03-15", "geral", 1)["doc_id"] == "d"
+    idx.atualizar("b", {"leite": 500})
+    assert idx.media_diaria() == 400.0                       # (300 + 500 + 400) / 3
+    idx.remover("c")
+    assert idx.duplicata("2026-03-15", "MIMO", 2) is None
+
+def test_producao_janela_rola():
+    idx = _producao()
+    idx.rolar(datetime.date(2026, 3, 28))                    # início passa a 14/03
+    assert idx.duplicata("2026-03-13", "geral", 1) is None
+    assert idx.media_diaria() == 210.0                       # (400 + 20) / 2
+    idx.registrar("e", {"data": "2026-03-28", "id_animal": "geral", "turno": 1, "leite": 600})
+    assert idx.media_diaria() == 340.0
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+test_lactacao.py — Testes unitarios das curvas de lactacao por vaca (lactacao.py)
+Ajuste de Wood (a, b, c) por minimos quadrados no log, em lote para o rebanho,
+forma do rebanho para vaca com poucos dados ou faixa de DIM curta, reajuste incremental por escrita
+e nova lactacao quando o parto muda.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+np = pytest.importorskip("numpy")
+import lactacao
+from lactacao import CurvasLactacao
+
+_PARTO = datetime.date(2026, 1, 1)
+
+
+def _dia(t):
+    return (_PARTO + datetime.timedelta(days=t)).isoformat()
+
+
+def _producao(nome, a, b, c, dims, turnos=2):
+    """Registros por turno cujo total diário segue exatamente Wood(a, b, c)."""
+    return [{"nome_animal": nome, "data": _dia(t), "leite": lactacao.wood(t, a, b, c) / turnos}
+            for t in dims for _ in range(turnos)]
+
+
+_ANIMAIS = [
+    {"nome": "Mimosa",  "dt_parto": "2026-01-01"},
+    {"nome": "Estrela", "dt_parto": "2026-01-01"},
+    {"nome": "Novilha"},                                # sem parto: sem curva própria
+]
+_PROD = (_producao("Mimosa", 25.0, 0.15, 0.004, range(5, 120))
+         + _producao("Estrela", 12.5, 0.15, 0.004, range(5, 8)))
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Ajuste em lote
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_ajuste_por_vaca_recupera_parametros():
+    p = CurvasLactacao(_PROD, _ANIMAIS).parametros("Mimosa")
+    assert p["fonte"] == "vaca" and p["dias"] == 115
+    assert (p["a"], p["b"], p["c"]) == pytest.approx((25.0, 0.15, 0.004), rel=1e-3)
+    assert p["dim_pico"] == 37
+
+def test_poucos_dados_usa_forma_do_rebanho_no_nivel_da_vaca():
+    cur = CurvasLactacao(_PROD, _ANIMAIS)
+    p = cur.parametros("Estrela")
+    assert p["fonte"] == "rebanho" and p["dias"] == 3
+    assert (p["a"], p["b"], p["c"]) == pytest.approx((12.5, 0.15, 0.004), rel=1e-3)
+    assert cur.parametros("Novilha")["fonte"] == "rebanho"
+    assert CurvasLactacao([], _ANIMAIS).parametros("Mimosa")["fonte"] == "padrao"
+
+def test_faixa_curta_de_dim_puxa_para_a_forma_do_rebanho():
+    # 20 dias no fim da lactação com outra forma: o ajuste próprio extrapolaria o pico
+    fim = _producao("Flor", 30.0, 0.25, 0.006, range(150, 170))
+    meio = _producao("Lua", 30.0, 0.25, 0.006, range(100, 145))
+    animais = _ANIMAIS + [{"nome": "Flor", "dt_parto": "2026-01-01"},
+                          {"nome": "Lua", "dt_parto": "2026-01-01"}]
+    cur = CurvasLactacao(_PROD + fim + meio, animais)
+    reb = cur.parametros("Novilha")
+    flor, lua = cur.parametros("Flor"), cur.parametros("Lua")
+    assert flor["fonte"] == "rebanho" and flor["dias"] == 20
+    assert (flor["b"], flor["c"]) == pytest.approx((reb["b"], reb["c"]), rel=1e-3)
+    assert lua["fonte"] == "parcial" and reb["b"] < lua["b"] < 0.25
+    # nível de cada vaca continua o dela na faixa observada
+    assert cur.esperado(["Flor"], [160])[0] == pytest.approx(lactacao.wood(160, 30.0, 0.25, 0.006), rel=0.05)
+
+def test_esperado_vetorizado():
+    cur = CurvasLactacao(_PROD, _ANIMAIS)
+    esp = cur.esperado(["Mimosa", "Estrela", "Desconhecida"], [100, 100, 0])
+    assert esp[0] == pytest.approx(lactacao.wood(100, 25.0, 0.15, 0.004), rel=1e-3)
+    assert esp[1] == pytest.approx(esp[0] / 2, rel=1e-3)
+    assert esp[2] == 0.0
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Reajuste incremental
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_registrar_equivale_a_remontar():
+    extra = _producao("Estrela", 12.5, 0.15, 0.004, range(8, 80), turnos=1)
+    cur = CurvasLactacao(_PROD, _ANIMAIS)
+    for p in extra:
+        cur.registrar(p["nome_animal"], p["data"], p["leite"])
+    # registro errado e sua remoção não deixam rastro
+    cur.registrar("Estrela", _dia(20), 40.0)
+    cur.registrar("Estrela", _dia(20), -40.0)
+    inc = cur.parametros("Estrela")
+    ref = CurvasLactacao(_PROD + extra, _ANIMAIS).parametros("Estrela")
+    assert inc["fonte"] == ref["fonte"] == "vaca"
+    assert (inc["a"], inc["b"], inc["c"]) == pytest.approx((ref["a"], ref["b"], ref["c"]), rel=1e-6)
+
+def test_novo_parto_recomeca_a_lactacao():
+    cur = CurvasLactacao(_PROD, _ANIMAIS)
+    cur.sincronizar([{"nome": "Mimosa", "dt_parto": "2026-05-01"},
+                     {"nome": "Pintada", "dt_parto": "2026-05-01"}])
+    assert cur.parametros("Mimosa")["dias"] == 0
+    assert cur.parametros("Pintada")["fonte"] == "padrao" and len(cur) == 3
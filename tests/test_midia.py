@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+test_midia.py — Testes unitarios do tratamento de midia recebida (midia.py)
+Cache por impressao digital (SHA-256) de transcricoes e leituras de imagem.
+Nao requer servidor, Firebase nem chaves de API.
+"""
+import sys
+import os
+import asyncio
+import base64
+import hashlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import midia
+from cache_disco import CacheDisco
+
+
+def _isolar(tmp_path, monkeypatch):
+    monkeypatch.setattr(midia, "CACHE_MIDIA",
+                        CacheDisco("midia", max_bytes=10_000, ttl_s=60, diretorio=str(tmp_path)))
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cache por impressao digital
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_midia_repetida_nao_chama_provedor(tmp_path, monkeypatch):
+    _isolar(tmp_path, monkeypatch)
+    chamadas = []
+
+    async def _transcrever(b):
+        chamadas.append(b)
+        return "tirei 20 litros da mimosa"
+
+    t1 = asyncio.run(midia.extrair_com_cache("audio", b"OggS...", _transcrever))
+    t2 = asyncio.run(midia.extrair_com_cache("audio", b"OggS...", _transcrever))
+    assert t1 == t2 == "tirei 20 litros da mimosa"
+    assert len(chamadas) == 1
+
+def test_resultado_vazio_nao_fica_em_cache(tmp_path, monkeypatch):
+    _isolar(tmp_path, monkeypatch)
+    chamadas = []
+
+    async def _falha(b):
+        chamadas.append(b)
+        return ""
+
+    asyncio.run(midia.extrair_com_cache("vision", b"jpeg", _falha))
+    asyncio.run(midia.extrair_com_cache("vision", b"jpeg", _falha))
+    assert len(chamadas) == 2
+
+def test_impressao_whatsapp_bate_com_sha256(tmp_path, monkeypatch):
+    _isolar(tmp_path, monkeypatch)
+    conteudo = b"foto da nota fiscal"
+    msg = {"fileSha256": base64.b64encode(hashlib.sha256(conteudo).digest()).decode()}
+    h = midia.impressao_whatsapp(msg)
+    assert h == midia.impressao(conteudo)
+    midia.guardar_texto("vision", h, "[NOTA FISCAL] ...")
+    assert midia.texto_por_impressao("vision", h) == "[NOTA FISCAL] ..."
+    assert midia.impressao_whatsapp({"fileSha256": "??"}) is None
+    assert midia.impressao_whatsapp({}) is None
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Pre-processamento de imagem
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_imagem_ilegivel_volta_original():
+    out, mime = midia.preparar_imagem(b"nao e imagem", "image/png")
+    assert (out, mime) == (b"nao e imagem", "image/png")
+    assert midia.metricas()["imagens"]["falhas"] >= 1
+
+def test_foto_girada_mantem_a_rotacao():
+    import pytest
+    Image = pytest.importorskip("PIL.Image")
+    import io
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6                                          # celular em pé: girar 90°
+    Image.effect_noise((400, 200), 60).convert("RGB").save(buf, format="JPEG", quality=20, exif=exif.tobytes())
+    # reprocessada em q100 fica maior que o original — mesmo assim sai a girada
+    out, _ = midia.preparar_imagem(buf.getvalue(), "image/jpeg", qualidade=100)
+    assert len(out) > len(buf.getvalue())
+    with Image.open(io.BytesIO(out)) as img:
+        assert img.size == (200, 400)
+
+def test_pdf_nao_passa_pelo_pillow():
+    antes = midia.metricas()["imagens"]["imagens"]
+    out, mime = midia.preparar_imagem(b"%PDF-1.4 ...", "application/pdf")
+    assert (out, mime) == (b"%PDF-1.4 ...", "application/pdf")
+    assert midia.metricas()["imagens"]["imagens"] == antes
+
+def test_imagem_reduzida_cinza_opcional():
+    import pytest
+    Image = pytest.importorskip("PIL.Image")
+    import io
+    buf = io.BytesIO()
+    Image.effect_noise((3000, 2000), 60).convert("RGB").save(buf, format="PNG")
+    out, mime = midia.preparar_imagem(buf.getvalue(), "image/png", lado_max=1000)
+    assert mime == "image/jpeg" and len(out) < len(buf.getvalue())
+    with Image.open(io.BytesIO(out)) as img:
+        assert max(img.size) == 1000 and img.mode == "RGB"
+    out, _ = midia.preparar_imagem(buf.getvalue(), "image/png", lado_max=1000, cinza=True)
+    with Image.open(io.BytesIO(out)) as img:
+        assert img.mode == "L"
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Download com limite
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_decodifica_base64_direto_do_json():
+    import json
+    audio = os.urandom(5000)
+    bruto = json.dumps({"mediaType": "audio", "base64": base64.b64encode(audio).decode(),
+                        "mimetype": "audio/ogg"}).encode()
+    assert midia.decodificar_base64_json(bruto) == audio
+    assert midia.decodificar_base64_json(b'{"erro": "nao encontrado"}') == b""
+    # valor null: não pode pegar a próxima string do JSON como base64
+    assert midia.decodificar_base64_json(b'{"base64": null, "mimetype": "audio/ogg"}') == b""
+
+def test_tamanho_declarado_acima_do_limite():
+    import pytest
+    limite = midia.limite_bytes("audio")
+    midia.checar_tamanho_declarado("audio", {"fileLength": str(limite)})
+    midia.checar_tamanho_declarado("audio", {})
+    with pytest.raises(midia.MidiaGrande):
+        midia.checar_tamanho_declarado("audio", {"fileLength": limite + 1})
+    with pytest.raises(midia.MidiaGrande):
+        midia.checar_tamanho_declarado("audio", {"fileLength": {"low": 0, "high": 1}})
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+test_previsao.py — Testes unitarios da previsao de producao do rebanho (previsao.py)
+Soma das curvas de lactacao por vaca, secagem e parto previstos no horizonte,
+producao lancada sem animal, efeito dia da semana e cache do lote noturno
+(memoria e disco).
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip("numpy")
+import lactacao
+import previsao
+from cache_disco import CacheDisco
+
+_HOJE  = datetime.date(2026, 6, 1)          # segunda-feira
+_PARTO = datetime.date(2026, 3, 1)
+
+
+def _dia(d):
+    return d.isoformat()
+
+
+def _producao(dias=60, domingo=1.0, rebanho=0.0):
+    """Mimosa segue Wood(25; 0,15; 0,004) desde o parto; `domingo` multiplica
+    o domingo e `rebanho` lança litros diários sem animal."""
+    prod = []
+    for k in range(dias, 0, -1):
+        d = _HOJE - datetime.timedelta(days=k)
+        f = domingo if d.weekday() == 6 else 1.0
+        prod.append({"nome_animal": "Mimosa", "data": _dia(d),
+                     "leite": lactacao.wood((d - _PARTO).days, 25.0, 0.15, 0.004) * f})
+        if rebanho:
+            prod.append({"nome_animal": "Rebanho", "data": _dia(d), "leite": rebanho * f})
+    return prod
+
+
+_MIMOSA = {"nome": "Mimosa", "status": "Lactação", "dt_parto": _dia(_PARTO)}
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Projeção por vaca
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_soma_das_curvas_mais_producao_sem_cadastro():
+    pintada = [{**p, "nome_animal": "Pintada", "leite": 10.0} for p in _producao()]
+    prev = previsao.prever(_producao() + pintada, [_MIMOSA], _HOJE, dias=7)
+    assert prev["modelo"]["base"] == "curvas" and prev["modelo"]["vacas"] == 1
+    assert prev["modelo"]["resto"] == 10.0
+    for k, d in enumerate(prev["dias"]):
+        dim = (_HOJE - _PARTO).days + k
+        assert d["litros"] == pytest.approx(lactacao.wood(dim, 25.0, 0.15, 0.004) + 10, rel=0.01)
+        assert d["min"] < d["litros"] < d["max"]
+    assert prev["total"] == pytest.approx(sum(d["litros"] for d in prev["dias"]), abs=0.5)
+
+def test_lactante_sem_registro_proprio_nao_entra():
+    outra = {"nome": "Estrela", "status": "Lactação", "dt_parto": _dia(_PARTO)}
+    so_mimosa = previsao.prever(_producao(), [_MIMOSA], _HOJE, dias=7)
+    prev = previsao.prever(_producao(), [_MIMOSA, outra], _HOJE, dias=7)
+    assert prev["modelo"]["vacas"] == 1 and prev["total"] == so_mimosa["total"]
+
+def test_so_totais_do_rebanho_calibra_sem_somar():
+    vacas = [{"nome": f"Vaca {i}", "status": "Lactação",
+              "dt_parto": _dia(_PARTO + datetime.timedelta(days=7 * i))} for i in range(10)]
+    totais = [{"nome_animal": "Rebanho", "data": _dia(_HOJE - datetime.timedelta(days=k)),
+               "leite": 150.0} for k in range(1, 61)]
+    prev = previsao.prever(totais, vacas, _HOJE, dias=7)
+    assert prev["modelo"]["base"] == "rebanho" and prev["modelo"]["resto"] == 0.0
+    assert prev["media_dia"] == pytest.approx(150.0, rel=0.05)
+
+def test_secagem_e_parto_no_horizonte():
+    insem = _HOJE + datetime.timedelta(days=3 + previsao.reproducao.DIAS_SECAR
+                                       - previsao.reproducao.GESTACAO)
+    mimosa = {**_MIMOSA, "prenhez": True, "dt_insem": _dia(insem)}        # seca em 3 dias
+    novilha = {"nome": "Flor", "status": "Novilha", "prenhez": True,
+               "dt_insem": _dia(_HOJE - datetime.timedelta(days=previsao.reproducao.GESTACAO - 5))}
+    prev = previsao.prever(_producao(), [mimosa, novilha], _HOJE, dias=10)
+    assert (prev["modelo"]["secagens"], prev["modelo"]["partos"]) == (1, 1)
+    litros = [d["litros"] for d in prev["dias"]]
+    assert litros[2] > 0 and litros[3:6] == [0.0, 0.0, 0.0]   # Mimosa seca, Flor ainda não pariu
+    assert litros[9] > litros[6] > 0                          # novilha parida entra na conta
+
+def test_sem_historico_suficiente():
+    prev = previsao.prever(_producao(dias=3), [_MIMOSA], _HOJE)
+    assert prev["dias"] == [] and prev["modelo"]["base"] == "sem_dados"
+    assert previsao.resumo(prev) is None
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Efeito dia da semana
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_domingo_mais_baixo():
+    prev = previsao.prever(_producao(domingo=0.7, rebanho=20.0), [_MIMOSA], _HOJE, dias=7)
+    semana = prev["modelo"]["semana"]
+    assert semana[6] < 0.8 < 1.0 < min(semana[:6])
+    por_dia = {datetime.date.fromisoformat(d["data"]).weekday(): d["litros"] for d in prev["dias"]}
+    assert por_dia[6] < 0.8 * por_dia[5]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cache do lote noturno
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_previsao_do_dia_calculada_uma_vez(tmp_path, monkeypatch):
+    monkeypatch.setattr(previsao, "CACHE", CacheDisco("p", 10**6, diretorio=str(tmp_path)))
+    leituras = []
+
+    def carregar():
+        leituras.append(1)
+        return _producao(), [_MIMOSA]
+
+    p1 = previsao.previsao("faz-prev", carregar, _HOJE)
+    assert previsao.previsao("faz-prev", carregar, _HOJE) is p1
+    previsao._MEMO.clear()                                    # outro processo: lê do disco
+    assert previsao.em_cache("faz-prev", _dia(_HOJE)) == p1
+    assert len(leituras) == 1
+    previsao.previsao("faz-prev", carregar, _HOJE, recalcular=True)
+    assert len(leituras) == 2
+    assert previsao.resumo(p1, 7)["dias"] == 7
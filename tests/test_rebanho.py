@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+test_rebanho.py — Testes unitarios do retrato colunar do rebanho (rebanho.py)
+Datas em datetime64 com NaT para vazio/invalido, status como categoria,
+consultas vetorizadas por DIM, prenhez e inseminacao.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+np = pytest.importorskip("numpy")
+from rebanho import Rebanho
+
+_HOJE = datetime.date(2026, 3, 10)
+
+_ANIMAIS = [
+    {"nome": "Mimosa",  "id": "MIMO", "status": "Lactação", "dt_parto": "2026-01-01"},             # DIM 68
+    {"nome": "Estrela", "id": "EST",  "status": "Lactação", "dt_parto": "2025-11-01",
+     "dt_insem": "2026-01-20"},                                                                    # inseminada
+    {"nome": "Jurema",  "id": "JUR",  "status": "Lactação", "dt_parto": "2025-10-01",
+     "prenhez": True, "dt_insem": "2025-12-10"},
+    {"nome": "Boneca",  "id": "BON",  "status": "Seca", "dt_parto": "2025-09-01"},                 # DIM 190
+    {"nome": "Pintada", "id": "PIN",  "status": "Lactação", "dt_parto": "2026-02-30"},             # data inválida
+    {"nome": "Tourinho", "status": "Reprodutor", "nasc": ""},
+]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Colunas
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_colunas_convertidas_uma_vez():
+    reb = Rebanho(_ANIMAIS)
+    assert len(reb) == 6
+    assert reb.dt_parto.dtype == np.dtype("datetime64[D]")
+    assert np.isnat(reb.dt_parto[4]) and np.isnat(reb.nasc[5])
+    assert reb.categorias[-1] == "Reprodutor"
+    assert reb.com_status("Lactação").sum() == 4
+    assert reb.id[5] == "Tourinho"
+
+def test_dim_com_nan_sem_parto():
+    dim = Rebanho(_ANIMAIS).dim(_HOJE)
+    assert dim[0] == 68 and dim[3] == 190
+    assert np.isnan(dim[4]) and np.isnan(dim[5])
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Consultas vetorizadas
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_lactantes_vazias_com_dim_acima_de_60():
+    reb = Rebanho(_ANIMAIS)
+    m = reb.filtrar(_HOJE, status="Lactação", prenhe=False, inseminada=False, dim_min=61)
+    assert reb.nomes(m) == ["Mimosa"]
+    assert reb.nomes(reb.vazias(_HOJE, 91)) == ["Boneca"]
+    assert reb.nomes(reb.vazias(_HOJE, 45, 90)) == ["Mimosa"]
+
+def test_linhas_com_dim():
+    reb = Rebanho(_ANIMAIS)
+    linhas = reb.linhas(reb.com_status("Lactação"), _HOJE)
+    assert linhas[0] == {"nome": "Mimosa", "id": "MIMO", "dim": 68}
+    assert linhas[-1]["dim"] is None
+    assert Rebanho([]).nomes(Rebanho([]).filtrar(_HOJE, dim_min=1)) == []
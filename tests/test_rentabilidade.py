@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+test_rentabilidade.py — Testes unitarios do motor de rentabilidade (rentabilidade.py)
+Modelo de custo unico (preco do leite, custo da racao, veterinario, rateio),
+agregacao vetorizada por animal, os tres rankings e o cache por fazenda/janela
+recalculado so quando a versao dos dados muda.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip("numpy")
+import rentabilidade
+
+_PROD = [
+    {"nome_animal": "Mimosa",  "id_animal": "MIMO", "leite": 20, "racao": 5, "data": "2026-03-01"},
+    {"nome_animal": "Mimosa",  "id_animal": "MIMO", "leite": 10, "racao": 0, "data": "2026-03-01"},
+    {"nome_animal": "Mimosa",  "id_animal": "MIMO", "leite": 30, "racao": 5, "data": "2026-03-02"},
+    {"nome_animal": "Estrela", "id_animal": "EST",  "leite": 20, "racao": 10, "data": "2026-03-02"},
+    {"nome_animal": "Seca",    "id_animal": "SEC",  "leite": 0,  "racao": 2, "data": "2026-03-02"},
+]
+_SAN = [
+    {"animal": "Estrela", "custo": 30.0},             # bot grava "custo"
+    {"nome_animal": "Mimosa", "valor": 6.0},          # app grava "valor"
+    {"animal": "Rebanho Todo", "custo": 99.0},        # sem animal produtivo: ignorado
+]
+_FIN = [
+    {"cat": "Venda de Leite", "valor": 200.0, "tipo": "receita"},
+    {"cat": "Energia", "valor": 40.0, "tipo": "despesa"},
+    {"categoria": "Ração / Nutrição", "valor": 500.0},            # já no consumo
+    {"cat": "Compra de Animais", "valor": 3000.0},                # capital
+    {"cat": "Medicamento / Sanitário", "valor": 30.0, "animal": "Estrela"},
+]
+_EST = [{"item": "Sal mineral", "custo_medio": 9.0},
+        {"item": "Ração 22%", "qtd": 100, "valor_total": 150.0}]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Modelo de custo
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_custo_racao_kg_do_estoque():
+    assert rentabilidade.custo_racao_kg(_EST) == 1.5
+    assert rentabilidade.custo_racao_kg([{"item": "Concentrado", "custo_medio": 2.1}]) == 2.1
+    assert rentabilidade.custo_racao_kg([]) == rentabilidade.CUSTO_RACAO_PADRAO
+
+def test_preco_do_leite_e_custos_fixos():
+    assert rentabilidade.preco_leite({}, _FIN, 80) == 2.5
+    assert rentabilidade.preco_leite({"preco_leite": "2.8"}, [], 80) == 2.8
+    assert rentabilidade.preco_leite({}, [], 80) == rentabilidade.PRECO_PADRAO
+    assert rentabilidade.custos_fixos(_FIN) == 40.0
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cálculo vetorizado
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_linhas_por_animal():
+    r = rentabilidade.calcular(_PROD, _SAN, _FIN, {}, _EST, 30)
+    por_nome = {l["nome"]: l for l in r["linhas"]}
+    assert set(por_nome) == {"Mimosa", "Estrela"}          # sem litros fica de fora
+    m = por_nome["Mimosa"]
+    assert (m["litros"], m["registros"], m["dias"], m["media_dia"]) == (60.0, 3, 2, 2.0)
+    assert m["receita"] == 150.0 and m["custo_racao"] == 15.0 and m["custo_vet"] == 6.0
+    assert m["custo_rateio"] == 30.0                       # 60 de 80 L × R$ 40
+    assert m["custo_total"] == 51.0 and m["margem"] == m["lucro"] == 99.0
+    e = por_nome["Estrela"]
+    assert e["custo_vet"] == 30.0 and e["custo_rateio"] == 10.0 and e["id_animal"] == "EST"
+    assert e["custo_litro"] == pytest.approx(55.0 / 20)
+
+def test_tres_rankings_e_custo_operacional():
+    r = rentabilidade.calcular(_PROD, _SAN, _FIN, {}, _EST, 30)
+    assert [l["nome"] for l in r["producao"]] == ["Mimosa", "Estrela"]
+    assert [l["nome"] for l in r["rentabilidade"]] == ["Mimosa", "Estrela"]
+    assert [l["nome"] for l in r["alerta_descarte"]] == ["Estrela", "Mimosa"]
+    op = rentabilidade.calcular(_PROD, [], [], {"preco_leite": 2.0}, [], 30, custo_litro_op=0.5)
+    assert {l["nome"]: l["custo_total"] for l in op["linhas"]}["Estrela"] == 12.0 + 10.0
+    vazio = rentabilidade.calcular([], [], [], {}, [], 30)
+    assert vazio["linhas"] == [] and vazio["preco_leite"] == rentabilidade.PRECO_PADRAO
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cache por fazenda e janela
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_cache_recalcula_so_com_nova_versao():
+    leituras = []
+
+    def carregar(ini, fim):
+        leituras.append((ini, fim))
+        return {"producao": _PROD, "sanitario": _SAN, "financeiro": _FIN, "estoque": _EST}
+
+    ini, fim = rentabilidade.janela(30, datetime.date(2026, 3, 31))
+    assert (ini, fim) == ("2026-03-01", "2026-03-31")
+    r1 = rentabilidade.ranking("faz-rent", ini, fim, 30, carregar, versao=1)
+    assert rentabilidade.ranking("faz-rent", ini, fim, 30, carregar, versao=1) is r1
+    assert len(leituras) == 1
+    r2 = rentabilidade.ranking("faz-rent", ini, fim, 30, carregar, versao=2)
+    assert r2 is not r1 and r2["linhas"] == r1["linhas"] and len(leituras) == 2
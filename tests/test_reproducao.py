@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+test_reproducao.py — Testes unitarios do calendario reprodutivo (reproducao.py)
+Linha do tempo por animal (diagnostico, inseminar, secar, parto, colostro,
+desmame), consulta por vencimento e por intervalo pendente, agenda semanal e
+cache por fazenda remontado so quando os animais mudam.
+Nao requer servidor nem Firebase.
+"""
+import sys
+import os
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import reproducao
+from reproducao import Calendario
+
+_D = datetime.date
+_HOJE = _D(2026, 3, 10)
+
+_REBANHO = [
+    # inseminada há 30 dias, sem diagnóstico
+    {"nome": "Mimosa", "status": "Lactação", "dt_insem": "2026-02-08", "prenhez": False},
+    # parida há 50 dias, sem inseminação → atrasada desde o dia 46
+    {"nome": "Estrela", "status": "Lactação", "dt_parto": "2026-01-19"},
+    # prenhe: parto previsto 2026-03-15 → secagem venceu em 2026-01-14
+    {"nome": "Jurema", "status": "Lactação", "dt_insem": "2025-06-05", "prenhez": True},
+    {"nome": "Bezerrinha", "status": "Bezerro", "nasc": "2026-03-09", "colostro": False},
+    {"nome": "Garrote", "status": "Bezerro", "nasc": "2025-12-01", "colostro": True},
+    {"nome": "Vendida", "status": "Vendido", "dt_insem": "2026-02-08"},
+]
+
+
+def _tipos(evs):
+    return sorted((e["tipo"], e["nome"]) for e in evs)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Linha do tempo
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_eventos_do_animal():
+    evs = reproducao.eventos_do_animal(_REBANHO[2])
+    secar, parto = sorted(evs, key=lambda e: e["data"])
+    assert parto["data"] == _D(2026, 3, 15) and parto["ini"] == _D(2026, 3, 8)
+    assert secar["data"] == _D(2026, 1, 14) and secar["parto"] == parto["data"]
+    assert reproducao.eventos_do_animal(_REBANHO[5]) == []
+
+def test_vencendo_hoje():
+    cal = Calendario(_REBANHO)
+    assert _tipos(cal.vencendo(_HOJE)) == [("diagnostico", "Mimosa")]
+    assert _tipos(cal.vencendo(_D(2026, 3, 6), tipos=("inseminar",))) == [("inseminar", "Estrela")]
+
+def test_pendentes_por_intervalo():
+    cal = Calendario(_REBANHO)
+    assert _tipos(cal.pendentes(_HOJE)) == [
+        ("colostro", "Bezerrinha"), ("desmame", "Garrote"), ("diagnostico", "Mimosa"),
+        ("inseminar", "Estrela"), ("parto", "Jurema"), ("secar", "Jurema")]
+    # colostro só nos 2 primeiros dias de vida
+    assert cal.pendentes(_D(2026, 3, 12), tipos=("colostro",)) == []
+    assert cal.pendentes(_D(2026, 2, 1), _D(2026, 2, 28), tipos=("colostro", "parto")) == []
+
+def test_agenda_da_semana():
+    ag = reproducao.agenda(Calendario(_REBANHO), _HOJE, 7)
+    assert len(ag) == 7
+    assert _tipos(ag["2026-03-10"]) == [("diagnostico", "Mimosa"), ("parto", "Jurema")]
+    assert ag["2026-03-14"][0]["faltam"] == 1
+    assert "2026-03-15" in ag and ag["2026-03-15"] == []
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# PYTEST — Cache por fazenda
+# ═══════════════════════════════════════════════════════════════════════
+
+def test_cache_remonta_so_quando_animais_mudam():
+    animais = [dict(a) for a in _REBANHO]
+    leituras = []
+
+    def carregar():
+        leituras.append(1)
+        return animais
+
+    c1 = reproducao.calendario("faz-teste", carregar)
+    assert reproducao.calendario("faz-teste", carregar) is c1
+    animais[0]["prenhez"] = True
+    c2 = reproducao.calendario("faz-teste", carregar)
+    assert c2 is not c1 and not c2.vencendo(_HOJE, tipos=("diagnostico",))
+    # com versão do chamador, nem relê a lista
+    n = len(leituras)
+    reproducao.calendario("faz-teste", carregar, versao=7)
+    assert reproducao.calendario("faz-teste", carregar, versao=7) is c2
+    assert len(leituras) == n + 1
@@ -37,6 +37,7 @@ import logging
 from typing import Optional
 
 import httpx
+import numpy as np
 from fastapi import FastAPI, Form, Response, Request, Header, HTTPException
 from pydantic import BaseModel
 import firebase_admin
@@ -47,7 +48,18 @@ logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("milkshow_bot")
 
 from starlette.middleware.cors import CORSMiddleware
-from mobile_api import mobile_router, notify_update
+from mobile_api import (mobile_router, notify_update, versao_colecao, versao_fazenda,
+                        alocar_id_animal, curvas_lactacao, previsao_fazenda)
+import relatorios
+import midia
+import conversa
+import anomalias
+import indices
+import lactacao
+import previsao
+import reproducao
+import rebanho
+import rentabilidade
 
 app = FastAPI(title="MilkShow WhatsApp Bot", version="1.0", docs_url=None, redoc_url=None)
 
@@ -325,8 +337,11 @@ def _get_conv(tel: str) -> dict:
 
 
 def _save_conv(tel: str, conv: dict):
-    """Grava em memória imediatamente; persiste no Firebase em background."""
+    """Grava em memória imediatamente; persiste no Firebase em background.
+    O histórico é compactado antes (resumo dos turnos antigos, teto por turno)."""
     conv["ts"] = datetime.datetime.now().isoformat()
+    conv["historico"] = conversa.compactar_historico(
+        conv.get("historico") or [], conv.get("tipo"), conv.get("dados"))
     with _CONV_LOCK:
         _CONV_MEM[tel] = dict(conv)
 
@@ -454,6 +469,101 @@ def _rate_ok(tel: str, max_por_min: int = 10) -> bool:
     return True
 
 
+# ─────────────────────────────────────────────
+# EXECUTORES DEDICADOS
+# Respostas ao produtor (interativo), disparos das 6h (agendador) e
+# geração de PDF rodam em pools separados — um broadcast pesado não
+# atrasa a resposta de quem está conversando com o bot.
+# ─────────────────────────────────────────────
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+import time as _time_exec
+
+
+class _ExecutorMedido:
+    """ThreadPoolExecutor nomeado que mede fila, tempo de espera e de execução."""
+
+    def __init__(self, nome: str, max_workers: int, espera_alerta_s: float = 2.0):
+        self.nome        = nome
+        self.max_workers = max_workers
+        self._espera_alerta = espera_alerta_s
+        self._pool = _ThreadPoolExecutor(max_workers=max_workers,
+                                         thread_name_prefix=f"ms-{nome}")
+        self._lock = threading.Lock()
+        self._m = {
+            "enviadas": 0, "na_fila": 0, "em_execucao": 0, "concluidas": 0, "erros": 0,
+            "espera_total_s": 0.0, "espera_max_s": 0.0,
+            "execucao_total_s": 0.0, "execucao_max_s": 0.0,
+        }
+
+    def submit(self, fn, *args, **kwargs):
+        """Agenda fn no pool e devolve um concurrent.futures.Future."""
+        t_envio = _time_exec.monotonic()
+        with self._lock:
+            self._m["enviadas"] += 1
+            self._m["na_fila"]  += 1
+
+        def _rodar():
+            t_ini  = _time_exec.monotonic()
+            espera = t_ini - t_envio
+            with self._lock:
+                self._m["na_fila"]     -= 1
+                self._m["em_execucao"] += 1
+                self._m["espera_total_s"] += espera
+                self._m["espera_max_s"] = max(self._m["espera_max_s"], espera)
+            if espera > self._espera_alerta:
+                log.warning(f"[exec:{self.nome}] tarefa {getattr(fn, '__name__', '?')} "
+                            f"esperou {espera:.1f}s na fila")
+            ok = False
+            try:
+                resultado = fn(*args, **kwargs)
+                ok = True
+                return resultado
+            finally:
+                dur = _time_exec.monotonic() - t_ini
+                with self._lock:
+                    self._m["em_execucao"] -= 1
+                    self._m["concluidas"]  += 1
+                    if not ok:
+                        self._m["erros"] += 1
+                    self._m["execucao_total_s"] += dur
+                    self._m["execucao_max_s"] = max(self._m["execucao_max_s"], dur)
+
+        return self._pool.submit(_rodar)
+
+    async def executar(self, fn, *args, **kwargs):
+        """Versão async de submit — substitui asyncio.to_thread."""
+        return await _asyncio_fila.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._m)
+        n = m["concluidas"] or 1
+        return {
+            "workers":          self.max_workers,
+            "na_fila":          m["na_fila"],
+            "em_execucao":      m["em_execucao"],
+            "enviadas":         m["enviadas"],
+            "concluidas":       m["concluidas"],
+            "erros":            m["erros"],
+            "espera_media_s":   round(m["espera_total_s"] / n, 3),
+            "espera_max_s":     round(m["espera_max_s"], 3),
+            "execucao_media_s": round(m["execucao_total_s"] / n, 3),
+            "execucao_max_s":   round(m["execucao_max_s"], 3),
+        }
+
+
+_EXEC_INTERATIVO = _ExecutorMedido("interativo", int(os.environ.get("EXEC_INTERATIVO_WORKERS", "16")))
+_EXEC_AGENDADOR  = _ExecutorMedido("agendador",  int(os.environ.get("EXEC_AGENDADOR_WORKERS", "4")),
+                                   espera_alerta_s=60.0)
+_EXEC_PDF        = _ExecutorMedido("pdf",        int(os.environ.get("EXEC_PDF_WORKERS", "2")),
+                                   espera_alerta_s=30.0)
+_EXECUTORES = {e.nome: e for e in (_EXEC_INTERATIVO, _EXEC_AGENDADOR, _EXEC_PDF)}
+
+
+def _metricas_executores() -> dict:
+    return {nome: e.metricas() for nome, e in _EXECUTORES.items()}
+
+
 # ── Leitores com cache ───────────────────────
 def _cached_animais(fazenda_id: str) -> list:
     key = f"anm:{fazenda_id}"
@@ -468,34 +578,147 @@ def _cached_animais(fazenda_id: str) -> list:
     return docs
 
 
+def _indice_animais(fazenda_id: str) -> indices.IndiceAnimais:
+    """Índice de nomes/apelidos/brincos, em cache junto com a lista de animais
+    (mesmo prefixo anm: — invalidado junto a cada escrita)."""
+    key = f"anm:{fazenda_id}:idx"
+    r = _cache_get(key)
+    if r is not None:
+        return r
+    idx = indices.IndiceAnimais(_cached_animais(fazenda_id))
+    _cache_set(key, idx, 600)
+    return idx
+
+
 def _resolver_animal(fazenda_id: str, nome_ia: str):
-    """Resolve o nome retornado pela IA para o nome exato cadastrado no Firebase.
-    A IA já fez a correspondência semântica e deve retornar o nome exato da lista.
-    Este fallback só corrige diferença de capitalização.
-    Retorna (nome_resolvido, id_resolvido).
+    """Resolve o nome vindo da IA ou do produtor para o animal cadastrado:
+    nome sem acento/artigo, apelido, diminutivo, brinco (#id) ou erro de digitação.
+    Retorna (nome_resolvido, id_resolvido); sem correspondência única devolve o
+    texto recebido.
     """
     if not nome_ia:
         return nome_ia, nome_ia
-    todos = _cached_animais(fazenda_id)
-    lower = nome_ia.lower().strip()
-    for a in todos:
-        if a.get("nome", "").lower() == lower:
-            return a["nome"], a.get("id", a["nome"])
+    a = _indice_animais(fazenda_id).resolver(nome_ia)
+    if a:
+        return a["nome"], a.get("id", a["nome"])
     # Sem match → devolve o que a IA enviou (IA já deveria ter pedido confirmação)
     return nome_ia, nome_ia
 
 
-def _cached_estoque(fazenda_id: str) -> list:
-    key = f"est:{fazenda_id}"
+_IDX_ESTOQUE: dict = {}   # fazenda_id → (IndiceEstoque, versão da coleção, expira)
+_IDX_ESTOQUE_LOCK = threading.Lock()
+
+
+def _indice_estoque(fazenda_id: str) -> indices.IndiceEstoque:
+    """Índice do estoque da fazenda. As escritas do bot o atualizam no lugar;
+    é relido quando o app grava no estoque (versao_colecao) ou após 10 min."""
+    versao = versao_colecao(fazenda_id, "estoque")
+    agora  = datetime.datetime.now()
+    with _IDX_ESTOQUE_LOCK:
+        e = _IDX_ESTOQUE.get(fazenda_id)
+    if e and e[1] == versao and e[2] > agora:
+        return e[0]
+    try:
+        itens = [{"doc_id": d.id, **d.to_dict()} for d in _coll(fazenda_id, "estoque").stream()]
+    except Exception as ex:
+        log.warning(f"estoque: falha ao ler coleção: {ex}")
+        return indices.IndiceEstoque([])
+    idx = indices.IndiceEstoque(itens)
+    with _IDX_ESTOQUE_LOCK:
+        _IDX_ESTOQUE[fazenda_id] = (idx, versao, agora + datetime.timedelta(seconds=600))
+    return idx
+
+
+def _rebanho(fazenda_id: str) -> rebanho.Rebanho:
+    """Retrato colunar do rebanho (datas já convertidas), no mesmo ciclo de
+    cache da lista de animais (prefixo anm:)."""
+    key = f"anm:{fazenda_id}:reb"
     r = _cache_get(key)
     if r is not None:
         return r
+    reb = rebanho.Rebanho(_cached_animais(fazenda_id))
+    _cache_set(key, reb, 600)
+    return reb
+
+
+def _curvas(fazenda_id: str) -> lactacao.CurvasLactacao:
+    """Curvas de Wood por vaca, com os partos da lista de animais em cache."""
+    cur = curvas_lactacao(fazenda_id)
+    cur.sincronizar(_cached_animais(fazenda_id))
+    return cur
+
+
+def _detector(fazenda_id: str) -> anomalias.Detector:
+    """Detector de anomalias de produção, montado pelo replay da produção
+    recente; as escritas do bot o atualizam no lugar (_apos_producao)."""
+    ini = (datetime.date.today() - datetime.timedelta(days=anomalias.JANELA_DIAS)).isoformat()
+    return anomalias.detector(fazenda_id, lambda: _cached_producao(fazenda_id, ini),
+                              versao_colecao(fazenda_id, "producao"))
+
+
+def _apos_producao(fazenda_id: str, nome: str, data, litros: float) -> list:
+    """Repassa uma escrita de produção do bot (litros negativos = remoção) às
+    estruturas incrementais já montadas, sem forçar leitura. Retorna as flags
+    de anomalia geradas pela escrita."""
+    flags = []
     try:
-        docs = [d.to_dict() for d in _coll(fazenda_id, "estoque").stream()]
-    except Exception:
-        docs = []
-    _cache_set(key, docs, 600)
-    return docs
+        cur = lactacao.existente(fazenda_id)
+        if cur is not None:
+            cur.registrar(nome, data, litros)
+        det = anomalias.existente(fazenda_id)
+        if det is not None:
+            flags = det.registrar(nome, data, litros)
+    except Exception as e:
+        log.warning(f"_apos_producao: {e}")
+    return flags
+
+
+def _calendario(fazenda_id: str) -> reproducao.Calendario:
+    """Calendário reprodutivo da fazenda — remontado só quando os animais mudam."""
+    return reproducao.calendario(fazenda_id, lambda: _cached_animais(fazenda_id))
+
+
+def _cached_estoque(fazenda_id: str) -> list:
+    return _indice_estoque(fazenda_id).itens()
+
+
+_IDX_PRODUCAO: dict = {}   # fazenda_id → (IndiceProducao, versão da coleção, expira, lido em)
+_IDX_PRODUCAO_LOCK = threading.Lock()
+# Idade máxima do índice para dispensar a consulta de duplicata ao Firestore
+_IDX_PRODUCAO_DUP_S = int(os.environ.get("PRODUCAO_DUP_INDICE_S", "60"))
+
+
+def _indice_producao(fazenda_id: str) -> indices.IndiceProducao:
+    """Produção dos últimos 14 dias da fazenda (duplicata por animal/dia/turno e
+    média diária do rebanho). Mesmo ciclo do índice de estoque: escritas do bot
+    atualizam no lugar, escrita do app ou 10 min → relê. O app legado não mexe
+    no contador de versões: o índice pode estar até 10 min atrás dele — ver
+    _indice_producao_idade."""
+    versao = versao_colecao(fazenda_id, "producao")
+    agora  = datetime.datetime.now()
+    with _IDX_PRODUCAO_LOCK:
+        e = _IDX_PRODUCAO.get(fazenda_id)
+    if e and e[1] == versao and e[2] > agora:
+        e[0].rolar(agora.date())
+        return e[0]
+    ini = (agora.date() - datetime.timedelta(days=indices.IndiceProducao.DIAS)).isoformat()
+    try:
+        docs = [{"doc_id": d.id, **d.to_dict()} for d in
+                _coll(fazenda_id, "producao").where(filter=FieldFilter("data", ">=", ini)).stream()]
+    except Exception as ex:
+        log.warning(f"producao: falha ao ler janela de 14 dias: {ex}")
+        return indices.IndiceProducao([], agora.date())
+    idx = indices.IndiceProducao(docs, agora.date())
+    with _IDX_PRODUCAO_LOCK:
+        _IDX_PRODUCAO[fazenda_id] = (idx, versao, agora + datetime.timedelta(seconds=600), agora)
+    return idx
+
+
+def _indice_producao_idade(fazenda_id: str) -> float:
+    """Segundos desde a última leitura do índice de produção no Firestore."""
+    with _IDX_PRODUCAO_LOCK:
+        e = _IDX_PRODUCAO.get(fazenda_id)
+    return (datetime.datetime.now() - e[3]).total_seconds() if e else float("inf")
 
 
 def _cached_producao(fazenda_id: str, ini: str, fim: str = None) -> list:
@@ -530,14 +753,37 @@ def _cached_financeiro(fazenda_id: str, ini: str, fim: str = None) -> list:
     return docs
 
 
+def _rentabilidade(fazenda_id: str, ini: str, dias: int) -> dict:
+    """Rentabilidade por animal de `ini` até hoje (motor único em
+    rentabilidade.py), recalculada só quando a fazenda recebe escrita."""
+    def carregar(ini: str, fim: str) -> dict:
+        try:
+            san = [d.to_dict() for d in _coll(fazenda_id, "sanitario")
+                   .where(filter=FieldFilter("data", ">=", ini))
+                   .where(filter=FieldFilter("data", "<=", fim)).stream()]
+            config = {}
+            for d in _coll(fazenda_id, "config").stream():
+                c = d.to_dict()
+                config[c.get("chave", d.id)] = c.get("valor")
+        except Exception as ex:
+            log.warning(f"rentabilidade: falha ao ler sanitário/config: {ex}")
+            san, config = [], {}
+        return {"producao": _cached_producao(fazenda_id, ini, fim), "sanitario": san,
+                "financeiro": _cached_financeiro(fazenda_id, ini, fim), "config": config,
+                "estoque": _cached_estoque(fazenda_id)}
+    fim = datetime.date.today().isoformat()
+    return rentabilidade.ranking(fazenda_id, ini, fim, dias, carregar, versao_fazenda(fazenda_id))
+
+
 # ─────────────────────────────────────────────
 # CONTEXTO DO REBANHO
 # ─────────────────────────────────────────────
 def _ctx_animais(fazenda_id: str) -> str:
     docs = _cached_animais(fazenda_id)
-    lst  = [f"{a.get('nome','?')} (#{a.get('id','?')}, {a.get('status','')})"
+    lst  = [f"{a.get('nome','?')} (#{a.get('id','?')}, {a.get('status','')}"
+            + (f", apelidos: {'/'.join(indices.apelidos(a))}" if a.get('apelidos') else "") + ")"
             for a in docs if a.get('status') != 'Vendido']
-    return ", ".join(lst[:25]) or "nenhum cadastrado"
+    return ", ".join(lst) or "nenhum cadastrado"
 
 
 def _ctx_estoque(fazenda_id: str) -> str:
@@ -556,7 +802,8 @@ def _classificar_pergunta(texto: str) -> set:
     secoes: set = set()
 
     if any(p in lower for p in ['produc', 'ordenh', 'litro', 'leite', 'produziu', 'produzi',
-                                  'produção', 'producao', 'média', 'media', 'semana', 'quanto leite']):
+                                  'produção', 'producao', 'média', 'media', 'semana', 'quanto leite',
+                                  'previsao', 'previsão', 'vai produzir', 'vou produzir']):
         secoes.add('producao')
         secoes.add('rebanho')  # IA precisa ver lista de animais para pedir por animal
     if any(p in lower for p in ['financ', 'saldo', 'gasto', 'receita', 'despesa', 'pagou', 'paguei',
@@ -684,6 +931,13 @@ def _ctx_dados_fazenda(fazenda_id: str, secoes: set = None) -> str:
                 ctx.append(f"  Mes anterior: {total_mes_ant:.0f} L")
                 if top:
                     ctx.append("  Por vaca (mes): " + ", ".join(f"{n}={v:.0f}L" for n, v in top))
+                # previsão da tarefa das 5h — só do cache, sem recalcular na conversa
+                prev = previsao.em_cache(fazenda_id, hoje_iso)
+                r7, r30 = previsao.resumo(prev, 7), previsao.resumo(prev, 30)
+                if r7:
+                    ctx.append(f"  Previsao proximos 7 dias: {r7['total']:.0f} L "
+                               f"(media {r7['media_dia']:.0f} L/dia, faixa {r7['min']:.0f}-{r7['max']:.0f} L)")
+                    ctx.append(f"  Previsao proximos {r30['dias']} dias: {r30['total']:.0f} L")
         except Exception:
             pass
 
@@ -722,24 +976,16 @@ def _ctx_dados_fazenda(fazenda_id: str, secoes: set = None) -> str:
     # ── REPRODUÇÃO ────────────────────────────
     if 'reproducao' in secoes and animais_raw:
         try:
-            animais_rep = [a for a in animais_raw if a.get("status") in ("Lactação", "Seca")]
-            if animais_rep:
-                total_rep = len(animais_rep)
-                prenhes_n = sum(1 for a in animais_rep if a.get("prenhez"))
-                tx_pren   = prenhes_n / total_rep * 100 if total_rep else 0
-                janela_ideal = []
-                inseminar_agora = []
-                for a in animais_rep:
-                    if a.get("prenhez") or a.get("dt_insem"):
-                        continue
-                    dp = _parse_dt(a.get("dt_parto"))
-                    if not dp:
-                        continue
-                    dias_pp = (hoje - dp).days
-                    if 45 <= dias_pp <= 90:
-                        janela_ideal.append(f"{a.get('nome','?')} ({dias_pp}d pós-parto)")
-                    elif dias_pp > 90:
-                        inseminar_agora.append(f"{a.get('nome','?')} ({dias_pp}d sem inseminar)")
+            reb = _rebanho(fazenda_id)
+            rep = reb.com_status(*rebanho.REPRODUTIVOS)
+            total_rep = int(rep.sum())
+            if total_rep:
+                prenhes_n = int((rep & reb.prenhez).sum())
+                tx_pren   = prenhes_n / total_rep * 100
+                janela_ideal = [f"{l['nome']} ({l['dim']}d pós-parto)"
+                                for l in reb.linhas(reb.vazias(hoje, 45, 90), hoje)]
+                inseminar_agora = [f"{l['nome']} ({l['dim']}d sem inseminar)"
+                                   for l in reb.linhas(reb.vazias(hoje, 91), hoje)]
                 ctx.append(f"\nREPRODUCAO:")
                 ctx.append(f"  Taxa de prenhez: {tx_pren:.0f}% ({prenhes_n}/{total_rep})")
                 if janela_ideal:
@@ -765,63 +1011,52 @@ def _ctx_dados_fazenda(fazenda_id: str, secoes: set = None) -> str:
         try:
             ctx.append(f"\nESTOQUE ({len(est_raw)} itens):")
             for e in est_raw:
+                prev = indices.previsao_consumo(e, hoje)
+                dura = (f", consumo {prev['consumo_dia']:.1f}/dia, acaba em ~{prev['dias_restantes']}d"
+                        if prev["dias_restantes"] is not None else "")
                 ctx.append(f"  {e.get('item','?')}: {e.get('qtd',0):.1f} {e.get('un','')} "
-                            f"(custo medio R${e.get('custo_medio',0):.2f})")
+                            f"(custo medio R${e.get('custo_medio',0):.2f}{dura})")
         except Exception:
             pass
 
     # ── AGENDA ────────────────────────────────
     if 'agenda' in secoes and animais_raw:
         try:
-            GESTACAO     = 283
-            DIAS_SECAR   = 60
-            DIAS_DIAGN   = 30
-            DIAS_PVE     = 45
-            DIAS_DESMAME = 90
-            SEMANA_ISO   = (hoje + datetime.timedelta(days=7)).isoformat()
+            semana       = hoje + datetime.timedelta(days=7)
+            SEMANA_ISO   = semana.isoformat()
             tarefas_hoje   = []
             tarefas_semana = []
             ordenhados_hoje = {d.get('id_animal') for d in prod_mes_raw if d.get('data') == hoje_iso}
 
-            for a in animais_raw:
-                nome   = a.get('nome', '?')
-                status = a.get('status', '')
-                d_insem = _parse_dt(a.get('dt_insem'))
-                d_parto = _parse_dt(a.get('dt_parto'))
-                d_nasc  = _parse_dt(a.get('nasc'))
-
-                if status == 'Lactação':
-                    if a.get('id') not in ordenhados_hoje:
-                        tarefas_hoje.append(f"Ordenhar {nome}")
-                    if d_insem and not a.get('prenhez'):
-                        dias_insem = (hoje - d_insem).days
-                        if dias_insem >= DIAS_DIAGN:
-                            tarefas_hoje.append(f"Confirmar prenhez: {nome} (inseminada ha {dias_insem}d)")
-                        elif dias_insem >= DIAS_DIAGN - 7:
-                            tarefas_semana.append(f"Confirmar prenhez em breve: {nome} (faltam {DIAS_DIAGN - dias_insem}d)")
-                    if not a.get('prenhez') and not d_insem and d_parto:
-                        dias_vazia = (hoje - d_parto).days
-                        if dias_vazia > DIAS_PVE:
-                            tarefas_hoje.append(f"Inseminar {nome} (vazia ha {dias_vazia}d)")
-                    if a.get('prenhez') and d_insem:
-                        prev_parto = d_insem + datetime.timedelta(days=GESTACAO)
-                        d_secar    = prev_parto - datetime.timedelta(days=DIAS_SECAR)
-                        dias_secar = (d_secar - hoje).days
-                        if dias_secar <= 0:
-                            tarefas_hoje.append(f"Secar {nome} URGENTE (parto previsto {prev_parto.isoformat()})")
-                        elif dias_secar <= 7:
-                            tarefas_semana.append(f"Secar {nome} em {dias_secar}d (parto ~{prev_parto.isoformat()})")
-                        dias_parto = (prev_parto - hoje).days
-                        if 0 <= dias_parto <= 7:
-                            tarefas_semana.append(f"Parto previsto: {nome} em ~{dias_parto}d ({prev_parto.isoformat()})")
-                        elif dias_parto < 0:
-                            tarefas_hoje.append(f"Parto em atraso: {nome} (previsto {prev_parto.isoformat()})")
-                if status == 'Bezerro' and d_nasc:
-                    idade_bez = (hoje - d_nasc).days
-                    if idade_bez <= 2 and not a.get('colostro'):
-                        tarefas_hoje.append(f"Dar colostro: {nome} (nasceu ha {idade_bez}d)")
-                    if idade_bez >= DIAS_DESMAME:
-                        tarefas_semana.append(f"Desmamar: {nome} ({idade_bez}d de idade)")
+            reb = _rebanho(fazenda_id)
+            nao_ordenhadas = reb.com_status('Lactação') & ~np.isin(reb.id, list(ordenhados_hoje))
+            tarefas_hoje += [f"Ordenhar {nome}" for nome in reb.nomes(nao_ordenhadas)]
+
+            cal = _calendario(fazenda_id)
+            for e in cal.pendentes(hoje, semana):
+                nome, dias = e['nome'], (e['data'] - hoje).days
+                if e['tipo'] == 'diagnostico':
+                    if dias <= 0:
+                        tarefas_hoje.append(f"Confirmar prenhez: {nome} "
+                                            f"(inseminada ha {reproducao.DIAS_DIAGN - dias}d)")
+                    elif dias <= 7:
+                        tarefas_semana.append(f"Confirmar prenhez em breve: {nome} (faltam {dias}d)")
+                elif e['tipo'] == 'inseminar' and dias <= 0:
+                    tarefas_hoje.append(f"Inseminar {nome} (vazia ha {reproducao.DIAS_PVE + 1 - dias}d)")
+                elif e['tipo'] == 'secar':
+                    if dias <= 0:
+                        tarefas_hoje.append(f"Secar {nome} URGENTE (parto previsto {e['parto'].isoformat()})")
+                    else:
+                        tarefas_semana.append(f"Secar {nome} em {dias}d (parto ~{e['parto'].isoformat()})")
+                elif e['tipo'] == 'parto':
+                    if 0 <= dias <= 7:
+                        tarefas_semana.append(f"Parto previsto: {nome} em ~{dias}d ({e['parto'].isoformat()})")
+                    elif dias < 0:
+                        tarefas_hoje.append(f"Parto em atraso: {nome} (previsto {e['parto'].isoformat()})")
+                elif e['tipo'] == 'colostro' and dias <= 0:
+                    tarefas_hoje.append(f"Dar colostro: {nome} (nasceu ha {-dias}d)")
+                elif e['tipo'] == 'desmame' and dias <= 0:
+                    tarefas_semana.append(f"Desmamar: {nome} ({reproducao.DIAS_DESMAME - dias}d de idade)")
 
             if tarefas_hoje or tarefas_semana:
                 ctx.append("\nAGENDA:")
@@ -841,50 +1076,15 @@ def _ctx_dados_fazenda(fazenda_id: str, secoes: set = None) -> str:
     # ── RENTABILIDADE ─────────────────────────
     if 'rentabilidade' in secoes and por_ani_mes and total_mes > 0:
         try:
-            custo_racao_kg = 2.0
-            for e in est_raw:
-                nome_e = e.get('item', '').lower()
-                if any(k in nome_e for k in ['racao', 'ração', 'concentrado', 'silagem']):
-                    c = e.get('custo_medio', 0)
-                    if c and float(c) > 0:
-                        custo_racao_kg = float(c)
-                        break
-            preco_litro = 2.50
-            vendas_leite = [d for d in fin_mes_raw if d.get('cat') == 'Venda de Leite']
-            total_val_vendas = sum(d.get('valor', 0) for d in vendas_leite)
-            if total_val_vendas > 0 and total_mes > 0:
-                preco_litro = total_val_vendas / total_mes
-            custos_fixos_mes = sum(
-                d.get('valor', 0) for d in fin_mes_raw
-                if d.get('cat') not in ('Venda de Leite', 'Venda de Animal') and not d.get('animal')
-            )
-            racao_ani: dict = {}
-            for d in prod_mes_raw:
-                n = d.get('nome_animal', '?')
-                racao_ani[n] = racao_ani.get(n, 0) + d.get('racao', 0)
-            vet_ani: dict = {}
-            for d in fin_mes_raw:
-                ani = d.get('animal')
-                if ani and d.get('cat') not in ('Venda de Leite', 'Venda de Animal'):
-                    vet_ani[ani] = vet_ani.get(ani, 0) + d.get('valor', 0)
+            rent = _rentabilidade(fazenda_id, ini_mes, hoje.day)
+            preco_litro = rent["preco_leite"]
             ctx.append(f"\nRENTABILIDADE POR ANIMAL (mes atual, preco R${preco_litro:.2f}/L):")
-            animais_rent = []
-            for nome_a, litros_a in por_ani_mes.items():
-                c_racao = racao_ani.get(nome_a, 0) * custo_racao_kg
-                c_vet   = vet_ani.get(nome_a, 0)
-                c_fixo  = (litros_a / total_mes) * custos_fixos_mes
-                c_total = c_racao + c_vet + c_fixo
-                receita = litros_a * preco_litro
-                lucro   = receita - c_total
-                c_litro = c_total / litros_a if litros_a > 0 else 0
-                l_litro = preco_litro - c_litro
-                animais_rent.append((nome_a, litros_a, c_litro, l_litro, lucro))
-            animais_rent.sort(key=lambda x: x[4])
-            for nome_a, litros_a, c_l, l_l, lucro in animais_rent:
-                status_rent = "PREJUIZO" if lucro < 0 else ("ATENCAO" if l_l < preco_litro * 0.1 else "OK")
+            for l in sorted(rent["linhas"], key=lambda x: x["lucro"]):
+                status_rent = ("PREJUIZO" if l["lucro"] < 0 else
+                               ("ATENCAO" if l["lucro_litro"] < preco_litro * 0.1 else "OK"))
                 ctx.append(
-                    f"  {nome_a}: {litros_a:.0f}L | custo R${c_l:.2f}/L | "
-                    f"lucro R${l_l:.2f}/L | total R${lucro:.0f} [{status_rent}]"
+                    f"  {l['nome']}: {l['litros']:.0f}L | custo R${l['custo_litro']:.2f}/L | "
+                    f"lucro R${l['lucro_litro']:.2f}/L | total R${l['lucro']:.0f} [{status_rent}]"
                 )
         except Exception:
             pass
@@ -904,47 +1104,43 @@ def _salvar_sugestao(fazenda_id: str, pergunta: str):
         pass
 
 
-def _parse_float(v) -> float:
-    """Converte valor monetário em float de forma robusta.
-    Aceita: 300, "300", "R$300", "300,50", "R$ 1.200,00", "trezentos" (passa 0).
-    """
-    if v is None:
-        return 0.0
-    if isinstance(v, (int, float)):
-        return float(v)
-    s = re.sub(r'[^\d.,]', '', str(v))   # remove tudo exceto dígitos, vírgula, ponto
-    if not s:
-        return 0.0
-    # "1.200,50" → "1200.50"  |  "300,50" → "300.50"  |  "300.50" → "300.50"
-    if ',' in s and '.' in s:
-        s = s.replace('.', '').replace(',', '.')
-    elif ',' in s:
-        s = s.replace(',', '.')
-    try:
-        return float(s)
-    except ValueError:
-        return 0.0
+_parse_float = conversa.parse_float   # valor monetário robusto ("R$ 1.200,50" → 1200.5)
 
 
 def _buscar_no_estoque(fazenda_id: str, nome_produto: str) -> Optional[dict]:
-    """Busca produto no estoque por similaridade de nome (case-insensitive, parcial)."""
+    """Busca produto no estoque: nome normalizado, sinônimo de insumo ou trecho do nome.
+    O item vem do índice (até 10 min defasado) — serve para resolver o nome e o
+    doc_id; quantidades a gravar saem de _atualizar_item_estoque."""
     try:
-        docs = list(_coll(fazenda_id, "estoque").stream())
-        nome_lower = nome_produto.lower()
-        # Busca exata primeiro
-        for d in docs:
-            if d.to_dict().get('item', '').lower() == nome_lower:
-                return {"doc_id": d.id, **d.to_dict()}
-        # Busca parcial
-        for d in docs:
-            item = d.to_dict().get('item', '').lower()
-            if nome_lower in item or item in nome_lower:
-                return {"doc_id": d.id, **d.to_dict()}
-        return None
+        return _indice_estoque(fazenda_id).buscar(nome_produto)
     except Exception:
         return None
 
 
+def _atualizar_item_estoque(fazenda_id: str, doc_id: str, calcular) -> Optional[dict]:
+    """Lê o item atual pelo doc_id numa transação, grava `calcular(item)` e
+    reflete no índice. O app legado grava no estoque sem passar pelo contador
+    de versões: calcular sobre o item do índice perderia essas escritas.
+    None se o documento não existe mais."""
+    ref = _coll(fazenda_id, "estoque").document(doc_id)
+
+    @firestore.transactional
+    def _tx(tx):
+        snap = ref.get(transaction=tx)
+        if not snap.exists:
+            return None
+        campos = calcular(snap.to_dict() or {})
+        tx.update(ref, campos)
+        return campos
+
+    campos = _tx(_db().transaction())
+    if campos is None:
+        _indice_estoque(fazenda_id).remover(doc_id)
+    else:
+        _indice_estoque(fazenda_id).gravar(doc_id, campos)
+    return campos
+
+
 # ─────────────────────────────────────────────
 # SYSTEM PROMPT
 # ─────────────────────────────────────────────
@@ -2165,6 +2361,66 @@ def _chamar_claude(historico: list, animais: str, estoque: str = "",
                           tipo_hint=tipo_hint)
 
 
+# Mapa: tipo de registro → coleção Firestore (para notify_update)
+_TIPO_COLECAO = {
+    "PRODUCAO_LEITE": "producao", "PRODUCAO_MULTIPLA": "producao",
+    "VENDA_LEITE": "financeiro",
+    "GASTO_GERAL": "financeiro", "GASTO_SANITARIO": "financeiro",
+    "COMPRA_PRODUTO": "financeiro", "VENDA_ANIMAL": "financeiro",
+    "COMPRA_ANIMAL": "financeiro",
+    "NOVO_ANIMAL": "animais", "REPRODUCAO": "animais",
+    "MORTE_ANIMAL": "animais", "ATUALIZAR_ANIMAL": "animais",
+    "AGENDAR_SANITARIO": "sanitario", "EXECUTAR_PROTOCOLO": "sanitario",
+    "AJUSTAR_ESTOQUE": "estoque",
+    "ALTERAR_CONFIG": "config",
+}
+
+
+def _executar_salvar(tel: str, tipo: str, dados: dict, itens, hist: list, fazenda_id: str) -> str:
+    """Grava o registro confirmado (único, lista de itens ou PRODUCAO_MULTIPLA),
+    notifica o app e limpa a conversa guardando o último salvo."""
+    ultimo_salvo = None
+    try:
+        # Fallback: varre histórico da conversa procurando itens de turn anterior
+        if not itens and tipo == "PRODUCAO_MULTIPLA":
+            for msg in reversed(hist):
+                try:
+                    h = json.loads(msg.get("content", "{}"))
+                    itens = conversa.itens_do_turno(h)
+                    if itens:
+                        break
+                except Exception:
+                    pass
+        if tipo == "PRODUCAO_MULTIPLA" and itens:
+            dados["itens"] = itens
+            resposta = _salvar(tipo, dados, fazenda_id, registrado_por=tel)
+            ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": itens, "resposta": resposta}
+        elif itens and isinstance(itens, list) and len(itens) > 1:
+            msgs = []
+            forn = dados.get("fornecedor") or ""
+            for item in itens:
+                item.setdefault("fornecedor", forn)
+                msgs.append(_salvar(tipo, item, fazenda_id, registrado_por=tel))
+            resposta = f"*{len(itens)} itens salvos:*\n" + "\n".join(
+                m.replace("*Salvo!*\n", "- ") for m in msgs
+            )
+            ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": itens, "resposta": resposta}
+        else:
+            resposta = _salvar(tipo, dados, fazenda_id, registrado_por=tel)
+            ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": None, "resposta": resposta}
+        # Notifica frontend em tempo real
+        _colecao_notif = _TIPO_COLECAO.get(tipo or "", "all")
+        try:
+            notify_update(fazenda_id, _colecao_notif, origem="bot")
+        except Exception:
+            pass
+    except Exception as e:
+        log.error(f"Erro ao salvar: {e}")
+        resposta = f"Erro ao salvar: {str(e)[:120]}"
+    _clear_conv(tel, ultimo_salvo=ultimo_salvo)
+    return resposta
+
+
 def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list] = None) -> str:
     if permissoes is None:
         permissoes = ["admin"]
@@ -2235,6 +2491,9 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
             _SUBST_PENDENTE.pop(tel, None)
             try:
                 _coll(pend["fazenda_id"], "producao").document(pend["doc_id"]).update(pend["dados_novos"])
+                _indice_producao(pend["fazenda_id"]).atualizar(pend["doc_id"], pend["dados_novos"])
+                _apos_producao(pend["fazenda_id"], pend.get("nome_animal"), pend.get("data"),
+                               pend["dados_novos"]["leite"] - pend.get("leite_antigo", 0))
                 return pend.get("msg_ok", "✅ Registro atualizado!")
             except Exception as e:
                 return f"Erro ao substituir: {str(e)[:60]}"
@@ -2265,11 +2524,13 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
             _INSUMO_DESAMBIG.pop(tel, None)
             dados_orig["produto"] = escolha
             try:
-                _coll(fazenda_id, "estoque").add({
+                doc_est = {
                     **dados_orig,
                     "criado_em": datetime.datetime.now().isoformat(),
                     "fonte": "whatsapp",
-                })
+                }
+                _, ref_est = _coll(fazenda_id, "estoque").add(doc_est)
+                _indice_estoque(fazenda_id).gravar(ref_est.id, doc_est)
                 return (f"✅ *{escolha}* registrado no estoque!\n"
                         f"Qtd: {dados_orig.get('qtd',0):.0f} {dados_orig.get('un','kg')} · "
                         f"R$ {dados_orig.get('custo_unit_kg',0):.2f}/kg")
@@ -2391,8 +2652,7 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
             except Exception as e:
                 log.error(f"_enviar_pdf_async erro: {e}")
                 _enviar_whatsapp(tel, "Erro ao gerar o relatorio. Tente novamente mais tarde.")
-        import threading as _thr
-        _thr.Thread(target=_enviar_pdf_async, daemon=True).start()
+        _EXEC_PDF.submit(_enviar_pdf_async)
         return ""  # resposta enviada assincronamente
 
     if lower in ("agenda", "semana", "tarefas", "/agenda"):
@@ -2478,6 +2738,68 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
     hist = conv.get("historico", [])
     hist.append({"role": "user", "content": texto})
 
+    # Confirmação local — "sim", "não" ou correção de um campo sem chamar a IA
+    if conv.get("estado") == "CONFIRMANDO" and conv.get("tipo"):
+        tipo_c  = conv["tipo"]
+        dados_c = dict(conv.get("dados") or {})
+        acao, campos = conversa.resolver_confirmacao(texto, tipo_c)
+        if acao == "confirmar":
+            if not _tem_permissao(permissoes, tipo_c):
+                _clear_conv(tel)
+                return _msg_sem_permissao(tipo_c)
+            log.info(f"[{tel}] confirmação local: {tipo_c}")
+            return _executar_salvar(tel, tipo_c, dados_c, conv.get("itens"), hist, fazenda_id)
+        if acao == "cancelar":
+            _clear_conv(tel)
+            return "Registro cancelado. Pode enviar outro se quiser."
+        if acao == "editar" and not conv.get("itens"):
+            log.info(f"[{tel}] correção local: {tipo_c} {campos}")
+            dados_c.update(campos)
+            resposta = conversa.resumo_confirmacao(tipo_c, dados_c)
+            hist.append({"role": "assistant", "content": json.dumps(
+                {"texto": resposta, "estado": "CONFIRMANDO", "tipo": tipo_c, "dados": dados_c},
+                ensure_ascii=False)})
+            conv.update({"historico": hist, "dados": dados_c})
+            _save_conv(tel, conv)
+            _enviar_botoes(tel, resposta, [("sim", "✅ Confirmar"), ("nao", "❌ Cancelar")])
+            return "__botoes_enviados__"
+
+    # Coleta local — resposta curta ao campo pendente (número, valor, data, turno,
+    # animal) preenche o esquema do tipo sem IA; o que não for lido segue para o agente
+    if conv.get("estado") == "COLETANDO" and conv.get("tipo") and not conv.get("itens"):
+        tipo_c  = conv["tipo"]
+        dados_c = dict(conv.get("dados") or {})
+        # só animais do rebanho (sem vendido/morto): nome escrito na frase e,
+        # sem ele, o índice (apelido, diminutivo, brinco, erro de digitação)
+        idx_ani = _indice_animais(fazenda_id)
+        nomes   = idx_ani.nomes_ativos()
+        pergunta = ""
+        for turno in reversed(hist[:-1]):
+            if turno.get("role") == "assistant":
+                try:
+                    pergunta = json.loads(turno.get("content") or "{}").get("texto") or ""
+                except (ValueError, AttributeError):
+                    pergunta = turno.get("content") or ""
+                break
+        novos = conversa.preencher_slots(tipo_c, dados_c, texto, nomes, pergunta=pergunta,
+                                         resolver=lambda t: idx_ani.resolver_nome(t, so_ativos=True))
+        if novos:
+            log.info(f"[{tel}] coleta local: {tipo_c} {novos}")
+            dados_c.update(novos)
+            falta = conversa.proximo_slot(tipo_c, dados_c)
+            estado_c = "COLETANDO" if falta else "CONFIRMANDO"
+            resposta = (conversa.pergunta_slot(tipo_c, falta[0]) if falta
+                        else conversa.resumo_confirmacao(tipo_c, dados_c))
+            hist.append({"role": "assistant", "content": json.dumps(
+                {"texto": resposta, "estado": estado_c, "tipo": tipo_c, "dados": dados_c},
+                ensure_ascii=False)})
+            conv.update({"historico": hist, "estado": estado_c, "dados": dados_c})
+            _save_conv(tel, conv)
+            if estado_c == "CONFIRMANDO":
+                _enviar_botoes(tel, resposta, [("sim", "✅ Confirmar"), ("nao", "❌ Cancelar")])
+                return "__botoes_enviados__"
+            return resposta
+
     # Fast path — resolve registros simples sem IA
     if conv.get("estado") in ("idle", None):
         fp = _fast_path(texto, fazenda_id)
@@ -2491,7 +2813,8 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
                             "producao" if "PRODUCAO" in fp["tipo"] else
                             "animais"  if fp["tipo"] in ("NOVO_ANIMAL","REPRODUCAO","MORTE_ANIMAL") else
                             "estoque"  if "ESTOQUE" in fp["tipo"] else
-                            "financeiro"
+                            "financeiro",
+                            origem="bot",
                         )
                     except Exception:
                         pass
@@ -2594,66 +2917,13 @@ def _processar(tel: str, texto: str, fazenda_id: str, permissoes: Optional[list]
         _clear_conv(tel)
         return _msg_sem_permissao(tipo)
 
-    # Mapa: tipo de registro → coleção Firestore (para notify_update)
-    _TIPO_COLECAO = {
-        "PRODUCAO_LEITE": "producao", "PRODUCAO_MULTIPLA": "producao",
-        "VENDA_LEITE": "financeiro",
-        "GASTO_GERAL": "financeiro", "GASTO_SANITARIO": "financeiro",
-        "COMPRA_PRODUTO": "financeiro", "VENDA_ANIMAL": "financeiro",
-        "COMPRA_ANIMAL": "financeiro",
-        "NOVO_ANIMAL": "animais", "REPRODUCAO": "animais",
-        "MORTE_ANIMAL": "animais", "ATUALIZAR_ANIMAL": "animais",
-        "AGENDAR_SANITARIO": "sanitario", "EXECUTAR_PROTOCOLO": "sanitario",
-        "AJUSTAR_ESTOQUE": "estoque",
-        "ALTERAR_CONFIG": "config",
-    }
-
     if estado == "SALVAR":
         # Verifica de novo no SALVAR (segurança dupla — caso tipo mude durante coleta)
         if tipo and not _tem_permissao(permissoes, tipo):
             _clear_conv(tel)
             return _msg_sem_permissao(tipo)
-
-        ultimo_salvo = None
-        try:
-            itens = parsed.get("itens") or conv.get("itens")
-            # Fallback: varre histórico da conversa procurando itens de turn anterior
-            if not itens and tipo == "PRODUCAO_MULTIPLA":
-                for msg in reversed(hist):
-                    try:
-                        h = json.loads(msg.get("content", "{}"))
-                        if h.get("itens"):
-                            itens = h["itens"]
-                            break
-                    except Exception:
-                        pass
-            if tipo == "PRODUCAO_MULTIPLA" and itens:
-                dados["itens"] = itens
-                resposta = _salvar(tipo, dados, fazenda_id, registrado_por=tel)
-                ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": itens, "resposta": resposta}
-            elif itens and isinstance(itens, list) and len(itens) > 1:
-                msgs = []
-                forn = dados.get("fornecedor") or ""
-                for item in itens:
-                    item.setdefault("fornecedor", forn)
-                    msgs.append(_salvar(tipo, item, fazenda_id, registrado_por=tel))
-                resposta = f"*{len(itens)} itens salvos:*\n" + "\n".join(
-                    m.replace("*Salvo!*\n", "- ") for m in msgs
-                )
-                ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": itens, "resposta": resposta}
-            else:
-                resposta = _salvar(tipo, dados, fazenda_id, registrado_por=tel)
-                ultimo_salvo = {"tipo": tipo, "dados": dados, "itens": None, "resposta": resposta}
-            # Notifica frontend em tempo real
-            _colecao_notif = _TIPO_COLECAO.get(tipo or "", "all")
-            try:
-                notify_update(fazenda_id, _colecao_notif)
-            except Exception:
-                pass
-        except Exception as e:
-            log.error(f"Erro ao salvar: {e}")
-            resposta = f"Erro ao salvar: {str(e)[:120]}"
-        _clear_conv(tel, ultimo_salvo=ultimo_salvo)
+        resposta = _executar_salvar(tel, tipo, dados, parsed.get("itens") or conv.get("itens"),
+                                    hist, fazenda_id)
 
     elif estado == "CANCELAR":
         resposta = "Registro cancelado. Pode enviar outro se quiser."
@@ -2697,7 +2967,6 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
 
     # Invalida cache das coleções que podem ser alteradas por este registro
     _cache_del(f"anm:{fazenda_id}")
-    _cache_del(f"est:{fazenda_id}")
     _cache_del(f"prod:{fazenda_id}")
     _cache_del(f"fin:{fazenda_id}")
 
@@ -2723,28 +2992,31 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         qtd = float(qtd or 1)
         # BUG1/12: usa busca case-insensitive para evitar duplicatas (ex: "milho" vs "Milho")
         existente = _buscar_no_estoque(fazenda_id, item)
-        if existente:
-            did   = existente["doc_id"]
-            d_qtd = existente.get("qtd", 0)
-            vant  = d_qtd * existente.get("custo_medio", 0)
+
+        def _entrada(atual):
+            d_qtd = float(atual.get("qtd") or 0)
+            vant  = d_qtd * float(atual.get("custo_medio") or 0)
             nqtd  = d_qtd + qtd
             nmed  = (vant + float(valor_total or 0)) / nqtd if nqtd else 0
-            _coll(fazenda_id, "estoque").document(did).update(
-                {"qtd": nqtd, "custo_medio": nmed, "un": un or existente.get("un", "un")}
-            )
-        else:
+            return {"qtd": nqtd, "custo_medio": nmed, "un": un or atual.get("un", "un")}
+
+        if not existente or _atualizar_item_estoque(fazenda_id, existente["doc_id"], _entrada) is None:
             cu = float(valor_total or 0) / qtd if qtd else 0
-            _coll(fazenda_id, "estoque").add(
-                {"item": item, "qtd": qtd, "un": un or "un", "custo_medio": cu}
-            )
+            doc = {"item": item, "qtd": qtd, "un": un or "un", "custo_medio": cu}
+            _, ref = _coll(fazenda_id, "estoque").add(doc)
+            _indice_estoque(fazenda_id).gravar(ref.id, doc)
 
-    def _estoque_baixa(item, qtd):
+    def _estoque_baixa(item, qtd, data=None):
         qtd = float(qtd or 0)
         # BUG6: usa busca case-insensitive para não falhar silenciosamente
         existente = _buscar_no_estoque(fazenda_id, item)
         if existente:
-            nova = max(existente.get("qtd", 0) - qtd, 0)
-            _coll(fazenda_id, "estoque").document(existente["doc_id"]).update({"qtd": nova})
+            dia = reproducao.data(data) or datetime.date.today()
+            # taxa de consumo do item atualizada na mesma escrita (previsão de ruptura)
+            _atualizar_item_estoque(
+                fazenda_id, existente["doc_id"],
+                lambda atual: {"qtd": max(float(atual.get("qtd") or 0) - qtd, 0),
+                               **indices.registrar_consumo(atual, qtd, dia)})
 
     # ── VENDA_ANIMAL ─────────────────────────
     if tipo == "VENDA_ANIMAL":
@@ -2769,14 +3041,8 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         status = dados.get("status_animal") or "Lactação"
         nasc   = dados.get("nasc") or hoje
         lote   = dados.get("lote") or "A"
-        # BUG14: usa sufixo numérico para evitar colisão de IDs (Rainha vs Raimunda)
-        base_id = nome[:4].upper()
-        existing_ids = {d.to_dict().get("id","") for d in _coll(fazenda_id, "animais").stream()}
-        ani_id = base_id
-        suffix = 2
-        while ani_id in existing_ids:
-            ani_id = f"{base_id}{suffix}"
-            suffix += 1
+        # BUG14: sufixo numérico evita colisão de IDs (Rainha vs Raimunda) — reservado em transação
+        ani_id = alocar_id_animal(fazenda_id, indices.base_id(nome))
         _coll(fazenda_id, "animais").add({
             "nome": nome, "sexo": sexo, "status": status,
             "nasc": str(nasc), "lote": lote, "id": ani_id,
@@ -2951,7 +3217,7 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         if qtd_u > 0:
             item_est = _buscar_no_estoque(fazenda_id, prod)
             if item_est:
-                _estoque_baixa(prod, qtd_u)
+                _estoque_baixa(prod, qtd_u, data_san)
                 avisos.append(f"{qtd_u:.1f} {item_est.get('un','un')} baixadas do estoque.")
             else:
                 avisos.append(f"Produto '{prod}' nao encontrado no estoque — baixa nao realizada.")
@@ -2997,23 +3263,14 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         _eh_rebanho = not _animal_raw or _animal_raw.lower() in ("rebanho", "")
         if not _eh_rebanho and litros > 50:
             return f"⚠️ {litros:.0f} L parece muito alto para uma vaca ({_animal_raw}). Pode confirmar?"
+        _idx_prod = _indice_producao(fazenda_id)
         if _eh_rebanho and litros > 0:
-            try:
-                _14dias_atras = (datetime.date.today() - datetime.timedelta(days=14)).isoformat()
-                _hist = list(_coll(fazenda_id, "producao")
-                             .where(filter=FieldFilter("data", ">=", _14dias_atras)).stream())
-                if _hist:
-                    # Soma por dia e calcula média diária total do rebanho
-                    _por_dia: dict = {}
-                    for _d in _hist:
-                        _dd = _d.to_dict()
-                        _por_dia[_dd.get("data", "")] = _por_dia.get(_dd.get("data", ""), 0) + _dd.get("leite", 0)
-                    _media = sum(_por_dia.values()) / len(_por_dia) if _por_dia else 0
-                    if _media > 0 and litros > _media * 2:
-                        return (f"⚠️ {litros:.0f} L é mais que o dobro da média diária do rebanho "
-                                f"({_media:.0f} L/dia). Pode confirmar esse valor?")
-            except Exception:
-                pass
+            # Média diária total do rebanho nos últimos 14 dias (buffer do índice;
+            # só um limiar de aviso — tolera os até 10 min de atraso do app legado)
+            _media = _idx_prod.media_diaria()
+            if _media > 0 and litros > _media * 2:
+                return (f"⚠️ {litros:.0f} L é mais que o dobro da média diária do rebanho "
+                        f"({_media:.0f} L/dia). Pode confirmar esse valor?")
         # BUG4: Claude pode retornar "manha"/"tarde" em vez de 1/2 — conversão segura
         _turno_raw = dados.get("turno") or 1
         _turno_map = {"manha": 1, "manhã": 1, "tarde": 2, "noite": 3}
@@ -3030,22 +3287,29 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
             nome_ani = "Rebanho"
 
         # Verifica duplicata: mesmo animal, mesmo dia, mesmo turno
+        # (no índice lido há pouco; data fora da janela de 14 dias ou índice mais
+        # velho que _IDX_PRODUCAO_DUP_S → consulta limit(1) ao Firestore, que vê
+        # também o que o app legado gravou)
         try:
-            dup = list(_coll(fazenda_id, "producao")
-                       .where(filter=FieldFilter("data", "==", str(data)))
-                       .where(filter=FieldFilter("id_animal", "==", id_ani))
-                       .where(filter=FieldFilter("turno", "==", turno))
-                       .limit(1).stream())
-            if dup:
-                d_dup = dup[0].to_dict()
-                doc_dup = dup[0]
+            if _idx_prod.cobre(data) and _indice_producao_idade(fazenda_id) <= _IDX_PRODUCAO_DUP_S:
+                d_dup = _idx_prod.duplicata(str(data), id_ani, turno)
+            else:
+                dup = list(_coll(fazenda_id, "producao")
+                           .where(filter=FieldFilter("data", "==", str(data)))
+                           .where(filter=FieldFilter("id_animal", "==", id_ani))
+                           .where(filter=FieldFilter("turno", "==", turno))
+                           .limit(1).stream())
+                d_dup = {"doc_id": dup[0].id, **dup[0].to_dict()} if dup else None
+            if d_dup:
                 turno_txt_dup = {1: "Manhã", 2: "Tarde", 3: "Noite"}.get(turno, str(turno))
                 turno_txt_novo = {1: "Manhã", 2: "Tarde", 3: "Noite"}.get(turno, str(turno))
                 # Armazena substituição pendente para o próximo handler
                 _SUBST_PENDENTE[registrado_por] = {
                     "fazenda_id": fazenda_id,
-                    "doc_id": doc_dup.id,
+                    "doc_id": d_dup["doc_id"],
                     "dados_novos": {"leite": litros},
+                    "nome_animal": nome_ani, "data": str(data),
+                    "leite_antigo": float(d_dup.get("leite") or 0),
                     "msg_ok": f"✅ *Substituído!* {nome_ani} — {turno_txt_novo}: {litros:.0f} L (era {d_dup.get('leite',0):.0f} L)",
                 }
                 return (f"⚠️ Já existe registro de {nome_ani} no {turno_txt_dup} de hoje "
@@ -3055,12 +3319,25 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         except Exception:
             pass
 
-        _coll(fazenda_id, "producao").add({
+        doc = {
             "data": str(data), "leite": litros, "turno": turno,
             "id_animal": id_ani, "nome_animal": nome_ani, "racao": 0,
-        })
+        }
+        _, ref = _coll(fazenda_id, "producao").add(doc)
+        _idx_prod.registrar(ref.id, doc)
+        flags = _apos_producao(fazenda_id, nome_ani, data, litros)
         turno_txt = {1: "Manhã", 2: "Tarde", 3: "Noite"}.get(turno, "")
-        return f"*Salvo!*\n{litros:.0f} L registrados — {nome_ani} ({turno_txt or 'turno ' + str(turno)})"
+        aviso = ""
+        for f in flags:
+            if f["nome"] != nome_ani:
+                continue
+            if f["tipo"] == "outlier":
+                aviso += (f"\n⚠️ Fora do padrão: {nome_ani} costuma dar ~{f['esperado']:.0f} L por ordenha. "
+                          f"Confira se o valor está certo.")
+            elif f["tipo"] == "queda":
+                aviso += (f"\n📉 {nome_ani} somou {f['valor']:.0f} L no dia, bem abaixo da média "
+                          f"de {f['esperado']:.0f} L/dia.")
+        return f"*Salvo!*\n{litros:.0f} L registrados — {nome_ani} ({turno_txt or 'turno ' + str(turno)}){aviso}"
 
     # ── NOVO_ANIMAL ───────────────────────────
     elif tipo == "NOVO_ANIMAL":
@@ -3069,13 +3346,7 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         status = dados.get("status_animal") or "Novilha"
         nasc   = dados.get("nasc") or hoje
         lote   = dados.get("lote") or "A"
-        base_id2 = nome[:4].upper()
-        existing_ids2 = {d.to_dict().get("id","") for d in _coll(fazenda_id, "animais").stream()}
-        id_ani = dados.get("id_animal") or base_id2
-        sfx = 2
-        while id_ani in existing_ids2:
-            id_ani = f"{base_id2}{sfx}"
-            sfx += 1
+        id_ani = alocar_id_animal(fazenda_id, dados.get("id_animal") or indices.base_id(nome))
 
         _coll(fazenda_id, "animais").add({
             "nome": nome, "sexo": sexo, "status": status,
@@ -3179,14 +3450,17 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
             nome_ani, id_ani = _resolver_animal(fazenda_id, nome_raw)
             animais_vistos.add(nome_ani)
 
-            _coll(fazenda_id, "producao").add({
+            doc = {
                 "data":        str(data_item),
                 "leite":       litros,
                 "turno":       turno_item,
                 "id_animal":   id_ani,
                 "nome_animal": nome_ani,
                 "racao":       0,
-            })
+            }
+            _, ref = _coll(fazenda_id, "producao").add(doc)
+            _indice_producao(fazenda_id).registrar(ref.id, doc)
+            _apos_producao(fazenda_id, nome_ani, data_item, litros)
             salvos += 1
             total  += litros
 
@@ -3221,12 +3495,19 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
             return f"Não encontrei registro de {animal} em {data_p} para corrigir."
         # Apaga o(s) antigo(s) e salva o correto
         litros_antigo = sum(d.to_dict().get("leite", 0) for d in antigos)
+        idx_prod = _indice_producao(fazenda_id)
         for d in antigos:
             _coll(fazenda_id, "producao").document(d.id).delete()
-        _coll(fazenda_id, "producao").add({
+            idx_prod.remover(d.id)
+            _apos_producao(fazenda_id, d.to_dict().get("nome_animal"), data_p,
+                           -float(d.to_dict().get("leite") or 0))
+        doc = {
             "data": data_p, "leite": litros_novo, "turno": turno,
             "id_animal": id_a, "nome_animal": animal, "racao": 0,
-        })
+        }
+        _, ref = _coll(fazenda_id, "producao").add(doc)
+        idx_prod.registrar(ref.id, doc)
+        _apos_producao(fazenda_id, animal, data_p, litros_novo)
         _log_correcao(fazenda_id, "CORRIGIR_PRODUCAO",
                       f"{animal} em {data_p}: {litros_antigo:.0f}L → {litros_novo:.0f}L",
                       registrado_por)
@@ -3245,8 +3526,12 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         if not antigos:
             return f"Não encontrei registro de {animal} em {data_p}."
         total_apagado = sum(d.to_dict().get("leite", 0) for d in antigos)
+        idx_prod = _indice_producao(fazenda_id)
         for d in antigos:
             _coll(fazenda_id, "producao").document(d.id).delete()
+            idx_prod.remover(d.id)
+            _apos_producao(fazenda_id, d.to_dict().get("nome_animal"), data_p,
+                           -float(d.to_dict().get("leite") or 0))
         _log_correcao(fazenda_id, "APAGAR_PRODUCAO",
                       f"{animal} em {data_p}: {total_apagado:.0f}L apagado",
                       registrado_por)
@@ -3417,7 +3702,7 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         if not existente:
             return f"Produto '{prod}' não encontrado no estoque."
         _coll(fazenda_id, "estoque").document(existente["doc_id"]).delete()
-        _cache_del(f"est:{fazenda_id}")
+        _indice_estoque(fazenda_id).remover(existente["doc_id"])
         qtd_txt = f"{existente.get('qtd', 0):.1f} {existente.get('un', 'un')}"
         return f"*Removido!*\n{existente.get('item', prod)} ({qtd_txt}) apagado do armazém."
 
@@ -3428,26 +3713,26 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
         operacao  = (dados.get("operacao") or "definir").lower()
         un        = dados.get("unidade") or "un"
         existente = _buscar_no_estoque(fazenda_id, prod)
-        if existente:
-            did     = existente["doc_id"]
-            qtd_ant = existente.get("qtd", 0)
+        ajuste = {}
+
+        def _ajustar(atual):
+            qtd_ant = float(atual.get("qtd") or 0)
             if operacao in ("adicionar", "somar", "add"):
                 qtd_final = qtd_ant + qtd_nova
             elif operacao in ("remover", "subtrair", "tirar"):
                 qtd_final = max(qtd_ant - qtd_nova, 0)
             else:
                 qtd_final = qtd_nova  # definir / setar
-            _coll(fazenda_id, "estoque").document(did).update(
-                {"qtd": qtd_final, "un": un or existente.get("un", "un")}
-            )
-            _cache_del(f"est:{fazenda_id}")
-            return (f"*Estoque ajustado!*\n{prod}: {qtd_ant:.1f} → *{qtd_final:.1f} {un}*")
+            ajuste.update(ant=qtd_ant, final=qtd_final)
+            return {"qtd": qtd_final, "un": un or atual.get("un", "un")}
+
+        if existente and _atualizar_item_estoque(fazenda_id, existente["doc_id"], _ajustar) is not None:
+            return (f"*Estoque ajustado!*\n{prod}: {ajuste['ant']:.1f} → *{ajuste['final']:.1f} {un}*")
         else:
             # Item novo no estoque
-            _coll(fazenda_id, "estoque").add(
-                {"item": prod, "qtd": qtd_nova, "un": un, "custo_medio": 0}
-            )
-            _cache_del(f"est:{fazenda_id}")
+            doc = {"item": prod, "qtd": qtd_nova, "un": un, "custo_medio": 0}
+            _, ref = _coll(fazenda_id, "estoque").add(doc)
+            _indice_estoque(fazenda_id).gravar(ref.id, doc)
             return f"*Adicionado ao estoque!*\n{prod}: {qtd_nova:.1f} {un}"
 
     return "Registro salvo!"
@@ -3456,10 +3741,17 @@ def _salvar(tipo: str, dados: dict, fazenda_id: str, registrado_por: str = "Bot
 # ─────────────────────────────────────────────
 # DOWNLOAD DE MÍDIA DO TWILIO
 # ─────────────────────────────────────────────
-async def _baixar_midia(url: str, sid: str, token: str) -> bytes:
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, auth=(sid, token))
-        return r.content
+async def _baixar_midia(url: str, sid: str, token: str, tipo: str = "audio") -> bytes:
+    """Download em streaming com o limite de tamanho do tipo (midia.LIMITES_MB)."""
+    return await midia.baixar(url, tipo, auth=(sid, token))
+
+
+def _aviso_midia_grande(e: "midia.MidiaGrande") -> str:
+    limite_mb = e.limite // (1024 * 1024)
+    if e.tipo == "audio":
+        return (f"🎙️ Esse áudio é grande demais para eu ouvir (limite de {limite_mb} MB). "
+                "Pode mandar em partes menores ou escrever?")
+    return f"📷 Essa imagem é grande demais (limite de {limite_mb} MB). Pode mandar uma foto menor?"
 
 
 # ─────────────────────────────────────────────
@@ -3467,9 +3759,22 @@ async def _baixar_midia(url: str, sid: str, token: str) -> bytes:
 # ─────────────────────────────────────────────
 async def _transcrever(media_url: str, twilio_sid: str, twilio_token: str,
                        content_type: str = "audio/ogg") -> str:
+    """Baixa o áudio do Twilio e transcreve (áudio repetido sai do cache de mídia)."""
+    try:
+        audio_bytes = await _baixar_midia(media_url, twilio_sid, twilio_token, "audio")
+        return await midia.extrair_com_cache(
+            "audio", audio_bytes, lambda b: _transcrever_bytes(b, content_type)
+        )
+    except midia.MidiaGrande:
+        raise
+    except Exception as e:
+        log.error(f"Transcricao error: {e}")
+        return ""
+
+
+async def _transcrever_bytes(audio_bytes: bytes, content_type: str = "audio/ogg") -> str:
     """Transcreve áudio usando Groq (grátis) ou OpenAI como fallback."""
     try:
-        audio_bytes = await _baixar_midia(media_url, twilio_sid, twilio_token)
         ext = "ogg"
         if "mp4" in content_type or "mpeg" in content_type:
             ext = "mp3"
@@ -3516,12 +3821,29 @@ async def _transcrever(media_url: str, twilio_sid: str, twilio_token: str,
 # ─────────────────────────────────────────────
 async def _ler_imagem(media_url: str, twilio_sid: str, twilio_token: str,
                       content_type: str = "image/jpeg") -> str:
+    """Baixa a imagem do Twilio e extrai os dados (foto repetida sai do cache de mídia)."""
+    try:
+        img_bytes = await _baixar_midia(media_url, twilio_sid, twilio_token, "imagem")
+        return await midia.extrair_com_cache(
+            "imagem", img_bytes, lambda b: _ler_imagem_bytes(b, content_type)
+        )
+    except midia.MidiaGrande:
+        raise
+    except Exception as e:
+        log.error(f"Vision error: {e}")
+        return ""
+
+
+async def _ler_imagem_bytes(img_bytes: bytes, content_type: str = "image/jpeg") -> str:
     """Usa Claude Vision para extrair dados de foto de nota fiscal ou produto."""
     try:
         import base64
         from anthropic import Anthropic
 
-        img_bytes = await _baixar_midia(media_url, twilio_sid, twilio_token)
+        if (content_type or "").startswith("image/"):      # PDF do Twilio vai como veio
+            img_bytes, content_type = await _EXEC_INTERATIVO.executar(
+                midia.preparar_imagem, img_bytes, content_type
+            )
         b64 = base64.standard_b64encode(img_bytes).decode()
 
         client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY", ""))
@@ -3578,9 +3900,189 @@ async def _ler_imagem(media_url: str, twilio_sid: str, twilio_token: str,
         return ""
 
 
+# Prompt do Vision no webhook da Evolution (tabelas manuscritas, notas, listas)
+_VISION_PROMPT = (
+    "Analise esta imagem de uma fazenda leiteira. Identifique qual dos tipos:\n\n"
+    "A) NOTA FISCAL / RECIBO / CUPOM: tem produtos, quantidades, valores, nome da loja.\n"
+    "B) TABELA MENSAL DE PRODUÇÃO: coluna de datas e coluna de litros, dia a dia. "
+    "Pode ser manuscrita em papel ou lousa. "
+    "REGRA CRÍTICA: o título ou nome no topo da tabela é quase sempre o NOME DO PRODUTOR ou da fazenda — NUNCA é nome de vaca. "
+    "Use sempre Animal: Rebanho, a menos que a tabela contenha explicitamente a palavra 'Vaca' ou 'Animal' seguida do nome do bicho.\n"
+    "C) LISTA DE VACAS DO DIA: lista com vários animais identificados pelo nome e seus litros. "
+    "Cada linha tem nome da vaca + litros (ex: Rainha 18L). Pode ser manuscrita.\n"
+    "D) OUTRO\n\n"
+    "Se A: responda exatamente:\n"
+    "[NOTA FISCAL]\nFornecedor: ...\nItens:\n- Produto: X, Qtd: N, Unidade: U, Valor: R$V\n\n"
+    "Se B: responda exatamente (leia com cuidado a escrita manual):\n"
+    "[TABELA MENSAL]\nAnimal: Rebanho (use 'Rebanho' por padrão; só mude se a tabela disser explicitamente 'Vaca: X')\nMes: MM/AAAA\nRegistros:\n"
+    "- Data: DD/MM/AAAA, Litros: N\n"
+    "(use '//' para dias sem dado — ex: Litros: //)\n\n"
+    "Se C: responda exatamente:\n"
+    "[PRODUCAO DO DIA]\nData: DD/MM/AAAA (se visível, senão 'hoje')\nAnimais:\n"
+    "- Animal: NomeVaca, Litros: N\n\n"
+    "Se D: descreva brevemente.\n"
+    "Extraia TODOS os dados visíveis. Inclua todas as linhas. "
+    "Ignore rasuras. Responda somente os dados."
+)
+
+
+async def _vision_evolution(img_bytes: bytes) -> str:
+    """Extrai os dados da foto: Gemini Vision (REST) com fallback Claude Vision."""
+    import base64
+    img_bytes, mime = await _EXEC_INTERATIVO.executar(midia.preparar_imagem, img_bytes)
+    b64_str = base64.standard_b64encode(img_bytes).decode()
+    texto_img = ""
+    # Tenta Gemini Vision via REST direto
+    import asyncio as _aio_vis
+    google_key = os.environ.get("GOOGLE_API_KEY", "")
+    if google_key:
+        _candidates = [
+            ("v1", "gemini-2.5-flash"),
+            ("v1", "gemini-2.5-flash-lite"),
+        ]
+        for _api_ver, _gmodel in _candidates:
+            try:
+                async with httpx.AsyncClient(timeout=30) as gc:
+                    gr = await gc.post(
+                        f"https://generativelanguage.googleapis.com/{_api_ver}/models/{_gmodel}:generateContent",
+                        params={"key": google_key},
+                        json={"contents": [{"parts": [
+                            {"inline_data": {"mime_type": mime, "data": b64_str}},
+                            {"text": _VISION_PROMPT},
+                        ]}]},
+                    )
+                if gr.status_code == 429:
+                    log.warning(f"Gemini Vision ({_gmodel}) rate limit — aguardando 5s")
+                    await _aio_vis.sleep(5)
+                    # retry uma vez
+                    async with httpx.AsyncClient(timeout=30) as gc:
+                        gr = await gc.post(
+                            f"https://generativelanguage.googleapis.com/{_api_ver}/models/{_gmodel}:generateContent",
+                            params={"key": google_key},
+                            json={"contents": [{"parts": [
+                                {"inline_data": {"mime_type": mime, "data": b64_str}},
+                                {"text": _VISION_PROMPT},
+                            ]}]},
+                        )
+                if gr.status_code not in (200, 201):
+                    log.warning(f"Gemini Vision ({_gmodel}) HTTP {gr.status_code} — tentando próximo")
+                    continue
+                gdata = gr.json()
+                texto_img = gdata["candidates"][0]["content"]["parts"][0]["text"].strip()
+                log.info(f"[Evolution] Gemini Vision ({_api_ver}/{_gmodel}) extraiu: {texto_img[:200]}")
+                break
+            except Exception as eg:
+                log.warning(f"Gemini Vision ({_gmodel}) falhou: {eg}")
+    # Fallback Claude Vision
+    if not texto_img:
+        anthropic_key = os.environ.get("ANTHROPIC_API_KEY", "")
+        if anthropic_key:
+            try:
+                from anthropic import Anthropic
+                client = Anthropic(api_key=anthropic_key)
+                cresp = client.messages.create(
+                    model="claude-haiku-4-5-20251001", max_tokens=600,
+                    messages=[{"role": "user", "content": [
+                        {"type": "image", "source": {"type": "base64", "media_type": mime, "data": b64_str}},
+                        {"type": "text", "text": _VISION_PROMPT},
+                    ]}],
+                )
+                texto_img = cresp.content[0].text.strip()
+                log.info(f"[Evolution] Claude Vision extraiu: {texto_img[:200]}")
+            except Exception as ec:
+                log.warning(f"Claude Vision falhou: {ec}")
+    return texto_img
+
+
 # ─────────────────────────────────────────────
 # ENVIO ATIVO — cascata: Evolution API (grátis) → Z-API → Twilio (pago)
+# Cliente HTTP único com keep-alive + rota aprendida por destinatário:
+# o JID e o formato de payload que funcionaram por último são tentados
+# primeiro, evitando até 6 POSTs por mensagem.
 # ─────────────────────────────────────────────
+_HTTP_ENVIO      = None
+_HTTP_ENVIO_LOCK = threading.Lock()
+_ROTA_ENVIO: dict = {}     # tel → {"jid": str, "formato": "v2" | "v1"}
+_MIDIA_MODO: dict = {}     # "evolution" → "multipart" | "base64" (capacidade do servidor)
+_METRICAS_ENVIO: dict = {} # provedor → {tentativas, ok, falhas, posts, latencia_total_s, latencia_max_s}
+_ENVIO_LOCK = threading.Lock()
+
+_PAYLOADS_EVOLUTION = {
+    "v2": lambda numero, texto: {"number": numero, "text": texto, "delay": 300},
+    "v1": lambda numero, texto: {"number": numero, "options": {"delay": 300},
+                                 "textMessage": {"text": texto}},
+}
+
+
+def _http_envio():
+    """Cliente httpx compartilhado (pool de conexões) para todos os provedores."""
+    global _HTTP_ENVIO
+    if _HTTP_ENVIO is None:
+        with _HTTP_ENVIO_LOCK:
+            if _HTTP_ENVIO is None:
+                _HTTP_ENVIO = httpx.Client(
+                    timeout=15,
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+                )
+    return _HTTP_ENVIO
+
+
+def _registrar_envio(provedor: str, ok: bool, t0: float, posts: int = 1):
+    """Acumula latência e taxa de sucesso por provedor."""
+    dur = _time_exec.monotonic() - t0
+    with _ENVIO_LOCK:
+        m = _METRICAS_ENVIO.setdefault(provedor, {
+            "tentativas": 0, "ok": 0, "falhas": 0, "posts": 0,
+            "latencia_total_s": 0.0, "latencia_max_s": 0.0,
+        })
+        m["tentativas"] += 1
+        m["ok" if ok else "falhas"] += 1
+        m["posts"] += posts
+        m["latencia_total_s"] += dur
+        m["latencia_max_s"] = max(m["latencia_max_s"], dur)
+
+
+def _metricas_envio() -> dict:
+    with _ENVIO_LOCK:
+        dados = {k: dict(v) for k, v in _METRICAS_ENVIO.items()}
+    for m in dados.values():
+        n = m["tentativas"] or 1
+        m["latencia_media_s"] = round(m.pop("latencia_total_s") / n, 3)
+        m["latencia_max_s"]   = round(m["latencia_max_s"], 3)
+        m["taxa_sucesso"]     = round(m["ok"] / n, 3)
+        m["posts_por_envio"]  = round(m["posts"] / n, 2)
+    return dados
+
+
+def _candidatos_jid(para: str) -> list:
+    """JIDs possíveis para o destinatário, na ordem de preferência.
+    A rota aprendida vem primeiro; depois JID original (@lid), número limpo
+    e variante sem nono dígito."""
+    num = re.sub(r'\D', '', para)
+    if not num.startswith('55'):
+        num = '55' + num
+    candidatos = []
+    rota = _ROTA_ENVIO.get(para)
+    if rota and rota.get("jid"):
+        candidatos.append(rota["jid"])
+    jid_original = _JID_CACHE.get(para, "")
+    if jid_original:
+        candidatos.append(jid_original)
+    candidatos.append(num)
+    if len(num) == 13:
+        candidatos.append(num[:4] + num[5:])
+    vistos = set()
+    return [c for c in candidatos if not (c in vistos or vistos.add(c))]
+
+
+def _aprender_rota(para: str, jid: str, formato: Optional[str] = None):
+    with _ENVIO_LOCK:
+        rota = _ROTA_ENVIO.setdefault(para, {})
+        rota["jid"] = jid
+        if formato:
+            rota["formato"] = formato
+
+
 def _enviar_evolution(para: str, mensagem: str) -> bool:
     """Evolution API — self-hosted, completamente grátis.
     Configura: EVOLUTION_URL=http://seu-servidor:8080
@@ -3593,46 +4095,34 @@ def _enviar_evolution(para: str, mensagem: str) -> bool:
     instance = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
     if not url or not api_key:
         return False
+    t0, posts, ok = _time_exec.monotonic(), 0, False
     try:
-        import httpx as _hx
-        base = url.rstrip("/")
-        hdrs = {"apikey": api_key, "Content-Type": "application/json"}
-
-        # Monta lista de candidatos: JID original (@lid ou @s.whatsapp.net) + número limpo
-        jid_original = _JID_CACHE.get(para, "")
-        num = re.sub(r'\D', '', para)
-        if not num.startswith('55'):
-            num = '55' + num
-
-        candidatos = []
-        # Prioridade 1: JID original completo (inclui @lid para iPhones)
-        if jid_original:
-            candidatos.append(jid_original)
-        # Prioridade 2: número limpo
-        candidatos.append(num)
-        # Prioridade 3: variante sem nono dígito (ex: 5577981258479)
-        if len(num) == 13:
-            candidatos.append(num[:4] + num[5:])
-
-        endpoint = f"{base}/message/sendText/{instance}"
-        for candidato in candidatos:
-            # Tenta formato Evolution v2: {"number": ..., "text": ...}
-            for payload in [
-                {"number": candidato, "text": mensagem, "delay": 300},
-                {"number": candidato, "options": {"delay": 300}, "textMessage": {"text": mensagem}},
-            ]:
-                r = _hx.post(endpoint, headers=hdrs, json=payload, timeout=15)
-                if r.status_code in (200, 201):
-                    log.info(f"Evolution → {para}: OK (via {candidato})")
+        hdrs     = {"apikey": api_key, "Content-Type": "application/json"}
+        endpoint = f"{url.rstrip('/')}/message/sendText/{instance}"
+        fmt_pref = _ROTA_ENVIO.get(para, {}).get("formato", "v2")
+        formatos = [fmt_pref] + [f for f in _PAYLOADS_EVOLUTION if f != fmt_pref]
+        status   = None
+        for candidato in _candidatos_jid(para):
+            for fmt in formatos:
+                posts += 1
+                r = _http_envio().post(endpoint, headers=hdrs,
+                                       json=_PAYLOADS_EVOLUTION[fmt](candidato, mensagem))
+                status = r.status_code
+                if status in (200, 201):
+                    _aprender_rota(para, candidato, fmt)
+                    log.info(f"Evolution → {para}: OK (via {candidato}, {fmt}, {posts} POST)")
+                    ok = True
                     return True
-                if r.status_code not in (400, 404, 422):
+                if status not in (400, 404, 422):
                     # Erro inesperado — não tenta mais variantes de payload
                     break
-        log.info(f"Evolution → {para}: FALHOU (último status {r.status_code})")
+        log.info(f"Evolution → {para}: FALHOU (último status {status})")
         return False
     except Exception as e:
         log.warning(f"Evolution falhou: {e}")
         return False
+    finally:
+        _registrar_envio("evolution", ok, t0, posts)
 
 
 def _enviar_zapi(para: str, mensagem: str) -> bool:
@@ -3646,16 +4136,15 @@ def _enviar_zapi(para: str, mensagem: str) -> bool:
     client_token = os.environ.get("ZAPI_CLIENT_TOKEN", "")
     if not instance or not token:
         return False
+    t0, ok = _time_exec.monotonic(), False
     try:
-        import httpx as _hx
         num = re.sub(r'\D', '', para)
         if not num.startswith('55'):
             num = '55' + num
-        r = _hx.post(
+        r = _http_envio().post(
             f"https://api.z-api.io/instances/{instance}/token/{token}/send-text",
             headers={"Client-Token": client_token, "Content-Type": "application/json"},
             json={"phone": num, "message": mensagem},
-            timeout=15,
         )
         ok = r.status_code in (200, 201)
         log.info(f"Z-API → {para}: {'OK' if ok else f'FALHOU {r.status_code}'}")
@@ -3663,6 +4152,8 @@ def _enviar_zapi(para: str, mensagem: str) -> bool:
     except Exception as e:
         log.warning(f"Z-API falhou: {e}")
         return False
+    finally:
+        _registrar_envio("zapi", ok, t0)
 
 
 def _enviar_twilio(para: str, mensagem: str) -> bool:
@@ -3672,362 +4163,159 @@ def _enviar_twilio(para: str, mensagem: str) -> bool:
     de    = os.environ.get("TWILIO_FROM", "whatsapp:+14155238886")
     if not sid or not token:
         return False
+    t0, ok = _time_exec.monotonic(), False
     try:
-        import urllib.request, urllib.parse, base64 as _b64
         para_fmt = f"whatsapp:{para}" if not para.startswith("whatsapp:") else para
-        payload  = urllib.parse.urlencode({"From": de, "To": para_fmt, "Body": mensagem}).encode()
-        req = urllib.request.Request(
+        r = _http_envio().post(
             f"https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json",
-            data=payload, method="POST",
+            auth=(sid, token),
+            data={"From": de, "To": para_fmt, "Body": mensagem},
+            timeout=10,
         )
-        cred = _b64.b64encode(f"{sid}:{token}".encode()).decode()
-        req.add_header("Authorization", f"Basic {cred}")
-        req.add_header("Content-Type", "application/x-www-form-urlencoded")
-        with urllib.request.urlopen(req, timeout=10) as r:
-            ok = r.status in (200, 201)
-            log.info(f"Twilio → {para}: {'OK' if ok else f'FALHOU {r.status}'}")
-            return ok
+        ok = r.status_code in (200, 201)
+        log.info(f"Twilio → {para}: {'OK' if ok else f'FALHOU {r.status_code}'}")
+        return ok
     except Exception as e:
         log.warning(f"Twilio falhou: {e}")
         return False
+    finally:
+        _registrar_envio("twilio", ok, t0)
+
+
+# Ordem da cascata de texto — a fila de saída percorre a mesma, com cadência por provedor
+_ENVIO_TEXTO = {"evolution": _enviar_evolution, "zapi": _enviar_zapi, "twilio": _enviar_twilio}
 
 
 def _enviar_whatsapp(para: str, mensagem: str) -> bool:
     """Envia mensagem em cascata: Evolution (grátis) → Z-API (flat) → Twilio (por mensagem)."""
     log.info(f"[{para}] enviando: '{mensagem[:60].replace(chr(10),' ')}'")
-    for fn in (_enviar_evolution, _enviar_zapi, _enviar_twilio):
+    for fn in _ENVIO_TEXTO.values():
         if fn(para, mensagem):
             return True
     log.error(f"Todos os provedores WhatsApp falharam para {para}")
     return False
 
 
-def _enviar_pdf_whatsapp(para: str, pdf_bytes: bytes, filename: str, caption: str = "") -> bool:
-    """Envia PDF via Evolution API como documento. Fallback: avisa que gerou mas não enviou."""
+def _enviar_midia_evolution(para: str, conteudo, filename: str, mimetype: str,
+                            mediatype: str = "document", caption: str = "") -> bool:
+    """Envia mídia via Evolution sendMedia.
+    `conteudo` pode ser bytes ou caminho de arquivo. Tenta upload multipart
+    (arquivo transmitido direto, sem inflar 33% em base64 dentro do JSON) e
+    cai para base64 se o servidor não aceitar; o modo que funcionou fica
+    memorizado."""
     import base64 as _b64
+    import io as _io
     url      = os.environ.get("EVOLUTION_URL", "").rstrip("/")
     api_key  = os.environ.get("EVOLUTION_KEY", "")
     instance = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
     if not url or not api_key:
-        log.warning("_enviar_pdf_whatsapp: Evolution não configurado")
+        log.warning("_enviar_midia_evolution: Evolution não configurado")
         return False
 
-    jid_original = _JID_CACHE.get(para, "")
-    num = re.sub(r'\D', '', para)
-    if not num.startswith('55'):
-        num = '55' + num
-
-    candidatos = []
-    if jid_original:
-        candidatos.append(jid_original)
-    candidatos.append(num)
-    if len(num) == 13:
-        candidatos.append(num[:4] + num[5:])
-
-    b64 = _b64.b64encode(pdf_bytes).decode()
-    # Evolution API v2 aceita base64 puro (sem prefixo data:...)
-    # ou URL pública. Enviamos base64 direto.
+    eh_arquivo = isinstance(conteudo, (str, os.PathLike))
+    tamanho    = os.path.getsize(conteudo) if eh_arquivo else len(conteudo)
+    endpoint   = f"{url}/message/sendMedia/{instance}"
+    campos = {"mediatype": mediatype, "mimetype": mimetype,
+              "caption": caption or filename, "fileName": filename, "delay": "300"}
+    modos = ["multipart", "base64"]
+    if _MIDIA_MODO.get("evolution") == "base64":
+        modos = ["base64"]
 
+    t0, posts, ok = _time_exec.monotonic(), 0, False
     try:
-        import httpx as _hx
-        hdrs = {"apikey": api_key, "Content-Type": "application/json"}
-        for candidato in candidatos:
-            r = _hx.post(
-                f"{url}/message/sendMedia/{instance}",
-                headers=hdrs,
-                json={
-                    "number":    candidato,
-                    "mediatype": "document",
-                    "mimetype":  "application/pdf",
-                    "caption":   caption or filename,
-                    "media":     b64,          # base64 puro, sem prefixo data:
-                    "fileName":  filename,
-                    "delay":     300,
-                },
-                timeout=60,
-            )
-            if r.status_code in (200, 201):
-                log.info(f"PDF → {para}: OK ({len(pdf_bytes)//1024}KB via {candidato})")
-                return True
-            log.debug(f"PDF sendMedia {candidato}: {r.status_code} {r.text[:120]}")
+        for modo in modos:
+            for candidato in _candidatos_jid(para):
+                posts += 1
+                if modo == "multipart":
+                    fh = open(conteudo, "rb") if eh_arquivo else _io.BytesIO(conteudo)
+                    try:
+                        r = _http_envio().post(
+                            endpoint, headers={"apikey": api_key},
+                            data={**campos, "number": candidato},
+                            files={"file": (filename, fh, mimetype)},
+                            timeout=60,
+                        )
+                    finally:
+                        fh.close()
+                else:
+                    if eh_arquivo:
+                        with open(conteudo, "rb") as fh:
+                            b64 = _b64.b64encode(fh.read()).decode()
+                    else:
+                        b64 = _b64.b64encode(conteudo).decode()
+                    # Evolution API v2 aceita base64 puro (sem prefixo data:...)
+                    r = _http_envio().post(
+                        endpoint,
+                        headers={"apikey": api_key, "Content-Type": "application/json"},
+                        json={**campos, "number": candidato, "media": b64, "delay": 300},
+                        timeout=60,
+                    )
+                    del b64
+                if r.status_code in (200, 201):
+                    _aprender_rota(para, candidato)
+                    _MIDIA_MODO["evolution"] = modo
+                    log.info(f"Mídia → {para}: OK ({tamanho//1024}KB via {candidato}, {modo})")
+                    ok = True
+                    return True
+                log.debug(f"sendMedia {modo} {candidato}: {r.status_code} {r.text[:120]}")
+                if modo == "multipart" and _multipart_recusado(r):
+                    # servidor não aceita multipart — não adianta trocar de JID,
+                    # e os próximos envios já vão direto em base64
+                    _MIDIA_MODO["evolution"] = "base64"
+                    break
     except Exception as e:
-        log.warning(f"_enviar_pdf_whatsapp erro: {e}")
+        log.warning(f"_enviar_midia_evolution erro: {e}")
+    finally:
+        _registrar_envio("evolution_midia", ok, t0, posts)
     return False
 
 
-def _gerar_pdf_relatorio(fazenda_id: str, mes: str = "") -> bytes:
-    """Gera o PDF do relatório mensal e retorna os bytes.
-    Reutiliza a mesma lógica do endpoint /relatorio_mensal."""
-    import datetime as _dt
-    import calendar as _cal
+def _multipart_recusado(r) -> bool:
+    """Resposta do sendMedia que indica servidor sem multipart: 415, ou 400/422
+    reclamando que falta `media` (o arquivo do form não foi lido)."""
+    if r.status_code == 415:
+        return True
+    if r.status_code not in (400, 422):
+        return False
+    corpo = (r.text or "")[:2000].lower()
+    return "media" in corpo and any(p in corpo for p in
+                                    ("required", "requires", "missing", "empty", "obrigat"))
 
-    hoje = _dt.date.today()
-    if mes:
-        try:
-            ano, m = int(mes[:4]), int(mes[5:7])
-        except Exception:
-            ano, m = hoje.year, hoje.month
-    else:
-        ano, m = hoje.year, hoje.month
 
-    # Importa e chama a função diretamente via mobile_api
-    from mobile_api import _coll
-    from google.cloud.firestore_v1.base_query import FieldFilter
+def _enviar_pdf_whatsapp(para: str, pdf_bytes, filename: str, caption: str = "") -> bool:
+    """Envia PDF via Evolution API como documento. Aceita bytes ou caminho do arquivo."""
+    return _enviar_midia_evolution(para, pdf_bytes, filename, "application/pdf",
+                                   mediatype="document", caption=caption)
 
-    ini_mes = f"{ano:04d}-{m:02d}-01"
-    fim_mes = f"{ano+1:04d}-01-01" if m == 12 else f"{ano:04d}-{m+1:02d}-01"
 
-    meses_pt = ["","Janeiro","Fevereiro","Marco","Abril","Maio","Junho",
-                "Julho","Agosto","Setembro","Outubro","Novembro","Dezembro"]
-    mes_label = f"{meses_pt[m]} / {ano}"
+def _gerar_pdf_relatorio(fazenda_id: str, mes: str = "") -> bytes:
+    """Gera o PDF do relatório mensal e retorna os bytes.
+    Mesmo motor (e mesmo cache) do endpoint /relatorio_mensal."""
+    from mobile_api import _coll, versao_fazenda
 
-    db_ref = _db()
-    nome_fazenda = fazenda_id
-    cfg_doc = _coll(fazenda_id, "config").document("principal").get()
-    if cfg_doc.exists:
-        nome_fazenda = cfg_doc.to_dict().get("nome_fazenda") or fazenda_id
-    else:
-        faz_doc = db_ref.collection("fazendas").document(fazenda_id).get()
-        if faz_doc.exists:
-            nome_fazenda = faz_doc.to_dict().get("nome") or fazenda_id
-
-    fin_docs  = [d.to_dict() for d in _coll(fazenda_id,"financeiro")
-                 .where(filter=FieldFilter("data",">=",ini_mes))
-                 .where(filter=FieldFilter("data","<",fim_mes)).stream()]
-    prod_docs = [d.to_dict() for d in _coll(fazenda_id,"producao")
-                 .where(filter=FieldFilter("data",">=",ini_mes))
-                 .where(filter=FieldFilter("data","<",fim_mes)).stream()]
-    animais   = [d.to_dict() for d in _coll(fazenda_id,"animais").stream()]
-
-    total_prod   = sum(p.get("leite",0) for p in prod_docs)
-    dias_no_mes  = _cal.monthrange(ano, m)[1]
-    media_dia    = round(total_prod / dias_no_mes, 1) if dias_no_mes else 0
-    vacas_lact   = len([a for a in animais if a.get("status","") in ("Lactacao","Lactação")])
-    total_rec    = sum(f.get("valor",0) for f in fin_docs if "Venda" in (f.get("cat") or f.get("categoria","")))
-    total_desp   = sum(f.get("valor",0) for f in fin_docs if "Venda" not in (f.get("cat") or f.get("categoria","")))
-    saldo        = total_rec - total_desp
-    custo_litro  = round(total_desp / total_prod, 2) if total_prod > 0 else 0.0
-    preco_litro  = round(total_rec  / total_prod, 2) if total_prod > 0 else 0.0
-    margem_litro = round(preco_litro - custo_litro, 2)
-
-    por_animal: dict = {}
-    for p in prod_docs:
-        n = p.get("nome_animal") or p.get("id_animal") or "?"
-        por_animal[n] = por_animal.get(n, 0) + p.get("leite", 0)
-    top_animais = sorted(por_animal.items(), key=lambda x: -x[1])[:8]
-
-    por_cat: dict = {}
-    for f in fin_docs:
-        if "Venda" in (f.get("cat") or f.get("categoria","")): continue
-        cat = f.get("cat") or f.get("categoria") or "Outros"
-        por_cat[cat] = por_cat.get(cat, 0) + f.get("valor", 0)
-    desp_cats = sorted(por_cat.items(), key=lambda x: -x[1])[:8]
-
-    from fpdf import FPDF
-    from fpdf.enums import XPos, YPos
-
-    C_GREEN_DARK  = (22,  101, 52)
-    C_GREEN_MED   = (34,  139, 70)
-    C_GREEN_LIGHT = (220, 242, 228)
-    C_GREEN_PALE  = (240, 253, 244)
-    C_BLUE        = (37,  99,  235)
-    C_BLUE_LIGHT  = (219, 234, 254)
-    C_RED         = (185, 28,  28)
-    C_RED_LIGHT   = (254, 226, 226)
-    C_AMBER       = (180, 83,  9)
-    C_AMBER_LIGHT = (254, 243, 199)
-    C_GRAY_900    = (17,  24,  39)
-    C_GRAY_600    = (75,  85,  99)
-    C_GRAY_400    = (156, 163, 175)
-    C_GRAY_100    = (243, 244, 246)
-    C_WHITE       = (255, 255, 255)
-    C_BORDER      = (209, 213, 219)
-
-    ML = 12; MR = 12; W = 210 - ML - MR
-
-    def _s(t):
-        return (str(t)
-                .replace("\u2014","-").replace("\u2013","-")
-                .replace("\u2019","'").replace("\u2018","'")
-                .replace("\u201c",'"').replace("\u201d",'"')
-                .encode("latin-1", errors="replace").decode("latin-1"))
-
-    def brl(v, sign=False):
-        s = f"{abs(v):,.2f}".replace(",","X").replace(".",",").replace("X",".")
-        prefix = "R$ " if not sign else ("+ R$ " if v >= 0 else "- R$ ")
-        return _s(prefix + s)
-
-    class PDF(FPDF):
-        def header(self):
-            self.set_fill_color(*C_GREEN_DARK)
-            self.rect(0, 0, 210, 32, style="F")
-            self.set_fill_color(*C_GREEN_MED)
-            self.rect(0, 32, 210, 2, style="F")
-            self.set_xy(ML, 6)
-            self.set_font("Helvetica", "B", 18)
-            self.set_text_color(*C_WHITE)
-            self.cell(90, 9, "MilkShow", new_x=XPos.RIGHT, new_y=YPos.TOP)
-            self.set_font("Helvetica", "B", 11)
-            self.set_text_color(180, 230, 190)
-            self.set_xy(ML + 90, 7)
-            self.cell(W - 90, 8, _s(mes_label), align="R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            self.set_xy(ML, 17)
-            self.set_font("Helvetica", "", 9)
-            self.set_text_color(180, 220, 190)
-            self.cell(W/2, 6, _s(nome_fazenda), new_x=XPos.RIGHT, new_y=YPos.TOP)
-            self.set_font("Helvetica", "", 8)
-            self.set_text_color(150, 200, 160)
-            self.set_xy(ML + W/2, 18)
-            self.cell(W/2, 5, f"Gerado em {hoje.strftime('%d/%m/%Y')}", align="R",
-                      new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            self.set_text_color(*C_GRAY_900)
-            self.set_y(38)
-
-        def footer(self):
-            self.set_y(-13)
-            self.set_fill_color(*C_GRAY_100)
-            self.rect(0, self.get_y(), 210, 13, style="F")
-            self.set_font("Helvetica", "", 8)
-            self.set_text_color(*C_GRAY_400)
-            self.cell(0, 13, _s(f"MilkShow  |  {nome_fazenda}  |  {mes_label}  |  Pag. {self.page_no()}"), align="C")
-
-    pdf = PDF()
-    pdf.set_margins(ML, 10, MR)
-    pdf.set_auto_page_break(auto=True, margin=18)
-    pdf.add_page()
-
-    def section_title(title):
-        pdf.ln(4)
-        y = pdf.get_y()
-        pdf.set_fill_color(*C_GREEN_LIGHT)
-        pdf.rect(ML, y, W, 8, style="F")
-        pdf.set_fill_color(*C_GREEN_MED)
-        pdf.rect(ML, y, 3, 8, style="F")
-        pdf.set_xy(ML + 5, y)
-        pdf.set_font("Helvetica", "B", 9)
-        pdf.set_text_color(*C_GREEN_DARK)
-        pdf.cell(W - 5, 8, _s(title), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.ln(2)
-
-    def kpi_card(x, y, w, h, label, value, unit="", bg=C_WHITE, val_color=None):
-        pdf.set_fill_color(*bg)
-        pdf.set_draw_color(*C_BORDER)
-        pdf.rect(x, y, w, h, style="FD")
-        pdf.set_xy(x + 2, y + 2)
-        pdf.set_font("Helvetica", "", 7)
-        pdf.set_text_color(*C_GRAY_400)
-        pdf.cell(w - 4, 4, _s(label.upper()), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.set_xy(x + 2, y + 7)
-        pdf.set_font("Helvetica", "B", 14)
-        pdf.set_text_color(*(val_color or C_GRAY_900))
-        pdf.cell(w - 4, 8, _s(str(value)), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        if unit:
-            pdf.set_xy(x + 2, y + h - 5)
-            pdf.set_font("Helvetica", "", 7)
-            pdf.set_text_color(*C_GRAY_400)
-            pdf.cell(w - 4, 4, _s(unit))
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.set_draw_color(0, 0, 0)
-
-    def bar_row(label, value, max_val, suffix="", color=C_GREEN_MED, show_val=""):
-        y = pdf.get_y()
-        if y > 265:
-            pdf.add_page(); y = pdf.get_y()
-        BAR_X = ML + 38; BAR_W = 95
-        bar_pct = min(value / max_val, 1.0) if max_val > 0 else 0
-        pdf.set_xy(ML, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.set_text_color(*C_GRAY_600)
-        pdf.cell(36, 6, _s(label[:18]), new_x=XPos.RIGHT, new_y=YPos.TOP)
-        pdf.set_fill_color(*C_GRAY_100)
-        pdf.rect(BAR_X, y + 1.5, BAR_W, 3.5, style="F")
-        if bar_pct > 0:
-            pdf.set_fill_color(*color)
-            pdf.rect(BAR_X, y + 1.5, BAR_W * bar_pct, 3.5, style="F")
-        pdf.set_xy(BAR_X + BAR_W + 2, y)
-        pdf.set_font("Helvetica", "B", 8)
-        pdf.set_text_color(*C_GRAY_900)
-        pdf.cell(18, 6, _s(suffix), new_x=XPos.RIGHT, new_y=YPos.TOP)
-        pdf.set_xy(BAR_X + BAR_W + 22, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.set_text_color(*C_GRAY_600)
-        pdf.cell(W - BAR_W - 60, 6, _s(show_val), align="R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        pdf.set_text_color(*C_GRAY_900)
-
-    gap = 3
-    cw = (W - gap * 3) / 4
-    section_title("PRODUCAO DE LEITE")
-    y0 = pdf.get_y()
-    kpi_card(ML,              y0, cw, 22, "Total do Mes",  f"{total_prod:,.0f}".replace(",","."), "litros", C_GREEN_PALE, C_GREEN_DARK)
-    kpi_card(ML+cw+gap,       y0, cw, 22, "Media Diaria",  f"{media_dia:.1f}", "L / dia",        C_BLUE_LIGHT, C_BLUE)
-    kpi_card(ML+(cw+gap)*2,   y0, cw, 22, "Vacas Lactacao",str(vacas_lact),    "animais",        C_GREEN_PALE, C_GREEN_MED)
-    kpi_card(ML+(cw+gap)*3,   y0, cw, 22, "Registros",     str(len(prod_docs)),"lancamentos",    C_GRAY_100, C_GRAY_600)
-    pdf.set_y(y0 + 26)
-
-    if top_animais:
-        section_title("TOP ANIMAIS - PRODUCAO DO MES")
-        max_anim = top_animais[0][1]
-        for nome_a, litros in top_animais:
-            pct = litros / total_prod * 100 if total_prod > 0 else 0
-            bar_row(nome_a, litros, max_anim, f"{pct:.1f}%", C_GREEN_MED, f"{litros:,.0f} L".replace(",","."))
-
-    fw = (W - gap * 2) / 3
-    section_title("RESUMO FINANCEIRO")
-    y1 = pdf.get_y()
-    bg_s = C_GREEN_PALE if saldo >= 0 else C_RED_LIGHT
-    c_s  = C_GREEN_DARK if saldo >= 0 else C_RED
-    kpi_card(ML,          y1, fw, 22, "Receitas (Venda de Leite)", brl(total_rec),  "", C_GREEN_PALE, C_GREEN_DARK)
-    kpi_card(ML+fw+gap,   y1, fw, 22, "Despesas Totais",           brl(total_desp), "", C_RED_LIGHT,  C_RED)
-    kpi_card(ML+(fw+gap)*2,y1,fw, 22, "Saldo do Mes",              brl(saldo),      "", bg_s, c_s)
-    pdf.set_y(y1 + 26)
-
-    if desp_cats:
-        section_title("DESPESAS POR CATEGORIA")
-        max_cat = desp_cats[0][1]
-        for cat, val in desp_cats:
-            pct = val / total_desp * 100 if total_desp > 0 else 0
-            bar_row(cat, val, max_cat, f"{pct:.1f}%", C_RED, brl(val))
-
-    tw = (W - gap * 2) / 3
-    section_title("CUSTO POR LITRO - KPI MENSAL")
-    y2 = pdf.get_y()
-    bg_m = C_GREEN_PALE if margem_litro >= 0 else C_AMBER_LIGHT
-    c_m  = C_GREEN_DARK if margem_litro >= 0 else C_AMBER
-    kpi_card(ML,           y2, tw, 22, "Custo / Litro",          f"R$ {custo_litro:.2f}",    "despesas / producao", C_RED_LIGHT,  C_RED)
-    kpi_card(ML+tw+gap,    y2, tw, 22, "Preco Recebido / Litro", f"R$ {preco_litro:.2f}",    "receita / producao",  C_BLUE_LIGHT, C_BLUE)
-    kpi_card(ML+(tw+gap)*2,y2, tw, 22, "Margem / Litro",         f"R$ {margem_litro:+.2f}", "preco - custo",       bg_m, c_m)
-    pdf.set_y(y2 + 26)
-
-    pdf.ln(4)
-    bg_box  = C_GREEN_PALE if margem_litro >= 0 else C_AMBER_LIGHT
-    cor_box = C_GREEN_DARK if margem_litro >= 0 else C_AMBER
-    icon_txt = "Resultado positivo:" if margem_litro >= 0 else "Atencao:"
-    if margem_litro >= 0:
-        analise = (f"Margem de R$ {margem_litro:.2f}/L. "
-                   f"A cada 1.000 litros, a fazenda gerou R$ {margem_litro*1000:.2f} de lucro.")
-    else:
-        analise = (f"Margem negativa de R$ {margem_litro:.2f}/L. "
-                   f"As despesas superaram as receitas em R$ {abs(saldo):.2f} no mes. "
-                   f"Revise as categorias de maior impacto.")
-    ya = pdf.get_y()
-    pdf.set_fill_color(*bg_box)
-    pdf.set_draw_color(*cor_box)
-    pdf.rect(ML, ya, W, 14, style="FD")
-    pdf.set_fill_color(*cor_box)
-    pdf.rect(ML, ya, 3, 14, style="F")
-    pdf.set_xy(ML + 6, ya + 2)
-    pdf.set_font("Helvetica", "B", 8)
-    pdf.set_text_color(*cor_box)
-    pdf.cell(30, 5, _s(icon_txt), new_x=XPos.RIGHT, new_y=YPos.TOP)
-    pdf.set_font("Helvetica", "", 8)
-    pdf.set_text_color(*C_GRAY_600)
-    pdf.set_xy(ML + 6 + 31, ya + 2)
-    pdf.multi_cell(W - 40, 5, _s(analise))
-    pdf.set_draw_color(0, 0, 0)
-    pdf.set_text_color(*C_GRAY_900)
-
-    return bytes(pdf.output())
+    hoje = datetime.date.today()
+    try:
+        ano, m = (int(mes[:4]), int(mes[5:7])) if mes else (hoje.year, hoje.month)
+    except Exception:
+        ano, m = hoje.year, hoje.month
+    mes_chave = f"{ano:04d}-{m:02d}"
+    pdf_bytes, _, _ = relatorios.pdf_mensal(_coll, _db(), fazenda_id, mes_chave,
+                                            versao_fazenda(fazenda_id))
+    return pdf_bytes
+
+
+def _pre_renderizar_mensal(fazendas: list, mes: str) -> dict:
+    """Lote do dia 1: todos os PDFs do mês renderizados em paralelo (processos);
+    o envio por fazenda depois só lê do cache."""
+    from mobile_api import _coll, versao_fazenda
+    t0 = _time_exec.monotonic()
+    res = relatorios.pdfs_mensais_lote(_coll, _db(), fazendas, mes,
+                                       marcas={fid: versao_fazenda(fid) for fid in fazendas})
+    novos = sum(1 for r in res.values() if r.get("cache") is False)
+    erros = [fid for fid, r in res.items() if r.get("erro")]
+    log.info(f"[relatorios] lote {mes}: {len(res)} fazendas, {novos} renderizados, "
+             f"{len(erros)} erros em {_time_exec.monotonic() - t0:.1f}s")
+    return res
 
 
 def _enviar_typing(para: str, duracao_ms: int = 4000):
@@ -4037,10 +4325,9 @@ def _enviar_typing(para: str, duracao_ms: int = 4000):
     inst = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
     if not url or not key:
         return
-    jid = _JID_CACHE.get(para, para)
+    jid = _candidatos_jid(para)[0]
     try:
-        import httpx as _hx
-        _hx.post(
+        _http_envio().post(
             f"{url}/chat/sendPresence/{inst}",
             headers={"apikey": key, "Content-Type": "application/json"},
             json={"number": jid, "options": {"presence": "composing", "delay": duracao_ms}},
@@ -4058,15 +4345,14 @@ def _enviar_botoes(para: str, texto: str, opcoes: list[tuple[str, str]]):
     url  = os.environ.get("EVOLUTION_URL", "").rstrip("/")
     key  = os.environ.get("EVOLUTION_KEY", "")
     inst = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
-    jid  = _JID_CACHE.get(para, para)
+    jid  = _candidatos_jid(para)[0]
     if not url or not key:
         _enviar_whatsapp(para, texto)
         return
     try:
-        import httpx as _hx
         botoes = [{"buttonId": bid, "buttonText": {"displayText": btxt}, "type": 0}
                   for bid, btxt in opcoes[:3]]
-        r = _hx.post(
+        r = _http_envio().post(
             f"{url}/message/sendButtons/{inst}",
             headers={"apikey": key, "Content-Type": "application/json"},
             json={"number": jid, "title": "MilkShow", "description": texto,
@@ -4095,75 +4381,53 @@ def _todos_telefones() -> list:
                 "fazenda_id": dd.get("fazenda_id", "default"),
                 "permissoes": dd.get("permissoes", ["admin"]),
                 "nome":       dd.get("nome", ""),
+                "created_at": dd.get("created_at", ""),
+                "nps_score":  dd.get("nps_score"),
             })
         return result
     except Exception:
         return []
 
 
-def _pd(s):
-    """Parse date string → date object (usado nos lembretes reprodutivos)."""
-    try:
-        return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
-    except Exception:
-        return None
+_pd = reproducao.data   # parse de data 'YYYY-MM-DD' (protocolos sanitários)
 
 
 def _lembretes_reprodutivos(fazenda_id: str, dias_antecedencia: int = 3) -> list:
     """Retorna mensagens de alertas reprodutivos para eventos nos próximos N dias."""
     alvo = datetime.date.today() + datetime.timedelta(days=dias_antecedencia)
-    GESTACAO  = 283
-    DIAS_SECAR = 60
-    DIAS_DIAGN = 30
-    DIAS_PVE   = 45
-
-    lembretes = []
     try:
-        animais = [d.to_dict() for d in _coll(fazenda_id, "animais").stream()]
+        cal = _calendario(fazenda_id)
     except Exception:
         return []
 
-    for a in animais:
-        nome   = a.get("nome", "?")
-        status = a.get("status", "")
-        d_ins  = _pd(a.get("ins") or a.get("inseminacao") or a.get("dt_insem"))
-        d_parto = _pd(a.get("dt_parto"))
-
-        # 1. Diagnóstico de prenhez (30 dias pós inseminação)
-        if d_ins and not a.get("prenhez") and status in ("Lactação", "Lactacao"):
-            if d_ins + datetime.timedelta(days=DIAS_DIAGN) == alvo:
-                lembretes.append(
-                    f"🔬 *{nome}* — Diagnóstico de prenhez em {dias_antecedencia} dias "
-                    f"({alvo.strftime('%d/%m')})\n"
-                    f"   _{DIAS_DIAGN} dias desde a inseminação_"
-                )
-
-        # 2. Momento ideal de inseminação (45 dias pós parto, sem inseminação)
-        if not d_ins and d_parto and status in ("Lactação", "Lactacao"):
-            if d_parto + datetime.timedelta(days=DIAS_PVE) == alvo:
-                lembretes.append(
-                    f"💉 *{nome}* — Pronta para inseminar em {dias_antecedencia} dias "
-                    f"({alvo.strftime('%d/%m')})\n"
-                    f"   _{DIAS_PVE} dias de pós-parto — janela ideal de reprodução_"
-                )
-
-        if a.get("prenhez") and d_ins:
-            parto_prev = d_ins + datetime.timedelta(days=GESTACAO)
-            d_secar    = parto_prev - datetime.timedelta(days=DIAS_SECAR)
-
-            # 3. Secagem preventiva
-            if d_secar == alvo:
-                lembretes.append(
-                    f"🛑 *{nome}* — Secar em {dias_antecedencia} dias ({alvo.strftime('%d/%m')})\n"
-                    f"   _Parto previsto: {parto_prev.strftime('%d/%m/%Y')}_"
-                )
-
-            # 4. Parto iminente
-            if parto_prev == alvo:
-                lembretes.append(
-                    f"🐄 *{nome}* — *PARTO EM {dias_antecedencia} DIAS!* ({alvo.strftime('%d/%m')})\n"
-                    f"   _Prepare o piquete de maternidade e avise o veterinário!_"
-                )
+    lembretes = []
+    # Inseminação: lembra do fim do PVE (janela ideal), um dia antes de ficar atrasada
+    evs = (cal.vencendo(alvo, tipos=("diagnostico", "secar", "parto"))
+           + cal.vencendo(alvo + datetime.timedelta(days=1), tipos=("inseminar",)))
+    for e in evs:
+        nome = e["nome"]
+        if e["tipo"] == "diagnostico":
+            lembretes.append(
+                f"🔬 *{nome}* — Diagnóstico de prenhez em {dias_antecedencia} dias "
+                f"({alvo.strftime('%d/%m')})\n"
+                f"   _{reproducao.DIAS_DIAGN} dias desde a inseminação_"
+            )
+        elif e["tipo"] == "inseminar":
+            lembretes.append(
+                f"💉 *{nome}* — Pronta para inseminar em {dias_antecedencia} dias "
+                f"({alvo.strftime('%d/%m')})\n"
+                f"   _{reproducao.DIAS_PVE} dias de pós-parto — janela ideal de reprodução_"
+            )
+        elif e["tipo"] == "secar":
+            lembretes.append(
+                f"🛑 *{nome}* — Secar em {dias_antecedencia} dias ({alvo.strftime('%d/%m')})\n"
+                f"   _Parto previsto: {e['parto'].strftime('%d/%m/%Y')}_"
+            )
+        elif e["tipo"] == "parto":
+            lembretes.append(
+                f"🐄 *{nome}* — *PARTO EM {dias_antecedencia} DIAS!* ({alvo.strftime('%d/%m')})\n"
+                f"   _Prepare o piquete de maternidade e avise o veterinário!_"
+            )
 
     return lembretes
 
@@ -4239,7 +4503,7 @@ def _gerar_relatorio_semanal(fazenda_id: str) -> str:
 
     try:
         # Estoque crítico (menos de 20% da qtd original estimada)
-        est = [d.to_dict() for d in _coll(fazenda_id, "estoque").stream()]
+        est = _cached_estoque(fazenda_id)
         criticos = [e for e in est if float(e.get("qtd", 1)) <= 2 and e.get("qtd") is not None]
         if criticos:
             linhas.append(f"\n*Estoque baixo:*")
@@ -4280,45 +4544,22 @@ def _gerar_alertas_proativos(fazenda_id: str) -> list:
     hoje_iso = hoje.isoformat()
     alertas  = []
 
-    GESTACAO   = 283
-    DIAS_SECAR = 60
-    DIAS_DIAGN = 30
-    DIAS_PVE   = 45
-
     try:
-        animais = [d.to_dict() for d in _coll(fazenda_id, "animais").stream()]
-        for a in animais:
-            nome   = a.get("nome", "?")
-            status = a.get("status", "")
-
-            def _pd(s):
-                try:
-                    return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
-                except Exception:
-                    return None
-
-            d_insem = _pd(a.get("dt_insem"))
-            d_parto = _pd(a.get("dt_parto"))
-
-            if status == "Lactação":
-                if d_insem and not a.get("prenhez"):
-                    dias = (hoje - d_insem).days
-                    if dias == DIAS_DIAGN:
-                        alertas.append(f"Diagnóstico de prenhez: {nome} foi inseminada há {dias} dias — verifique hoje!")
-
-                if not a.get("prenhez") and not d_insem and d_parto:
-                    dias_v = (hoje - d_parto).days
-                    if dias_v == DIAS_PVE + 1:
-                        alertas.append(f"Inseminar: {nome} está vazia há {dias_v} dias — está atrasada!")
-
-                if a.get("prenhez") and d_insem:
-                    prev  = d_insem + datetime.timedelta(days=GESTACAO)
-                    d_sec = prev - datetime.timedelta(days=DIAS_SECAR)
-                    dias_sec = (d_sec - hoje).days
-                    if dias_sec == 0:
-                        alertas.append(f"SECAR HOJE: {nome} — parto previsto em {DIAS_SECAR} dias ({prev.isoformat()})")
-                    if (prev - hoje).days in (7, 3, 1):
-                        alertas.append(f"Parto próximo: {nome} previsto em {(prev-hoje).days} dia(s) ({prev.isoformat()}) — prepare o local!")
+        cal = _calendario(fazenda_id)
+        for e in cal.vencendo(hoje, tipos=("diagnostico", "inseminar", "secar")):
+            nome = e["nome"]
+            if e["tipo"] == "diagnostico":
+                alertas.append(f"Diagnóstico de prenhez: {nome} foi inseminada há "
+                               f"{reproducao.DIAS_DIAGN} dias — verifique hoje!")
+            elif e["tipo"] == "inseminar":
+                alertas.append(f"Inseminar: {nome} está vazia há {reproducao.DIAS_PVE + 1} dias — está atrasada!")
+            else:
+                alertas.append(f"SECAR HOJE: {nome} — parto previsto em "
+                               f"{reproducao.DIAS_SECAR} dias ({e['parto'].isoformat()})")
+        for dd in (7, 3, 1):
+            for e in cal.vencendo(hoje + datetime.timedelta(days=dd), tipos=("parto",)):
+                alertas.append(f"Parto próximo: {e['nome']} previsto em {dd} dia(s) "
+                               f"({e['parto'].isoformat()}) — prepare o local!")
     except Exception:
         pass
 
@@ -4335,27 +4576,39 @@ def _gerar_alertas_proativos(fazenda_id: str) -> list:
         pass
 
     try:
-        # Vaca seca — vaca em Lactação sem produção há 3+ dias úteis
-        _3_dias_atras = (hoje - datetime.timedelta(days=3)).isoformat()
-        animais_lac = [d.to_dict() for d in _coll(fazenda_id, "animais").stream()
-                       if d.to_dict().get("status") == "Lactação"]
-        if animais_lac:
-            prod_recente = list(_coll(fazenda_id, "producao")
-                                .where(filter=FieldFilter("data", ">=", _3_dias_atras)).stream())
-            animais_com_prod = {d.to_dict().get("nome_animal") for d in prod_recente}
-            for a in animais_lac:
-                nome_a = a.get("nome", "?")
-                if nome_a not in animais_com_prod and nome_a.lower() not in ("rebanho", ""):
-                    alertas.append(f"Vaca seca? *{nome_a}* está em Lactação mas sem produção há 3+ dias.")
+        # Anomalias já marcadas pelo detector a cada escrita (queda súbita,
+        # registro fora do padrão) e lactantes sem ordenha há 3+ dias
+        reb = _rebanho(fazenda_id)
+        lactantes = [n for n in reb.nomes(reb.com_status("Lactação"))
+                     if n.lower() not in ("rebanho", "")]
+        for f in _detector(fazenda_id).alertas(hoje, lactantes):
+            if f["tipo"] == "sem_ordenha":
+                alertas.append(f"Vaca seca? *{f['nome']}* está em Lactação mas sem produção há "
+                               f"{anomalias.DIAS_SEM_ORDENHA}+ dias.")
+            elif f["tipo"] == "queda" and f["nome"] == "Rebanho":
+                alertas.append(f"📉 Produção do rebanho caiu: {f['valor']:.0f} L em {f['data']} "
+                               f"(média {f['esperado']:.0f} L/dia) — verifique ordenha e trato.")
+            elif f["tipo"] == "queda":
+                alertas.append(f"📉 Queda súbita: *{f['nome']}* — {f['valor']:.0f} L em {f['data']} "
+                               f"(média {f['esperado']:.0f} L/dia). Verifique saúde/mastite.")
+            elif f["tipo"] == "outlier":
+                alertas.append(f"Registro fora do padrão: *{f['nome']}* — {f['valor']:.0f} L em "
+                               f"{f['data']} (típico {f['esperado']:.0f} L). Confira se foi digitado certo.")
     except Exception:
         pass
 
     try:
-        # Estoque zerado
-        est = [d.to_dict() for d in _coll(fazenda_id, "estoque").stream()]
-        for e in est:
+        # Estoque zerado ou acabando pela taxa de consumo das baixas
+        idx = _indice_estoque(fazenda_id)
+        for e in idx.itens():
             if float(e.get("qtd", 1)) <= 0:
                 alertas.append(f"Estoque ZERADO: {e.get('item','?')} — reponha o quanto antes.")
+        for e in idx.esgotando(hoje, indices.ESTOQUE_AVISO_DIAS):
+            p = e["previsao"]
+            if float(e.get("qtd", 0)) > 0:
+                alertas.append(f"Estoque acabando: {e.get('item','?')} — {e.get('qtd', 0):.1f} "
+                               f"{e.get('un','un')}, dura ~{p['dias_restantes']} dia(s) "
+                               f"no consumo atual ({p['consumo_dia']:.1f}/dia). Programe a compra.")
     except Exception:
         pass
 
@@ -4594,7 +4847,7 @@ def _calcular_custo_litro_fazenda(fazenda_id: str, ini_mes=None) -> dict:
 # RELATÓRIO MATINAL (briefing diário às 6h)
 # ─────────────────────────────────────────────
 def _relatorio_manha(fazenda_id: str) -> str:
-    """Resumo da manhã: produção de ontem, agenda de hoje, saldo do mês."""
+    """Resumo da manhã: produção de ontem, previsão, estoque acabando, agenda de hoje, saldo do mês."""
     hoje      = datetime.date.today()
     ontem     = hoje - datetime.timedelta(days=1)
     ini_mes   = hoje.replace(day=1).isoformat()
@@ -4611,6 +4864,24 @@ def _relatorio_manha(fazenda_id: str) -> str:
     except Exception:
         pass
 
+    try:
+        acabando = [e for e in _indice_estoque(fazenda_id).esgotando(hoje, indices.ESTOQUE_AVISO_DIAS)
+                    if float(e.get("qtd", 0)) > 0]
+        if acabando:
+            linhas.append("📦 Estoque acabando: " + ", ".join(
+                f"*{e.get('item','?')}* (~{e['previsao']['dias_restantes']}d)" for e in acabando[:4]))
+    except Exception:
+        pass
+
+    try:
+        prev = previsao_fazenda(fazenda_id)
+        r7 = previsao.resumo(prev, 7)
+        if r7:
+            linhas.append(f"🔮 Previsão de hoje: *{prev['dias'][0]['litros']:.0f} L* "
+                          f"| próximos 7 dias: {r7['media_dia']:.0f} L/dia")
+    except Exception as e:
+        log.warning(f"Previsão no resumo da manhã {fazenda_id}: {e}")
+
     try:
         fin_mes = _cached_financeiro(fazenda_id, ini_mes)
         rec  = sum(f.get("valor", 0) for f in fin_mes if "Venda" in f.get("cat", ""))
@@ -4634,31 +4905,17 @@ def _relatorio_manha(fazenda_id: str) -> str:
         pass
 
     try:
-        animais = _cached_animais(fazenda_id)
+        cal = _calendario(fazenda_id)
         tarefas = []
-        DIAS_SECAR = 60; DIAS_DIAGN = 30; DIAS_PVE = 45; GESTACAO = 283
-
-        def _pd(s):
-            try: return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
-            except: return None
-
-        for a in animais:
-            nome, status = a.get("nome","?"), a.get("status","")
-            d_insem = _pd(a.get("dt_insem"))
-            d_parto = _pd(a.get("dt_parto"))
-            if status == "Lactação":
-                if d_insem and not a.get("prenhez"):
-                    if (hoje - d_insem).days == DIAS_DIAGN:
-                        tarefas.append(f"🔬 Diagnóstico prenhez: *{nome}*")
-                if not d_insem and d_parto and (hoje - d_parto).days > DIAS_PVE:
-                    tarefas.append(f"💉 Inseminar (atrasada): *{nome}*")
-                if a.get("prenhez") and d_insem:
-                    prev  = d_insem + datetime.timedelta(days=GESTACAO)
-                    secar = prev - datetime.timedelta(days=DIAS_SECAR)
-                    if secar == hoje:
-                        tarefas.append(f"🛑 Secar hoje: *{nome}*")
-                    if 1 <= (prev - hoje).days <= 7:
-                        tarefas.append(f"🐄 Parto em {(prev-hoje).days}d: *{nome}*")
+        for e in cal.vencendo(hoje, tipos=("diagnostico",)):
+            tarefas.append(f"🔬 Diagnóstico prenhez: *{e['nome']}*")
+        for e in cal.pendentes(hoje, tipos=("inseminar",)):
+            tarefas.append(f"💉 Inseminar (atrasada): *{e['nome']}*")
+        for e in cal.vencendo(hoje, tipos=("secar",)):
+            tarefas.append(f"🛑 Secar hoje: *{e['nome']}*")
+        for e in cal.vencendo(hoje + datetime.timedelta(days=1),
+                              hoje + datetime.timedelta(days=reproducao.DIAS_PRE_PARTO), tipos=("parto",)):
+            tarefas.append(f"🐄 Parto em {(e['data'] - hoje).days}d: *{e['nome']}*")
 
         if tarefas:
             linhas.append("\n📋 *Agenda de hoje:*")
@@ -4676,97 +4933,27 @@ def _relatorio_manha(fazenda_id: str) -> str:
 # RANKING DE RENTABILIDADE (mensal)
 # ─────────────────────────────────────────────
 def _gerar_ranking_rentabilidade(fazenda_id: str, dias: int = 30) -> str:
-    """Ranking de rentabilidade por vaca: receita do leite vs custo de ração e vet."""
-    hoje = datetime.date.today()
-    ini  = (hoje - datetime.timedelta(days=dias)).isoformat()
-
-    # Preço do leite: config > média das vendas
-    preco_litro = 2.50
-    try:
-        for d in _coll(fazenda_id, "config").stream():
-            c = d.to_dict()
-            if c.get("chave") == "preco_leite" or d.id == "preco_leite":
-                preco_litro = float(c.get("valor", 2.50))
-                break
-        if preco_litro == 2.50:
-            vendas = list(_coll(fazenda_id, "financeiro")
-                          .where(filter=FieldFilter("data", ">=", ini)).stream())
-            vals = [d.to_dict() for d in vendas
-                    if "Venda" in (d.to_dict().get("cat") or d.to_dict().get("categoria", ""))]
-            if vals:
-                total_rec = sum(v.get("valor", 0) for v in vals)
-                prod_prd  = list(_coll(fazenda_id, "producao")
-                                 .where(filter=FieldFilter("data", ">=", ini)).stream())
-                total_lit = sum(d.to_dict().get("leite", 0) for d in prod_prd)
-                if total_lit > 0:
-                    preco_litro = total_rec / total_lit
-    except Exception:
-        pass
-
-    # Custo ração/kg do estoque
-    custo_racao_kg = 1.20
+    """Ranking de rentabilidade por vaca: receita do leite vs custo de ração, vet e rateio."""
+    ini = (datetime.date.today() - datetime.timedelta(days=dias)).isoformat()
     try:
-        for e in _coll(fazenda_id, "estoque").stream():
-            ed = e.to_dict()
-            item = (ed.get("item") or "").lower()
-            if any(k in item for k in ("ração", "racao", "concentrado", "milho")):
-                val = float(ed.get("custo_unit") or 0)
-                if val > 0:
-                    custo_racao_kg = val
-                    break
-    except Exception:
-        pass
-
-    # Dados de produção
-    ranking: dict = {}
-    try:
-        for d in (_coll(fazenda_id, "producao")
-                  .where(filter=FieldFilter("data", ">=", ini)).stream()):
-            p    = d.to_dict()
-            nome = p.get("nome_animal") or "Rebanho"
-            if nome not in ranking:
-                ranking[nome] = {"litros": 0.0, "racao_kg": 0.0, "custo_vet": 0.0}
-            ranking[nome]["litros"]   += float(p.get("leite") or 0)
-            ranking[nome]["racao_kg"] += float(p.get("racao") or 0)
-    except Exception:
-        pass
-
-    # Custos veterinários
-    try:
-        for d in (_coll(fazenda_id, "sanitario")
-                  .where(filter=FieldFilter("data", ">=", ini)).stream()):
-            s    = d.to_dict()
-            nome = s.get("nome_animal") or s.get("animal") or "Rebanho"
-            val  = float(s.get("valor") or 0)
-            if nome in ranking:
-                ranking[nome]["custo_vet"] += val
-    except Exception:
-        pass
-
-    if not ranking:
-        return "Sem dados de produção nos últimos 30 dias para calcular o ranking."
-
-    # Calcula e ordena
-    resultado = []
-    for nome, r in ranking.items():
-        receita     = r["litros"] * preco_litro
-        custo_racao = r["racao_kg"] * custo_racao_kg
-        custo_total = custo_racao + r["custo_vet"]
-        margem      = receita - custo_total
-        resultado.append((nome, r["litros"], receita, custo_total, margem))
-    resultado.sort(key=lambda x: x[4], reverse=True)
+        rent = _rentabilidade(fazenda_id, ini, dias)
+    except Exception as ex:
+        log.warning(f"ranking: falha no cálculo de rentabilidade: {ex}")
+        rent = {"margem": []}
+    if not rent["margem"]:
+        return f"Sem dados de produção nos últimos {dias} dias para calcular o ranking."
 
     linhas = [
         f"*🏆 Ranking de Rentabilidade — {dias} dias*\n"
-        f"Preço leite: R${preco_litro:.2f}/L · Ração: R${custo_racao_kg:.2f}/kg\n"
+        f"Preço leite: R${rent['preco_leite']:.2f}/L · Ração: R${rent['custo_racao_kg']:.2f}/kg\n"
     ]
     medalhas = ["🥇", "🥈", "🥉"]
-    for i, (nome, litros, receita, custo, margem) in enumerate(resultado[:10]):
+    for i, l in enumerate(rent["margem"][:10]):
         med = medalhas[i] if i < 3 else f"{i+1}."
-        sinal = "+" if margem >= 0 else ""
+        sinal = "+" if l["margem"] >= 0 else ""
         linhas.append(
-            f"{med} *{nome}* — {litros:.0f}L\n"
-            f"   Receita R${receita:.0f} · Custo R${custo:.0f} · Margem *{sinal}R${margem:.0f}*"
+            f"{med} *{l['nome']}* — {l['litros']:.0f}L\n"
+            f"   Receita R${l['receita']:.0f} · Custo R${l['custo_total']:.0f} · Margem *{sinal}R${l['margem']:.0f}*"
         )
 
     return "\n".join(linhas)
@@ -4775,83 +4962,36 @@ def _gerar_ranking_rentabilidade(fazenda_id: str, dias: int = 30) -> str:
 # ─────────────────────────────────────────────
 # CURVA DE LACTAÇÃO — modelo de Wood
 # ─────────────────────────────────────────────
-import math as _math
-
-def _wood_curve(dim: int, a: float = 20.0, b: float = 0.12, c: float = 0.0035) -> float:
-    """Produção esperada (L/dia) pelo modelo de Wood para um dado DIM.
-    Valores padrão calibrados para bovinos leiteiros zebuínos/cruzados brasileiros.
-    DIM = days in milk (dias desde o parto)."""
-    if dim <= 0:
-        return 0.0
-    return a * (dim ** b) * _math.exp(-c * dim)
-
-
-def _dim_pico(b: float = 0.12, c: float = 0.0035) -> int:
-    """Dia do pico de produção na curva de Wood: DIM_pico = b/c."""
-    return int(b / c)
-
-
-def _escalar_curva(dim_atual: int, media_real_7d: float,
-                   a=20.0, b=0.12, c=0.0035) -> float:
-    """Fator de escala para ajustar a curva à vaca real (se temos produção conhecida)."""
-    esperado = _wood_curve(dim_atual, a, b, c)
-    if esperado > 0 and media_real_7d > 0:
-        return media_real_7d / esperado
-    return 1.0
-
-
 def _detectar_queda_lactacao(fazenda_id: str) -> list:
-    """Detecta vacas em queda acelerada vs curva de lactação padrão.
-    Retorna lista de dicts: {nome, dim, media_real, esperado, queda_pct}."""
+    """Detecta vacas em queda acelerada vs a própria curva de lactação (Wood
+    ajustado por vaca em lactacao.py). Retorna lista de dicts:
+    {nome, dim, media_real, esperado, queda_pct}."""
     hoje     = datetime.date.today()
     alertas  = []
-    JANELA   = 7   # dias de média real
-    LIMIAR   = 60  # % do esperado abaixo do qual emite alerta (< 60%)
+    QUEDA    = 35  # % abaixo do esperado que dispara o alerta
 
     try:
-        animais = [d.to_dict() for d in _coll(fazenda_id, "animais").stream()
-                   if d.to_dict().get("status") == "Lactação"]
-        ini_prod = (hoje - datetime.timedelta(days=JANELA)).isoformat()
-        prods    = [d.to_dict() for d in _coll(fazenda_id, "producao")
-                    .where(filter=FieldFilter("data", ">=", ini_prod)).stream()]
-
-        for a in animais:
-            nome = a.get("nome", "?")
-            # Precisa de dt_parto para calcular DIM
-            dt_parto_raw = a.get("dt_parto") or a.get("parto")
-            if not dt_parto_raw:
-                continue
-            try:
-                dt_parto = datetime.datetime.strptime(str(dt_parto_raw)[:10], "%Y-%m-%d").date()
-            except Exception:
-                continue
-            dim = (hoje - dt_parto).days
-            if dim < 30:
-                continue  # ainda no início, variação normal
-
-            # Produção média real nos últimos JANELA dias
-            prod_ani = [p.get("leite", 0) for p in prods
-                        if p.get("nome_animal") == nome]
-            if len(prod_ani) < 3:
-                continue  # poucos dados
-            media_real = sum(prod_ani) / len(prod_ani)
-
-            # Escala curva pela média do pico (dias 20-50)
-            esperado_raw = _wood_curve(dim)
-            # Fator de escala baseado na mediana do rebanho (simplificado — usa 1x)
-            fator = _escalar_curva(max(30, dim), media_real)
-            esperado = _wood_curve(dim) * fator if fator < 0.9 else _wood_curve(dim)
-
-            if esperado > 0:
-                queda_pct = (1 - media_real / esperado) * 100
-                if queda_pct >= 35 and dim > 60:  # queda > 35% do esperado após pico
-                    alertas.append({
-                        "nome":       nome,
-                        "dim":        dim,
-                        "media_real": round(media_real, 1),
-                        "esperado":   round(esperado, 1),
-                        "queda_pct":  round(queda_pct, 0),
-                    })
+        reb      = _rebanho(fazenda_id)
+        # Lactantes após o pico (DIM > 60); média diária recente vem do detector
+        # de anomalias (EWMA atualizada a cada escrita), sem varrer a produção
+        linhas = reb.linhas(reb.filtrar(hoje, status="Lactação", dim_min=61), hoje)
+        medias = _detector(fazenda_id).medias([l["nome"] for l in linhas])
+        linhas = [l for l in linhas if l["nome"] in medias]
+        if not linhas:
+            return alertas
+        nomes    = [l["nome"] for l in linhas]
+        media    = np.array([medias[n] for n in nomes])
+        esperado = _curvas(fazenda_id).esperado(nomes, [l["dim"] for l in linhas])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            queda = np.where(esperado > 0, (1 - media / esperado) * 100, 0.0)
+        for k in np.flatnonzero(queda >= QUEDA):
+            alertas.append({
+                "nome":       nomes[k],
+                "dim":        linhas[k]["dim"],
+                "media_real": round(float(media[k]), 1),
+                "esperado":   round(float(esperado[k]), 1),
+                "queda_pct":  round(float(queda[k]), 0),
+            })
     except Exception as e:
         log.warning(f"_detectar_queda_lactacao: {e}")
     return alertas
@@ -4867,53 +5007,15 @@ def _agenda_proximos_dias(fazenda_id: str, dias: int = 7) -> dict:
     hoje     = datetime.date.today()
     agenda   = {str(hoje + datetime.timedelta(days=i)): [] for i in range(dias)}
 
-    GESTACAO   = 283
-    DIAS_SECAR = 60
-    DIAS_DIAGN = 30
-    DIAS_PVE   = 45
-
-    def _pd(s):
-        try:
-            return datetime.datetime.strptime(str(s)[:10], "%Y-%m-%d").date() if s else None
-        except Exception:
-            return None
-
+    _TEXTO = {
+        "diagnostico": "🔬 Diagnóstico prenhez: *{nome}*",
+        "inseminar":   "💉 Inseminar (atrasada): *{nome}*",
+        "secar":       "🛑 Secar hoje: *{nome}*",
+        "parto":       "🐄 Parto em {faltam}d: *{nome}* ({parto:%d/%m})",
+    }
     try:
-        animais = [d.to_dict() for d in _coll(fazenda_id, "animais").stream()]
-        for a in animais:
-            nome     = a.get("nome", "?")
-            status   = a.get("status", "")
-            d_insem  = _pd(a.get("dt_insem"))
-            d_parto  = _pd(a.get("dt_parto"))
-
-            if status != "Lactação":
-                continue
-
-            # Diagnóstico de prenhez (30 dias pós inseminação)
-            if d_insem and not a.get("prenhez"):
-                data_diagn = d_insem + datetime.timedelta(days=DIAS_DIAGN)
-                if str(data_diagn) in agenda:
-                    agenda[str(data_diagn)].append(f"🔬 Diagnóstico prenhez: *{nome}*")
-
-            # Inseminação atrasada (> DIAS_PVE sem inseminar após parto)
-            if not d_insem and d_parto:
-                data_pve = d_parto + datetime.timedelta(days=DIAS_PVE + 1)
-                if str(data_pve) in agenda:
-                    agenda[str(data_pve)].append(f"💉 Inseminar (atrasada): *{nome}*")
-
-            # Secar (60 dias antes do parto previsto)
-            if a.get("prenhez") and d_insem:
-                prev  = d_insem + datetime.timedelta(days=GESTACAO)
-                d_sec = prev - datetime.timedelta(days=DIAS_SECAR)
-                if str(d_sec) in agenda:
-                    agenda[str(d_sec)].append(f"🛑 Secar hoje: *{nome}*")
-                # Alerta pré-parto (7 dias)
-                for dd in range(1, 8):
-                    data_alerta = prev - datetime.timedelta(days=dd)
-                    if str(data_alerta) in agenda:
-                        agenda[str(data_alerta)].append(
-                            f"🐄 Parto em {dd}d: *{nome}* ({prev.strftime('%d/%m')})"
-                        )
+        for dia, evs in reproducao.agenda(_calendario(fazenda_id), hoje, dias).items():
+            agenda[dia].extend(_TEXTO[e["tipo"]].format(**e) for e in evs)
     except Exception:
         pass
 
@@ -4923,7 +5025,7 @@ def _agenda_proximos_dias(fazenda_id: str, dias: int = 7) -> dict:
         for p in protos:
             if not p.get("ativo", True):
                 continue
-            prox = _pd(p.get("proxima_data"))
+            prox = reproducao.data(p.get("proxima_data"))
             if prox and str(prox) in agenda:
                 agenda[str(prox)].append(
                     f"📋 Protocolo: *{p.get('nome','Sanitário')}*"
@@ -5005,11 +5107,203 @@ def _twiml(msg: str) -> Response:
     return Response(content=xml.encode("utf-8"), media_type="application/xml; charset=utf-8")
 
 
+# ─────────────────────────────────────────────
+# FILA DE SAÍDA DO BROADCAST (mensagens agendadas)
+# Agrupa tudo que vai para o mesmo telefone numa só mensagem, limita a
+# concorrência, respeita a cadência de cada provedor (Evolution: evitar
+# bloqueio do número; Z-API: plano flat; Twilio: custo por mensagem) e
+# re-tenta com backoff exponencial.
+# ─────────────────────────────────────────────
+import random as _random_saida
+
+_LIMITE_MSG_WHATSAPP = 3500   # caracteres por mensagem (margem sob o limite do WhatsApp)
+_SEPARADOR_SAIDA     = "\n\n━━━━━━━━━━━━━━\n\n"
+
+_EXEC_ENVIO = _ExecutorMedido("envio", int(os.environ.get("EXEC_ENVIO_WORKERS", "8")),
+                              espera_alerta_s=120.0)
+_EXECUTORES[_EXEC_ENVIO.nome] = _EXEC_ENVIO
+
+
+class _Cadencia:
+    """Espaça envios de um provedor em no máximo `por_min` mensagens por minuto."""
+
+    def __init__(self, por_min: float):
+        self.intervalo = 60.0 / por_min if por_min > 0 else 0.0
+        self._prox = 0.0
+        self._lock = None
+
+    async def aguardar(self):
+        if not self.intervalo:
+            return
+        if self._lock is None:
+            self._lock = _asyncio_fila.Lock()
+        async with self._lock:
+            agora  = _time_exec.monotonic()
+            espera = self._prox - agora
+            self._prox = max(agora, self._prox) + self.intervalo
+        if espera > 0:
+            await _asyncio_fila.sleep(espera)
+
+
+_CADENCIA_PROVEDOR = {
+    "evolution": _Cadencia(float(os.environ.get("EVOLUTION_MSG_POR_MIN", "40"))),
+    "zapi":      _Cadencia(float(os.environ.get("ZAPI_MSG_POR_MIN", "60"))),
+    "twilio":    _Cadencia(float(os.environ.get("TWILIO_MSG_POR_MIN", "20"))),
+}
+
+
+def _provedores_configurados() -> list:
+    """Provedores da cascata com credenciais, na ordem de _ENVIO_TEXTO."""
+    provs = []
+    if os.environ.get("EVOLUTION_URL") and os.environ.get("EVOLUTION_KEY"):
+        provs.append("evolution")
+    if os.environ.get("ZAPI_INSTANCE") and os.environ.get("ZAPI_TOKEN"):
+        provs.append("zapi")
+    if os.environ.get("TWILIO_ACCOUNT_SID") and os.environ.get("TWILIO_AUTH_TOKEN"):
+        provs.append("twilio")
+    return provs
+
+
+def _provedor_primario() -> str:
+    """Primeiro provedor configurado da cascata — é ele que recebe a carga."""
+    return (_provedores_configurados() or ["twilio"])[0]
+
+
+def _dividir_mensagem(texto: str, limite: int = _LIMITE_MSG_WHATSAPP) -> list:
+    """Quebra texto longo em partes ≤ limite, preferindo fronteiras de parágrafo."""
+    if len(texto) <= limite:
+        return [texto]
+    partes, atual = [], ""
+    for bloco in texto.split("\n\n"):
+        while len(bloco) > limite:
+            if atual:
+                partes.append(atual)
+                atual = ""
+            partes.append(bloco[:limite])
+            bloco = bloco[limite:]
+        candidato = f"{atual}\n\n{bloco}" if atual else bloco
+        if len(candidato) > limite:
+            partes.append(atual)
+            atual = bloco
+        else:
+            atual = candidato
+    if atual:
+        partes.append(atual)
+    return partes
+
+
+class _FilaSaida:
+    """Acumula mensagens do ciclo do agendador e despacha em lote com `drenar()`."""
+
+    def __init__(self, concorrencia: int = 8, tentativas: int = 3, backoff_s: float = 2.0):
+        self.concorrencia = concorrencia
+        self.tentativas   = tentativas
+        self.backoff_s    = backoff_s
+        self._pend: dict  = {}   # tel → {"textos": [...], "midias": [...]}
+        self._lock = threading.Lock()
+        self._m = {"drenagens": 0, "telefones": 0, "mensagens_entrada": 0,
+                   "mensagens_enviadas": 0, "retentativas": 0, "falhas": 0,
+                   "ultima_duracao_s": 0.0}
+
+    def adicionar(self, tel: str, texto: str):
+        if not texto:
+            return
+        with self._lock:
+            self._pend.setdefault(tel, {"textos": [], "midias": []})["textos"].append(texto)
+            self._m["mensagens_entrada"] += 1
+
+    def adicionar_pdf(self, tel: str, conteudo, filename: str, caption: str = ""):
+        with self._lock:
+            self._pend.setdefault(tel, {"textos": [], "midias": []})["midias"].append(
+                (conteudo, filename, caption))
+            self._m["mensagens_entrada"] += 1
+
+    async def _texto_cadenciado(self, tel: str, parte: str) -> bool:
+        """Cascata do _enviar_whatsapp, aguardando a cadência de cada provedor
+        logo antes de usá-lo — Evolution fora do ar cai no Twilio no ritmo do Twilio."""
+        for provedor in _provedores_configurados():
+            await _CADENCIA_PROVEDOR[provedor].aguardar()
+            if await _EXEC_ENVIO.executar(_ENVIO_TEXTO[provedor], tel, parte):
+                return True
+        log.error(f"[saida] todos os provedores WhatsApp falharam para {tel}")
+        return False
+
+    async def _midia_cadenciada(self, tel: str, conteudo, filename: str, caption: str) -> bool:
+        """Mídia só sai pela Evolution: cadência da Evolution."""
+        await _CADENCIA_PROVEDOR["evolution"].aguardar()
+        return await _EXEC_ENVIO.executar(_enviar_pdf_whatsapp, tel, conteudo, filename, caption)
+
+    async def _com_retentativa(self, enviar, *args) -> bool:
+        for tentativa in range(self.tentativas):
+            try:
+                if await enviar(*args):
+                    return True
+            except Exception as e:
+                log.warning(f"[saida] {enviar.__name__} erro: {e}")
+            if tentativa + 1 < self.tentativas:
+                with self._lock:
+                    self._m["retentativas"] += 1
+                espera = self.backoff_s * (4 ** tentativa)
+                await _asyncio_fila.sleep(espera + _random_saida.uniform(0, espera / 2))
+        return False
+
+    async def _despachar(self, tel: str, item: dict, sem) -> bool:
+        async with sem:
+            ok = True
+            texto = _SEPARADOR_SAIDA.join(item["textos"])
+            for parte in (_dividir_mensagem(texto) if texto else []):
+                enviado = await self._com_retentativa(self._texto_cadenciado, tel, parte)
+                ok = ok and enviado
+                with self._lock:
+                    self._m["mensagens_enviadas" if enviado else "falhas"] += 1
+            for conteudo, filename, caption in item["midias"]:
+                enviado = await self._com_retentativa(
+                    self._midia_cadenciada, tel, conteudo, filename, caption)
+                ok = ok and enviado
+                with self._lock:
+                    self._m["mensagens_enviadas" if enviado else "falhas"] += 1
+            return ok
+
+    async def drenar(self) -> dict:
+        """Envia tudo que foi acumulado e devolve um resumo do lote."""
+        with self._lock:
+            pend, self._pend = self._pend, {}
+        if not pend:
+            return {"telefones": 0}
+        t0       = _time_exec.monotonic()
+        provedor = _provedor_primario()
+        sem      = _asyncio_fila.Semaphore(self.concorrencia)
+        res = await _asyncio_fila.gather(
+            *(self._despachar(tel, item, sem) for tel, item in pend.items()),
+            return_exceptions=True,
+        )
+        dur    = _time_exec.monotonic() - t0
+        falhas = sum(1 for r in res if r is not True)
+        with self._lock:
+            self._m["drenagens"] += 1
+            self._m["telefones"] += len(pend)
+            self._m["ultima_duracao_s"] = round(dur, 1)
+        log.info(f"[saida] {len(pend)} telefones (primário {provedor}) em {dur:.1f}s "
+                 f"({falhas} com falha)")
+        return {"telefones": len(pend), "falhas": falhas, "duracao_s": round(dur, 1)}
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {**self._m, "pendentes": len(self._pend)}
+
+
+_FILA_SAIDA = _FilaSaida(
+    concorrencia=int(os.environ.get("BROADCAST_CONCORRENCIA", "8")),
+    tentativas=int(os.environ.get("BROADCAST_TENTATIVAS", "3")),
+)
+
+
 # ─────────────────────────────────────────────
 # AGENDADOR INTERNO (alertas diários + relatório semanal)
 # ─────────────────────────────────────────────
 import asyncio as _asyncio
 import hashlib as _hashlib
+from agendador import Agendador, Tarefa, diaria, semanal, mensal, atraso_espalhado
 
 # Dedup: guarda {(fazenda_id, alerta_hash, data_iso)} para não reenviar o mesmo
 # alerta para a mesma fazenda no mesmo dia.
@@ -5033,177 +5327,290 @@ def _alerta_ja_enviado(fazenda_id: str, alerta: str) -> bool:
     return False
 
 
+# Quem recebe cada artefato da fazenda (None = todos os membros ativos).
+# admin sempre recebe tudo.
+_DESTINO_ARTEFATO = {
+    "manha":       None,
+    "alertas":     None,
+    "semanal":     None,
+    "reprodutivo": ("rebanho", "ordenha"),
+    "sanitario":   ("rebanho",),
+    "mensal":      ("admin",),
+}
+
+
+def _membro_recebe(permissoes: list, artefato: str) -> bool:
+    requisitos = _DESTINO_ARTEFATO.get(artefato)
+    if requisitos is None or "admin" in (permissoes or []):
+        return True
+    return any(p in (permissoes or []) for p in requisitos)
+
+
+async def _artefatos_fazenda(fazenda_id: str, hoje: datetime.date) -> dict:
+    """Calcula uma única vez, por fazenda, tudo o que o ciclo das 6h envia."""
+    art: dict = {}
+
+    try:
+        art["manha"] = await _EXEC_AGENDADOR.executar(_relatorio_manha, fazenda_id)
+    except Exception as e:
+        log.error(f"Relatório matinal erro {fazenda_id}: {e}")
+
+    # Alertas proativos críticos (dedup: não reenvia mesmo alerta no mesmo dia)
+    try:
+        alertas = await _EXEC_AGENDADOR.executar(_gerar_alertas_proativos, fazenda_id)
+        novos = [a for a in alertas if not _alerta_ja_enviado(fazenda_id, a)]
+        if novos:
+            art["alertas"] = "*⚠️ Alertas MilkShow:*\n" + "\n".join(f"• {a}" for a in novos)
+    except Exception as e:
+        log.error(f"Alertas proativos erro {fazenda_id}: {e}")
+
+    # Relatório semanal toda segunda-feira (inclui agenda na função)
+    if hoje.weekday() == 0:
+        try:
+            art["semanal"] = await _EXEC_AGENDADOR.executar(
+                _texto_pre_gerado, "semanal", fazenda_id, hoje, _gerar_relatorio_semanal
+            )
+        except Exception as e:
+            log.error(f"Relatório semanal erro {fazenda_id}: {e}")
+
+    # ── Lembretes reprodutivos — 3 dias de antecedência ───────
+    try:
+        lembr = await _EXEC_AGENDADOR.executar(_lembretes_reprodutivos, fazenda_id, 3)
+        novos_lembr = [l for l in lembr if not _alerta_ja_enviado(fazenda_id, l)]
+        if novos_lembr:
+            art["reprodutivo"] = (
+                "🐄 *Agenda Reprodutiva — Próximos 3 dias:*\n\n"
+                + "\n\n".join(novos_lembr)
+            )
+    except Exception as e:
+        log.warning(f"Lembretes reprodutivos erro {fazenda_id}: {e}")
+
+    # Alertas sanitários proativos — protocolo com data == hoje (um por dia)
+    try:
+        def _protos_ativos():
+            return [p.to_dict() for p in _coll(fazenda_id, "protocolos_sanitarios")
+                    .where(filter=FieldFilter("ativo", "==", True)).stream()]
+        for pd_ in await _EXEC_AGENDADOR.executar(_protos_ativos):
+            if _pd(pd_.get("proxima_data")) != hoje:
+                continue
+            nome_proto = pd_.get("nome", "?")
+            if not _alerta_ja_enviado(fazenda_id, f"sanitario:{nome_proto}:{hoje.isoformat()}"):
+                art["sanitario"] = {
+                    "protocolo":      nome_proto,
+                    "intervalo_dias": int(pd_.get("intervalo_dias", 365)),
+                    "texto": (
+                        f"💉 *Protocolo de hoje:* {nome_proto}\n"
+                        f"Animais: {pd_.get('animais', 'rebanho')}\n\n"
+                        "Você executou? Responda *sim* ou *não*."
+                    ),
+                }
+                break  # um por vez para não sobrecarregar
+    except Exception as e:
+        log.warning(f"Alertas sanitários erro {fazenda_id}: {e}")
+
+    return art
+
+
+def _texto_pre_gerado(tipo: str, fazenda_id: str, dia: datetime.date, gerar, *args) -> str:
+    """Texto que o lote (scripts/gerar_relatorios.py) gerou para o envio de `dia` —
+    a data do disparo, não a de hoje: disparo recuperado depois da meia-noite
+    ainda acha o texto — ou gera agora."""
+    txt = relatorios.texto_em_cache(tipo, fazenda_id, dia.isoformat())
+    return txt if txt is not None else gerar(fazenda_id, *args)
+
+
+async def _artefato_mensal(fazenda_id: str, hoje: datetime.date) -> dict:
+    """Relatório completo do mês anterior em PDF + ranking (disparo do dia 1)."""
+    art: dict = {}
+    mes_ant  = hoje.replace(day=1) - datetime.timedelta(days=1)
+    mes_str  = mes_ant.strftime("%Y-%m")
+    meses_pt = ["","Janeiro","Fevereiro","Março","Abril","Maio","Junho",
+                "Julho","Agosto","Setembro","Outubro","Novembro","Dezembro"]
+    mes_label = f"{meses_pt[mes_ant.month]} {mes_ant.year}"
+    try:
+        pdf_bytes = await _EXEC_PDF.executar(_gerar_pdf_relatorio, fazenda_id, mes_str)
+        ranking_msg = await _EXEC_AGENDADOR.executar(
+            _texto_pre_gerado, "ranking", fazenda_id, hoje, _gerar_ranking_rentabilidade, 30
+        )
+        art["mensal"] = {
+            "texto": (
+                f"📊 *Relatório Mensal — {mes_label}*\n\n"
+                f"Seu relatório completo de {mes_label} está pronto!\n"
+                f"Inclui: produção, receitas, despesas, top vacas e margem.\n\n"
+                f"Arquivo PDF gerado agora ↓"
+            ),
+            "pdf":      pdf_bytes,
+            "filename": f"MilkShow_{mes_str}.pdf",
+            "caption":  f"📊 Relatório {mes_label} — MilkShow",
+            "ranking":  ranking_msg,
+        }
+    except Exception as e:
+        log.error(f"Relatório mensal PDF erro {fazenda_id}: {e}")
+    return art
+
+
+def _distribuir_artefatos(fazenda_id: str, membros: list, art: dict):
+    """Enfileira os artefatos já calculados para cada membro, conforme permissões."""
+    for reg in membros:
+        tel, perms = reg["tel"], reg.get("permissoes", ["admin"])
+        for chave in ("manha", "alertas", "semanal", "reprodutivo"):
+            if art.get(chave) and _membro_recebe(perms, chave):
+                _FILA_SAIDA.adicionar(tel, art[chave])
+        if art.get("mensal") and _membro_recebe(perms, "mensal"):
+            m = art["mensal"]
+            _FILA_SAIDA.adicionar(tel, m["texto"])
+            _FILA_SAIDA.adicionar(tel, m["ranking"])
+            _FILA_SAIDA.adicionar_pdf(tel, m["pdf"], m["filename"], caption=m["caption"])
+        if art.get("sanitario") and _membro_recebe(perms, "sanitario"):
+            s = art["sanitario"]
+            _CONFIRMA_SAN[tel] = {
+                "fazenda_id":     fazenda_id,
+                "protocolo":      s["protocolo"],
+                "intervalo_dias": s["intervalo_dias"],
+            }
+            _FILA_SAIDA.adicionar(tel, s["texto"])
+
+
+def _verificar_nps(reg: dict):
+    """NPS — pergunta após 30 dias de uso (só uma vez). Usa os campos já lidos
+    em _todos_telefones, sem nova leitura no Firestore."""
+    tel = reg["tel"]
+    try:
+        if reg.get("nps_score") or tel in _NPS_PENDENTE:
+            return
+        created_raw = reg.get("created_at", "")
+        if not created_raw:
+            return
+        created_dt = datetime.datetime.fromisoformat(str(created_raw)[:19])
+        if (datetime.datetime.now() - created_dt).days >= 30:
+            _NPS_PENDENTE.add(tel)
+            _FILA_SAIDA.adicionar(tel,
+                "🌟 *Uma pergunta rápida!*\n\n"
+                "Você usa o MilkShow há 30 dias. "
+                "De *0 a 10*, qual a chance de você "
+                "indicar o MilkShow a outro produtor?\n\n"
+                "_(Responda só com o número)_"
+            )
+    except Exception as e:
+        log.warning(f"NPS check erro: {e}")
+
+
+def _membros_por_fazenda(registros: list) -> dict:
+    por_fazenda: dict = {}
+    for reg in registros:
+        por_fazenda.setdefault(reg["fazenda_id"], []).append(reg)
+    return por_fazenda
+
+
+async def _por_fazenda(artefatos_fn, hoje: datetime.date, rotulo: str):
+    """Calcula `artefatos_fn(fid, hoje)` uma vez por fazenda — em paralelo limitado,
+    cada fazenda deslocada na janela de espalhamento — e distribui aos membros."""
+    t0 = _time_exec.monotonic()
+    por_fazenda = _membros_por_fazenda(await _EXEC_AGENDADOR.executar(_todos_telefones))
+    sem    = _asyncio.Semaphore(int(os.environ.get("AGENDADOR_FAZENDAS_CONCORRENCIA", "4")))
+    janela = float(os.environ.get("AGENDADOR_JANELA_S", "600"))
+
+    async def _uma_fazenda(fid: str, membros: list):
+        await _asyncio.sleep(atraso_espalhado(f"{rotulo}:{fid}", janela))
+        async with sem:
+            try:
+                art = await artefatos_fn(fid, hoje)
+                _distribuir_artefatos(fid, membros, art)
+                if rotulo == "matinal":
+                    for reg in membros:
+                        _verificar_nps(reg)
+            except Exception as e:
+                log.error(f"Agendador {rotulo} erro para fazenda {fid}: {e}")
+        # Despacha o que já está pronto sem esperar a janela inteira
+        await _FILA_SAIDA.drenar()
+
+    await _asyncio.gather(*(_uma_fazenda(fid, m) for fid, m in por_fazenda.items()))
+    log.info(f"[agendador] {rotulo}: {len(por_fazenda)} fazendas em "
+             f"{_time_exec.monotonic() - t0:.1f}s")
+
+
+async def _previsoes_lote(fazendas: list, recalcular: bool):
+    """Previsão do dia de cada fazenda gravada no cache (previsao.py); sem
+    `recalcular`, só calcula a que ainda não existe."""
+    sem = _asyncio.Semaphore(int(os.environ.get("AGENDADOR_FAZENDAS_CONCORRENCIA", "4")))
+
+    async def _uma(fid: str):
+        async with sem:
+            try:
+                await _EXEC_AGENDADOR.executar(previsao_fazenda, fid, recalcular)
+            except Exception as e:
+                log.warning(f"Previsão erro {fid}: {e}")
+
+    await _asyncio.gather(*(_uma(fid) for fid in fazendas))
+
+
+async def _job_previsao(previsto: datetime.datetime):
+    """Antes das 6h: previsão de produção de todas as fazendas — o matinal e o
+    PDF do dia 1 só leem do cache."""
+    t0 = _time_exec.monotonic()
+    fazendas = list(_membros_por_fazenda(await _EXEC_AGENDADOR.executar(_todos_telefones)))
+    await _previsoes_lote(fazendas, recalcular=True)
+    log.info(f"[agendador] previsão: {len(fazendas)} fazendas em "
+             f"{_time_exec.monotonic() - t0:.1f}s")
+
+
+async def _job_matinal(previsto: datetime.datetime):
+    """6h: relatório matinal, alertas, semanal (segunda), reprodução, sanitário, NPS."""
+    await _por_fazenda(_artefatos_fazenda, previsto.date(), "matinal")
+
+
+async def _job_mensal(previsto: datetime.datetime):
+    """Dia 1 às 6h: PDF do mês anterior + ranking para os admins."""
+    hoje    = previsto.date()
+    mes_str = (hoje.replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+    try:
+        fazendas = list(_membros_por_fazenda(await _EXEC_AGENDADOR.executar(_todos_telefones)))
+        # a seção de previsão (e a versão do PDF) não pode depender de o
+        # matinal daquela fazenda já ter rodado: calcula a que faltar
+        await _previsoes_lote(fazendas, recalcular=False)
+        await _EXEC_PDF.executar(_pre_renderizar_mensal, fazendas, mes_str)
+    except Exception as e:
+        log.error(f"Lote de PDFs mensais erro: {e}")
+    await _por_fazenda(_artefato_mensal, hoje, "mensal")
+
+
+async def _job_backup(previsto: datetime.datetime):
+    """Domingo às 2h: backup JSON de todas as fazendas."""
+    for fid in _membros_por_fazenda(await _EXEC_AGENDADOR.executar(_todos_telefones)):
+        await _EXEC_AGENDADOR.executar(_backup_fazenda, fid)
+
+
+def _carregar_estado_agendador() -> dict:
+    return {d.id: d.to_dict() for d in _db().collection("agendador_estado").stream()}
+
+
+def _salvar_estado_agendador(nome: str, estado: dict):
+    _db().collection("agendador_estado").document(nome).set(estado)
+
+
+_AGENDADOR = Agendador(
+    [
+        # recuperar_h: até quando um disparo perdido (restart, deploy) ainda roda
+        Tarefa("previsao", diaria(int(os.environ.get("PREVISAO_HORA", "5"))),
+               _job_previsao, recuperar_h=1),
+        Tarefa("matinal", diaria(6),              _job_matinal, recuperar_h=6),
+        Tarefa("mensal",  mensal(1, 6, 5),        _job_mensal,  recuperar_h=72),
+        Tarefa("backup",  semanal(6, 2),          _job_backup,  recuperar_h=24),
+    ],
+    carregar_estado=_carregar_estado_agendador,
+    salvar_estado=_salvar_estado_agendador,
+)
+
+
 async def _loop_agendador():
-    """Roda em background:
-    - 6h todo dia: relatório matinal + alertas críticos
-    - 7h toda segunda: relatório semanal
+    """Roda em background o agendador de tarefas (ver agendador.py):
+    - 5h todo dia: previsão de produção de todas as fazendas (cache)
+    - 6h todo dia: relatório matinal + alertas (+ semanal às segundas)
+    - 6h05 dia 1: relatório mensal em PDF
     - Domingo às 2h: backup de todas as fazendas
+    Último disparo fica em `agendador_estado`; disparos perdidos são recuperados.
     """
-    while True:
-        try:
-            agora = datetime.datetime.now()
-
-            # Calcula próximo disparo (6h ou 2h domingo, o que vier primeiro)
-            prox_6h = agora.replace(hour=6, minute=0, second=0, microsecond=0)
-            if agora >= prox_6h:
-                prox_6h += datetime.timedelta(days=1)
-
-            prox_backup = agora.replace(hour=2, minute=0, second=0, microsecond=0)
-            while prox_backup.weekday() != 6:  # domingo
-                prox_backup += datetime.timedelta(days=1)
-            if agora >= prox_backup:
-                prox_backup += datetime.timedelta(days=7)
-
-            prox   = min(prox_6h, prox_backup)
-            espera = (prox - agora).total_seconds()
-            await _asyncio.sleep(espera)
-
-            agora    = datetime.datetime.now()
-            hoje     = datetime.date.today()
-            segunda  = hoje.weekday() == 0
-            domingo  = hoje.weekday() == 6
-            eh_6h    = agora.hour == 6
-            registros = _todos_telefones()
-
-            # ── Backup semanal (domingo às 2h) ────
-            if domingo and agora.hour == 2:
-                fazendas_vistas = set()
-                for reg in registros:
-                    fid = reg["fazenda_id"]
-                    if fid not in fazendas_vistas:
-                        fazendas_vistas.add(fid)
-                        await _asyncio.to_thread(_backup_fazenda, fid)
-                continue  # só backup neste ciclo
-
-            for reg in registros:
-                tel        = reg["tel"]
-                fazenda_id = reg["fazenda_id"]
-                try:
-                    # Relatório matinal diário às 6h
-                    if eh_6h:
-                        manha = await _asyncio.to_thread(_relatorio_manha, fazenda_id)
-                        _enviar_whatsapp(tel, manha)
-
-                    # Alertas proativos críticos (dedup: não reenvia mesmo alerta no mesmo dia)
-                    alertas = _gerar_alertas_proativos(fazenda_id)
-                    novos = [a for a in alertas if not _alerta_ja_enviado(fazenda_id, a)]
-                    if novos:
-                        msg = "*⚠️ Alertas MilkShow:*\n" + "\n".join(f"• {a}" for a in novos)
-                        _enviar_whatsapp(tel, msg)
-
-                    # Relatório semanal toda segunda-feira (inclui agenda na função)
-                    if segunda and eh_6h:
-                        rel = _gerar_relatorio_semanal(fazenda_id)
-                        _enviar_whatsapp(tel, rel)
-
-                    # ── Dia 1 do mês às 6h: relatório completo em PDF ────────
-                    if hoje.day == 1 and eh_6h and "admin" in reg.get("permissoes", ["admin"]):
-                        # Mês anterior
-                        primeiro = hoje.replace(day=1)
-                        mes_ant  = (primeiro - datetime.timedelta(days=1))
-                        mes_str  = mes_ant.strftime("%Y-%m")
-                        meses_pt = ["","Janeiro","Fevereiro","Março","Abril","Maio","Junho",
-                                    "Julho","Agosto","Setembro","Outubro","Novembro","Dezembro"]
-                        mes_label = f"{meses_pt[mes_ant.month]} {mes_ant.year}"
-                        try:
-                            pdf_bytes = await _asyncio.to_thread(
-                                _gerar_pdf_relatorio, fazenda_id, mes_str
-                            )
-                            _enviar_whatsapp(tel,
-                                f"📊 *Relatório Mensal — {mes_label}*\n\n"
-                                f"Seu relatório completo de {mes_label} está pronto!\n"
-                                f"Inclui: produção, receitas, despesas, top vacas e margem.\n\n"
-                                f"Arquivo PDF gerado agora ↓"
-                            )
-                            _enviar_pdf_whatsapp(
-                                tel, pdf_bytes,
-                                f"MilkShow_{mes_str}.pdf",
-                                caption=f"📊 Relatório {mes_label} — MilkShow"
-                            )
-                            # Ranking de rentabilidade junto
-                            ranking_msg = await _asyncio.to_thread(
-                                _gerar_ranking_rentabilidade, fazenda_id, 30
-                            )
-                            _enviar_whatsapp(tel, ranking_msg)
-                        except Exception as e:
-                            log.error(f"Relatório mensal PDF erro {fazenda_id}: {e}")
-
-                    # ── Lembretes reprodutivos — 3 dias de antecedência ───────
-                    if eh_6h:
-                        try:
-                            lembr = await _asyncio.to_thread(
-                                _lembretes_reprodutivos, fazenda_id, 3
-                            )
-                            novos_lembr = [l for l in lembr if not _alerta_ja_enviado(fazenda_id, l)]
-                            if novos_lembr:
-                                msg_rep = (
-                                    "🐄 *Agenda Reprodutiva — Próximos 3 dias:*\n\n"
-                                    + "\n\n".join(novos_lembr)
-                                )
-                                _enviar_whatsapp(tel, msg_rep)
-                        except Exception as e:
-                            log.warning(f"Lembretes reprodutivos erro {fazenda_id}: {e}")
-
-                    # Alertas sanitários proativos — protocolos com data == hoje
-                    if eh_6h:
-                        try:
-                            protos_hoje = list(_coll(fazenda_id, "protocolos_sanitarios")
-                                               .where(filter=FieldFilter("ativo", "==", True)).stream())
-                            for p in protos_hoje:
-                                pd_ = p.to_dict()
-                                try:
-                                    prox_d = datetime.datetime.strptime(
-                                        str(pd_.get("proxima_data", ""))[:10], "%Y-%m-%d"
-                                    ).date()
-                                except Exception:
-                                    continue
-                                if prox_d == hoje:
-                                    nome_proto = pd_.get("nome", "?")
-                                    chave_san  = f"sanitario:{nome_proto}:{hoje.isoformat()}"
-                                    if not _alerta_ja_enviado(fazenda_id, chave_san):
-                                        _CONFIRMA_SAN[tel] = {
-                                            "fazenda_id":    fazenda_id,
-                                            "protocolo":     nome_proto,
-                                            "intervalo_dias": int(pd_.get("intervalo_dias", 365)),
-                                        }
-                                        _enviar_whatsapp(tel,
-                                            f"💉 *Protocolo de hoje:* {nome_proto}\n"
-                                            f"Animais: {pd_.get('animais', 'rebanho')}\n\n"
-                                            "Você executou? Responda *sim* ou *não*."
-                                        )
-                                        break  # um por vez para não sobrecarregar
-                        except Exception as e:
-                            log.warning(f"Alertas sanitários erro: {e}")
-
-                    # NPS — pergunta após 30 dias de uso (só uma vez)
-                    if eh_6h:
-                        try:
-                            doc_tel = _db().collection("registros_tel").document(tel).get()
-                            if doc_tel.exists:
-                                dados_tel = doc_tel.to_dict()
-                                if not dados_tel.get("nps_score") and tel not in _NPS_PENDENTE:
-                                    created_raw = dados_tel.get("created_at", "")
-                                    if created_raw:
-                                        created_dt = datetime.datetime.fromisoformat(str(created_raw)[:19])
-                                        dias_uso = (datetime.datetime.now() - created_dt).days
-                                        if dias_uso >= 30:
-                                            _NPS_PENDENTE.add(tel)
-                                            _enviar_whatsapp(tel,
-                                                "🌟 *Uma pergunta rápida!*\n\n"
-                                                "Você usa o MilkShow há 30 dias. "
-                                                "De *0 a 10*, qual a chance de você "
-                                                "indicar o MilkShow a outro produtor?\n\n"
-                                                "_(Responda só com o número)_"
-                                            )
-                        except Exception as e:
-                            log.warning(f"NPS check erro: {e}")
-
-                except Exception as e:
-                    log.error(f"Agendador erro para {tel}: {e}")
-
-        except Exception as e:
-            log.error(f"Agendador loop error: {e}")
-            await _asyncio.sleep(3600)
+    await _AGENDADOR.rodar()
 
 
 async def _loop_monitor_evolution():
@@ -5313,6 +5720,18 @@ def status(authorization: str = Header(default="")):
         "anthropic": bool(os.environ.get("ANTHROPIC_API_KEY")),
         "groq":      bool(os.environ.get("GROQ_API_KEY")),
         "twilio":    bool(os.environ.get("TWILIO_ACCOUNT_SID")),
+        "executores": _metricas_executores(),
+        "envio":      _metricas_envio(),
+        "fila_saida": _FILA_SAIDA.metricas(),
+        "agendador":  _AGENDADOR.metricas(),
+        "relatorios": relatorios.metricas(),
+        "midia":      midia.metricas(),
+        "conversa":   conversa.metricas(),
+        "reproducao": reproducao.metricas(),
+        "rentabilidade": rentabilidade.metricas(),
+        "lactacao":   lactacao.metricas(),
+        "anomalias":  anomalias.metricas(),
+        "previsao":   previsao.metricas(),
     }
 
 
@@ -5406,152 +5825,61 @@ async def webhook_evolution(request: Request):
         ""
     ).strip()
 
-    # Áudio (audioMessage)
+    # Áudio (audioMessage) — áudio encaminhado já transcrito nem é baixado
+    if not texto and "audioMessage" in msg:
+        texto = midia.texto_por_impressao("audio", midia.impressao_whatsapp(msg["audioMessage"])) or ""
     if not texto and "audioMessage" in msg:
         try:
-            # Evolution serve a mídia via URL própria
+            # Evolution serve a mídia via URL própria (base64 em JSON, baixado em streaming)
+            midia.checar_tamanho_declarado("audio", msg["audioMessage"])
             ev_url  = os.environ.get("EVOLUTION_URL", "").rstrip("/")
             ev_key  = os.environ.get("EVOLUTION_KEY", "")
             ev_inst = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
-            msg_id  = key.get("id", "")
-            media_url = f"{ev_url}/chat/getBase64FromMediaMessage/{ev_inst}"
-            async with httpx.AsyncClient(timeout=20) as c:
-                r = await c.post(
-                    media_url,
-                    headers={"apikey": ev_key},
-                    json={"message": data},
-                )
-                b64_data = r.json().get("base64", "")
-            if b64_data:
-                import base64 as _b64
-                audio_bytes = _b64.b64decode(b64_data)
-                # Transcreve via Groq
-                groq_key = os.environ.get("GROQ_API_KEY", "")
-                if groq_key:
-                    async with httpx.AsyncClient(timeout=30) as c:
-                        resp = await c.post(
-                            "https://api.groq.com/openai/v1/audio/transcriptions",
-                            headers={"Authorization": f"Bearer {groq_key}"},
-                            files={"file": ("audio.ogg", audio_bytes, "audio/ogg")},
-                            data={"model": "whisper-large-v3-turbo", "language": "pt"},
-                        )
-                        texto = resp.json().get("text", "")
+            audio_bytes = await midia.baixar_evolution(
+                f"{ev_url}/chat/getBase64FromMediaMessage/{ev_inst}", "audio",
+                headers={"apikey": ev_key}, corpo={"message": data},
+            )
+            if audio_bytes:
+                texto = await midia.extrair_com_cache("audio", audio_bytes, _transcrever_bytes)
+        except midia.MidiaGrande as e:
+            log.warning(f"[Evolution][{tel_limpo}] {e}")
+            _enviar_whatsapp(tel_limpo, _aviso_midia_grande(e))
         except Exception as e:
             log.error(f"Evolution audio error: {e}")
 
-    # Imagem
+    # Imagem — foto reenviada já lida nem é baixada
+    texto_img = None
     if not texto and "imageMessage" in msg:
-        # Feedback imediato antes de processar (pode demorar 5-15s)
-        _enviar_whatsapp(tel_limpo, "📷 Analisando imagem...")
+        texto_img = midia.texto_por_impressao("vision", midia.impressao_whatsapp(msg["imageMessage"]))
+    if not texto and "imageMessage" in msg and texto_img is None:
         try:
+            midia.checar_tamanho_declarado("imagem", msg["imageMessage"])
+            # Feedback imediato antes de processar (pode demorar 5-15s)
+            _enviar_whatsapp(tel_limpo, "📷 Analisando imagem...")
             ev_url  = os.environ.get("EVOLUTION_URL", "").rstrip("/")
             ev_key  = os.environ.get("EVOLUTION_KEY", "")
             ev_inst = os.environ.get("EVOLUTION_INSTANCE", "milkshow")
-            async with httpx.AsyncClient(timeout=20) as c:
-                r = await c.post(
-                    f"{ev_url}/chat/getBase64FromMediaMessage/{ev_inst}",
-                    headers={"apikey": ev_key},
-                    json={"message": data},
-                )
-                b64_data = r.json().get("base64", "")
-            if b64_data:
-                import base64 as _b64
-                img_bytes = _b64.b64decode(b64_data)
-                b64_str = _b64.standard_b64encode(img_bytes).decode()
-                _VISION_PROMPT = (
-                    "Analise esta imagem de uma fazenda leiteira. Identifique qual dos tipos:\n\n"
-                    "A) NOTA FISCAL / RECIBO / CUPOM: tem produtos, quantidades, valores, nome da loja.\n"
-                    "B) TABELA MENSAL DE PRODUÇÃO: coluna de datas e coluna de litros, dia a dia. "
-                    "Pode ser manuscrita em papel ou lousa. "
-                    "REGRA CRÍTICA: o título ou nome no topo da tabela é quase sempre o NOME DO PRODUTOR ou da fazenda — NUNCA é nome de vaca. "
-                    "Use sempre Animal: Rebanho, a menos que a tabela contenha explicitamente a palavra 'Vaca' ou 'Animal' seguida do nome do bicho.\n"
-                    "C) LISTA DE VACAS DO DIA: lista com vários animais identificados pelo nome e seus litros. "
-                    "Cada linha tem nome da vaca + litros (ex: Rainha 18L). Pode ser manuscrita.\n"
-                    "D) OUTRO\n\n"
-                    "Se A: responda exatamente:\n"
-                    "[NOTA FISCAL]\nFornecedor: ...\nItens:\n- Produto: X, Qtd: N, Unidade: U, Valor: R$V\n\n"
-                    "Se B: responda exatamente (leia com cuidado a escrita manual):\n"
-                    "[TABELA MENSAL]\nAnimal: Rebanho (use 'Rebanho' por padrão; só mude se a tabela disser explicitamente 'Vaca: X')\nMes: MM/AAAA\nRegistros:\n"
-                    "- Data: DD/MM/AAAA, Litros: N\n"
-                    "(use '//' para dias sem dado — ex: Litros: //)\n\n"
-                    "Se C: responda exatamente:\n"
-                    "[PRODUCAO DO DIA]\nData: DD/MM/AAAA (se visível, senão 'hoje')\nAnimais:\n"
-                    "- Animal: NomeVaca, Litros: N\n\n"
-                    "Se D: descreva brevemente.\n"
-                    "Extraia TODOS os dados visíveis. Inclua todas as linhas. "
-                    "Ignore rasuras. Responda somente os dados."
-                )
-                texto_img = ""
-                # Tenta Gemini Vision via REST direto
-                import asyncio as _aio_vis
-                google_key = os.environ.get("GOOGLE_API_KEY", "")
-                if google_key:
-                    _candidates = [
-                        ("v1", "gemini-2.5-flash"),
-                        ("v1", "gemini-2.5-flash-lite"),
-                    ]
-                    for _api_ver, _gmodel in _candidates:
-                        try:
-                            async with httpx.AsyncClient(timeout=30) as gc:
-                                gr = await gc.post(
-                                    f"https://generativelanguage.googleapis.com/{_api_ver}/models/{_gmodel}:generateContent",
-                                    params={"key": google_key},
-                                    json={"contents": [{"parts": [
-                                        {"inline_data": {"mime_type": "image/jpeg", "data": b64_str}},
-                                        {"text": _VISION_PROMPT},
-                                    ]}]},
-                                )
-                            if gr.status_code == 429:
-                                log.warning(f"Gemini Vision ({_gmodel}) rate limit — aguardando 5s")
-                                await _aio_vis.sleep(5)
-                                # retry uma vez
-                                async with httpx.AsyncClient(timeout=30) as gc:
-                                    gr = await gc.post(
-                                        f"https://generativelanguage.googleapis.com/{_api_ver}/models/{_gmodel}:generateContent",
-                                        params={"key": google_key},
-                                        json={"contents": [{"parts": [
-                                            {"inline_data": {"mime_type": "image/jpeg", "data": b64_str}},
-                                            {"text": _VISION_PROMPT},
-                                        ]}]},
-                                    )
-                            if gr.status_code not in (200, 201):
-                                log.warning(f"Gemini Vision ({_gmodel}) HTTP {gr.status_code} — tentando próximo")
-                                continue
-                            gdata = gr.json()
-                            texto_img = gdata["candidates"][0]["content"]["parts"][0]["text"].strip()
-                            log.info(f"[Evolution] Gemini Vision ({_api_ver}/{_gmodel}) extraiu: {texto_img[:200]}")
-                            break
-                        except Exception as eg:
-                            log.warning(f"Gemini Vision ({_gmodel}) falhou: {eg}")
-                # Fallback Claude Vision
-                if not texto_img:
-                    anthropic_key = os.environ.get("ANTHROPIC_API_KEY", "")
-                    if anthropic_key:
-                        try:
-                            from anthropic import Anthropic
-                            client = Anthropic(api_key=anthropic_key)
-                            cresp = client.messages.create(
-                                model="claude-haiku-4-5-20251001", max_tokens=600,
-                                messages=[{"role": "user", "content": [
-                                    {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": b64_str}},
-                                    {"type": "text", "text": _VISION_PROMPT},
-                                ]}],
-                            )
-                            texto_img = cresp.content[0].text.strip()
-                            log.info(f"[Evolution] Claude Vision extraiu: {texto_img[:200]}")
-                        except Exception as ec:
-                            log.warning(f"Claude Vision falhou: {ec}")
-                log.info(f"[Evolution] Vision extraiu: {texto_img[:200]}")
-                if "[TABELA MENSAL]" in texto_img:
-                    texto = f"[Foto tabela mensal de producao] {texto_img}"
-                elif "[PRODUCAO DO DIA]" in texto_img:
-                    texto = f"[Foto producao do dia] {texto_img}"
-                elif "[NOTA FISCAL]" in texto_img:
-                    texto = f"[Nota fiscal] {texto_img}"
-                else:
-                    texto = f"[Foto] {texto_img}"
+            img_bytes = await midia.baixar_evolution(
+                f"{ev_url}/chat/getBase64FromMediaMessage/{ev_inst}", "imagem",
+                headers={"apikey": ev_key}, corpo={"message": data},
+            )
+            if img_bytes:
+                texto_img = await midia.extrair_com_cache("vision", img_bytes, _vision_evolution)
+        except midia.MidiaGrande as e:
+            log.warning(f"[Evolution][{tel_limpo}] {e}")
+            _enviar_whatsapp(tel_limpo, _aviso_midia_grande(e))
         except Exception as e:
             log.error(f"Evolution imagem error: {e}")
+    if not texto and texto_img is not None:
+        log.info(f"[Evolution] Vision extraiu: {texto_img[:200]}")
+        if "[TABELA MENSAL]" in texto_img:
+            texto = f"[Foto tabela mensal de producao] {texto_img}"
+        elif "[PRODUCAO DO DIA]" in texto_img:
+            texto = f"[Foto producao do dia] {texto_img}"
+        elif "[NOTA FISCAL]" in texto_img:
+            texto = f"[Nota fiscal] {texto_img}"
+        else:
+            texto = f"[Foto] {texto_img}"
 
     log.info(f"[Evolution][{tel_limpo}] mensagem: '{texto[:80]}'")
 
@@ -5562,7 +5890,7 @@ async def webhook_evolution(request: Request):
     if user_info is None:
         # Inicia/continua onboarding em vez de rejeitar
         _asyncio_fila.create_task(
-            _asyncio_fila.to_thread(_processar_onboarding, tel_limpo, texto)
+            _EXEC_INTERATIVO.executar(_processar_onboarding, tel_limpo, texto)
         )
         return {"ok": True}
 
@@ -5602,11 +5930,11 @@ async def webhook_evolution(request: Request):
             log.info(f"[{tel_limpo}] {len(msgs)} msgs agrupadas offline: '{texto_final[:80]}'")
         import asyncio as _aio
         # Mostra "digitando..." imediatamente enquanto processa
-        _aio.create_task(_aio.to_thread(_enviar_typing, tel_limpo, 6000))
-        # Roda em thread para não bloquear o event loop (Firestore + httpx síncronos)
-        resposta = await _aio.to_thread(_processar, tel_limpo, texto_final, fazenda_id, permissoes)
+        _aio.create_task(_EXEC_INTERATIVO.executar(_enviar_typing, tel_limpo, 6000))
+        # Roda no pool interativo para não bloquear o event loop (Firestore + httpx síncronos)
+        resposta = await _EXEC_INTERATIVO.executar(_processar, tel_limpo, texto_final, fazenda_id, permissoes)
         if resposta and resposta != "__botoes_enviados__":
-            await _aio.to_thread(_enviar_whatsapp, tel_limpo, resposta)
+            await _EXEC_INTERATIVO.executar(_enviar_whatsapp, tel_limpo, resposta)
 
     _asyncio_fila.create_task(_processar_e_enviar())
     return {"ok": True}  # retorna imediatamente — processa em background
@@ -5646,7 +5974,10 @@ async def webhook(
 
     # ── Áudio ────────────────────────────────
     if num_media > 0 and "audio" in ctype:
-        transcrito = await _transcrever(MediaUrl0, AccountSid, twilio_token, ctype)
+        try:
+            transcrito = await _transcrever(MediaUrl0, AccountSid, twilio_token, ctype)
+        except midia.MidiaGrande as e:
+            return _twiml(_aviso_midia_grande(e))
         if transcrito:
             texto = transcrito
             log.info(f"[{tel_limpo}] audio transcrito: '{texto[:80]}'")
@@ -5655,7 +5986,10 @@ async def webhook(
 
     # ── Imagem / Nota Fiscal ─────────────────
     elif num_media > 0 and ("image" in ctype or "pdf" in ctype):
-        extraido = await _ler_imagem(MediaUrl0, AccountSid, twilio_token, ctype or "image/jpeg")
+        try:
+            extraido = await _ler_imagem(MediaUrl0, AccountSid, twilio_token, ctype or "image/jpeg")
+        except midia.MidiaGrande as e:
+            return _twiml(_aviso_midia_grande(e))
         if extraido:
             texto = extraido
             log.info(f"[{tel_limpo}] imagem processada: '{texto[:80]}'")
@@ -5692,7 +6026,7 @@ async def webhook(
         texto_final = " | ".join(m["texto"] for m in msgs)
         log.info(f"[{tel_limpo}] {len(msgs)} msgs agrupadas offline: '{texto_final[:80]}'")
 
-    resposta = _processar(tel_limpo, texto_final, fazenda_id, permissoes)
+    resposta = await _EXEC_INTERATIVO.executar(_processar, tel_limpo, texto_final, fazenda_id, permissoes)
     return _twiml(resposta)
 
 